@@ -37,6 +37,9 @@ DEFAULT_TILE_STORAGE_TYPE = "files"
 TILE_STORAGE_FILES = "files"
 TILE_STORAGE_SQLITE = "sqlite"
 TILE_STORAGE_TYPES = [TILE_STORAGE_FILES, TILE_STORAGE_SQLITE]
+# read only store for MBTiles files placed to the layer folder,
+# can't be used as the primary tile storage type
+TILE_STORAGE_MBTILES = "mbtiles"
 
 # GTK GUI
 PANGO_ON = '<span color="green">ON</span>'
@@ -63,6 +66,7 @@ THREAD_GPSD_CONSUMER = "modRanaGPSDConsumer"
 THREAD_TILE_DOWNLOAD_MANAGER = "modRanaTileDownloadManager"
 THREAD_TILE_DOWNLOAD_WORKER = "modRanaTileDownloadWorker"
 THREAD_TILE_STORAGE_LOADER = "modRanaTileStorageLoader"
+THREAD_TILE_STORAGE_EVICTOR = "modRanaTileStorageEvictor"
 # resource checking
 THREAD_CONNECTIVITY_CHECK = "modRanaConnectivityCheck"
 THREAD_LOCATION_CHECK = "modRanaCurrentPositionCheck"
@@ -88,6 +92,13 @@ DEFAULT_THREAD_COUNT_BATCH_DOWNLOAD = 5
 # NOTE: even though we are downloading only the headers, for a few thousand tiles this can be an
 #       un-trivial amount of data (so use this with caution on metered connections)
 DEFAULT_THREAD_COUNT_BATCH_SIZE_CHECK = 20
+# Batch size check modes
+# * sample - check the size of a sample of the tiles on each zoom level
+#            & estimate the batch size from it
+# * exact - check the size of every tile in the batch
+BATCH_SIZE_CHECK_SAMPLE = "sample"
+BATCH_SIZE_CHECK_EXACT = "exact"
+DEFAULT_BATCH_SIZE_CHECK_MODE = BATCH_SIZE_CHECK_SAMPLE
 
 # tile download request queue default size
 # * up to 100 download tasks can be stored in the request queue
@@ -95,15 +106,32 @@ DEFAULT_THREAD_COUNT_BATCH_SIZE_CHECK = 20
 # * if a 101th request comes, it replaces the oldest not in progress task
 DEFAULT_AUTOMATIC_TILE_DOWNLOAD_QUEUE_SIZE = 100
 
+# how far (in tiles) outside of the visible area can a tile be
+# before its automatic download request is cancelled
+# * 0 means download requests are never cancelled
+DEFAULT_TILE_DOWNLOAD_CANCEL_MARGIN = 2
+
+# how many concurrent requests can be made to a single tileserver host
+# * shared by the automatic & batch tile downloaders
+# * the limit is lowered automatically if the host starts failing
+#   and raised back once it recovers
+DEFAULT_MAX_CONCURRENT_REQUESTS_PER_HOST = 10
+
 # in-memory tile cache size
 # * this controls how many tiles modRana keeps in memory
 #   after downloading them of loading them from storage
 # * the tiles are cached so they can be quickly used if
 #   requested again, which is often needed by the GTK GUI
 #   and should also help the Qt 5 GUI
+# * the cache is budgeted by memory usage, this is the number
+#   of decoded 256x256 px tile images that fit into the budget,
+#   least recently used tiles are dropped once the budget is exceeded
 DEFAULT_MEMORY_TILE_CACHE_SIZE = 150
-# how many tiles to remove from cache when it gets full
-DEFAULT_MEMORY_TILE_CACHE_TRIM_SIZE = 30
+
+# tile download notifications are sent to the Qt 5 GUI in batches
+# gathered over this time window, so that fast panning doesn't
+# flood the QML event loop with per-tile messages
+DEFAULT_TILE_NOTIFICATION_WINDOW = 0.025 # seconds
 
 # sqlite tile database commit interval
 # * lower interval - lower amount of tiles in flight and this
@@ -112,6 +140,14 @@ DEFAULT_MEMORY_TILE_CACHE_TRIM_SIZE = 30
 #   IO happens less often in longer hopefully more efficient bursts
 DEFAULT_SQLITE_TILE_DATABASE_COMMIT_INTERVAL = 5 # seconds
 
+# per-layer tile storage size limit
+# * once the tiles stored for a layer take more space than this,
+#   least recently used tiles are removed
+# * 0 means no limit
+DEFAULT_TILE_STORAGE_LAYER_SIZE_LIMIT = 0 # MiB
+# how often to check tile storage size limits
+TILE_STORAGE_EVICTION_INTERVAL = 300 # seconds
+
 # device types
 DEVICE_TYPE_DESKTOP = 1
 DEVICE_TYPE_SMARTPHONE = 2
@@ -191,3 +227,4 @@ TILE_DOWNLOAD_SUCCESS = 0
 TILE_DOWNLOAD_ERROR = 1
 TILE_DOWNLOAD_TEMPORARY_ERROR = 2
 TILE_DOWNLOAD_QUEUE_FULL = 3
+TILE_DOWNLOAD_CANCELLED = 4
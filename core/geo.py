@@ -18,10 +18,29 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #---------------------------------------------------------------------------
 from math import *
+import bisect
+import itertools
 import time
+import timeit
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 EARTH_RADIUS = 6371.0
 
+# backends of the array distance functions
+BACKEND_PYTHON = "python"
+BACKEND_NUMPY = "numpy"
+if numpy is not None:
+    BACKENDS = (BACKEND_NUMPY, BACKEND_PYTHON)
+else:
+    BACKENDS = (BACKEND_PYTHON,)
+# converting points to arrays has a cost,
+# so NumPy is only used for longer point lists by default
+NUMPY_MIN_POINTS = 64
+
 
 def distanceOld(lat1, lon1, lat2, lon2):
     """Distance between two points in km
@@ -42,15 +61,8 @@ def simple_pythagorean_distance(x1, y1, x2, y2):
 
 
 def combined_distance(pointList):
-    """return combined distance for a list of ordered points
-    NOTE: not tested yet !!"""
-    distance_sum = 0
-    (lat1, lon1) = pointList[0]
-    for point in pointList[1:]:
-        (lat2, lon2) = point
-        distance_sum += distance(lat1, lon1, lat2, lon2)
-        (lat1, lon1) = (lat2, lon2)
-    return distance_sum
+    """return combined distance for a list of ordered points"""
+    return path_length(pointList)
 
 
 def bearing(lat1, lon1, lat2, lon2):
@@ -246,6 +258,156 @@ def distance_approx_radians(lat1, lon1, lat2, lon2):
     return acos(sin(lat1) * sin(lat2) + cos(lat1) * cos(lat2) * cos(lon1 - lon2)) * EARTH_RADIUS
 
 
+# array counterparts of the distance functions
+#
+# Code working with long point lists (routes, tracklogs) should use these
+# rather than calling the functions above in a loop. They compute the same
+# haversine distances as distance(), using NumPy when it is available
+# and the point list is long enough for it to pay off.
+# Results are sequences of floats - lists from the pure Python backend,
+# NumPy arrays from the NumPy backend.
+
+def _array_backend(backend, point_count):
+    if backend is None:
+        if numpy is not None and point_count >= NUMPY_MIN_POINTS:
+            return BACKEND_NUMPY
+        else:
+            return BACKEND_PYTHON
+    elif backend not in BACKENDS:
+        raise ValueError("geo array backend not available: %s" % backend)
+    return backend
+
+
+def _numpy_lat_lon(points):
+    """Get point latitudes and longitudes in radians as NumPy arrays"""
+    count = len(points)
+    lats = numpy.radians(numpy.fromiter((point[0] for point in points), float, count))
+    lons = numpy.radians(numpy.fromiter((point[1] for point in points), float, count))
+    return lats, lons
+
+
+def _numpy_distance_radians(lat1, lon1, lat2, lon2):
+    h1 = numpy.sin(0.5 * (lat2 - lat1))
+    h2 = numpy.sin(0.5 * (lon2 - lon1))
+    d = h1 * h1 + numpy.cos(lat1) * numpy.cos(lat2) * h2 * h2
+    return 2.0 * numpy.arctan2(numpy.sqrt(d), numpy.sqrt(1.0 - d)) * EARTH_RADIUS
+
+
+def distances(lat, lon, points, backend=None):
+    """Compute distances from a position to all the given points.
+
+    :param float lat: latitude in degrees
+    :param float lon: longitude in degrees
+    :param points: sequence of (lat, lon, ...) tuples in degrees
+    :param str backend: backend to use, None for automatic selection
+    :return: distances in kilometers, one for each point
+    :rtype: sequence of floats
+    """
+    if _array_backend(backend, len(points)) == BACKEND_NUMPY:
+        lats, lons = _numpy_lat_lon(points)
+        return _numpy_distance_radians(radians(lat), radians(lon), lats, lons)
+    lat1 = radians(lat)
+    lon1 = radians(lon)
+    cos1 = cos(lat1)
+    result = []
+    for point in points:
+        lat2 = radians(point[0])
+        h1 = sin(0.5 * (lat2 - lat1))
+        h2 = sin(0.5 * (radians(point[1]) - lon1))
+        d = h1 * h1 + cos1 * cos(lat2) * h2 * h2
+        result.append(2.0 * atan2(sqrt(d), sqrt(1.0 - d)) * EARTH_RADIUS)
+    return result
+
+
+def segment_lengths(points, backend=None):
+    """Compute lengths of all segments of a polyline.
+
+    :param points: sequence of (lat, lon, ...) tuples in degrees
+    :param str backend: backend to use, None for automatic selection
+    :return: segment lengths in kilometers, one less than there are points
+    :rtype: sequence of floats
+    """
+    if _array_backend(backend, len(points)) == BACKEND_NUMPY:
+        lats, lons = _numpy_lat_lon(points)
+        return _numpy_distance_radians(lats[:-1], lons[:-1], lats[1:], lons[1:])
+    result = []
+    if not points:
+        return result
+    lat1 = radians(points[0][0])
+    lon1 = radians(points[0][1])
+    cos1 = cos(lat1)
+    for point in itertools.islice(points, 1, None):
+        lat2 = radians(point[0])
+        lon2 = radians(point[1])
+        cos2 = cos(lat2)
+        h1 = sin(0.5 * (lat2 - lat1))
+        h2 = sin(0.5 * (lon2 - lon1))
+        d = h1 * h1 + cos1 * cos2 * h2 * h2
+        result.append(2.0 * atan2(sqrt(d), sqrt(1.0 - d)) * EARTH_RADIUS)
+        lat1, lon1, cos1 = lat2, lon2, cos2
+    return result
+
+
+def along_track_distances(points, backend=None):
+    """Compute cumulative distance along a polyline for each of its points.
+
+    :param points: sequence of (lat, lon, ...) tuples in degrees
+    :param str backend: backend to use, None for automatic selection
+    :return: distances from the first point in kilometers
+             (0 for the first point), empty for no points
+    :rtype: sequence of floats
+    """
+    backend = _array_backend(backend, len(points))
+    lengths = segment_lengths(points, backend)
+    if backend == BACKEND_NUMPY:
+        result = numpy.zeros(len(points))
+        numpy.cumsum(lengths, out=result[1:])
+        return result
+    if not points:
+        return []
+    result = [0.0]
+    total = 0.0
+    for length in lengths:
+        total += length
+        result.append(total)
+    return result
+
+
+def path_length(points, backend=None):
+    """Compute total length of a polyline.
+
+    :param points: sequence of (lat, lon, ...) tuples in degrees
+    :param str backend: backend to use, None for automatic selection
+    :return: length in kilometers
+    :rtype: float
+    """
+    backend = _array_backend(backend, len(points))
+    lengths = segment_lengths(points, backend)
+    if backend == BACKEND_NUMPY:
+        return float(lengths.sum())
+    return sum(lengths, 0.0)
+
+
+def closest_index(lat, lon, points, backend=None):
+    """Get index of the point closest to a position.
+
+    :param float lat: latitude in degrees
+    :param float lon: longitude in degrees
+    :param points: sequence of (lat, lon, ...) tuples in degrees
+    :param str backend: backend to use, None for automatic selection
+    :return: index of the closest point (the first one of equally close points)
+             or None if there are no points
+    :rtype: int or None
+    """
+    if not points:
+        return None
+    backend = _array_backend(backend, len(points))
+    point_distances = distances(lat, lon, points, backend)
+    if backend == BACKEND_NUMPY:
+        return int(numpy.argmin(point_distances))
+    return min(range(len(point_distances)), key=point_distances.__getitem__)
+
+
 def ll2radians(lat, lon):
     """convert lat and lon in degrees to radians"""
     return radians(lat), radians(lon)
@@ -340,21 +502,38 @@ def cluster_trackpoints(trackpointsList, cluster_distance):
     Groups points that are less than cluster_distance pixels apart at
     a given zoom level into a cluster.
     """
-    clusters = []
     if trackpointsList:
-        points = [{'latitude': point.latitude, 'longitude': point.longitude} for point in trackpointsList[0]]
+        return cluster_lls([(point.latitude, point.longitude) for point in trackpointsList[0]], cluster_distance)
+    else:
+        return []
+
+
+def cluster_lls(lls, cluster_distance):
+    """Group (lat, lon) points that are less than cluster_distance kilometers apart
+
+    :returns: list of clusters, each a list of {'latitude': lat, 'longitude': lon} dicts
+    :rtype: list
+    """
+    clusters = []
+    if lls:
+        lls = list(lls)
+        points = [{'latitude': lat, 'longitude': lon} for lat, lon in lls]
         while len(points) > 0:
             point1 = points.pop()
+            lat, lon = lls.pop()
             cluster = []
-            for point2 in points[:]:
-                pixel_distance = distance(point1['latitude'],
-                                          point1['longitude'],
-                                          point2['latitude'],
-                                          point2['longitude'])
-
-                if pixel_distance < cluster_distance:
-                    points.remove(point2)
+            remaining_points = []
+            remaining_lls = []
+            # distances to all the remaining points at once
+            point_distances = distances(lat, lon, lls)
+            for point2, ll, point_distance in zip(points, lls, point_distances):
+                if point_distance < cluster_distance:
                     cluster.append(point2)
+                else:
+                    remaining_points.append(point2)
+                    remaining_lls.append(ll)
+            points = remaining_points
+            lls = remaining_lls
 
             # add the first point to the cluster
             if len(cluster) > 0:
@@ -432,111 +611,73 @@ def circle_around_point_cluster(cluster):
 
 
 def per_elev_list(trackpointsList, numPoints=200):
-    """determine elevation in regular interval, numPoints gives the number of intervals"""
-    points = [{'lat': point.latitude, 'lon': point.longitude, 'elev': point.elevation} for point in trackpointsList[0]]
-
-    # create a list, where we have (cumulative distance from starting point, elevation)
-    distanceList = [(0, points[0]['elev'], points[0]['lat'], points[0]['lon'])]
-    prevIndex = 0
-    totalDist = 0
-    for point in points[1:]:
-        prevPoint = points[prevIndex]
-        (pLat, pLon) = (prevPoint['lat'], prevPoint['lon'])
-        (lat, lon, elev) = (point['lat'], point['lon'], point['elev'])
-        dist = distance(pLat, pLon, lat, lon)
-        prevIndex += 1
-        totalDist += dist
-        distanceList.append((totalDist, elev, point['lat'], point['lon']))
-
-    trackLength = distanceList[-1][0]
-    delta = trackLength / numPoints
-    for i in range(1, numPoints): # like this, we should always be between two points with known elevation
-        currentDistance = i * delta
-        distanceList.append((currentDistance, None)) # we add the new points in regular intervals
+    """determine elevation in regular interval, numPoints gives the number of intervals
 
-    distanceList.sort() # now we sort the list by distance
-
-    periodicElevationList = [distanceList[0]]
-    index = 0
-    #  print("length: %d" % len(distanceList))
+    :returns: list of (distance from start in km, elevation, lat, lon) tuples
+              for the first point of the track, numPoints - 1 points in regular
+              intervals and the last point of the track
+    :rtype: list
+    """
+    return per_elev_list_lle([(point.latitude, point.longitude, point.elevation) for point in trackpointsList[0]],
+                             numPoints)
 
-    """when we find a point with unknown elevation, we:
-       * find the first points with known elevation to the "left" and "right"
-       * elevation of these points create a virtual right triangle,
-         where the opposite side is the elevation difference
-       * using trigonometric calculations, we find the interpolated elevation of the current periodic point
 
-       then we store the point in our new list and that's it
+def per_elev_list_lle(points, numPoints=200):
+    """determine elevation in regular interval for a track given as (lat, lon, elevation) tuples
 
-       we are doing this, to get carts with uniform x axis distribution,
+    :returns: same as per_elev_list()
+    :rtype: list
+    """
+    if not points:
+        return []
+    alongTrack = along_track_distances(points)
+    trackLength = float(alongTrack[-1])
+    # elevation is interpolated just from points with known elevation
+    elevationPoints = [(float(alongTrack[index]), point[2]) for index, point in enumerate(points)
+                       if point[2] is not None]
+    elevationDistances = [point[0] for point in elevationPoints]
+
+    """we are doing this, to get carts with uniform x axis distribution,
        even when the points in the tracklog are no uniformly distributed (e.g. routing results)
+
+       the periodic points are linearly interpolated between the closest
+       track points before and after them
     """
-    for point in distanceList:
-        if point[1] is None:
-            prevIndex = index - 1
-            while distanceList[prevIndex][1] is None:
-                prevIndex -= 1
-            prevPoint = distanceList[prevIndex]
-
-            nextIndex = index + 1
-            while distanceList[nextIndex][1] is None:
-                nextIndex += 1
-            nextPoint = distanceList[nextIndex]
-
-            #      print(prevPoint)
-            #      print(point)
-            #      print(nextPoint)
-
-            prevElev = prevPoint[1]
-            nextElev = nextPoint[1]
-
-            newElev = None
-            if prevElev == nextElev:
-                newElev = prevElev
-
-            elif prevElev > nextElev:
-                opposite = abs(prevPoint[1] - nextPoint[1])
-                adjacent = abs(prevPoint[0] - nextPoint[0])
-                beta = atan(opposite / adjacent)
-                alpha = pi - beta - pi / 2
-                adjacentPart = nextPoint[0] - point[0]
-                dElev = adjacentPart / tan(alpha)
-                newElev = nextElev + dElev
-
-            elif prevElev < nextElev:
-                opposite = abs(prevPoint[1] - nextPoint[1])
-                adjacent = abs(prevPoint[0] - nextPoint[0])
-                beta = atan(opposite / adjacent)
-                alpha = pi - beta - pi / 2
-                adjacentPart = point[0] - prevPoint[0]
-                dElev = adjacentPart / tan(alpha)
-                newElev = prevElev + dElev
-
-            # add coordinates to periodic points
-            (lat1, lon1) = prevPoint[2:4]
-            (lat2, lon2) = nextPoint[2:4]
-            #      (lat,lon) = point[2:4]
-            d = distance(lat1, lon1, lat2, lon2) # distance between the two known points
-            dPart = point[0] - prevPoint[0] # distance to the periodic point
-
-            actual = dPart / d # the actual distance fraction
-            rest = 1 - actual # how much remains
-
-            # get the periodic point coordinates, depending on its distance from known points
-            lat = (rest * lat1) + (actual * lat2)
-            lon = (rest * lon1) + (actual * lon2)
-
-            #      print((d,dPart))
-            #      print((actual,rest))
-
-            periodicElevationList.append((point[0], newElev, lat, lon))
-
-        index += 1
-
-    periodicElevationList.append(distanceList[-1]) # add the last point of the track
+    firstPoint = points[0]
+    periodicElevationList = [(0, firstPoint[2], firstPoint[0], firstPoint[1])]
+    delta = trackLength / numPoints
+    for i in range(1, numPoints): # like this, we should always be between two points with known elevation
+        currentDistance = i * delta
+        # coordinates
+        nextIndex = min(max(bisect.bisect_right(alongTrack, currentDistance), 1), len(points) - 1)
+        (lat1, lon1) = points[nextIndex - 1][:2]
+        (lat2, lon2) = points[nextIndex][:2]
+        actual = _interpolation_fraction(alongTrack[nextIndex - 1], alongTrack[nextIndex], currentDistance)
+        rest = 1 - actual
+        lat = (rest * lat1) + (actual * lat2)
+        lon = (rest * lon1) + (actual * lon2)
+        # elevation
+        newElev = None
+        if elevationPoints:
+            elevationIndex = bisect.bisect_right(elevationDistances, currentDistance)
+            prevPoint = elevationPoints[max(elevationIndex - 1, 0)]
+            nextPoint = elevationPoints[min(elevationIndex, len(elevationPoints) - 1)]
+            actual = _interpolation_fraction(prevPoint[0], nextPoint[0], currentDistance)
+            newElev = prevPoint[1] + actual * (nextPoint[1] - prevPoint[1])
+        periodicElevationList.append((currentDistance, newElev, lat, lon))
+
+    lastPoint = points[-1]
+    periodicElevationList.append((trackLength, lastPoint[2], lastPoint[0], lastPoint[1])) # add the last point of the track
 
     return periodicElevationList
 
+
+def _interpolation_fraction(distance1, distance2, currentDistance):
+    """How far is currentDistance between the two distances, from 0 to 1"""
+    if distance2 <= distance1:
+        return 0.0
+    return min(max((currentDistance - distance1) / float(distance2 - distance1), 0.0), 1.0)
+
 def parse_geo_coords(geo_coords_string):
     """Parse a string geographic coordinates with the geo: prefix
        to a lat, lon tuple
@@ -567,14 +708,8 @@ def get_closest_point(point, points):
     if not points:
         return None
 
-    # create a list of all message points with distance
-    # from the given point
-    points_with_distance = []
-    for some_point in points:
-        distance_to_point = distance_p2p(point, some_point)
-        points_with_distance.append((distance_to_point, some_point))
-    # sort the list and return the closest point
-    return sorted(points_with_distance, key=lambda x: x[0])[0][1]
+    # no need to sort all the points just to get the closest one
+    return min(points, key=lambda some_point: distance_p2p(point, some_point))
 
 def get_closest_lle(lle, lle_list):
     """Get closest point to a point from a list of points.
@@ -594,65 +729,81 @@ def get_closest_lle(lle, lle_list):
     if not lle_list:
         return None
 
-    # create a list of all message lle tuples with distance
-    # from the given lle tuple
-    lle_tuples_with_distance = []
-    for some_lle in lle_list:
-        distance_to_lle = distance(lat1=some_lle[0], lon1=some_lle[1], lat2=lle[0], lon2=lle[1])
-        lle_tuples_with_distance.append((distance_to_lle, some_lle))
-    # sort the list and return the closest lle tuple
-    return sorted(lle_tuples_with_distance, key=lambda x: x[0])[0][1]
+    return lle_list[closest_index(lle[0], lle[1], lle_list)]
+
+def _benchmark_run(results, label, function, sampleSize, repeat):
+    best = None
+    for _i in range(repeat):
+        start = timeit.default_timer()
+        result = function()
+        elapsed = timeit.default_timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    results[label] = best
+    print("%12.3f ms %s" % (1000 * best, label))
+    if sampleSize:
+        print(list(result[0:sampleSize]))
 
-def distance_benchmark(LLE, sampleSize=None):
-    """geographic distance measurement method benchmark"""
 
+def distance_benchmark(LLE, sampleSize=None, repeat=3):
+    """geographic distance measurement method benchmark
+
+    The single point distance functions called in a loop are compared
+    with the array distance functions on all the available backends.
+
+    :param LLE: list of (lat, lon, elevation) tuples in degrees
+    :param int sampleSize: how many results of each method to print
+    :param int repeat: how many times to run each method, the best time is reported
+    :return: method name -> best time in seconds dictionary
+    :rtype: dict
+    """
     lat, lon = 49.2, 16.616667 # Brno
+    results = {}
     print("#Geographic distance algorithm benchmark start #")
-    print("%d points" % len(LLE))
+    print("%d points, backends: %s" % (len(LLE), ", ".join(BACKENDS)))
 
     # first test on classic lat, lon, elevation tuples with coordinates in degrees
-
-    # Classic modRana method
-    start1 = time.clock()
-    l = map(lambda x: distanceOld(lat, lon, x[0], x[1]), LLE)
-    print("%1.9f ms Classic modRana method" % (1000 * (time.clock() - start1)))
-    if sampleSize:
-        print(l[0:sampleSize - 1])
-
-    # Marble method
-    start1 = time.clock()
-    l = map(lambda x: distance(lat, lon, x[0], x[1]), LLE)
-    print("%1.9f ms Marble method" % (1000 * (time.clock() - start1)))
-    if sampleSize:
-        print(l[0:sampleSize - 1])
-
-    # Marble approximate
-    start1 = time.clock()
-    l = map(lambda x: distance_approx(lat, lon, x[0], x[1]), LLE)
-    print("%1.9f ms Marble approximate method" % (1000 * (time.clock() - start1)))
-    if sampleSize:
-        print(l[0:sampleSize - 1])
+    print("# distances from a point #")
+    _benchmark_run(results, "Classic modRana method",
+                   lambda: [distanceOld(lat, lon, x[0], x[1]) for x in LLE], sampleSize, repeat)
+    _benchmark_run(results, "Marble method",
+                   lambda: [distance(lat, lon, x[0], x[1]) for x in LLE], sampleSize, repeat)
+    _benchmark_run(results, "Marble approximate method",
+                   lambda: [distance_approx(lat, lon, x[0], x[1]) for x in LLE], sampleSize, repeat)
 
     # lets check on precomputed coordinates in radians
-    LLERadians = map(lambda x: (radians(x[0]), radians(x[1]), x[2]), LLE)
-    lat = radians(lat)
-    lon = radians(lon)
-    # Marble method on radians
-    start1 = time.clock()
-    l = map(lambda x: distance_radians(lat, lon, x[0], x[1]), LLERadians)
-    print("%1.9f ms Marble method on radians" % (1000 * (time.clock() - start1)))
-    if sampleSize:
-        print(l[0:sampleSize - 1])
-
-    # Marble approximate method on radians
-    start1 = time.clock()
-    l = map(lambda x: distance_approx_radians(lat, lon, x[0], x[1]), LLERadians)
-    print("%1.9f ms Marble approximate method on radians" % (1000 * (time.clock() - start1)))
-    if sampleSize:
-        print(l[0:sampleSize - 1])
+    LLERadians = lle_tuples2radians(LLE)
+    latRadians = radians(lat)
+    lonRadians = radians(lon)
+    _benchmark_run(results, "Marble method on radians",
+                   lambda: [distance_radians(latRadians, lonRadians, x[0], x[1]) for x in LLERadians],
+                   sampleSize, repeat)
+    _benchmark_run(results, "Marble approximate method on radians",
+                   lambda: [distance_approx_radians(latRadians, lonRadians, x[0], x[1]) for x in LLERadians],
+                   sampleSize, repeat)
+    for backend in BACKENDS:
+        _benchmark_run(results, "distances() - %s backend" % backend,
+                       lambda: distances(lat, lon, LLE, backend), sampleSize, repeat)
+
+    # cumulative distance along the points
+    print("# along track distances #")
+
+    def along_track_loop():
+        result = [0.0]
+        for index in range(1, len(LLE)):
+            a = LLE[index - 1]
+            b = LLE[index]
+            result.append(result[-1] + distance(a[0], a[1], b[0], b[1]))
+        return result
+
+    _benchmark_run(results, "Marble method in a loop", along_track_loop, sampleSize, repeat)
+    for backend in BACKENDS:
+        _benchmark_run(results, "along_track_distances() - %s backend" % backend,
+                       lambda: along_track_distances(LLE, backend), sampleSize, repeat)
 
     # done
     print("# benchmark finished #")
+    return results
 
 ## RESULTS ##
 # (a route from prague to Sevastopol was used)
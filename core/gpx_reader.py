@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""Streaming GPX track reader
+
+Loading a tracklog with upoints builds an ElementTree of the whole file
+and a Trackpoint object for every point, which for multi-megabyte
+tracklogs takes seconds and a lot of memory on handheld devices.
+
+The reader instead goes through the file with iterparse(), dropping
+elements once they have been processed, and stores trackpoints straight
+to compact point arrays. Bounding box, length and elevation statistics
+are computed in the same pass, so nothing needs to go over the points again.
+Clusters are computed once the file has been read, from the point arrays.
+
+Timestamps are stored as seconds since the epoch (in UTC), timestamps
+that can't be parsed are kept as they are.
+"""
+import re
+import calendar
+import logging
+from xml.etree import ElementTree
+
+from core import geo
+from core.point_array import PointArray
+
+log = logging.getLogger("core.gpx_reader")
+
+# ISO 8601 timestamps as used in GPX files, eq. 2020-01-01T10:00:00Z
+# or 2009-07-12T05:56:36.000-07:00
+TIME_RE = re.compile(r"^\s*(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(\.\d+)?"
+                     r"(?:([zZ])|([+-])(\d\d):?(\d\d))?\s*$")
+
+
+def parse_time(text):
+    """Parse a GPX timestamp
+
+    Timestamps without a time zone are assumed to be in UTC.
+
+    :param str text: ISO 8601 timestamp
+    :returns: seconds since the epoch or None if the timestamp can't be parsed
+    :rtype: float or None
+    """
+    match = TIME_RE.match(text)
+    if match is None:
+        return None
+    year, month, day, hour, minute, second, fraction, _utc, sign, zone_hours, zone_minutes = match.groups()
+    try:
+        seconds = calendar.timegm((int(year), int(month), int(day), int(hour), int(minute), int(second), 0, 0, 0))
+    except (ValueError, OverflowError):
+        return None
+    if fraction:
+        seconds += float(fraction)
+    if sign:
+        offset = 3600 * int(zone_hours) + 60 * int(zone_minutes)
+        if sign == "+":
+            seconds -= offset
+        else:
+            seconds += offset
+    return float(seconds)
+
+
+def _local_name(tag):
+    """Element tag without the namespace"""
+    return tag[tag.rfind("}") + 1:]
+
+
+class TrackStats(object):
+    """Statistics of a track segment, updated as points are added"""
+
+    def __init__(self):
+        self.point_count = 0
+        self.min_lat = None
+        self.min_lon = None
+        self.max_lat = None
+        self.max_lon = None
+        self.length = 0.0  # in meters
+        self.elevation_count = 0
+        self.min_elevation = None
+        self.max_elevation = None
+        self.first_elevation = None
+        self.last_elevation = None
+        self._last_point = None
+
+    def add(self, lat, lon, elevation):
+        if self.point_count:
+            self.min_lat = min(self.min_lat, lat)
+            self.min_lon = min(self.min_lon, lon)
+            self.max_lat = max(self.max_lat, lat)
+            self.max_lon = max(self.max_lon, lon)
+            last_lat, last_lon = self._last_point
+            self.length += geo.distance(last_lat, last_lon, lat, lon) * 1000
+        else:
+            self.min_lat = self.max_lat = lat
+            self.min_lon = self.max_lon = lon
+        self._last_point = lat, lon
+        self.point_count += 1
+        if elevation is not None:
+            if self.elevation_count:
+                self.min_elevation = min(self.min_elevation, elevation)
+                self.max_elevation = max(self.max_elevation, elevation)
+            else:
+                self.min_elevation = self.max_elevation = self.first_elevation = elevation
+            self.last_elevation = elevation
+            self.elevation_count += 1
+
+    @property
+    def bounds(self):
+        """(min lat, min lon, max lat, max lon) tuple or None if there are no points"""
+        if not self.point_count:
+            return None
+        return self.min_lat, self.min_lon, self.max_lat, self.max_lon
+
+    @property
+    def route_info(self):
+        """Elevation statistics in the tracklog route info format or None if no point has elevation"""
+        if not self.elevation_count:
+            return None
+        return {
+            'maxElevation': self.max_elevation,
+            'minElevation': self.min_elevation,
+            'middle': self.min_elevation + (self.max_elevation - self.min_elevation) / 2,
+            'firstElevation': self.first_elevation,
+            'lastElevation': self.last_elevation,
+        }
+
+
+class GPXTrack(object):
+    """Track segments read from a GPX file"""
+
+    def __init__(self):
+        # one point array & statistics per track segment
+        self.segments = []
+        self.stats = []
+        # per segment dicts of point index -> (name, description)
+        # for the few trackpoints that have them
+        self.point_texts = []
+        # clusters of the first segment, if requested
+        self.clusters = None
+
+    @property
+    def points(self):
+        """Points of the first track segment"""
+        if self.segments:
+            return self.segments[0]
+        else:
+            return PointArray()
+
+    @property
+    def point_count(self):
+        return sum(len(segment) for segment in self.segments)
+
+    def to_trackpoints(self):
+        """Convert the track to upoints Trackpoints
+
+        :returns: upoints Trackpoints, one list of Trackpoint objects per segment
+        """
+        # import the GPX module only when really needed
+        from upoints import gpx
+        from upoints import utils
+        utc = utils.TzOffset("+00:00")
+        trackpoints = gpx.Trackpoints()
+        for segment, texts in zip(self.segments, self.point_texts):
+            points = []
+            for index in range(len(segment)):
+                name, description = texts.get(index, (None, None))
+                seconds = segment.times[index]
+                if seconds == seconds:  # not NaN
+                    timestamp = utils.Timestamp.utcfromtimestamp(seconds).replace(tzinfo=utc)
+                else:
+                    timestamp = segment.timestamp(index)
+                points.append(gpx.Trackpoint(segment.lats[index], segment.lons[index], name, description,
+                                             segment.elevation(index), timestamp))
+            trackpoints.append(points)
+        return trackpoints
+
+
+def read_gpx(source, cluster_distance=None):
+    """Read track segments from a GPX file
+
+    Both GPX 1.0 and 1.1 files are supported, waypoints and routes are ignored.
+    Trackpoints without valid coordinates are skipped.
+
+    :param source: path to a GPX file or a file object
+    :param cluster_distance: cluster the points of the first segment to clusters
+                             of about this diameter in kilometers, no clustering if None
+    :returns: the track
+    :rtype: GPXTrack
+    :raises: SyntaxError (ElementTree.ParseError) for malformed files
+    """
+    track = GPXTrack()
+    root = None
+    depth = 0
+    segment_element = None
+    segment_depth = None
+    points = None
+    stats = None
+    texts = None
+    skipped_count = 0
+    for event, element in ElementTree.iterparse(source, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if root is None:
+                root = element
+            elif segment_element is None and _local_name(element.tag) == "trkseg":
+                segment_element = element
+                segment_depth = depth
+                points = PointArray()
+                stats = TrackStats()
+                texts = {}
+                track.segments.append(points)
+                track.stats.append(stats)
+                track.point_texts.append(texts)
+            continue
+        depth -= 1
+        if element is segment_element:
+            segment_element = None
+            element.clear()
+        elif depth == segment_depth and segment_element is not None and _local_name(element.tag) == "trkpt":
+            # a trackpoint directly in the segment
+            elevation = None
+            timestamp = None
+            name = None
+            description = None
+            for child in element:
+                tag = _local_name(child.tag)
+                if tag == "ele":
+                    if child.text:
+                        try:
+                            elevation = float(child.text)
+                        except ValueError:
+                            pass
+                elif tag == "time":
+                    if child.text:
+                        timestamp = parse_time(child.text)
+                        if timestamp is None:
+                            timestamp = child.text
+                elif tag == "name":
+                    name = child.text
+                elif tag == "desc":
+                    description = child.text
+            try:
+                lat = float(element.get("lat"))
+                lon = float(element.get("lon"))
+            except (TypeError, ValueError):
+                skipped_count += 1
+            else:
+                if name is not None or description is not None:
+                    texts[len(points)] = (name, description)
+                points.append(lat, lon, elevation, timestamp)
+                stats.add(lat, lon, elevation)
+            # drop the processed trackpoint from the tree
+            segment_element.clear()
+        elif depth == 1:
+            # done with a top level element (track, route, metadata, ...)
+            root.clear()
+    if skipped_count:
+        log.warning("%d trackpoints without valid coordinates skipped", skipped_count)
+    if cluster_distance is not None:
+        first = track.points
+        track.clusters = geo.cluster_lls(zip(first.lats, first.lons), cluster_distance)
+    return track
@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+"""Per-host download concurrency control & circuit breaker
+
+Tile servers that are struggling (returning server errors, rate limiting us or
+timing out) should not be hammered by all the download threads modRana has.
+A HostController is shared by all code downloading from a single host and:
+
+* limits the number of concurrent requests to the host, using additive increase
+  on success and multiplicative decrease on failure (AIMD)
+* honours the Retry-After header of 429 & 503 responses
+* opens a circuit breaker after a number of consecutive failures, failing
+  requests at once without contacting the host, with the circuit open
+  for an exponentially growing & jittered period of time
+* after that, lets a single trial request through (half-open circuit)
+  and closes the circuit if it succeeds
+"""
+from __future__ import with_statement
+import time
+import random
+import threading
+import calendar
+from email.utils import parsedate
+
+try:  # Python 2
+    from urlparse import urlparse
+except ImportError:  # Python 3
+    from urllib.parse import urlparse
+
+from core import constants
+
+import logging
+log = logging.getLogger("core.host_controller")
+
+# request outcomes
+SUCCESS = "success"
+FAILURE = "failure"  # the host is struggling (5xx, 429, timeouts, connection errors)
+NEUTRAL = "neutral"  # the host works but the request failed (404, etc.)
+
+# circuit states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "halfOpen"
+
+# how many consecutive failures open the circuit
+DEFAULT_FAILURE_THRESHOLD = 5
+# how long is the circuit open the first time
+# - the time doubles with each consecutive opening
+CIRCUIT_OPEN_BASE_TIME = 5  # seconds
+CIRCUIT_OPEN_MAX_TIME = 5 * 60  # seconds
+# retry delay for failed requests, doubling with each attempt
+RETRY_BASE_DELAY = 0.1  # seconds
+RETRY_MAX_DELAY = 30  # seconds
+# the concurrency limit is decreased at most once per this interval,
+# so that a burst of concurrent failures does not collapse it at once
+DECREASE_INTERVAL = 1.0  # seconds
+# longest Retry-After we honour
+MAX_RETRY_AFTER = 60 * 60  # seconds
+
+
+class HostUnavailable(Exception):
+    """Raised when a request can't be made as the host is backing off"""
+    def __init__(self, host, retryIn):
+        Exception.__init__(self)
+        self.host = host
+        self.retryIn = retryIn
+
+    def __str__(self):
+        return "host %s is unavailable, retry in %1.1f s" % (self.host, self.retryIn)
+
+
+def outcomeForStatus(status):
+    """Get request outcome for a HTTP status code
+
+    :param int status: HTTP status code
+    :returns: SUCCESS, FAILURE or NEUTRAL
+    :rtype: str
+    """
+    if status < 400:
+        return SUCCESS
+    elif status in (408, 429) or status >= 500:
+        return FAILURE
+    else:
+        return NEUTRAL
+
+
+def parseRetryAfter(value, now=None):
+    """Parse the Retry-After header value
+
+    :param value: header value, either delay in seconds or a HTTP date
+    :param float now: current timestamp
+    :returns: delay in seconds or None if the value can't be parsed
+    :rtype: float or None
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        delay = float(value)
+    except ValueError:
+        date = parsedate(value)
+        if date is None:
+            return None
+        if now is None:
+            now = time.time()
+        delay = calendar.timegm(date) - now
+    return min(max(delay, 0.0), MAX_RETRY_AFTER)
+
+
+def hostForUrl(url):
+    """Get the host (including port) a URL points to
+
+    :param str url: the URL
+    :returns: host[:port] string
+    :rtype: str
+    """
+    return urlparse(url).netloc.lower()
+
+
+class HostController(object):
+    """Concurrency limit, backoff & circuit breaker for a single host"""
+
+    def __init__(self, host, maxConcurrency=constants.DEFAULT_MAX_CONCURRENT_REQUESTS_PER_HOST,
+                 failureThreshold=DEFAULT_FAILURE_THRESHOLD, clock=time.time, random=random.random):
+        """
+        :param str host: the host
+        :param int maxConcurrency: maximum number of concurrent requests to the host
+        :param int failureThreshold: how many consecutive failures open the circuit
+        :param clock: function returning current time in seconds
+        :param random: function returning a random float in [0.0, 1.0)
+        """
+        self._host = host
+        self._maxConcurrency = maxConcurrency
+        self._failureThreshold = failureThreshold
+        self._clock = clock
+        self._random = random
+        self._condition = threading.Condition(threading.Lock())
+        self._limit = float(maxConcurrency)
+        self._inFlight = 0
+        self._state = CLOSED
+        self._consecutiveFailures = 0
+        self._openCount = 0
+        self._openUntil = 0
+        # Retry-After deadline
+        self._blockedUntil = 0
+        self._lastDecrease = None
+        self._trialInFlight = False
+
+    @property
+    def host(self):
+        return self._host
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def limit(self):
+        """Current concurrency limit"""
+        return int(self._limit)
+
+    @property
+    def inFlight(self):
+        return self._inFlight
+
+    def retryIn(self):
+        """How long until requests to the host can be made again
+
+        :returns: time in seconds, 0 if requests can be made right now
+        :rtype: float
+        """
+        now = self._clock()
+        waitUntil = self._blockedUntil
+        if self._state == OPEN:
+            waitUntil = max(waitUntil, self._openUntil)
+        return max(waitUntil - now, 0.0)
+
+    def _backoff(self, attempt, baseDelay, maxDelay):
+        """Exponential backoff with jitter - random delay in the upper half of the
+        exponentially growing interval, so that retries from different threads
+        don't all arrive at the same time
+        """
+        delay = min(baseDelay * 2 ** attempt, maxDelay)
+        return delay * (0.5 + 0.5 * self._random())
+
+    def retryDelay(self, attempt):
+        """How long to wait before retrying a failed request
+
+        :param int attempt: how many times the request already failed (0 for the first failure)
+        :returns: delay in seconds
+        :rtype: float
+        """
+        return max(self._backoff(attempt, RETRY_BASE_DELAY, RETRY_MAX_DELAY), self.retryIn())
+
+    def _canStart(self, now):
+        """Check if the circuit and Retry-After allow a request to be started,
+        transitioning the circuit to half-open once the open time is over
+
+        :returns: True if a request can be started, False if requests should
+                  fail right now, None if the request should wait for a slot
+        """
+        if now < self._blockedUntil:
+            return False
+        if self._state == OPEN:
+            if now < self._openUntil:
+                return False
+            self._state = HALF_OPEN
+            self._trialInFlight = False
+            log.info("%s: circuit half-open, trying a single request", self._host)
+        if self._state == HALF_OPEN:
+            if self._trialInFlight:
+                return False
+            return True
+        if self._inFlight >= int(self._limit):
+            return None
+        return True
+
+    def acquire(self, timeout=None):
+        """Acquire a request slot for the host
+
+        Waits for a free slot if the concurrency limit has been reached,
+        fails at once if the circuit is open or the host asked us to back off.
+
+        :param timeout: how long to wait for a free slot, None means forever
+        :returns: True if the request can be made, False otherwise
+        :rtype: bool
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self._condition:
+            while True:
+                canStart = self._canStart(self._clock())
+                if canStart:
+                    if self._state == HALF_OPEN:
+                        self._trialInFlight = True
+                    self._inFlight += 1
+                    return True
+                elif canStart is False:
+                    return False
+                # wait for a free slot
+                if deadline is None:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+
+    def release(self, outcome, retryAfter=None):
+        """Release a request slot & record the request outcome
+
+        :param str outcome: SUCCESS, FAILURE or NEUTRAL
+        :param retryAfter: how long the host asked us to back off (in seconds)
+        """
+        with self._condition:
+            now = self._clock()
+            self._inFlight = max(self._inFlight - 1, 0)
+            if retryAfter:
+                self._blockedUntil = max(self._blockedUntil, now + retryAfter)
+            if outcome == FAILURE:
+                self._failure(now)
+            else:
+                if self._state != CLOSED:
+                    log.info("%s: circuit closed", self._host)
+                self._state = CLOSED
+                self._trialInFlight = False
+                self._consecutiveFailures = 0
+                self._openCount = 0
+                if outcome == SUCCESS and self._limit < self._maxConcurrency:
+                    # additive increase - about +1 once a full window of requests succeeds
+                    self._limit = min(self._limit + 1.0 / self._limit, self._maxConcurrency)
+            self._condition.notify_all()
+
+    def _failure(self, now):
+        self._consecutiveFailures += 1
+        # multiplicative decrease
+        if self._lastDecrease is None or now - self._lastDecrease >= DECREASE_INTERVAL:
+            self._limit = max(self._limit / 2.0, 1.0)
+            self._lastDecrease = now
+        if self._state == HALF_OPEN or self._consecutiveFailures >= self._failureThreshold:
+            openTime = self._backoff(self._openCount, CIRCUIT_OPEN_BASE_TIME, CIRCUIT_OPEN_MAX_TIME)
+            self._openCount += 1
+            self._state = OPEN
+            self._trialInFlight = False
+            self._openUntil = now + openTime
+            log.warning("%s: circuit open for %1.1f s after %d consecutive failures",
+                        self._host, openTime, self._consecutiveFailures)
+
+    def request(self, connPool, method, url, slotTimeout=None, **kwargs):
+        """Make a request to the host through the given connection pool
+
+        :param connPool: urllib3 connection pool
+        :param str method: HTTP method
+        :param str url: URL to request
+        :param slotTimeout: how long to wait for a request slot, None means forever
+        :param kwargs: keyword arguments for the urllib3 request() call
+        :returns: the response
+        :raises HostUnavailable: if the host is backing off
+        """
+        if not self.acquire(timeout=slotTimeout):
+            raise HostUnavailable(self._host, self.retryIn())
+        try:
+            response = connPool.request(method, url, **kwargs)
+        except Exception:
+            self.release(FAILURE)
+            raise
+        retryAfter = None
+        if response.status in (429, 503):
+            retryAfter = parseRetryAfter(response.getheaders().get("retry-after"), self._clock())
+        self.release(outcomeForStatus(response.status), retryAfter=retryAfter)
+        return response
+
+    def statusText(self):
+        """Short human readable description of the host state
+
+        :returns: the description or an empty string if the host is healthy
+        :rtype: str
+        """
+        retryIn = self.retryIn()
+        if self._state == OPEN or retryIn:
+            return "%s is not responding, retrying in %d s" % (self._host, max(retryIn, 1))
+        elif self._state == HALF_OPEN:
+            return "%s is not responding, retrying" % self._host
+        elif int(self._limit) < self._maxConcurrency:
+            return "%s is slow, using %d of %d connections" % (self._host, int(self._limit), self._maxConcurrency)
+        else:
+            return ""
+
+
+class HostControllers(object):
+    """Registry of per-host controllers shared by all tile downloaders"""
+
+    def __init__(self, **controllerKwargs):
+        self._controllerKwargs = controllerKwargs
+        self._controllers = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        """Get the controller for the host the URL points to
+
+        :param str url: URL or host
+        :returns: host controller
+        :rtype: HostController
+        """
+        host = hostForUrl(url) if "://" in url else url.lower()
+        controller = self._controllers.get(host)
+        if controller is None:
+            with self._lock:
+                controller = self._controllers.get(host)
+                if controller is None:
+                    controller = HostController(host, **self._controllerKwargs)
+                    self._controllers[host] = controller
+        return controller
+
+    def statusText(self):
+        """Describe all hosts that are not healthy
+
+        :returns: the description or an empty string if all hosts are healthy
+        :rtype: str
+        """
+        with self._lock:
+            controllers = list(self._controllers.values())
+        return ", ".join(text for text in (c.statusText() for c in controllers) if text)
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""Shared HTTP connection pools
+
+Many map layers and online services live on the same host, so rather than
+each of them creating its own urllib3 connection pool (and its own
+sockets & TLS sessions), all HTTP traffic goes through connection pools
+shared by scheme, host and port.
+
+Pools are sized to the largest number of connections any user asked for,
+pools not used for a while are dropped and per-pool statistics are kept
+so that connection reuse can be checked. Dropped pools are not closed,
+as someone might still be using them, their connections are closed
+once the pool is garbage collected.
+"""
+from __future__ import with_statement
+import sys
+import time
+import threading
+
+try:  # Python 2
+    from urlparse import urlparse, urljoin
+except ImportError:  # Python 3
+    from urllib.parse import urlparse, urljoin
+
+try:
+    import ssl
+except ImportError:
+    ssl = None
+
+from core import constants
+
+import logging
+log = logging.getLogger("core.http_pools")
+
+DEFAULT_POOL_SIZE = 1
+# drop pools not used for this long
+DEFAULT_IDLE_TIMEOUT = 5 * 60  # seconds
+# how often to check for idle pools
+REAP_INTERVAL = 60  # seconds
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+# how many redirects to follow for a single request
+MAX_REDIRECTS = 5
+# verify server certificates like urlopen() does - it does so on Pythons
+# that can load the system certificates (2.7.9+ & 3.4+)
+VERIFY_CERTIFICATES = ssl is not None and hasattr(ssl, "create_default_context")
+
+
+class HTTPStatusError(Exception):
+    """Raised by ConnectionPoolRegistry.getData() for HTTP error responses
+    and by ConnectionPoolRegistry.request() for too many redirects"""
+    def __init__(self, url, status):
+        Exception.__init__(self)
+        self.url = url
+        self.status = status
+
+    def __str__(self):
+        return "server returned HTTP status %d\nURL:%s" % (self.status, self.url)
+
+
+def poolKey(url):
+    """Get the connection pool key for a URL
+
+    :param str url: the URL
+    :returns: (scheme, host, port) tuple
+    :rtype: tuple
+    """
+    parsed = urlparse(url)
+    scheme = (parsed.scheme or "http").lower()
+    host = (parsed.hostname or "").lower()
+    port = parsed.port or DEFAULT_PORTS.get(scheme)
+    return scheme, host, port
+
+
+class ConnectionPoolRegistry(object):
+    """Thread safe registry of connection pools shared by scheme, host and port"""
+
+    def __init__(self, timeout=constants.INTERNET_CONNECTIVITY_TIMEOUT,
+                 idleTimeout=DEFAULT_IDLE_TIMEOUT, clock=time.time, **poolKwargs):
+        """
+        :param timeout: default request timeout in seconds for new pools
+        :param idleTimeout: drop pools not used for this long (in seconds)
+        :param clock: function returning current time in seconds
+        :param poolKwargs: additional keyword arguments for new urllib3 pools
+        """
+        self._timeout = timeout
+        self._idleTimeout = idleTimeout
+        self._clock = clock
+        self._poolKwargs = poolKwargs
+        # (scheme, host, port) -> [pool, size, last used timestamp]
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._lastReap = clock()
+        # statistics of already dropped pools
+        self._droppedConnections = {}
+        self._droppedRequests = {}
+
+    def __len__(self):
+        return len(self._pools)
+
+    def _newPool(self, key, size):
+        # only import urllib3 once needed
+        if sys.version_info[:2] <= (2, 5):
+            from core.backports import urllib3_python25 as urllib3
+        else:
+            import urllib3
+        scheme, host, port = key
+        poolKwargs = dict(self._poolKwargs)
+        if scheme == "https":
+            poolClass = urllib3.HTTPSConnectionPool
+            if VERIFY_CERTIFICATES:
+                # urllib3 loads the system certificates if no ca_certs are given
+                poolKwargs.setdefault("cert_reqs", "CERT_REQUIRED")
+        else:
+            poolClass = urllib3.HTTPConnectionPool
+        # non-blocking - if more connections than the pool size are needed
+        # at once, the extra connections are made but not kept
+        return poolClass(host, port=port, maxsize=size, block=False,
+                         timeout=self._timeout, **poolKwargs)
+
+    def get(self, url, size=None):
+        """Get a connection pool for the given URL
+
+        :param str url: the URL (only scheme, host & port are used)
+        :param int size: how many connections should the pool keep open,
+                         an existing smaller pool is replaced by a larger one
+        :returns: urllib3 connection pool
+        """
+        key = poolKey(url)
+        size = max(size or DEFAULT_POOL_SIZE, 1)
+        with self._lock:
+            now = self._clock()
+            entry = self._pools.get(key)
+            if entry is None or entry[1] < size:
+                if entry is not None:
+                    # callers might still hold the old pool, so it is just
+                    # replaced & left to be garbage collected
+                    self._dropPool(key, entry[0])
+                log.debug("creating connection pool for %s://%s:%s with size %d", key[0], key[1], key[2], size)
+                entry = [self._newPool(key, size), size, now]
+                self._pools[key] = entry
+            else:
+                entry[2] = now
+            if now - self._lastReap >= REAP_INTERVAL:
+                self._reapIdle(now)
+        return entry[0]
+
+    def request(self, method, url, size=None, **kwargs):
+        """Make a HTTP request using a shared connection pool
+
+        A pool can only talk to a single host, so redirects are followed
+        here, each with the pool for the URL it redirects to.
+
+        :param str method: HTTP method
+        :param str url: the URL
+        :param int size: pool size hint, see get()
+        :param kwargs: keyword arguments for the urllib3 request() call
+        :returns: urllib3 response
+        :raises HTTPStatusError: if there are more than MAX_REDIRECTS redirects
+        """
+        for _redirect in range(MAX_REDIRECTS + 1):
+            parsed = urlparse(url)
+            # send just the path, the host is already given by the pool
+            path = parsed.path or "/"
+            if parsed.query:
+                path = "%s?%s" % (path, parsed.query)
+            response = self.get(url, size=size).request(method, path, redirect=False, **kwargs)
+            location = response.get_redirect_location()
+            if not location:
+                return response
+            if response.status == 303:
+                method = 'GET'
+            url = urljoin(url, location)
+            log.debug("following redirect to %s", url)
+        raise HTTPStatusError(url, response.status)
+
+    def getData(self, url, headers=None, **kwargs):
+        """Download data from the URL using a shared connection pool
+
+        :param str url: the URL
+        :param dict headers: request headers
+        :param kwargs: keyword arguments for the urllib3 request() call
+        :returns: response data
+        :rtype: bytes
+        :raises HTTPStatusError: if the server returns an error status
+        """
+        response = self.request('GET', url, headers=headers, **kwargs)
+        if response.status >= 400:
+            raise HTTPStatusError(url, response.status)
+        return response.data
+
+    def _dropPool(self, key, pool):
+        """Record statistics of a pool no longer handed out by the registry
+
+        NOTE: requests still made with the pool once dropped are not counted
+        """
+        self._droppedConnections[key] = self._droppedConnections.get(key, 0) + pool.num_connections
+        self._droppedRequests[key] = self._droppedRequests.get(key, 0) + pool.num_requests
+
+    def _reapIdle(self, now):
+        self._lastReap = now
+        reaped = 0
+        for key, (pool, _size, lastUsed) in list(self._pools.items()):
+            if now - lastUsed >= self._idleTimeout:
+                # the pool is not closed, as a caller might still hold it,
+                # the connections are closed once it is garbage collected
+                self._dropPool(key, pool)
+                del self._pools[key]
+                reaped += 1
+        if reaped:
+            log.debug("dropped %d idle connection pools", reaped)
+        return reaped
+
+    def reapIdle(self):
+        """Drop pools that were not used for longer than the idle timeout
+
+        :returns: number of dropped pools
+        :rtype: int
+        """
+        with self._lock:
+            return self._reapIdle(self._clock())
+
+    def stats(self):
+        """Get per-pool statistics
+
+        Statistics of dropped pools are included, so the numbers
+        are cumulative for the whole lifetime of the registry.
+
+        :returns: (scheme, host, port) -> dictionary with "connections"
+                  (new connections made), "requests", "size" and "idle" (seconds
+                  since the pool was last used, None for dropped pools) keys
+        :rtype: dict
+        """
+        with self._lock:
+            now = self._clock()
+            stats = {}
+            for key in set(self._pools) | set(self._droppedConnections):
+                entry = self._pools.get(key)
+                connections = self._droppedConnections.get(key, 0)
+                requests = self._droppedRequests.get(key, 0)
+                if entry:
+                    pool, size, lastUsed = entry
+                    stats[key] = {"connections": connections + pool.num_connections,
+                                  "requests": requests + pool.num_requests,
+                                  "size": size,
+                                  "idle": now - lastUsed}
+                else:
+                    stats[key] = {"connections": connections,
+                                  "requests": requests,
+                                  "size": 0,
+                                  "idle": None}
+            return stats
+
+    def clear(self):
+        """Close all pools - only use once no more requests will be made"""
+        with self._lock:
+            for key, entry in list(self._pools.items()):
+                self._dropPool(key, entry[0])
+                entry[0].close()
+            self._pools.clear()
+
+
+# connection pools shared by all of modRana
+registry = ConnectionPoolRegistry()
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""Negative cache for failed tile downloads
+
+Remembers tiles that could not be downloaded, so that they are not requested
+again and again every time the map is panned. How long a tile is remembered
+depends on the kind of the error - tiles missing on the server are remembered
+for a long time while timeouts & other network errors are only remembered
+for a short time, which grows exponentially if the tile keeps failing.
+"""
+from __future__ import with_statement
+import sys
+import time
+import threading
+
+try:  # Python 2.7+
+    from collections import OrderedDict as OrderedDict
+except ImportError:
+    from core.backports.odict import odict as OrderedDict  # Python <2.7
+
+# error classes
+ERROR_NOT_FOUND = "notFound"  # 404 & 410
+ERROR_CLIENT = "clientError"  # other 4xx errors, such as 403
+ERROR_NOT_IMAGE = "notImage"  # an error page returned in place of the tile
+ERROR_SERVER = "serverError"  # 5xx errors & rate limiting
+ERROR_TIMEOUT = "timeout"  # timeouts & other network errors
+ERROR_HOST_UNAVAILABLE = "hostUnavailable"  # the tileserver host is backing off
+
+# error class -> (initial TTL, maximum TTL) in seconds,
+# the TTL doubles with each consecutive failure of a tile
+# until the maximum is reached
+DEFAULT_TTLS = {
+    ERROR_NOT_FOUND: (24 * 60 * 60, 24 * 60 * 60),
+    ERROR_CLIENT: (60 * 60, 24 * 60 * 60),
+    ERROR_NOT_IMAGE: (60 * 60, 24 * 60 * 60),
+    ERROR_SERVER: (60, 60 * 60),
+    ERROR_TIMEOUT: (10, 10 * 60),
+    ERROR_HOST_UNAVAILABLE: (5, 60),
+}
+
+# errors that are not expected to go away by just retrying the download
+PERMANENT_ERRORS = frozenset([ERROR_NOT_FOUND, ERROR_CLIENT, ERROR_NOT_IMAGE])
+
+# how many failed tiles to remember at most
+DEFAULT_MAX_ENTRIES = 10000
+
+
+def errorClassForStatus(status):
+    """Get error class for a HTTP status code
+
+    :param int status: HTTP status code
+    :returns: error class or None if the status is not an error
+    :rtype: str or None
+    """
+    if status < 400:
+        return None
+    elif status in (404, 410):
+        return ERROR_NOT_FOUND
+    elif status == 408:
+        return ERROR_TIMEOUT
+    elif status == 429 or status >= 500:
+        return ERROR_SERVER
+    else:
+        return ERROR_CLIENT
+
+
+def errorClassForException(exception):
+    """Get error class for an exception raised by a tile download
+
+    :param exception: the exception
+    :returns: error class or None if the exception is not a network error
+    :rtype: str or None
+    """
+    if isinstance(exception, EnvironmentError):
+        # socket errors, timeouts & urllib2 URLErrors
+        return ERROR_TIMEOUT
+    # only import urllib3 once needed
+    if sys.version_info[:2] <= (2, 5):
+        from core.backports import urllib3_python25 as urllib3
+    else:
+        import urllib3
+    if isinstance(exception, urllib3.exceptions.HTTPError):
+        # urllib3 timeouts and connection errors
+        return ERROR_TIMEOUT
+    return None
+
+
+class NegativeTileCache(object):
+    """Thread safe store of recently failed tile downloads"""
+
+    def __init__(self, ttls=None, maxEntries=DEFAULT_MAX_ENTRIES, clock=time.time):
+        """
+        :param dict ttls: error class -> (initial TTL, maximum TTL) dictionary
+        :param int maxEntries: how many failed tiles to remember at most
+        :param clock: function returning current time in seconds
+        """
+        self._ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self._ttls.update(ttls)
+        self._maxEntries = maxEntries
+        self._clock = clock
+        # lzxy -> (error class, consecutive failure count, expire timestamp),
+        # ordered from the oldest to the newest failure
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def addFailure(self, lzxy, errorClass, ttl=None):
+        """Record a failed download of a tile
+
+        :param tuple lzxy: tile description tuple
+        :param str errorClass: one of the ERROR_* error classes
+        :param ttl: how long to remember the failure in seconds,
+                    if None the TTL is based on the error class
+        :returns: expire timestamp of the failure
+        :rtype: float
+        """
+        initialTTL, maxTTL = self._ttls[errorClass]
+        with self._lock:
+            entry = self._entries.pop(lzxy, None)
+            if entry and entry[0] == errorClass:
+                failureCount = entry[1] + 1
+            else:
+                failureCount = 1
+            if ttl is None:
+                ttl = min(initialTTL * 2 ** (failureCount - 1), maxTTL)
+            expireTimestamp = self._clock() + ttl
+            self._entries[lzxy] = (errorClass, failureCount, expireTimestamp)
+            while len(self._entries) > self._maxEntries:
+                self._entries.popitem(last=False)
+        return expireTimestamp
+
+    def recordResponse(self, lzxy, status):
+        """Record the HTTP status of a tile download
+
+        A successful download clears any failures recorded for the tile.
+
+        :param tuple lzxy: tile description tuple
+        :param int status: HTTP status code
+        :returns: error class or None if the status is not an error
+        :rtype: str or None
+        """
+        errorClass = errorClassForStatus(status)
+        if errorClass:
+            self.addFailure(lzxy, errorClass)
+        else:
+            self.remove(lzxy)
+        return errorClass
+
+    def recordException(self, lzxy, exception):
+        """Record an exception raised by a tile download
+
+        :param tuple lzxy: tile description tuple
+        :param exception: the exception
+        :returns: error class or None if the exception is not a network error
+        :rtype: str or None
+        """
+        errorClass = errorClassForException(exception)
+        if errorClass:
+            self.addFailure(lzxy, errorClass)
+        return errorClass
+
+    def getFailure(self, lzxy):
+        """Get the active failure of a tile
+
+        Expired failures are not reported, but are still remembered
+        so that the next failure of the tile uses a longer TTL.
+
+        :param tuple lzxy: tile description tuple
+        :returns: (error class, expire timestamp) tuple or None
+                  if the tile has no active failure
+        :rtype: tuple or None
+        """
+        with self._lock:
+            entry = self._entries.get(lzxy)
+        if entry is None:
+            return None
+        errorClass, _failureCount, expireTimestamp = entry
+        if self._clock() >= expireTimestamp:
+            return None
+        return errorClass, expireTimestamp
+
+    def isBlocked(self, lzxy):
+        """Report if a tile should not be downloaded as it failed recently
+
+        :param tuple lzxy: tile description tuple
+        :rtype: bool
+        """
+        return self.getFailure(lzxy) is not None
+
+    def remove(self, lzxy):
+        """Forget any failures of a tile"""
+        with self._lock:
+            self._entries.pop(lzxy, None)
+
+    def clear(self):
+        """Forget all failures"""
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""Compact column storage of way points
+
+Long routes & tracklogs (a day of logging at one point per second is
+86 400 points) used to be stored as lists of (lat, lon, elevation, timestamp)
+tuples - about 200 bytes per point on 64 bit CPython, mostly tuple, float
+& string object overhead. The point array instead keeps each coordinate
+in a typed array('d') column, so a point takes 32 bytes and appending
+to the end is amortised O(1).
+
+Unknown elevations & timestamps are stored as NaN. Timestamps are stored
+as seconds since the epoch if they are in the format used
+by geo.timestamp_utc() and convert back to the exact same string,
+anything else is kept as is on the side.
+
+Tuples are only created when points are accessed, slices of the array
+are views that don't copy the point data.
+
+Point arrays are pickled as raw column bytes, so they can be cheaply passed
+between processes.
+"""
+import calendar
+import time
+from array import array
+from math import radians
+
+NaN = float("nan")
+
+if hasattr(array, "tobytes"):
+    def _column_bytes(column):
+        return column.tobytes()
+
+    def _extend_column(column, data):
+        column.frombytes(data)
+else:  # Python 2
+    def _column_bytes(column):
+        return column.tostring()
+
+    def _extend_column(column, data):
+        column.fromstring(data)
+# format of timestamps that can be stored as numbers, see geo.timestamp_utc()
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+# timestamps of a tracklog are mostly from the same few days,
+# so converted dates are cached
+DATE_CACHE_SIZE = 1024
+_date_seconds = {}
+_date_strings = {}
+
+
+def _cached(cache, key, value):
+    if len(cache) >= DATE_CACHE_SIZE:
+        cache.clear()
+    cache[key] = value
+    return value
+
+
+def timestamp_to_seconds(timestamp):
+    """Convert a timestamp string to seconds
+
+    :param timestamp: timestamp in TIMESTAMP_FORMAT
+    :returns: seconds since the epoch or None if the timestamp
+              can't be stored as a number without changing it
+    :rtype: float or None
+    """
+    if not isinstance(timestamp, str) or len(timestamp) != 19 or timestamp[10] != "T":
+        return None
+    date = timestamp[0:10]
+    seconds = _date_seconds.get(date)
+    try:
+        if seconds is None:
+            seconds = calendar.timegm((int(date[0:4]), int(date[5:7]), int(date[8:10]), 0, 0, 0, 0, 0, 0))
+            # the format has to match exactly, eq. no extra spaces or out of range values
+            if seconds_to_timestamp(seconds)[0:10] != date:
+                return None
+            _cached(_date_seconds, date, seconds)
+        hours = int(timestamp[11:13])
+        minutes = int(timestamp[14:16])
+        secs = int(timestamp[17:19])
+    except (ValueError, OverflowError):
+        return None
+    if hours > 23 or minutes > 59 or secs > 59 or "%02d:%02d:%02d" % (hours, minutes, secs) != timestamp[11:]:
+        return None
+    return float(seconds + 3600 * hours + 60 * minutes + secs)
+
+
+def seconds_to_timestamp(seconds):
+    """Convert whole seconds since the epoch to a timestamp string in TIMESTAMP_FORMAT"""
+    days, secs = divmod(int(seconds), 86400)
+    date = _date_strings.get(days)
+    if date is None:
+        date = _cached(_date_strings, days, time.strftime("%Y-%m-%dT", time.gmtime(days * 86400)))
+    return "%s%02d:%02d:%02d" % (date, secs // 3600, secs // 60 % 60, secs % 60)
+
+
+class PointArrayView(object):
+    """A read only view of a continuous part of a point array
+
+    Accessing a view creates (lat, lon, elevation) tuples just like the point array,
+    but no point data is copied when the view is created.
+
+    NOTE: the view covers the points that were in the given range when it was created,
+          points appended later are not part of it
+    """
+
+    def __init__(self, points, start, stop):
+        self._points = points
+        self._start = start
+        self._stop = stop
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __iter__(self):
+        lle = self._points.lle
+        for index in range(self._start, self._stop):
+            yield lle(index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return PointArrayView(self._points, self._start + start, self._start + max(start, stop))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("point view index out of range")
+        return self._points.lle(self._start + index)
+
+    def lle_list(self):
+        """Copy the viewed points to a list of (lat, lon, elevation) tuples"""
+        return self._points.lle_list(self._start, self._stop)
+
+
+class PointArray(object):
+    """Points stored in typed columns
+
+    Items are (lat, lon, elevation) tuples, use llet() to get timestamps as well.
+    Points can only be appended or all of them dropped.
+
+    NOTE: not thread safe, callers that append from other threads need a lock
+    """
+
+    def __init__(self, points=None):
+        """
+        :param points: sequence of (lat, lon), (lat, lon, elevation)
+                       or (lat, lon, elevation, timestamp) tuples
+        """
+        self.lats = array('d')
+        self.lons = array('d')
+        self.elevations = array('d')
+        self.times = array('d')
+        # point index -> timestamps that can't be stored as seconds
+        self._other_times = {}
+        self._time_count = 0
+        # radian columns, derived once requested & extended as points are appended
+        self._radian_lats = array('d')
+        self._radian_lons = array('d')
+        if points:
+            self.extend(points)
+
+    def __len__(self):
+        return len(self.lats)
+
+    def __iter__(self):
+        return iter(self.view())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.view()[index]
+        return self.lle(index)
+
+    def __getstate__(self):
+        # the radian columns can be derived again
+        columns = tuple(_column_bytes(column) for column in (self.lats, self.lons, self.elevations, self.times))
+        return columns + (self._other_times, self._time_count)
+
+    def __setstate__(self, state):
+        self.__init__()
+        for column, data in zip((self.lats, self.lons, self.elevations, self.times), state[0:4]):
+            _extend_column(column, data)
+        self._other_times, self._time_count = state[4:6]
+
+    @property
+    def has_time(self):
+        """Report if any of the points has a timestamp"""
+        return self._time_count > 0
+
+    def append(self, lat, lon, elevation=None, timestamp=None):
+        """Add a point to the end of the array
+
+        :param timestamp: timestamp string or seconds since the epoch
+        """
+        lat = float(lat)
+        lon = float(lon)
+        if elevation is None:
+            elevation = NaN
+        else:
+            elevation = float(elevation)
+        seconds = NaN
+        if isinstance(timestamp, float):
+            self._time_count += 1
+            seconds = timestamp
+        elif timestamp is not None:
+            self._time_count += 1
+            converted = timestamp_to_seconds(timestamp)
+            if converted is None:
+                self._other_times[len(self.lats)] = timestamp
+            else:
+                seconds = converted
+        # add the coordinates last, so that a failed conversion leaves the columns consistent
+        self.lats.append(lat)
+        self.lons.append(lon)
+        self.elevations.append(elevation)
+        self.times.append(seconds)
+
+    def extend(self, points):
+        """Add points to the end of the array
+
+        :param points: sequence of (lat, lon), (lat, lon, elevation)
+                       or (lat, lon, elevation, timestamp) tuples
+        """
+        append = self.append
+        for point in points:
+            append(*point[0:4])
+
+    def clear(self):
+        """Drop all points"""
+        self.__init__()
+
+    def elevation(self, index):
+        elevation = self.elevations[index]
+        if elevation != elevation:  # NaN
+            return None
+        return elevation
+
+    def timestamp(self, index):
+        if index < 0:
+            index += len(self.lats)
+        seconds = self.times[index]
+        if seconds != seconds:  # NaN
+            return self._other_times.get(index)
+        return seconds_to_timestamp(seconds)
+
+    def lle(self, index):
+        """Get a point as a (lat, lon, elevation) tuple"""
+        return self.lats[index], self.lons[index], self.elevation(index)
+
+    def llet(self, index):
+        """Get a point as a (lat, lon, elevation, timestamp) tuple"""
+        return self.lats[index], self.lons[index], self.elevation(index), self.timestamp(index)
+
+    def view(self, start=0, stop=None):
+        """Get a view of a range of points without copying them"""
+        if stop is None:
+            stop = len(self.lats)
+        return PointArrayView(self, start, stop)
+
+    def lle_list(self, start=0, stop=None):
+        """Copy a range of points to a list of (lat, lon, elevation) tuples"""
+        elevations = [None if elevation != elevation else elevation
+                      for elevation in self.elevations[start:stop]]
+        return list(zip(self.lats[start:stop], self.lons[start:stop], elevations))
+
+    def llet_list(self, start=0, stop=None):
+        """Copy a range of points to a list of (lat, lon, elevation, timestamp) tuples"""
+        elevations = [None if elevation != elevation else elevation
+                      for elevation in self.elevations[start:stop]]
+        other_times = self._other_times
+        timestamps = [other_times.get(index) if seconds != seconds else seconds_to_timestamp(seconds)
+                      for index, seconds in enumerate(self.times[start:stop], start)]
+        return list(zip(self.lats[start:stop], self.lons[start:stop], elevations, timestamps))
+
+    def radians(self):
+        """Get latitude & longitude columns in radians
+
+        :returns: (latitudes, longitudes) tuple of arrays
+        """
+        lats = self._radian_lats
+        lons = self._radian_lons
+        derived = len(lats)
+        if derived < len(self.lats):
+            lats.extend(radians(lat) for lat in self.lats[derived:])
+            lons.extend(radians(lon) for lon in self.lons[derived:])
+        return lats, lons
+
+    def radians_list(self, drop_elevation=False, start=0):
+        """Get points as (lat, lon, elevation) or (lat, lon) tuples in radians
+
+        :param bool drop_elevation: return (lat, lon) tuples
+        :param int start: index of the first point to return
+        """
+        lats, lons = self.radians()
+        if drop_elevation:
+            return list(zip(lats[start:], lons[start:]))
+        elevations = [None if elevation != elevation else elevation
+                      for elevation in self.elevations[start:]]
+        return list(zip(lats[start:], lons[start:], elevations))
+
+    def memory_size(self):
+        """Approximate size of the point data in bytes"""
+        size = 0
+        for column in (self.lats, self.lons, self.elevations, self.times, self._radian_lats, self._radian_lons):
+            size += column.buffer_info()[1] * column.itemsize
+        return size
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""A spatial index for nearest point queries on long point lists
+
+Finding the points of a long way (thousands of route or tracklog points)
+closest to a position used to mean computing the distance to every single
+point. The point index instead puts the points to a grid of latitude/longitude
+cells with roughly square cells (an equirectangular projection) and only
+checks points in cells that can possibly contain a close enough point.
+
+Results are exact for the haversine distance used by geo.distance() -
+cells are skipped only based on a lower bound of the haversine distance
+between the query point and anything in the cell.
+"""
+import heapq
+from math import radians, sin, cos, sqrt, atan2, asin, floor
+
+from core import geo
+
+# about how many consecutive points should share a grid cell
+POINTS_PER_CELL = 8
+# grid cell size limits in degrees of latitude
+MIN_CELL_SIZE = 0.00001  # about 1 m
+MAX_CELL_SIZE = 1.0  # about 111 km
+# once a search would need to check more empty grid cells than this,
+# all non-empty cells are checked in order of their distance instead
+MAX_RING_CELLS = 2048
+# lower bounds are lowered by this fraction, so that rounding errors
+# can't cause skipping a cell with a point right at the distance limit
+BOUND_SLACK = 1e-9
+
+
+def _haversineLowerBound(dLat, dLon, cosProduct):
+    """Lower bound of the haversine distance
+
+    :param float dLat: the smallest possible latitude difference in radians
+    :param float dLon: the smallest possible longitude difference in radians
+    :param float cosProduct: the smallest possible product of latitude cosines
+    :returns: distance in kilometers
+    :rtype: float
+    """
+    h1 = sin(0.5 * dLat)
+    h2 = sin(0.5 * dLon)
+    h = min(h1 * h1 + cosProduct * h2 * h2, 1.0)
+    return 2.0 * asin(sqrt(h)) * geo.EARTH_RADIUS * (1.0 - BOUND_SLACK)
+
+
+class PointIndex(object):
+    """Grid based spatial index of (lat, lon, ...) points
+
+    All query results are lists of (distance in kilometers, point index) tuples
+    sorted by distance (and point index for equally distant points).
+
+    NOTE: the index does not follow changes of the point list it was created for,
+          create a new one once the points change
+    """
+
+    def __init__(self, points):
+        """
+        :param points: sequence of (lat, lon, ...) tuples in degrees
+        """
+        self._count = len(points)
+        self._latRadians = [radians(point[0]) for point in points]
+        self._lonRadians = [radians(point[1]) for point in points]
+        self._latCos = [cos(lat) for lat in self._latRadians]
+        # (row, column) -> list of point indexes
+        self._cells = {}
+        if not points:
+            return
+        lats = [point[0] for point in points]
+        lons = [point[1] for point in points]
+        self._minLon = min(lons)
+        self._maxLon = max(lons)
+        self._cellLat = self._cellSize(points)
+        # make the cells roughly square around the middle of the indexed area
+        middleCos = cos(radians((min(lats) + max(lats)) / 2.0))
+        self._cellLon = min(self._cellLat / max(middleCos, 0.01), 360.0)
+        for index in range(self._count):
+            cell = self._cell(lats[index], lons[index])
+            cellPoints = self._cells.get(cell)
+            if cellPoints is None:
+                self._cells[cell] = [index]
+            else:
+                cellPoints.append(index)
+        rows = [row for row, _column in self._cells]
+        columns = [column for _row, column in self._cells]
+        self._rowRange = min(rows), max(rows)
+        self._columnRange = min(columns), max(columns)
+
+    def __len__(self):
+        return self._count
+
+    def _cellSize(self, points):
+        """Pick a grid cell size so that about POINTS_PER_CELL consecutive points share a cell"""
+        steps = sorted(max(abs(a[0] - b[0]), abs(a[1] - b[1])) for a, b in zip(points, points[1:]))
+        if steps:
+            step = steps[len(steps) // 2]
+        else:
+            step = 0
+        return min(max(step * POINTS_PER_CELL, MIN_CELL_SIZE), MAX_CELL_SIZE)
+
+    def _cell(self, lat, lon):
+        return int(floor(lat / self._cellLat)), int(floor(lon / self._cellLon))
+
+    def _distance(self, latRadians, lonRadians, latCos, index):
+        """Haversine distance in kilometers, computed just like geo.distance()"""
+        h1 = sin(0.5 * (self._latRadians[index] - latRadians))
+        h2 = sin(0.5 * (self._lonRadians[index] - lonRadians))
+        d = h1 * h1 + latCos * self._latCos[index] * h2 * h2
+        return 2.0 * atan2(sqrt(d), sqrt(1.0 - d)) * geo.EARTH_RADIUS
+
+    def _minCos(self, row1, row2):
+        """Smallest latitude cosine in a range of grid rows"""
+        lat1 = max(row1 * self._cellLat, -90.0)
+        lat2 = min((row2 + 1) * self._cellLat, 90.0)
+        if lat1 <= 0.0 <= lat2:
+            minCos = cos(radians(max(-lat1, lat2)))
+        else:
+            minCos = min(cos(radians(lat1)), cos(radians(lat2)))
+        return max(minCos, 0.0)
+
+    def _cellBound(self, lat, lon, latCos, cell):
+        """Lower bound of the distance of any point in a cell"""
+        row, column = cell
+        cellLat1 = row * self._cellLat
+        cellLon1 = column * self._cellLon
+        dLat = max(cellLat1 - lat, lat - (cellLat1 + self._cellLat), 0.0)
+        dLon = max(cellLon1 - lon, lon - (cellLon1 + self._cellLon), 0.0)
+        return _haversineLowerBound(radians(dLat), radians(dLon), latCos * self._minCos(row, row))
+
+    def _ringBound(self, lat, latCos, row, ring):
+        """Lower bound of the distance of any point in a ring of cells around the query point cell"""
+        if ring == 0:
+            return 0.0
+        minCos = self._minCos(row - ring, row + ring)
+        return min(_haversineLowerBound(radians((ring - 1) * self._cellLat), 0.0, 0.0),
+                   _haversineLowerBound(0.0, radians((ring - 1) * self._cellLon), latCos * minCos))
+
+    def _ringCells(self, row, column, ring):
+        if ring == 0:
+            yield row, column
+            return
+        for c in range(column - ring, column + ring + 1):
+            yield row - ring, c
+            yield row + ring, c
+        for r in range(row - ring + 1, row + ring):
+            yield r, column - ring
+            yield r, column + ring
+
+    def _search(self, lat, lon, accept, limit):
+        """Visit points in cells that might contain accepted points
+
+        :param accept: function called with (distance, index) for every candidate point
+        :param limit: function returning the current largest interesting distance
+        """
+        latRadians = radians(lat)
+        lonRadians = radians(lon)
+        latCos = cos(latRadians)
+        if max(self._maxLon, lon) - min(self._minLon, lon) >= 180.0:
+            # points on the other side of the 180th meridian might be closer
+            # than the grid suggests, so just check all of them
+            for index in range(self._count):
+                accept(self._distance(latRadians, lonRadians, latCos, index), index)
+            return
+        row, column = self._cell(lat, lon)
+        lastRing = max(abs(row - self._rowRange[0]), abs(row - self._rowRange[1]),
+                       abs(column - self._columnRange[0]), abs(column - self._columnRange[1]))
+        ring = 0
+        visitedCells = 0
+        while ring <= lastRing:
+            if self._ringBound(lat, latCos, row, ring) > limit():
+                return
+            if visitedCells > MAX_RING_CELLS:
+                break
+            for cell in self._ringCells(row, column, ring):
+                visitedCells += 1
+                cellPoints = self._cells.get(cell)
+                if cellPoints and self._cellBound(lat, lon, latCos, cell) <= limit():
+                    for index in cellPoints:
+                        accept(self._distance(latRadians, lonRadians, latCos, index), index)
+            ring += 1
+        else:
+            return
+        # the query point is far from the points, check the remaining cells by distance
+        remaining = []
+        for cell in self._cells:
+            if max(abs(cell[0] - row), abs(cell[1] - column)) >= ring:
+                remaining.append((self._cellBound(lat, lon, latCos, cell), cell))
+        remaining.sort()
+        for bound, cell in remaining:
+            if bound > limit():
+                return
+            for index in self._cells[cell]:
+                accept(self._distance(latRadians, lonRadians, latCos, index), index)
+
+    def k_nearest(self, lat, lon, k):
+        """Get the k points closest to a position
+
+        :param float lat: latitude in degrees
+        :param float lon: longitude in degrees
+        :param int k: how many points to return
+        :returns: list of up to k (distance in kilometers, point index) tuples
+        :rtype: list
+        """
+        if k <= 0 or not self._count:
+            return []
+        # a max-heap of the k closest points so far
+        closest = []
+
+        def accept(distance, index):
+            if len(closest) < k:
+                heapq.heappush(closest, (-distance, -index))
+            elif (-distance, -index) > closest[0]:
+                heapq.heapreplace(closest, (-distance, -index))
+
+        def limit():
+            if len(closest) < k:
+                return float("inf")
+            return -closest[0][0]
+
+        self._search(lat, lon, accept, limit)
+        return sorted((-distance, -index) for distance, index in closest)
+
+    def nearest(self, lat, lon):
+        """Get the point closest to a position
+
+        :param float lat: latitude in degrees
+        :param float lon: longitude in degrees
+        :returns: (distance in kilometers, point index) tuple or None if there are no points
+        :rtype: tuple or None
+        """
+        result = self.k_nearest(lat, lon, 1)
+        if result:
+            return result[0]
+        else:
+            return None
+
+    def within_radius(self, lat, lon, radius):
+        """Get all points within a radius from a position
+
+        :param float lat: latitude in degrees
+        :param float lon: longitude in degrees
+        :param float radius: radius in kilometers
+        :returns: list of (distance in kilometers, point index) tuples
+        :rtype: list
+        """
+        found = []
+
+        def accept(distance, index):
+            if distance <= radius:
+                found.append((distance, index))
+
+        if self._count:
+            self._search(lat, lon, accept, lambda: radius)
+        found.sort()
+        return found
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""Level of detail pyramid for drawing long polylines
+
+Routes & tracklogs can have tens of thousands of points, while at lower
+zoom levels most of them end up in the same few screen pixels. Instead
+of projecting every point on every redraw (or skipping points at random),
+the polyline is simplified once per zoom level with the Douglas-Peucker
+algorithm, so that no point is further than a fraction of a pixel
+from the simplified polyline at the given zoom level.
+
+Points are stored as integers in world coordinates (relative projection
+units scaled to COORD_SCALE) and split to blocks of consecutive points.
+Each block is simplified separately and has a bounding box for each level,
+so only blocks intersecting the viewport need to be projected & drawn.
+Blocks also make appending cheap - only the last block changes.
+"""
+from core.tilenames import ll2relativeXY
+
+# world coordinate resolution - relative projection units
+# (0-1 for the whole world) are scaled to this
+COORD_BITS = 30
+COORD_SCALE = 2 ** COORD_BITS
+# levels are computed for tiles of this size
+TILE_SIZE = 256  # in pixels
+# zoom levels above this are drawn with all the points
+MAX_LOD_ZOOM = 18
+# maximum distance of a dropped point from the simplified polyline
+# for a single level, the total error at a zoom level is at most twice this
+DEFAULT_TOLERANCE = 0.5  # in tile pixels
+# how many consecutive points are simplified & clipped together
+BLOCK_SIZE = 256
+
+
+def simplify(xs, ys, tolerance):
+    """Simplify a polyline with the Douglas-Peucker algorithm
+
+    :param list xs: point x coordinates
+    :param list ys: point y coordinates
+    :param float tolerance: maximum distance of a dropped point
+                            from the simplified polyline
+    :returns: sorted indexes of points to keep, always including
+              the first and last point
+    :rtype: list
+    """
+    count = len(xs)
+    if count < 3:
+        return list(range(count))
+    keep = [False] * count
+    keep[0] = keep[-1] = True
+    toleranceSq = tolerance * tolerance
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        ax = xs[first]
+        ay = ys[first]
+        dx = xs[last] - ax
+        dy = ys[last] - ay
+        lengthSq = float(dx * dx + dy * dy)
+        maxDistanceSq = -1.0
+        maxIndex = None
+        for index in range(first + 1, last):
+            px = xs[index] - ax
+            py = ys[index] - ay
+            if lengthSq:
+                # distance from the segment, not just the line
+                t = (px * dx + py * dy) / lengthSq
+                if t < 0.0:
+                    t = 0.0
+                elif t > 1.0:
+                    t = 1.0
+                px -= t * dx
+                py -= t * dy
+            distanceSq = px * px + py * py
+            if distanceSq > maxDistanceSq:
+                maxDistanceSq = distanceSq
+                maxIndex = index
+        if maxDistanceSq > toleranceSq:
+            keep[maxIndex] = True
+            stack.append((first, maxIndex))
+            stack.append((maxIndex, last))
+    return [index for index in range(count) if keep[index]]
+
+
+def _level(xs, ys):
+    """Level tuple: (xs, ys, min x, min y, max x, max y)"""
+    return xs, ys, min(xs), min(ys), max(xs), max(ys)
+
+
+class _Block(object):
+    """Consecutive points of a polyline with their simplified levels
+
+    The last point of a block is also the first point of the next block.
+    """
+
+    def __init__(self, xs, ys):
+        self.xs = xs
+        self.ys = ys
+        # bounding box of all the points - levels are only computed
+        # for blocks that might be visible
+        self.minX = min(xs)
+        self.minY = min(ys)
+        self.maxX = max(xs)
+        self.maxY = max(ys)
+        # zoom -> level tuple
+        self._levels = {}
+
+    def __len__(self):
+        return len(self.xs)
+
+    def append(self, x, y):
+        self.xs.append(x)
+        self.ys.append(y)
+        self.minX = min(self.minX, x)
+        self.minY = min(self.minY, y)
+        self.maxX = max(self.maxX, x)
+        self.maxY = max(self.maxY, y)
+        self._levels.clear()
+
+    def level(self, zoom, lod):
+        """Get a level tuple for a zoom level, levels are simplified from the next higher one"""
+        level = self._levels.get(zoom)
+        if level is None:
+            if zoom > lod.maxZoom:
+                level = _level(self.xs, self.ys)
+            else:
+                xs, ys = self.level(zoom + 1, lod)[0:2]
+                kept = simplify(xs, ys, lod.levelTolerance(zoom))
+                level = _level([xs[index] for index in kept], [ys[index] for index in kept])
+            self._levels[zoom] = level
+        return level
+
+
+class PolylineLOD(object):
+    """Level of detail pyramid of a polyline
+
+    NOTE: not thread safe, should be used from a single thread (eq. the drawing one)
+    """
+
+    def __init__(self, points=None, tolerance=DEFAULT_TOLERANCE, maxZoom=MAX_LOD_ZOOM, blockSize=BLOCK_SIZE):
+        """
+        :param points: sequence of (px, py, ...) tuples in relative projection units
+        :param float tolerance: single level simplification tolerance in tile pixels
+        :param int maxZoom: zoom levels above this are drawn with all the points
+        :param int blockSize: how many points to simplify & clip together
+        """
+        self.tolerance = tolerance
+        self.maxZoom = maxZoom
+        self._blockSize = max(blockSize, 2)
+        self._blocks = []
+        self._count = 0
+        if points:
+            xs = [int(round(point[0] * COORD_SCALE)) for point in points]
+            ys = [int(round(point[1] * COORD_SCALE)) for point in points]
+            self._count = len(xs)
+            step = self._blockSize - 1
+            for start in range(0, max(self._count - 1, 1), step):
+                end = min(start + self._blockSize, self._count)
+                self._blocks.append(_Block(xs[start:end], ys[start:end]))
+
+    @classmethod
+    def fromLL(cls, lls, **kwargs):
+        """Create a pyramid for a polyline in geographic coordinates
+
+        :param lls: sequence of (lat, lon, ...) tuples
+        """
+        return cls([ll2relativeXY(ll[0], ll[1]) for ll in lls], **kwargs)
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def lastPoint(self):
+        """The last point in relative projection units or None if there are no points"""
+        if not self._blocks:
+            return None
+        block = self._blocks[-1]
+        return float(block.xs[-1]) / COORD_SCALE, float(block.ys[-1]) / COORD_SCALE
+
+    def append(self, px, py):
+        """Add a point to the end of the polyline
+
+        :param float px: x coordinate in relative projection units
+        :param float py: y coordinate in relative projection units
+        """
+        x = int(round(px * COORD_SCALE))
+        y = int(round(py * COORD_SCALE))
+        if not self._blocks:
+            self._blocks.append(_Block([x], [y]))
+        elif len(self._blocks[-1]) >= self._blockSize:
+            lastBlock = self._blocks[-1]
+            self._blocks.append(_Block([lastBlock.xs[-1], x], [lastBlock.ys[-1], y]))
+        else:
+            self._blocks[-1].append(x, y)
+        self._count += 1
+
+    def appendLL(self, lat, lon):
+        """Add a point in geographic coordinates to the end of the polyline"""
+        px, py = ll2relativeXY(lat, lon)
+        self.append(px, py)
+
+    def clear(self):
+        """Drop all points"""
+        self._blocks = []
+        self._count = 0
+
+    def levelTolerance(self, zoom):
+        """Simplification tolerance of a level in world coordinates"""
+        return self.tolerance * COORD_SCALE / float(TILE_SIZE * 2 ** zoom)
+
+    def errorBound(self, zoom):
+        """Maximum distance of any point from the polyline drawn at a zoom level
+
+        Each level is simplified from the next higher one, so errors add up,
+        but the tolerance halves with each higher level.
+
+        :param int zoom: zoom level
+        :returns: distance in tile pixels
+        :rtype: float
+        """
+        # points are rounded to integers in world coordinates
+        rounding = TILE_SIZE * 2 ** zoom / float(COORD_SCALE)
+        if zoom > self.maxZoom:
+            return rounding
+        return self.tolerance * (2.0 - 0.5 ** (self.maxZoom - zoom)) + rounding
+
+    def visibleRuns(self, zoom, px1, py1, px2, py2, margin=0):
+        """Get points of a zoom level that should be drawn in a viewport
+
+        :param int zoom: zoom level
+        :param float px1: viewport left edge in tile units of the zoom level
+        :param float py1: viewport top edge in tile units of the zoom level
+        :param float px2: viewport right edge in tile units of the zoom level
+        :param float py2: viewport bottom edge in tile units of the zoom level
+        :param float margin: how far outside the viewport points are still drawn, in tile pixels
+        :returns: list of (xs, ys) tuples of continuous parts of the polyline
+                  in world coordinates
+        :rtype: list
+        """
+        unit = COORD_SCALE / float(2 ** zoom)
+        marginUnits = margin * unit / TILE_SIZE
+        minX = px1 * unit - marginUnits
+        minY = py1 * unit - marginUnits
+        maxX = px2 * unit + marginUnits
+        maxY = py2 * unit + marginUnits
+        zoom = min(zoom, self.maxZoom + 1)
+        runs = []
+        runXs = None
+        runYs = None
+        for block in self._blocks:
+            if block.maxX < minX or block.minX > maxX or block.maxY < minY or block.minY > maxY:
+                runXs = None
+                continue
+            # simplified levels have tighter bounding boxes
+            xs, ys, blockMinX, blockMinY, blockMaxX, blockMaxY = block.level(zoom, self)
+            if blockMaxX < minX or blockMinX > maxX or blockMaxY < minY or blockMinY > maxY:
+                runXs = None
+                continue
+            if runXs is None:
+                runXs = list(xs)
+                runYs = list(ys)
+                runs.append((runXs, runYs))
+            else:
+                # the first point of a block is the last point of the previous one
+                runXs.extend(xs[1:])
+                runYs.extend(ys[1:])
+        return runs
+
+    def draw(self, ctx, zoom, px1, py1, px2, py2, scale, margin=0):
+        """Add the visible parts of the polyline to the current path of a cairo context
+
+        The coordinates match the ones used by the projection module
+        (pxpyRel2xy() & co).
+
+        :param ctx: cairo context
+        :param int zoom: zoom level
+        :param float px1: viewport left edge in tile units of the zoom level
+        :param float py1: viewport top edge in tile units of the zoom level
+        :param float px2: viewport right edge in tile units of the zoom level
+        :param float py2: viewport bottom edge in tile units of the zoom level
+        :param float scale: screen pixels per tile unit
+        :param float margin: how far outside the viewport points are still drawn, in screen pixels
+        :returns: how many points have been drawn
+        :rtype: int
+        """
+        # screen pixels per world coordinate unit
+        k = 2 ** zoom * scale / float(COORD_SCALE)
+        ox = px1 * scale
+        oy = py1 * scale
+        pointCount = 0
+        moveTo = ctx.move_to
+        lineTo = ctx.line_to
+        for xs, ys in self.visibleRuns(zoom, px1, py1, px2, py2, margin * TILE_SIZE / float(scale)):
+            moveTo(xs[0] * k - ox, ys[0] * k - oy)
+            for index in range(1, len(xs)):
+                lineTo(xs[index] * k - ox, ys[index] * k - oy)
+            pointCount += len(xs)
+        return pointCount
@@ -197,4 +197,41 @@ class LifoThreadPool(ThreadPool):
             self._workQueue.put((1, self._terminator))
         # if requested, wait for the pool to shutdown
         if join:
-            self._workQueue.join()
\ No newline at end of file
+            self._workQueue.join()
+
+class PriorityThreadPool(LifoThreadPool):
+    """A thread pool variant that processes the best ranked tasks first
+
+    Tasks are ranked by calling rankFunction with the same arguments the task
+    will be called with, lower rank is better. The tasks can be re-ranked,
+    for example once the ranking criteria change, and tasks the rankFunction
+    returns None for are dropped from the pool when re-ranking.
+    Just like the LifoThreadPool, the pool can leak the worst ranked task
+    once the work queue becomes full.
+    """
+
+    def __init__(self, maxThreads, rankFunction, name=None, taskBufferSize=0, leak=False):
+        # needs to be set before calling parent class __init__
+        # as that calls _getQueue
+        self._rankFunction = rankFunction
+        LifoThreadPool.__init__(self, maxThreads, name, taskBufferSize, leak)
+
+    def _getQueue(self):
+        return queues.RankedQueue(self._rankWorkItem, maxsize=self._queueSize, leak=self._leak)
+
+    def _rankWorkItem(self, workItem):
+        priority, item = workItem
+        if item is self._terminator:
+            # shutdown requests are never dropped, the LifoThreadPool based shutdown
+            # handler always shuts down at once
+            return (float("-inf"),)
+        fn, args, kwargs = item
+        return self._rankFunction(*args, **kwargs)
+
+    def rerank(self):
+        """Re-rank all waiting tasks, dropping tasks that should not be processed anymore
+
+        :returns: list of dropped (function, args, kwargs) tuples
+        :rtype: list
+        """
+        return [workItem[1] for workItem in self._workQueue.rerank()]
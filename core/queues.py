@@ -149,17 +149,10 @@ class LeakyLifoQueue:
         self.not_full.acquire()
         bottomItem = NOTHING
         try:
-            if self.maxsize > 0:
-                if self.leak:
-                    # if maxsize and leak==True are set, leak the bottom most
-                    # item once queue becomes full (note that as a result of this
-                    # the block & timeout kwargs are effectively ignored as the queue
-                    # can never become full)
-                    if self._qsize() == self.maxsize:
-                        bottomItem = self.queue.popleft()
-                        self.unfinished_tasks -= 1
-
-                elif not block:
+            # if leaking is enabled, the bottom most item
+            # is leaked once the new item is added
+            if self.maxsize > 0 and not self.leak:
+                if not block:
                     if self._qsize() == self.maxsize:
                         raise Full
                 elif timeout is None:
@@ -176,6 +169,13 @@ class LeakyLifoQueue:
                         self.not_full.wait(remaining)
             self._put(item)
             self.unfinished_tasks += 1
+            if self.maxsize > 0 and self.leak and self._qsize() > self.maxsize:
+                # if maxsize and leak==True are set, leak the bottom most
+                # item once queue becomes full (note that as a result of this
+                # the block & timeout kwargs are effectively ignored as the queue
+                # can never become full)
+                bottomItem = self._popBottom()
+                self.unfinished_tasks -= 1
             self.not_empty.notify()
         finally:
             self.not_full.release()
@@ -250,6 +250,77 @@ class LeakyLifoQueue:
     def _get(self):
         return self.queue.pop()
 
+    # Remove and return the item that should be leaked
+    def _popBottom(self):
+        return self.queue.popleft()
+
+
+class RankedQueue(LeakyLifoQueue):
+    """A leaky queue that returns the best ranked item first
+
+    Items are ranked by the rankFunction, lower rank is better and items
+    with the same rank are returned in LiFo order. Once the queue becomes full
+    the worst ranked item is leaked. As the rank of an item can depend on external
+    state (such as what part of the map is visible), the items can be re-ranked
+    by calling rerank(), which also drops items the rankFunction returns None for.
+    """
+    def __init__(self, rankFunction, maxsize=0, leak=True):
+        self._rankFunction = rankFunction
+        self._counter = 0
+        LeakyLifoQueue.__init__(self, maxsize=maxsize, leak=leak)
+
+    def _rank(self, item):
+        rank = self._rankFunction(item)
+        if rank is None:
+            # dropped on next re-rank
+            rank = (float("inf"),)
+        return rank
+
+    def _init(self, maxsize):
+        # heap of (rank, -insertion counter, item) tuples
+        self.queue = []
+
+    def _put(self, item):
+        self._counter += 1
+        heapq.heappush(self.queue, (self._rank(item), -self._counter, item))
+
+    def _get(self):
+        return heapq.heappop(self.queue)[2]
+
+    def _popBottom(self):
+        worst = max(self.queue)
+        self.queue.remove(worst)
+        heapq.heapify(self.queue)
+        return worst[2]
+
+    def rerank(self):
+        """Rank all items again and drop items that should no longer be processed
+
+        :returns: list of dropped items
+        :rtype: list
+        """
+        self.mutex.acquire()
+        try:
+            kept = []
+            dropped = []
+            for _rank, counter, item in self.queue:
+                rank = self._rankFunction(item)
+                if rank is None:
+                    dropped.append(item)
+                else:
+                    kept.append((rank, counter, item))
+            heapq.heapify(kept)
+            self.queue = kept
+            if dropped:
+                self.unfinished_tasks -= len(dropped)
+                if not self.unfinished_tasks:
+                    # wake up threads waiting in join()
+                    self.all_tasks_done.notifyAll()
+                self.not_full.notifyAll()
+            return dropped
+        finally:
+            self.mutex.release()
+
 
 # just backport for Python 2.5 as the 2.5 queue doesn't look like
 # to use the same subclassing interface
@@ -43,12 +43,14 @@ SEARCH_PROVIDER_ERROR = 5
 LOCAL_SEARCH_CURRENT_POSITION_UNKNOWN_ERROR = 6
 CURRENT_POSITION_UNKNOWN_ERROR = 7
 COORDINATE_PARSING_ERROR = 8
+TILE_STORE_CONVERSION_ERROR = 9
 
 USE_LAST_KNOWN_POSITION_KEYWORD = "LAST_KNOWN_POSITION"
 
 POI_SUBCOMMAND = "poi"
+TILES_SUBCOMMAND = "tiles"
 
-SUBCOMMAND_LIST = [POI_SUBCOMMAND]
+SUBCOMMAND_LIST = [POI_SUBCOMMAND, TILES_SUBCOMMAND]
 
 SUBCOMMANDS = set(SUBCOMMAND_LIST)
 
@@ -59,6 +61,7 @@ class Startup(object):
         self.originalStderr = None
         self._subcommand_present = len(sys.argv) >= 2 and sys.argv[1] in SUBCOMMANDS
         self._poi_subcommand_present = False
+        self._tiles_subcommand_present = False
         current_subcommands = ",".join(SUBCOMMAND_LIST)
         parser = argparse.ArgumentParser(description="A flexible GPS navigation system.",
                                          epilog="You can also use the following subcommands: [%s] \
@@ -213,6 +216,34 @@ class Startup(object):
                                          help='POI category name or index (default: 11/Other), EXAMPLE: "Landmark" or "10"')
                 # list-categories
                 poi_subcommands.add_parser("list-categories", help='list POI database categories')
+            elif subcommand == TILES_SUBCOMMAND:
+                # tiles subcommand
+                from core.tile_storage.convert import STORE_TYPES
+                self._tiles_subcommand_present = True
+                subcommands = parser.add_subparsers()
+                tiles = subcommands.add_parser("tiles", help="Tile store handling")
+                tiles.required = False
+                tiles_subcommands = tiles.add_subparsers(dest="tiles_subcommand")
+                # convert
+                tiles_convert = tiles_subcommands.add_parser(
+                    "convert", help='convert tiles between the files, sqlite and MBTiles tile stores')
+                tiles_convert.add_argument(type=str, dest="tiles_source",
+                                           help='path to the source tile store, EXAMPLE: "~/Maps/OpenStreetMap I"')
+                tiles_convert.add_argument(type=str, dest="tiles_destination",
+                                           help='path to the destination tile store, EXAMPLE: "~/osm.mbtiles"')
+                tiles_convert.add_argument("--from", type=str, dest="tiles_source_type", default=None,
+                                           choices=STORE_TYPES,
+                                           help='source tile store type (detected automatically by default)')
+                tiles_convert.add_argument("--to", type=str, dest="tiles_destination_type", default=None,
+                                           choices=STORE_TYPES,
+                                           help='destination tile store type (default: mbtiles for paths '
+                                                'ending with .mbtiles, otherwise sqlite)')
+                tiles_convert.add_argument("--name", type=str, dest="tiles_name", default=None,
+                                           help='layer name stored in MBTiles metadata, EXAMPLE: "OpenStreetMap"')
+                tiles_convert.add_argument("--layer", type=str, dest="tiles_layer", default=None,
+                                           help='id of the map layer the tiles belong to, its label, tile format, '
+                                                'zoom range and attribution are stored in MBTiles metadata, '
+                                                'EXAMPLE: "mapnik"')
 
         self.args, _unknownArgs = parser.parse_known_args()
 
@@ -239,6 +270,8 @@ class Startup(object):
             self._disableStdout()
         elif self._poi_subcommand_present:
             self._disableStdout()
+        elif self._tiles_subcommand_present:
+            self._disableStdout()
 
     def handle_non_gui_tasks(self):
         """Handle CLI arguments that can be handled before the general modRana startup,
@@ -262,6 +295,9 @@ class Startup(object):
                 self._addPOI()
             elif self.args.poi_subcommand == "list-categories":
                 self._listCategories()
+        elif self._tiles_subcommand_present:
+            if self.args.tiles_subcommand == "convert":
+                self._convertTiles()
 
     def handlePostFirstTimeTasks(self):
         """
@@ -486,6 +522,63 @@ class Startup(object):
             print("%d, %s, %s" % (index, name, description))
         self._exit(0)
 
+    # tiles
+
+    def _convertTiles(self):
+        """Convert tiles between tile stores"""
+        import os
+        from core.tile_storage import convert
+        from core.tile_storage.exceptions import TileStoreInitializationFailed
+        source_path = os.path.expanduser(self.args.tiles_source)
+        destination_path = os.path.expanduser(self.args.tiles_destination)
+        source_type = self.args.tiles_source_type or convert.detect_store_type(source_path)
+        destination_type = self.args.tiles_destination_type
+        if destination_type is None:
+            if destination_path.endswith(".mbtiles"):
+                destination_type = convert.STORE_TYPE_MBTILES
+            else:
+                destination_type = convert.STORE_TYPE_SQLITE
+        self._enableStdout()
+        if source_type is None:
+            print("no tile store found in: %s" % source_path)
+            self._exit(TILE_STORE_CONVERSION_ERROR)
+        kwargs = {}
+        if destination_type == convert.STORE_TYPE_MBTILES:
+            if self.args.tiles_layer:
+                from core.tile_storage.mbtiles_store import layer_to_metadata
+                self._disableStdout()
+                map_layers = self.modrana._load_module("mod_mapLayers", "mapLayers")
+                layer = map_layers.getLayerById(self.args.tiles_layer) if map_layers else None
+                self._enableStdout()
+                if layer is None:
+                    print("unknown map layer: %s" % self.args.tiles_layer)
+                    self._exit(TILE_STORE_CONVERSION_ERROR)
+                metadata = layer_to_metadata(layer)
+            else:
+                # the format, zoom range and bounds are filled in from the converted tiles
+                metadata = {"name" : os.path.splitext(os.path.basename(destination_path))[0],
+                            "type" : "baselayer"}
+            if self.args.tiles_name:
+                metadata["name"] = self.args.tiles_name
+            kwargs["metadata"] = metadata
+        try:
+            source = convert.open_store(source_path, source_type)
+            destination = convert.open_store(destination_path, destination_type, writable=True, **kwargs)
+        except TileStoreInitializationFailed as e:
+            print("opening tile stores failed: %s" % e)
+            self._exit(TILE_STORE_CONVERSION_ERROR)
+        print("converting %s tile store %s to %s tile store %s" % (source_type, source_path,
+                                                                   destination_type, destination_path))
+        def report_progress(count):
+            print("%d tiles converted" % count)
+        try:
+            count = convert.convert(source, destination, progress_callback=report_progress)
+        finally:
+            source.close()
+            destination.close()
+        print("done, %d tiles converted" % count)
+        self._exit(0)
+
     def _returnStaticMapUrl(self, results, online):
         """return static map url for early search methods & exit"""
         if results:
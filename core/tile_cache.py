@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""In memory least recently used tile cache"""
+import time
+
+try:  # Python 2.7+
+    from collections import OrderedDict as OrderedDict
+except ImportError:
+    from core.backports.odict import odict as OrderedDict  # Python <2.7
+
+# size of a decoded 256x256 px ARGB tile image
+DECODED_TILE_SIZE = 256 * 256 * 4  # bytes
+# status & error tiles (such as "Loading..." or "Download failed") are just
+# references to a single shared image, so their size is just a rough estimate
+# of the cache entry overhead
+PLACEHOLDER_TILE_SIZE = 512  # bytes
+
+
+def decodedSize(item):
+    """Estimate how much memory a cached tile item takes
+
+    :param item: a Cairo ImageSurface, raw tile data or something else
+    :returns: size of the item in bytes
+    :rtype: int
+    """
+    if isinstance(item, (bytes, bytearray)):
+        return len(item)
+    elif hasattr(item, "get_stride") and hasattr(item, "get_height"):
+        # Cairo ImageSurface
+        return item.get_stride() * item.get_height()
+    else:
+        return DECODED_TILE_SIZE
+
+
+class TileCache(object):
+    """A least recently used tile cache with a memory budget
+
+    Tiles are stored under their lzxy tuple together with a metadata dictionary
+    and the cache evicts the least recently used tiles once the total size
+    of the cached tiles is over the budget. Tiles with an expireTimestamp
+    in their metadata are dropped once they expire.
+
+    All operations are O(1) (or proportional to the number of tiles being removed),
+    tiles are indexed by type so that all status tiles can be dropped without
+    scanning the whole cache.
+
+    NOTE: the cache is not thread safe, users need to provide their own locking
+    """
+
+    def __init__(self, maxSize, clock=time.time):
+        """
+        :param int maxSize: maximum size of all cached tiles in bytes
+        :param clock: function returning current time in seconds
+        """
+        self._maxSize = maxSize
+        self._clock = clock
+        self._size = 0
+        # lzxy -> (item, metadata), ordered from least to most recently used
+        self._items = OrderedDict()
+        self._sizes = {}
+        # tile type -> set of lzxy tuples
+        self._typeIndex = {}
+        if hasattr(self._items, "move_to_end"):
+            self._touch = self._items.move_to_end
+        else:
+            self._touch = self._reinsert
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, lzxy):
+        return lzxy in self._items
+
+    @property
+    def size(self):
+        """Total size of all cached tiles in bytes"""
+        return self._size
+
+    @property
+    def maxSize(self):
+        return self._maxSize
+
+    @maxSize.setter
+    def maxSize(self, value):
+        self._maxSize = value
+        self._evict()
+
+    def _reinsert(self, lzxy):
+        """Move an item to the most recently used end of the cache
+        on Pythons where OrderedDict has no move_to_end()
+        """
+        self._items[lzxy] = self._items.pop(lzxy)
+
+    def get(self, lzxy, default=None):
+        """Get a cached tile & mark it as recently used
+
+        :param tuple lzxy: tile description tuple
+        :returns: (item, metadata) tuple or default if the tile is not cached
+                  or has expired
+        """
+        value = self._items.get(lzxy)
+        if value is None:
+            return default
+        expireTimestamp = value[1].get("expireTimestamp")
+        if expireTimestamp is not None and self._clock() >= expireTimestamp:
+            self._remove(lzxy)
+            return default
+        self._touch(lzxy)
+        return value
+
+    def peek(self, lzxy, default=None):
+        """Get a cached tile without marking it as recently used"""
+        return self._items.get(lzxy, default)
+
+    def add(self, lzxy, item, metadata, size):
+        """Add a tile to the cache, replacing any tile cached under the same lzxy
+
+        Least recently used tiles are evicted if the cache is over budget afterwards,
+        but the newly added tile is always kept.
+
+        :param tuple lzxy: tile description tuple
+        :param item: the tile to cache
+        :param dict metadata: tile metadata
+        :param int size: size of the tile in bytes
+        :returns: number of evicted tiles
+        :rtype: int
+        """
+        if lzxy in self._items:
+            self._remove(lzxy)
+        self._items[lzxy] = (item, metadata)
+        self._sizes[lzxy] = size
+        self._size += size
+        typeTiles = self._typeIndex.get(metadata["type"])
+        if typeTiles is None:
+            typeTiles = set()
+            self._typeIndex[metadata["type"]] = typeTiles
+        typeTiles.add(lzxy)
+        return self._evict()
+
+    def _remove(self, lzxy):
+        _item, metadata = self._items.pop(lzxy)
+        self._size -= self._sizes.pop(lzxy)
+        typeTiles = self._typeIndex[metadata["type"]]
+        typeTiles.discard(lzxy)
+        if not typeTiles:
+            del self._typeIndex[metadata["type"]]
+
+    def _evict(self):
+        """Evict least recently used tiles until the cache is within budget"""
+        evictedCount = 0
+        while self._size > self._maxSize and len(self._items) > 1:
+            lzxy = next(iter(self._items))
+            self._remove(lzxy)
+            evictedCount += 1
+        return evictedCount
+
+    def remove(self, lzxy):
+        """Remove a tile from the cache
+
+        :param tuple lzxy: tile description tuple
+        :returns: True if the tile was cached, False otherwise
+        :rtype: bool
+        """
+        if lzxy in self._items:
+            self._remove(lzxy)
+            return True
+        else:
+            return False
+
+    def removeTypes(self, imageTypes):
+        """Remove all tiles with given type in their metadata
+
+        :param imageTypes: tile types to remove
+        :returns: number of removed tiles
+        :rtype: int
+        """
+        removedCount = 0
+        for imageType in imageTypes:
+            typeTiles = self._typeIndex.get(imageType)
+            if typeTiles:
+                removedCount += len(typeTiles)
+                for lzxy in list(typeTiles):
+                    self._remove(lzxy)
+        return removedCount
+
+    def clear(self):
+        """Remove all tiles from the cache"""
+        self._items.clear()
+        self._sizes.clear()
+        self._typeIndex.clear()
+        self._size = 0
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""Tile id parsing & tile data caching for GUI tile image providers
+
+The Qt 5 GUI identifies tiles by strings like
+"<pinch map id>/<layer id>/<z>/<x>/<y>". The same ids are checked
+for availability & then requested from the image provider
+over & over again as the map is panned, so both the parsed ids
+and the tile data handed to the image provider are cached.
+
+Tile download notifications are coalesced into batches,
+so that the QML side gets one message per batch, not one per tile.
+"""
+import sys
+import threading
+
+try:  # Python 2.7+
+    from collections import OrderedDict as OrderedDict
+except ImportError:
+    from core.backports.odict import odict as OrderedDict  # Python <2.7
+
+from core.tile_cache import TileCache
+from core import constants
+
+import logging
+log = logging.getLogger("core.tile_provider")
+
+PYTHON3 = sys.version_info[0] > 2
+
+# how many parsed tile ids to remember
+TILE_ID_CACHE_SIZE = 1024
+# memory budget for tile data cached for the image provider
+TILE_DATA_CACHE_SIZE = 8 * 1024 * 1024  # bytes
+# tiles cached for the image provider are always normal tiles
+TILE_METADATA = {"type": "normal"}
+
+
+def parseTileId(tileId):
+    """Parse a tile id string
+
+    :param str tileId: map instance name/layer id/z/x/y
+    :returns: (map instance name, layer id, z, x, y) tuple
+    :rtype: tuple
+    :raises ValueError: for malformed tile ids
+    """
+    pinchMapId, layerId, z, x, y = tileId.split("/")
+    return pinchMapId, layerId, int(z), int(x), int(y)
+
+
+if PYTHON3:
+    def imageData(tileData):
+        """Turn tile data to something an image provider can return
+
+        PyOtherSide converts both bytes & bytearray to QByteArray,
+        so tile data is returned as it is, without copying.
+        """
+        if isinstance(tileData, (bytes, bytearray)):
+            return tileData
+        else:  # memoryview & other buffers
+            return bytes(tileData)
+else:
+    def imageData(tileData):
+        """Turn tile data to something an image provider can return
+
+        PyOtherSide converts str to a string on Python 2,
+        so tile data needs to be a bytearray.
+        """
+        if isinstance(tileData, bytearray):
+            return tileData
+        else:
+            return bytearray(tileData)
+
+
+class TileIdParser(object):
+    """Turn tile id strings to lzxy tuples & remember the most recently used ones"""
+
+    def __init__(self, getLayerById, maxSize=TILE_ID_CACHE_SIZE):
+        """
+        :param getLayerById: function returning a layer object for a layer id or None
+        :param int maxSize: how many tile ids to remember
+        """
+        self._getLayerById = getLayerById
+        self._maxSize = maxSize
+        self._lock = threading.Lock()
+        # tile id -> lzxy, ordered from least to most recently used
+        self._lzxys = OrderedDict()
+
+    def __len__(self):
+        return len(self._lzxys)
+
+    def lzxy(self, tileId):
+        """Get lzxy tuple for a tile id
+
+        :param str tileId: map instance name/layer id/z/x/y
+        :returns: lzxy tuple, the layer is None for unknown layer ids
+        :rtype: tuple
+        :raises ValueError: for malformed tile ids
+        """
+        with self._lock:
+            lzxy = self._lzxys.pop(tileId, None)
+            if lzxy is not None:
+                self._lzxys[tileId] = lzxy
+                return lzxy
+        _pinchMapId, layerId, z, x, y = parseTileId(tileId)
+        layer = self._getLayerById(layerId)
+        lzxy = (layer, z, x, y)
+        if layer is not None:  # the layer might show up later
+            with self._lock:
+                self._lzxys[tileId] = lzxy
+                if len(self._lzxys) > self._maxSize:
+                    self._lzxys.popitem(last=False)
+        return lzxy
+
+    def clear(self):
+        """Forget all parsed tile ids, eq. once map layers change"""
+        with self._lock:
+            self._lzxys.clear()
+
+
+class TileDataCache(object):
+    """A thread safe LRU cache of tile data ready to be returned by an image provider
+
+    The same tiles are checked for availability & loaded by the image provider
+    and are often shown again while the map is being panned, so keeping them
+    here saves going to the tile storage for each request.
+
+    NOTE: the cache holds the encoded (PNG/JPEG) tile data as read from the tile
+          storage, not decoded images - decoding is left to the QML side
+          and the memory budget is counted in encoded bytes
+    """
+
+    def __init__(self, maxSize=TILE_DATA_CACHE_SIZE):
+        """
+        :param int maxSize: maximum size of all cached tile data in bytes
+        """
+        self._lock = threading.Lock()
+        self._cache = TileCache(maxSize)
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __contains__(self, lzxy):
+        with self._lock:
+            return lzxy in self._cache
+
+    def get(self, lzxy):
+        """Get cached tile data
+
+        :param tuple lzxy: tile description tuple
+        :returns: tile data as returned by imageData() or None if not cached
+        """
+        with self._lock:
+            item = self._cache.get(lzxy)
+        if item is None:
+            return None
+        return item[0]
+
+    def add(self, lzxy, tileData):
+        """Cache tile data
+
+        :param tuple lzxy: tile description tuple
+        :param tileData: tile data
+        :returns: the tile data as returned by imageData()
+        """
+        tileData = imageData(tileData)
+        with self._lock:
+            self._cache.add(lzxy, tileData, TILE_METADATA, len(tileData))
+        return tileData
+
+    def remove(self, lzxy):
+        """Drop a tile from the cache, eq. once it has been downloaded again"""
+        with self._lock:
+            self._cache.remove(lzxy)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+class NotificationCoalescer(object):
+    """Gather notifications & send them in batches
+
+    The first notification of a batch starts a time window,
+    once it runs out all the notifications gathered are sent,
+    with one send() call per key. Keys are sent in the order
+    they first showed up & notifications are kept in the order
+    they were added.
+    """
+
+    def __init__(self, send, window=constants.DEFAULT_TILE_NOTIFICATION_WINDOW):
+        """
+        :param send: function taking a key and a list of notifications
+        :param float window: how long to gather notifications before sending them, in seconds
+        """
+        self._send = send
+        self._window = window
+        self._lock = threading.Lock()
+        # keeps batches in order if flush() is called while the timer fires
+        self._sendLock = threading.Lock()
+        # key -> list of notifications
+        self._pending = OrderedDict()
+        self._timer = None
+
+    @property
+    def window(self):
+        return self._window
+
+    def add(self, key, notification):
+        """Add a notification to the current batch
+
+        :param key: what to group the notification by, eq. a map instance name
+        :param notification: the notification
+        """
+        with self._lock:
+            notifications = self._pending.get(key)
+            if notifications is None:
+                notifications = []
+                self._pending[key] = notifications
+            notifications.append(notification)
+            if self._timer is None:
+                self._timer = threading.Timer(self._window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Send all pending notifications right away"""
+        with self._sendLock:
+            with self._lock:
+                pending = self._pending
+                self._pending = OrderedDict()
+                timer = self._timer
+                self._timer = None
+            if timer is not None:
+                timer.cancel()
+            for key, notifications in pending.items():
+                try:
+                    self._send(key, notifications)
+                except Exception:
+                    log.exception("sending notifications for %s failed", key)
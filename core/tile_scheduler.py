@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""Viewport based tile download request ranking"""
+import math
+
+from core import constants
+
+
+class ViewportTileScheduler(object):
+    """Ranks tile download requests by how relevant they are for the current viewport
+
+    Tiles matching the viewport zoom level come first, followed by tiles
+    of other zoom levels ordered by the zoom level difference. Tiles on the same
+    zoom level are ordered by distance of their centre from the viewport centre
+    and tiles with the same distance by the request timestamp, newest first.
+
+    If the viewport is not known, tiles are ranked just by zoom level match
+    (if the zoom level is known) and request timestamp.
+    """
+
+    def __init__(self, cancelMargin=constants.DEFAULT_TILE_DOWNLOAD_CANCEL_MARGIN):
+        """
+        :param cancelMargin: requests for tiles further than this (in tiles)
+                             outside of the viewport are cancelled,
+                             0 or None disables cancelling
+        """
+        self.cancelMargin = cancelMargin
+        # (z, centre x, centre y, half width, half height) in tiles of zoom level z
+        self._viewport = None
+        self._z = None
+
+    @property
+    def viewport(self):
+        return self._viewport
+
+    @property
+    def z(self):
+        return self._z
+
+    def setViewport(self, z, centreX, centreY, halfWidth, halfHeight):
+        """Set the currently visible area
+
+        :param int z: zoom level of the visible tiles
+        :param float centreX: x coordinate of the viewport centre in tiles
+        :param float centreY: y coordinate of the viewport centre in tiles
+        :param float halfWidth: half of the viewport width in tiles
+        :param float halfHeight: half of the viewport height in tiles
+        :returns: True if ranking of the requests might have changed, False otherwise
+        :rtype: bool
+        """
+        old = self._viewport
+        self._viewport = (z, centreX, centreY, halfWidth, halfHeight)
+        self._z = z
+        if old is None or old[0] != z or old[3:] != (halfWidth, halfHeight):
+            return True
+        # ignore movement within a single tile, so that smooth panning
+        # does not trigger re-ranking on every frame
+        return int(old[1]) != int(centreX) or int(old[2]) != int(centreY)
+
+    def setZoom(self, z):
+        """Set the current zoom level, keeping the viewport centre
+
+        :param int z: the new zoom level
+        :returns: True if ranking of the requests might have changed, False otherwise
+        :rtype: bool
+        """
+        if z == self._z:
+            return False
+        if self._viewport is not None:
+            oldZ, centreX, centreY, halfWidth, halfHeight = self._viewport
+            factor = 2.0 ** (z - oldZ)
+            self._viewport = (z, centreX * factor, centreY * factor, halfWidth, halfHeight)
+        self._z = z
+        return True
+
+    def rank(self, lzxy, timestamp):
+        """Rank a tile download request
+
+        :param tuple lzxy: tile description tuple
+        :param float timestamp: when the tile was requested
+        :returns: rank tuple (lower is better) or None if the request should be cancelled
+        :rtype: tuple or None
+        """
+        _layer, z, x, y = lzxy
+        viewport = self._viewport
+        if viewport is None:
+            if self._z is None:
+                return 0, 0, -timestamp
+            else:
+                return abs(z - self._z), 0, -timestamp
+        vz, centreX, centreY, halfWidth, halfHeight = viewport
+        # tile centre and half size in tiles of the viewport zoom level
+        factor = 2.0 ** (vz - z)
+        tileX = (x + 0.5) * factor
+        tileY = (y + 0.5) * factor
+        tileHalfSide = 0.5 * factor
+        dx = tileX - centreX
+        dy = tileY - centreY
+        if self.cancelMargin:
+            outsideX = abs(dx) - tileHalfSide - halfWidth
+            outsideY = abs(dy) - tileHalfSide - halfHeight
+            if max(outsideX, outsideY) > self.cancelMargin:
+                return None
+        return abs(z - vz), math.sqrt(dx * dx + dy * dy), -timestamp
@@ -35,9 +35,84 @@ class BaseTileStore(object):
     def tile_is_stored(self, lzxy):
         pass
 
+    def get_tiles(self, lzxy_iterable):
+        """Get data and timestamps for many tiles at once
+
+        Stores should override this with something more efficient than
+        calling get_tile() for every tile.
+
+        :param lzxy_iterable: iterable of lzxy tuples
+        :returns: dictionary of (tile data, timestamp) tuples for the tiles found in the store,
+                  keyed by the corresponding lzxy tuple
+        :rtype: dict
+        """
+        tiles = {}
+        for lzxy in lzxy_iterable:
+            tile_tuple = self.get_tile(lzxy)
+            if tile_tuple is not None:
+                tiles[lzxy] = tile_tuple
+        return tiles
+
+    def tiles_stored(self, lzxy_iterable):
+        """Report which of the given tiles are stored
+
+        Stores should override this with something more efficient than
+        calling tile_is_stored() for every tile.
+
+        :param lzxy_iterable: iterable of lzxy tuples
+        :returns: dictionary of timestamps for the tiles found in the store,
+                  keyed by the corresponding lzxy tuple
+        :rtype: dict
+        """
+        stored = {}
+        for lzxy in lzxy_iterable:
+            result = self.tile_is_stored(lzxy)
+            if result:
+                stored[lzxy] = result[1]
+        return stored
+
+    def get_tile_sizes(self, lzxy_iterable):
+        """Get data sizes for many tiles at once
+
+        Stores should override this with something that does not need
+        to load the tile data.
+
+        :param lzxy_iterable: iterable of lzxy tuples
+        :returns: dictionary of tile data sizes in bytes for the tiles found in the store,
+                  keyed by the corresponding lzxy tuple
+        :rtype: dict
+        """
+        return dict((lzxy, len(tile_tuple[0])) for lzxy, tile_tuple in self.get_tiles(lzxy_iterable).items())
+
     def delete_tile(self, lzxy):
         pass
 
+    def iter_tiles(self):
+        """Iterate over all tiles in the store
+
+        :returns: generator of (z, x, y, tile data, timestamp) tuples
+        """
+        return iter([])
+
+    def get_size(self):
+        """Return the size of the store in bytes
+
+        :returns: store size in bytes or None if the store can't report its size
+        :rtype: int or None
+        """
+        return None
+
+    def evict(self, max_size):
+        """Remove least recently used tiles until the store is not larger than max_size
+
+        Stores that don't support eviction (such as read only stores) don't remove anything.
+
+        :param int max_size: maximum store size in bytes
+        :returns: number of removed tiles
+        :rtype: int
+        """
+        return 0
+
     def clear(self):
         """Clear the store from permanent storage"""
         pass
@@ -0,0 +1,105 @@
+"""Conversion between the different tile store types"""
+import time
+
+from .files_store import FileBasedTileStore
+from .sqlite_store import SqliteTileStore
+from .mbtiles_store import MBTilesStore
+from .exceptions import TileStoreInitializationFailed
+from . import utils
+
+import logging
+log = logging.getLogger("tile_storage.convert")
+
+STORE_TYPE_FILES = "files"
+STORE_TYPE_SQLITE = "sqlite"
+STORE_TYPE_MBTILES = "mbtiles"
+STORE_TYPES = [STORE_TYPE_FILES, STORE_TYPE_SQLITE, STORE_TYPE_MBTILES]
+
+STORE_CLASSES = {
+    STORE_TYPE_FILES : FileBasedTileStore,
+    STORE_TYPE_SQLITE : SqliteTileStore,
+    STORE_TYPE_MBTILES : MBTilesStore
+}
+
+# how many tiles to write in a single transaction
+CONVERSION_BATCH_SIZE = 1000
+# how often to report conversion progress
+PROGRESS_INTERVAL = 1.0  # in seconds
+
+class TileFormat(object):
+    """Stands in for the map layer when converting tiles,
+    as the stores only need the layer to know the tile type
+    """
+    _formats = {}
+
+    def __init__(self, tile_type):
+        self.type = tile_type
+
+    @classmethod
+    def for_tile_data(cls, tile_data):
+        tile_type = utils.is_an_image(tile_data) or "png"
+        tile_format = cls._formats.get(tile_type)
+        if tile_format is None:
+            tile_format = cls(tile_type)
+            cls._formats[tile_type] = tile_format
+        return tile_format
+
+
+def detect_store_type(path):
+    """Detect type of the tile store at the given path
+
+    :param str path: path to an existing tile store
+    :returns: store type or None if no store is found
+    :rtype: str or None
+    """
+    # a folder can contain both a sqlite and a files store,
+    # in such a case prefer the sqlite store
+    for store_type in (STORE_TYPE_MBTILES, STORE_TYPE_SQLITE, STORE_TYPE_FILES):
+        if STORE_CLASSES[store_type].is_store(path):
+            return store_type
+    return None
+
+def open_store(path, store_type, writable=False, **kwargs):
+    """Open a tile store of the given type
+
+    :param str path: path to the store
+    :param str store_type: store type, one of STORE_TYPES
+    :param bool writable: if the store will be written to
+    :returns: tile store instance
+    """
+    store_class = STORE_CLASSES.get(store_type)
+    if store_class is None:
+        raise TileStoreInitializationFailed("unknown tile store type: %s" % store_type)
+    if not writable and not store_class.is_store(path):
+        raise TileStoreInitializationFailed("%s is not a %s tile store" % (path, store_type))
+    if store_type == STORE_TYPE_MBTILES:
+        return MBTilesStore(path, read_only=not writable, commit_batch_size=CONVERSION_BATCH_SIZE, **kwargs)
+    elif store_type == STORE_TYPE_SQLITE:
+        return SqliteTileStore(path, commit_batch_size=CONVERSION_BATCH_SIZE, **kwargs)
+    else:
+        return FileBasedTileStore(path, **kwargs)
+
+def convert(source, destination, progress_callback=None):
+    """Copy all tiles from the source store to the destination store
+
+    The tiles are streamed from the source to the destination, so memory usage
+    does not depend on the size of the store. Both sqlite based destination stores
+    write the tiles in large transactions.
+
+    :param source: source tile store
+    :param destination: destination tile store
+    :param progress_callback: called periodically with the number of tiles copied so far
+    :returns: number of tiles copied
+    :rtype: int
+    """
+    count = 0
+    last_report = time.time()
+    for z, x, y, tile_data, _timestamp in source.iter_tiles():
+        destination.store_tile_data((TileFormat.for_tile_data(tile_data), z, x, y), tile_data)
+        count += 1
+        if progress_callback and time.time() - last_report >= PROGRESS_INTERVAL:
+            progress_callback(count)
+            last_report = time.time()
+    destination.flush()
+    log.info("%d tiles copied from %s to %s", count, source, destination)
+    return count
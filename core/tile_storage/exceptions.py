@@ -1,4 +1,7 @@
 """Exceptions raised by classes from the Tile Storage module"""
 
 class TileStoreInitializationFailed(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class TileStoreReadOnly(Exception):
+    pass
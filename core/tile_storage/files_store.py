@@ -3,6 +3,8 @@ import os
 import glob
 import shutil
 import re
+import time
+import threading
 
 from .base import BaseTileStore
 from . import utils
@@ -24,6 +26,28 @@ def _get_toplevel_tile_folder_list(path):
     return [folder for folder in tile_folders if os.path.isdir(os.path.join(path, folder))]
 
 
+def _list_tile_column(column_path):
+    """List tile files in a single x column folder
+
+    :param str column_path: path to the x column folder
+    :returns: dictionary of file name lists keyed by the y coordinate
+    :rtype: dict
+    """
+    try:
+        file_names = os.listdir(column_path)
+    except OSError:
+        # no such column
+        return {}
+    column = {}
+    for file_name in file_names:
+        if file_name.endswith(PARTIAL_TILE_FILE_SUFFIX):
+            continue
+        y_string = file_name.split(".", 1)[0]
+        if y_string.isdigit():
+            column.setdefault(int(y_string), []).append(file_name)
+    return column
+
+
 class FileBasedTileStore(BaseTileStore):
 
     @staticmethod
@@ -48,6 +72,13 @@ class FileBasedTileStore(BaseTileStore):
         # such as that it contains a file that disables media indexing on platforms where this is needed
         utils.check_folder(self.store_path, prevent_media_indexing=prevent_media_indexing)
 
+        # last access times of tiles that have been read since the access times
+        # have been last written, tile file path -> timestamp
+        # - the access times are stored as file access times, but as many file systems
+        #   are mounted with noatime/relatime we set them ourselves in batches
+        self._access_times = {}
+        self._access_times_lock = threading.Lock()
+
     def __str__(self):
         return "file based store @ %s" % self.store_path
 
@@ -111,7 +142,9 @@ class FileBasedTileStore(BaseTileStore):
             try:
                 tile_mtime = os.path.getmtime(file_path)
                 with open(file_path, "rb") as f:
-                    return f.read(), tile_mtime
+                    tile_data = f.read()
+                self._record_access([file_path])
+                return tile_data, tile_mtime
             except:
                 log.exception("tile file reading failed for: %s", file_path)
                 return  None
@@ -139,7 +172,227 @@ class FileBasedTileStore(BaseTileStore):
         else:
             return False
 
+    def get_tiles(self, lzxy_iterable, fuzzy_matching=True):
+        """Get data and timestamps for many tiles at once
+
+        This lists every x column folder just once instead of checking
+        the tiles one by one.
+
+        :param lzxy_iterable: iterable of lzxy tuples
+        :param bool fuzzy_matching: if fuzzy tile matching should be used
+        :returns: dictionary of (tile data, timestamp) tuples for the tiles found in the store,
+                  keyed by the corresponding lzxy tuple
+        :rtype: dict
+        """
+        tiles = {}
+        accessed_paths = []
+        for lzxy, file_paths in self._find_tile_files(lzxy_iterable, fuzzy_matching):
+            for file_path in file_paths:
+                try:
+                    tile_mtime = os.path.getmtime(file_path)
+                    with open(file_path, "rb") as f:
+                        tile_data = f.read()
+                except:
+                    log.exception("tile file reading failed for: %s", file_path)
+                    continue
+                # with fuzzy matching we want the first file that is actually an image
+                if not fuzzy_matching or utils.is_an_image(tile_data):
+                    tiles[lzxy] = tile_data, tile_mtime
+                    accessed_paths.append(file_path)
+                    break
+                else:
+                    log.warning("%s is not an image", file_path)
+        self._record_access(accessed_paths)
+        return tiles
+
+    def tiles_stored(self, lzxy_iterable, fuzzy_matching=True):
+        """Report which of the given tiles are present in this file based tile store
+
+        This lists every x column folder just once instead of checking
+        the tiles one by one.
+
+        NOTE: Unlike tile_is_stored() this does not check that the tile files
+              found by fuzzy matching actually are images.
+
+        :param lzxy_iterable: iterable of lzxy tuples
+        :param bool fuzzy_matching: if fuzzy tile matching should be used
+        :returns: dictionary of timestamps for the tiles found in the store,
+                  keyed by the corresponding lzxy tuple
+        :rtype: dict
+        """
+        stored = {}
+        for lzxy, file_paths in self._find_tile_files(lzxy_iterable, fuzzy_matching):
+            try:
+                stored[lzxy] = os.path.getmtime(file_paths[0])
+            except OSError:
+                # the tile has most probably been deleted since we listed the folder
+                pass
+        return stored
+
+    def get_tile_sizes(self, lzxy_iterable, fuzzy_matching=True):
+        """Get data sizes for many tiles at once
+
+        :param lzxy_iterable: iterable of lzxy tuples
+        :param bool fuzzy_matching: if fuzzy tile matching should be used
+        :returns: dictionary of tile file sizes in bytes for the tiles found in the store,
+                  keyed by the corresponding lzxy tuple
+        :rtype: dict
+        """
+        sizes = {}
+        for lzxy, file_paths in self._find_tile_files(lzxy_iterable, fuzzy_matching):
+            try:
+                sizes[lzxy] = os.path.getsize(file_paths[0])
+            except OSError:
+                # the tile has most probably been deleted since we listed the folder
+                pass
+        return sizes
+
+    def _find_tile_files(self, lzxy_iterable, fuzzy_matching):
+        """Find files for the given tiles with a single listing per x column folder
+
+        :param lzxy_iterable: iterable of lzxy tuples
+        :param bool fuzzy_matching: if also files with other than the layer extension
+                                    should be returned
+        :returns: generator of (lzxy, file paths) tuples for the found tiles,
+                  the file path with the layer extension (if any) is always first
+        """
+        columns = {}
+        for lzxy in lzxy_iterable:
+            columns.setdefault((lzxy[1], lzxy[2]), []).append(lzxy)
+        for (z, x), column_tiles in columns.items():
+            column_path = os.path.join(self.store_path, str(z), str(x))
+            column = _list_tile_column(column_path)
+            if not column:
+                continue
+            for lzxy in column_tiles:
+                file_names = column.get(lzxy[3])
+                if not file_names:
+                    continue
+                primary_file_name = "%d.%s" % (lzxy[3], lzxy[0].type)
+                if primary_file_name in file_names:
+                    file_names = [primary_file_name] + [name for name in file_names if name != primary_file_name]
+                elif not fuzzy_matching:
+                    continue
+                if not fuzzy_matching:
+                    file_names = file_names[:1]
+                yield lzxy, [os.path.join(column_path, name) for name in file_names]
+
+    def iter_tiles(self):
+        """Iterate over all tiles in the store
+
+        :returns: generator of (z, x, y, tile data, timestamp) tuples
+        """
+        for z_folder in _get_toplevel_tile_folder_list(self.store_path):
+            if not z_folder.isdigit():
+                continue
+            z_path = os.path.join(self.store_path, z_folder)
+            for x_folder in os.listdir(z_path):
+                if not x_folder.isdigit():
+                    continue
+                column_path = os.path.join(z_path, x_folder)
+                for y, file_names in _list_tile_column(column_path).items():
+                    for file_name in file_names:
+                        file_path = os.path.join(column_path, file_name)
+                        try:
+                            with open(file_path, "rb") as f:
+                                tile_data = f.read()
+                            tile_mtime = os.path.getmtime(file_path)
+                        except (IOError, OSError):
+                            log.exception("tile file reading failed for: %s", file_path)
+                            continue
+                        if utils.is_an_image(tile_data):
+                            yield int(z_folder), int(x_folder), y, tile_data, tile_mtime
+                            break
+
+    def _record_access(self, file_paths):
+        """Remember that the given tile files have been accessed"""
+        timestamp = time.time()
+        with self._access_times_lock:
+            for file_path in file_paths:
+                self._access_times[file_path] = timestamp
+
+    def _write_access_times(self):
+        """Set access times of the recently read tile files, keeping their modification times"""
+        with self._access_times_lock:
+            access_times = self._access_times
+            self._access_times = {}
+        for file_path, timestamp in access_times.items():
+            try:
+                os.utime(file_path, (timestamp, os.path.getmtime(file_path)))
+            except OSError:
+                # the tile has most probably been deleted in the meantime
+                pass
+
+    def _list_tile_files(self):
+        """List all tile files in the store
+
+        :returns: list of (access time, size, path, z, x) tuples
+        :rtype: list
+        """
+        tile_files = []
+        for z_folder in _get_toplevel_tile_folder_list(self.store_path):
+            z_path = os.path.join(self.store_path, z_folder)
+            for x_folder in os.listdir(z_path):
+                column_path = os.path.join(z_path, x_folder)
+                if not os.path.isdir(column_path):
+                    continue
+                for file_names in _list_tile_column(column_path).values():
+                    for file_name in file_names:
+                        file_path = os.path.join(column_path, file_name)
+                        try:
+                            stat = os.stat(file_path)
+                        except OSError:
+                            continue
+                        tile_files.append((stat.st_atime, stat.st_size, file_path, z_folder, x_folder))
+        return tile_files
+
+    def get_size(self):
+        """Return the size of all tile files in the store in bytes
+
+        NOTE: This needs to go over all the tile files, so it can take a while for large stores.
+
+        :returns: store size in bytes
+        :rtype: int
+        """
+        return sum(tile_file[1] for tile_file in self._list_tile_files())
+
+    def evict(self, max_size):
+        """Remove least recently used tiles until the store is not larger than max_size
+
+        :param int max_size: maximum store size in bytes
+        :returns: number of removed tiles
+        :rtype: int
+        """
+        self._write_access_times()
+        tile_files = self._list_tile_files()
+        size = sum(tile_file[1] for tile_file in tile_files)
+        if size <= max_size:
+            return 0
+        tile_files.sort()
+        removed_count = 0
+        columns = set()
+        for _atime, file_size, file_path, z_folder, x_folder in tile_files:
+            if size <= max_size:
+                break
+            try:
+                os.remove(file_path)
+            except OSError:
+                log.exception("evicting tile %s failed", file_path)
+                continue
+            size -= file_size
+            removed_count += 1
+            columns.add((z_folder, x_folder))
+        for z_folder, x_folder in columns:
+            self._delete_empty_folders(z_folder, x_folder)
+        log.info("%d least recently used tiles evicted from %s", removed_count, self)
+        return removed_count
+
+    def close(self):
+        self._write_access_times()
+
     def _delete_empty_folders(self, z, x):
+        z = str(z)
+        x = str(x)
         # x-level folder
         x_path = os.path.join(self.store_path, z, x)
         if not os.listdir(x_path):
@@ -152,7 +405,7 @@ class FileBasedTileStore(BaseTileStore):
                     pass
                 # z-level folder
                 z_path = os.path.join(self.store_path, z)
-                if os.listdir(z_path):
+                if not os.listdir(z_path):
                     try:
                         os.rmdir(z_path)
                     except OSError:
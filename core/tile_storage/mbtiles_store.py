@@ -0,0 +1,326 @@
+# A tile store backed by a single MBTiles file
+#
+# MBTiles is a widely supported SQLite based format for storing map tiles,
+# see https://github.com/mapbox/mbtiles-spec for the specification.
+# This makes it possible to use tiles pre-seeded by other tools and to export
+# tiles from modRana in a format other tools can use.
+#
+# The MBTiles database schema looks like this:
+#
+# table metadata (name text, value text)
+# table tiles (zoom_level integer, tile_column integer, tile_row integer, tile_data blob)
+#
+# Unlike the modRana stores MBTiles uses the TMS tiling scheme, which has the y axis
+# pointing north, so the y coordinate needs to be flipped when converting between
+# the two. MBTiles also does not store tile timestamps, so the modification time
+# of the MBTiles file is used instead.
+#
+# The store is read only by default, as MBTiles files are usually just dropped
+# into the layer folder and we don't want to modify them behind the users back.
+
+from __future__ import with_statement
+
+import math
+import os
+import sqlite3
+from threading import RLock
+
+import logging
+log = logging.getLogger("tile_storage.mbtiles_store")
+
+from .base import BaseTileStore
+from .exceptions import TileStoreReadOnly
+from . import utils
+
+MBTILES_EXTENSION = ".mbtiles"
+# commit the tiles written to a writable store after this many tiles
+DEFAULT_COMMIT_BATCH_SIZE = 1000
+MBTILES_VERSION = "1.1"
+
+def flip_y(z, y):
+    """Convert between XYZ and TMS y coordinates (the conversion is symmetric)
+
+    :param int z: zoom level
+    :param int y: y coordinate
+    :returns: the flipped y coordinate
+    :rtype: int
+    """
+    return (2 ** z) - 1 - y
+
+def tile_bounds(z, min_x, min_y, max_x, max_y):
+    """Get the geographic bounds of a range of XYZ tiles
+
+    :returns: (west, south, east, north) tuple in degrees
+    :rtype: tuple
+    """
+    n = 2.0 ** z
+    def lat(y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    def lon(x):
+        return -180.0 + 360.0 * x / n
+    return lon(min_x), lat(max_y + 1), lon(max_x + 1), lat(min_y)
+
+def metadata_to_layer_config(metadata, folder_name):
+    """Convert MBTiles metadata to a dictionary usable as MapLayer configuration
+
+    :param dict metadata: MBTiles metadata
+    :param str folder_name: name of the map folder subfolder containing the MBTiles file
+    :returns: map layer configuration
+    :rtype: dict
+    """
+    config = {
+        "label" : metadata.get("name", folder_name),
+        "url" : "",
+        "type" : metadata.get("format", "png"),
+        "min_zoom" : int(metadata.get("minzoom", 0)),
+        "max_zoom" : int(metadata.get("maxzoom", 18)),
+        "folder_prefix" : folder_name,
+        "coordinates" : "osm",
+    }
+    if "description" in metadata:
+        config["description"] = metadata["description"]
+    if "attribution" in metadata:
+        config["attribution"] = metadata["attribution"]
+    return config
+
+def layer_to_metadata(layer):
+    """Convert a map layer to MBTiles metadata
+
+    :param layer: MapLayer instance
+    :returns: MBTiles metadata
+    :rtype: dict
+    """
+    metadata = {
+        "name" : layer.label,
+        "format" : layer.type,
+        "minzoom" : str(layer.min_zoom),
+        "maxzoom" : str(layer.max_zoom),
+        "type" : "baselayer",
+        "version" : MBTILES_VERSION,
+    }
+    for key in ("description", "attribution"):
+        if key in layer.config:
+            metadata[key] = layer.config[key]
+    return metadata
+
+
+class MBTilesStore(BaseTileStore):
+
+    @staticmethod
+    def is_store(path):
+        """We consider the path to be a MBTiles store if it is a file
+           with the .mbtiles extension and has the tiles table
+
+        :param str path: path to test
+        :returns: True if the path leads to a MBTiles file, else False
+        :rtype: bool
+        """
+        if not (path.endswith(MBTILES_EXTENSION) and os.path.isfile(path)):
+            return False
+        try:
+            connection = sqlite3.connect(path)
+            try:
+                result = connection.execute(
+                    "select name from sqlite_master where name='tiles'").fetchone()
+            finally:
+                connection.close()
+            return result is not None
+        except sqlite3.Error:
+            log.exception("checking MBTiles file failed: %s", path)
+            return False
+
+    def __init__(self, store_path, prevent_media_indexing=False, read_only=True, metadata=None,
+                 commit_batch_size=DEFAULT_COMMIT_BATCH_SIZE):
+        """
+        :param str store_path: path to the MBTiles file
+        :param bool read_only: if the store should be read only
+        :param dict metadata: metadata for a newly created MBTiles file
+        :param int commit_batch_size: how many tiles to write in a single transaction
+        """
+        BaseTileStore.__init__(self, store_path, prevent_media_indexing=prevent_media_indexing)
+        self._read_only = read_only
+        self._commit_batch_size = commit_batch_size
+        self._uncommitted_count = 0
+        # MBTiles files are mostly read, so a single connection
+        # guarded by a lock is good enough
+        self._lock = RLock()
+        if not os.path.exists(store_path):
+            if read_only:
+                log.error("MBTiles file does not exist: %s", store_path)
+            else:
+                self._create(store_path, metadata)
+        self._connection = sqlite3.connect(store_path, check_same_thread=False)
+        if read_only:
+            self._connection.execute("PRAGMA query_only=1")
+        self._timestamp = os.path.getmtime(store_path) if os.path.exists(store_path) else 0
+        self._metadata = None
+
+    def __str__(self):
+        return "MBTiles store @ %s" % self.store_path
+
+    def __repr__(self):
+        return str(self)
+
+    @property
+    def read_only(self):
+        return self._read_only
+
+    def _create(self, path, metadata):
+        """Create a new MBTiles file with the given metadata"""
+        folder_path = os.path.dirname(path)
+        if folder_path:
+            utils.check_folder(folder_path, prevent_media_indexing=self._prevent_media_indexing)
+        log.info("creating a new MBTiles file in %s", path)
+        connection = sqlite3.connect(path)
+        connection.execute("create table metadata (name text, value text)")
+        connection.execute(
+            "create table tiles (zoom_level integer, tile_column integer, tile_row integer, tile_data blob)")
+        connection.execute("create unique index tile_index on tiles (zoom_level, tile_column, tile_row)")
+        connection.execute("create unique index metadata_index on metadata (name)")
+        metadata = dict(metadata or {})
+        metadata.setdefault("version", MBTILES_VERSION)
+        connection.executemany("insert into metadata (name, value) values (?, ?)", metadata.items())
+        connection.commit()
+        connection.close()
+
+    @property
+    def metadata(self):
+        """MBTiles metadata as a dictionary"""
+        with self._lock:
+            if self._metadata is None:
+                self._metadata = dict(self._connection.execute("select name, value from metadata").fetchall())
+            return dict(self._metadata)
+
+    def set_metadata(self, name, value):
+        """Set a single metadata value"""
+        self._check_writable()
+        with self._lock:
+            self._connection.execute("delete from metadata where name=?", (name,))
+            self._connection.execute("insert into metadata (name, value) values (?, ?)", (name, str(value)))
+            self._connection.commit()
+            self._metadata = None
+
+    def get_layer_config(self, folder_name=None):
+        """Return map layer configuration based on the MBTiles metadata
+
+        :param str folder_name: layer folder name, defaults to the name
+                                of the folder containing the MBTiles file
+        """
+        if folder_name is None:
+            folder_name = os.path.basename(os.path.dirname(os.path.abspath(self.store_path)))
+        return metadata_to_layer_config(self.metadata, folder_name)
+
+    def _check_writable(self):
+        if self._read_only:
+            raise TileStoreReadOnly("%s is read only" % self)
+
+    def store_tile_data(self, lzxy, tile_data):
+        self._check_writable()
+        layer, z, x, y = lzxy
+        with self._lock:
+            if self._uncommitted_count == 0 and "format" not in self.metadata:
+                # the first tile stored to a new file decides its format
+                self.set_metadata("format", layer.type)
+            self._connection.execute(
+                "insert or replace into tiles (zoom_level, tile_column, tile_row, tile_data) values (?, ?, ?, ?)",
+                (z, x, flip_y(z, y), sqlite3.Binary(tile_data)))
+            self._uncommitted_count += 1
+            if self._uncommitted_count >= self._commit_batch_size:
+                self.flush()
+
+    def get_tile(self, lzxy):
+        """Get tile data and timestamp corresponding to the given coordinate tuple
+
+        :param tuple lzxy: layer, z, x, y coordinate tuple describing a single tile
+                           (layer is actually not used and can be None)
+        :returns: (tile data, timestamp) or None if tile is not found in the database
+        :rtype: a (bytes, int) tuple or None
+        """
+        _layer, z, x, y = lzxy
+        with self._lock:
+            result = self._connection.execute(
+                "select tile_data from tiles where zoom_level=? and tile_column=? and tile_row=?",
+                (z, x, flip_y(z, y))).fetchone()
+        if result:
+            return result[0], self._timestamp
+        else:
+            return None
+
+    def tile_is_stored(self, lzxy):
+        _layer, z, x, y = lzxy
+        with self._lock:
+            result = self._connection.execute(
+                "select 1 from tiles where zoom_level=? and tile_column=? and tile_row=?",
+                (z, x, flip_y(z, y))).fetchone()
+        if result:
+            return True, self._timestamp
+        else:
+            return False
+
+    def delete_tile(self, lzxy):
+        self._check_writable()
+        _layer, z, x, y = lzxy
+        with self._lock:
+            self._connection.execute(
+                "delete from tiles where zoom_level=? and tile_column=? and tile_row=?",
+                (z, x, flip_y(z, y)))
+            self.flush()
+
+    def iter_tiles(self):
+        """Iterate over all tiles in the store
+
+        :returns: generator of (z, x, y, tile data, timestamp) tuples
+        """
+        # use a separate connection so that we don't block other users
+        # of the store for the whole iteration
+        connection = sqlite3.connect(self.store_path)
+        try:
+            cursor = connection.execute("select zoom_level, tile_column, tile_row, tile_data from tiles")
+            for z, x, tms_y, tile_data in cursor:
+                yield z, x, flip_y(z, tms_y), tile_data, self._timestamp
+        finally:
+            connection.close()
+
+    def _update_zoom_metadata(self):
+        """Set the min & max zoom metadata if not already set"""
+        metadata = self.metadata
+        if "minzoom" in metadata and "maxzoom" in metadata:
+            return
+        min_zoom, max_zoom = self._connection.execute(
+            "select min(zoom_level), max(zoom_level) from tiles").fetchone()
+        if min_zoom is not None:
+            self.set_metadata("minzoom", min_zoom)
+            self.set_metadata("maxzoom", max_zoom)
+
+    def _update_bounds_metadata(self):
+        """Set the bounds metadata from the tiles at the highest zoom level if not already set"""
+        if "bounds" in self.metadata:
+            return
+        z, min_x, max_x, min_tms_y, max_tms_y = self._connection.execute(
+            "select zoom_level, min(tile_column), max(tile_column), min(tile_row), max(tile_row) "
+            "from tiles where zoom_level=(select max(zoom_level) from tiles)").fetchone()
+        if z is not None:
+            bounds = tile_bounds(z, min_x, flip_y(z, max_tms_y), max_x, flip_y(z, min_tms_y))
+            self.set_metadata("bounds", ",".join("%.6f" % b for b in bounds))
+
+    def flush(self):
+        """Commit any tiles written so far"""
+        if self._read_only:
+            return
+        with self._lock:
+            self._connection.commit()
+            self._uncommitted_count = 0
+
+    def close(self):
+        with self._lock:
+            if not self._read_only:
+                self.flush()
+                self._update_zoom_metadata()
+                self._update_bounds_metadata()
+            self._connection.close()
+
+    def clear(self):
+        """Delete the MBTiles file"""
+        self._check_writable()
+        self.close()
+        os.remove(self.store_path)
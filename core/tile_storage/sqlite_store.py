@@ -36,14 +36,29 @@
 #
 # When looking for a tile in the database, the lookup database is checked first and if the coordinates
 # are found the corresponding storage database is queried for the actual data.
+#
+# Writes are done "behind" the caller - store_tile_data() just puts the tile to a queue
+# and a dedicated writer thread stores the queued tiles in batches, each batch in a single
+# transaction. A batch is committed once it has SQLITE_QUEUE_SIZE tiles or once
+# the commit interval elapses, whichever comes first. Tiles waiting in the queue are
+# still visible to get_tile() and tile_is_stored(). Call flush() to make sure all the
+# queued tiles have been committed to the databases.
 
 from __future__ import with_statement
 
 import os
+import math
 import sqlite3
 import glob
 import time
+import threading
 from threading import RLock
+from contextlib import contextmanager
+
+try:  # Python 2
+    import Queue as queue
+except ImportError:  # Python 3
+    import queue
 
 import logging
 log = logging.getLogger("tile_storage.sqlite_store")
@@ -55,32 +70,155 @@ from . import utils
 # the storage database files can be only this big to avoid
 # maximum file size limitations on FAT32 and possibly elsewhere
 MAX_STORAGE_DB_FILE_SIZE = 3.7  # in Gibi Bytes
+# commit the write queue once it has this many tiles waiting
 SQLITE_QUEUE_SIZE = 50
+# store_tile_data() blocks once this many tiles are waiting to be written
+SQLITE_MAX_PENDING_TILES = 500
+# commit the write queue at least once every this many seconds
+DEFAULT_COMMIT_INTERVAL = 5
+# how many idle read only connections to keep around per database file
+READ_CONNECTION_POOL_SIZE = 4
+# maximum number of x coordinates in a single bulk lookup query
+# (well below the default SQLITE_MAX_VARIABLE_NUMBER of 999)
+MAX_BULK_QUERY_COLUMNS = 500
+# how many times eviction re-estimates the number of tiles to remove
+# if the store is still over the limit
+MAX_EVICTION_ROUNDS = 3
+# value of the auto_vacuum pragma for incremental vacuum
+INCREMENTAL_AUTO_VACUUM = 2
+# use a single rectangle query for bulk lookups if at least 1/Nth
+# of the tiles in the rectangle have been requested
+BULK_QUERY_DENSITY = 4
 SQLITE_TILE_STORAGE_FORMAT_VERSION = 1
 LOOKUP_DB_NAME = "lookup.sqlite"
 STORE_DB_NAME_PREFIX = "store.sqlite."
 
-def connect_to_db(path_to_database):
-    """Setting check_same_thread to False fixes a Sqlite exception
-    that happens when a thread tries to access a database read connection
-    that was created in a different thread. All write connections are "owned"
-    by the storage thread so they don't have these issues.
-    According to shreds of information available on the Internet &
-    GitHub search revealing massive usage of check_same_thread=False,
-    we are also using this flag to fix the issues.
-    Possible alternative solutions:
-    * per thread connections read connections
-    * replacing the connection if it was created in a different thread
-    * having a thread own the connection and handling read operations
-      asynchronously
-    In case that check_same_thread does not work somewhere or that is
-    found that it has some serious disadvantages, some of these alternative
-    solutions could be used.
+def connect_to_db(path_to_database, read_only=False):
+    """Connect to a tile database
+
+    The databases use the WAL journal mode, so that readers don't block the writer
+    and the writer does not block readers.
+
+    Write connections are only used with the database lock held, either by the writer thread
+    or by the thread deleting a tile, so setting check_same_thread to False is safe for them.
+    Read only connections are handed out by the read connection pool and are only ever
+    used by a single thread at a time, but not always the one that created them,
+    so they also need check_same_thread set to False.
 
     :param str path_to_database: path to the database
+    :param bool read_only: if the connection should be read only
     :returns: Sqlite database connection
     """
-    return sqlite3.connect(path_to_database, check_same_thread=False)
+    connection = sqlite3.connect(path_to_database, check_same_thread=False)
+    if read_only:
+        connection.execute("PRAGMA query_only=1")
+    else:
+        # make it possible to shrink the database file once tiles are evicted
+        # - this only has an effect for new databases and needs to be set before
+        #   the journal mode, as setting the journal mode initializes the database,
+        #   free pages of existing databases are just reused for new tiles
+        connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        # the journal mode is persistent, but it's cheap to set it again,
+        # which also converts stores created by older modRana versions
+        connection.execute("PRAGMA journal_mode=WAL")
+    return connection
+
+def _remove_db_files(path_to_database):
+    """Remove a database file together with any leftover WAL mode files"""
+    os.remove(path_to_database)
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(path_to_database + suffix):
+            os.remove(path_to_database + suffix)
+
+class _ReadConnectionPool(object):
+    """A small pool of read only connections to a single database file
+
+    Each reading thread takes a connection of its own from the pool
+    and returns it once it is done with it, so readers never need
+    to share a connection or take the database lock.
+    """
+
+    def __init__(self, path_to_database, size=READ_CONNECTION_POOL_SIZE):
+        self._path = path_to_database
+        self._size = size
+        self._idle_connections = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @contextmanager
+    def connection(self):
+        with self._lock:
+            connection = self._idle_connections.pop() if self._idle_connections else None
+        if connection is None:
+            connection = connect_to_db(self._path, read_only=True)
+        try:
+            yield connection
+        finally:
+            with self._lock:
+                if not self._closed and len(self._idle_connections) < self._size:
+                    self._idle_connections.append(connection)
+                    connection = None
+            # the pool is full or closed
+            if connection is not None:
+                connection.close()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            for connection in self._idle_connections:
+                connection.close()
+            self._idle_connections = []
+
+def _group_by_zoom(lzxy_iterable):
+    """Group lzxy tuples by zoom level
+
+    :returns: {z : {(x, y) : lzxy}} dictionary
+    :rtype: dict
+    """
+    zooms = {}
+    for lzxy in lzxy_iterable:
+        zooms.setdefault(lzxy[1], {})[(lzxy[2], lzxy[3])] = lzxy
+    return zooms
+
+def _query_zoom_level(connection, columns, z, xy_dict):
+    """Query the tiles table for many tiles on a single zoom level
+
+    If the requested tiles are dense enough (such as a screen full of tiles)
+    a single query for their bounding rectangle is used, otherwise we query
+    only the requested x columns.
+
+    :param connection: database connection
+    :param str columns: columns to return in addition to x and y
+    :param int z: zoom level
+    :param dict xy_dict: dictionary with (x, y) tuples of the requested tiles as keys
+    :returns: generator of (x, y, <columns>) rows for the requested tiles
+    """
+    xs = set(x for x, _y in xy_dict)
+    ys = [y for _x, y in xy_dict]
+    min_y, max_y = min(ys), max(ys)
+    area = (max(xs) - min(xs) + 1) * (max_y - min_y + 1)
+    query = "select x, y, %s from tiles where z=? and %%s and y between ? and ?" % columns
+    if area <= len(xy_dict) * BULK_QUERY_DENSITY:
+        queries = [(query % "x between ? and ?", [z, min(xs), max(xs), min_y, max_y])]
+    else:
+        xs = sorted(xs)
+        queries = []
+        for i in range(0, len(xs), MAX_BULK_QUERY_COLUMNS):
+            chunk = xs[i:i + MAX_BULK_QUERY_COLUMNS]
+            x_condition = "x in (%s)" % ",".join("?" * len(chunk))
+            queries.append((query % x_condition, [z] + chunk + [min_y, max_y]))
+    for query, parameters in queries:
+        for row in connection.execute(query, parameters):
+            if (row[0], row[1]) in xy_dict:
+                yield row
+
+# marks the end of the write queue
+_STOP_WRITER = object()
+
+class _FlushRequest(object):
+    """Asks the writer thread to write all the tiles queued before it"""
+    def __init__(self):
+        self.done = threading.Event()
 
 class SqliteTileStore(BaseTileStore):
 
@@ -104,8 +242,11 @@ class SqliteTileStore(BaseTileStore):
                 is_store = True
         return is_store
 
-    def __init__(self, store_path, prevent_media_indexing = False):
+    def __init__(self, store_path, prevent_media_indexing = False, commit_interval=DEFAULT_COMMIT_INTERVAL,
+                 commit_batch_size=SQLITE_QUEUE_SIZE):
         BaseTileStore.__init__(self, store_path, prevent_media_indexing=prevent_media_indexing)
+        self._commit_interval = commit_interval
+        self._commit_batch_size = commit_batch_size
 
         # SQLite tends to blow up with the infamous "sqlite3.OperationalError: database is locked"
         # if the database is accessed from multiple threads an/or processes at the same time.
@@ -114,18 +255,38 @@ class SqliteTileStore(BaseTileStore):
         # error. And of course a single write transaction is enough to basically block the
         # database indefinitely.
         #
-        # tl;dr: serialize W & RO access to the database to prevent random lockups
-        #
-        # We should try to compensate for this by batching read and write requests,
-        # which should ot be that difficult as for example modRana often needs to fetch a full
-        # screen of tiles and we can quite easily cache write requests and submit them in batch.
+        # To avoid this the databases use the WAL journal mode, where readers don't block
+        # the writer and the writer does not block readers. All writing goes through
+        # a single set of write connections guarded by the database lock, while readers
+        # use read only connections from per-database pools and never take the lock.
         self._db_lock = RLock()
+        # read only connection pools, one per database file name
+        self._read_pools = {}
+        self._read_pools_lock = threading.Lock()
         # to avoid possible race conditions we needs to mutually exclude operations concerning
         # storage database free space checking and the related adding of new stores
         self._storage_db_management_lock = RLock()
-
+        # approximate sizes of the storage database files in bytes, so that we don't
+        # need to stat the database file every time we want to store a tile
+        self._store_sizes = {}
+        # tiles that have been queued for writing but not yet committed,
+        # (z, x, y) -> (z, x, y, tile_data, extension, timestamp)
+        self._pending_tiles = {}
+        self._pending_tiles_lock = threading.Lock()
+        self._write_queue = queue.Queue(maxsize=SQLITE_MAX_PENDING_TILES)
+        # last access times of tiles that have been read since the access times
+        # have been last written to the lookup database, (z, x, y) -> timestamp
+        self._access_times = {}
+        self._access_times_lock = threading.Lock()
+
+        self._open()
+
+    def _open(self):
+        """Open the store, creating the databases if they don't exist yet,
+        and start the writer thread
+        """
         # make sure the folder containing the sqlite tile databases exists
-        utils.check_folder(self.store_path, prevent_media_indexing=prevent_media_indexing)
+        utils.check_folder(self.store_path, prevent_media_indexing=self._prevent_media_indexing)
 
         # there is always only one lookup database per store that stores only tile coordinates
         # and name of the storage database holding the tile data
@@ -150,6 +311,11 @@ class SqliteTileStore(BaseTileStore):
         self._new_tiles_store_name = store_name
         self._new_tiles_store_connection = store_connection
 
+        # start the thread that writes queued tiles to the database
+        self._writer_thread = threading.Thread(target=self._writer_run, name="SqliteTileStoreWriter")
+        self._writer_thread.daemon = True
+        self._writer_thread.start()
+
     def __str__(self):
         return "sqlite store @ %s" % self.store_path
 
@@ -174,6 +340,21 @@ class SqliteTileStore(BaseTileStore):
                 cursor.execute("create table version (v integer)")
                 cursor.execute("insert into version values (?)", (SQLITE_TILE_STORAGE_FORMAT_VERSION,))
                 connection.commit()
+        # tile last access times used for LRU eviction, stored in a separate table
+        # so that the lookup table does not need to be changed
+        # - every tile has an access time, initially the time it has been stored,
+        #   so that the least recently used tiles can be selected from an index
+        with self._db_lock:
+            connection.execute(
+                "create table if not exists access (z integer, x integer, y integer, unix_epoch_timestamp integer, primary key (z, x, y))")
+            index = connection.execute(
+                "select name from sqlite_master where type='index' and name='access_time'").fetchone()
+            if index is None:
+                log.info("sqlite tiles: indexing tile access times")
+                connection.execute(
+                    "insert or ignore into access (z, x, y, unix_epoch_timestamp) select z, x, y, unix_epoch_timestamp from tiles")
+                connection.execute("create index access_time on access (unix_epoch_timestamp)")
+            connection.commit()
         return connection
 
     def _get_storage_db_connections(self):
@@ -181,14 +362,15 @@ class SqliteTileStore(BaseTileStore):
            - if no storage databases exist, create the first (store.sqlite.0) storage database
         """
         connections = {}
+        self._storage_databases = connections
         existing_stores = self._list_store_files()
         if existing_stores:
             for store_path in existing_stores:
                 store_name = os.path.basename(store_path)
                 connections[store_name] = connect_to_db(store_path)
+                self._store_sizes[store_name] = os.path.getsize(store_path)
         else:  # no stores yet, create the first one
-            store_name, store_connection = self._add_store()
-            connections = {store_name : store_connection}
+            self._add_store()
         return connections
 
     def _add_store(self):
@@ -208,11 +390,15 @@ class SqliteTileStore(BaseTileStore):
                     # eq. something that fails to parse to an integer
                     pass
             if integer_list:
-                highest_number = sorted(number_candidate_list)[-1]
+                highest_number = sorted(integer_list)[-1]
                 new_highest_number = highest_number + 1
 
         store_name = "store.sqlite.%d" % new_highest_number
-        return store_name, self._create_new_store(os.path.join(self.store_path, store_name))
+        store_path = os.path.join(self.store_path, store_name)
+        connection = self._create_new_store(store_path)
+        self._store_sizes[store_name] = os.path.getsize(store_path)
+        self._storage_databases[store_name] = connection
+        return store_name, connection
 
     def _create_new_store(self, path):
         """Create a new store database at the given file path
@@ -259,7 +445,9 @@ class SqliteTileStore(BaseTileStore):
         :returns: list of found storage database paths
         :rtype: list of strings
         """
-        return glob.glob(os.path.join(self.store_path, "%s*" % STORE_DB_NAME_PREFIX))
+        # skip the WAL mode -wal and -shm files
+        return [path for path in glob.glob(os.path.join(self.store_path, "%s*" % STORE_DB_NAME_PREFIX))
+                if path.rsplit(STORE_DB_NAME_PREFIX, 1)[1].isdigit()]
 
     def _will_it_fit_in(self, storage_database_name, size_in_bytes):
         """Report if the given amount of data in bytes will still fit into the currently used
@@ -275,76 +463,194 @@ class SqliteTileStore(BaseTileStore):
         :rtype: bool
         """
         maximum_size_in_bytes = MAX_STORAGE_DB_FILE_SIZE * GIBI_BYTE
-        storage_database_path = os.path.join(self.store_path, storage_database_name)
-        store_size_in_bytes = os.path.getsize(storage_database_path)
+        store_size_in_bytes = self._store_sizes.get(storage_database_name, 0)
         if (store_size_in_bytes + size_in_bytes) <= maximum_size_in_bytes:
             return True  # the database will (probably) still smaller than the limit
         else:
             return False  # the database will be larger
 
     def store_tile_data(self, lzxy, tile_data):
+        """Queue the tile for writing to the database
+
+        The tile is written by the writer thread as part of the next batch,
+        use flush() to wait for all queued tiles to be written.
+
+        :param tuple lzxy: layer, z, x, y coordinate tuple describing a single tile
+        :param bytes tile_data: tile data to store
+        """
+        layer, z, x, y = lzxy
+        item = (z, x, y, tile_data, layer.type, int(time.time()))
+        with self._pending_tiles_lock:
+            self._pending_tiles[(z, x, y)] = item
+        # this blocks if too many tiles are already waiting to be written
+        self._write_queue.put(item)
+
+    def _writer_run(self):
+        """Write queued tiles to the database in batches
+
+        A batch is written once it is big enough or once the commit interval elapses.
+        Any flush request or the stop marker also causes the current batch to be written.
+        Tile access times are written with every batch and also once per commit interval
+        when no tiles are being written, so that they are kept up to date for stores
+        that are just being read.
+        """
+        batch = []
+        batch_started = None
+        while True:
+            if batch:
+                timeout = max(0, batch_started + self._commit_interval - time.time())
+            else:
+                # nothing to write, just wait for the next item
+                # & check for tile access times now and then
+                timeout = self._commit_interval
+            try:
+                item = self._write_queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None  # commit interval elapsed
+            if isinstance(item, tuple):
+                batch.append(item)
+                if batch_started is None:
+                    batch_started = time.time()
+                if len(batch) < self._commit_batch_size:
+                    continue
+            if batch:
+                self._write_batch(batch)
+                self._write_access_times()
+                batch = []
+                batch_started = None
+            elif item is None:
+                self._write_access_times()
+            if item is _STOP_WRITER:
+                break
+            elif isinstance(item, _FlushRequest):
+                item.done.set()
+
+    def _write_batch(self, batch):
+        """Write a batch of tiles to the database in a single transaction
+
+        The storage databases are committed before the lookup database,
+        so that if we crash in between the lookup database never points
+        to a tile that has not been stored.
+
+        :param list batch: list of (z, x, y, tile_data, extension, timestamp) tuples
+        """
         with self._db_lock:
-            layer, z, x, y = lzxy
-            extension = layer.type
             lookup_connection = self._lookup_db_connection
             lookup_cursor = lookup_connection.cursor()
-            data_size = len(tile_data)
-            integer_timestamp = int(time.time())
-            tile_exists = lookup_cursor.execute(
-                "select store_filename from tiles where z=? and x=? and y=?",
-                (z, x, y)).fetchone()
-            if tile_exists:  # tile is already in the database, update it
-                # check if the new tile will fit to the storage database where the tile currently is
-                # (we count as we would add the tile to the database, not replace it du to
-                # database file size uncertainties caused by metadata updates, etc.)
-                store_name = tile_exists[0]
-                if self._will_it_fit_in(store_name, data_size):
-                    # update the tile data and its timestamp in place
-                    store_connection = self._storage_databases[store_name]
-                    store_cursor = store_connection.cursor()
-                    # update the storage database
-                    su_query = "insert or replace into tiles (z, x, y, tile, extension, unix_epoch_timestamp) values (?, ?, ?, ?, ?, ?)"
-                    # use "insert or replace" in case that the storage database is missing the tile for some reason
-                    # - this should never happen as long as the database is properly managed, but better be safe than sorry
-                    store_cursor.execute(su_query, [z, x, y, sqlite3.Binary(tile_data), extension, integer_timestamp])
-                    store_connection.commit()
-                    # update the extension and timestamp in the lookup database
-                    lu_query = "update tiles set extension=?, unix_epoch_timestamp=? where z=? and x=? and y=?"
-                    lookup_cursor.execute(lu_query, [extension, integer_timestamp, z, x, y])
-                    lookup_connection.commit()
-                else:
-                    # remove the tile from the current storage database file
-                    old_store_connection = self._storage_databases[store_name]
-                    old_store_cursor = old_store_connection.cursor()
-                    old_store_cursor.execute("delete from tiles where z=? and x=? and y=?", (z, x, y))
-                    old_store_connection.commit()
-                    # find a suitable storage database file
-                    new_store_name, new_store_connection = self._get_name_connection_to_available_store(data_size)
-                    # store the tile to it
-                    store_query = "insert or replace into tiles (z, x, y, tile, extension, unix_epoch_timestamp) values (?, ?, ?, ?, ?, ?)"
-                    # we use "insert or replace" in case there already is an unexpected leftover tile in the store for the coordinates
-                    # - this should never happen as long as the database is properly managed, but better be safe than sorry
-                    store_cursor = new_store_connection.cursor()
-                    store_cursor.execute(store_query, [z, x, y, sqlite3.Binary(tile_data), extension, integer_timestamp])
-                    new_store_connection.commit()
-                    # update the store path, extension and timestamp in the lookup database
-                    lu_query = "update tiles set store_filename=?, extension=?, unix_epoch_timestamp=? where where z=? and x=? and y=?"
-                    lookup_cursor.execute(lu_query, [new_store_name, extension, integer_timestamp, z, x, y])
-                    lookup_connection.commit()
-
-            else:   # tile is not yet in the database, so just store it
-                # get a store that can store this tile
-                store_name, store_connection = self._get_name_connection_to_available_store(data_size)
-                # write in the lookup db
-                lookup_query = "insert into tiles (z, x, y, store_filename, extension, unix_epoch_timestamp) values (?, ?, ?, ?, ?, ?)"
-                lookup_cursor = lookup_connection.cursor()
-                lookup_cursor.execute(lookup_query, [z, x, y, store_name, extension, integer_timestamp])
+            used_store_names = set()
+            store_query = "insert or replace into tiles (z, x, y, tile, extension, unix_epoch_timestamp) values (?, ?, ?, ?, ?, ?)"
+            access_query = "insert or replace into access (z, x, y, unix_epoch_timestamp) values (?, ?, ?, ?)"
+            try:
+                for z, x, y, tile_data, extension, integer_timestamp in batch:
+                    data_size = len(tile_data)
+                    tile_exists = lookup_cursor.execute(
+                        "select store_filename from tiles where z=? and x=? and y=?",
+                        (z, x, y)).fetchone()
+                    if tile_exists:  # tile is already in the database, update it
+                        # check if the new tile will fit to the storage database where the tile currently is
+                        # (we count as we would add the tile to the database, not replace it du to
+                        # database file size uncertainties caused by metadata updates, etc.)
+                        store_name = tile_exists[0]
+                        if store_name in self._storage_databases and self._will_it_fit_in(store_name, data_size):
+                            # update the tile data and its timestamp in place
+                            # - use "insert or replace" in case that the storage database is missing the tile for some reason
+                            #   this should never happen as long as the database is properly managed, but better be safe than sorry
+                            store_cursor = self._storage_databases[store_name].cursor()
+                            store_cursor.execute(store_query, [z, x, y, sqlite3.Binary(tile_data), extension, integer_timestamp])
+                            # update the extension and timestamp in the lookup database
+                            lu_query = "update tiles set extension=?, unix_epoch_timestamp=? where z=? and x=? and y=?"
+                            lookup_cursor.execute(lu_query, [extension, integer_timestamp, z, x, y])
+                        else:
+                            # remove the tile from the current storage database file
+                            old_store_connection = self._storage_databases.get(store_name)
+                            if old_store_connection is not None:
+                                old_store_connection.cursor().execute("delete from tiles where z=? and x=? and y=?", (z, x, y))
+                                used_store_names.add(store_name)
+                            # find a suitable storage database file & store the tile to it
+                            store_name, store_connection = self._get_name_connection_to_available_store(data_size)
+                            store_cursor = store_connection.cursor()
+                            store_cursor.execute(store_query, [z, x, y, sqlite3.Binary(tile_data), extension, integer_timestamp])
+                            # update the store path, extension and timestamp in the lookup database
+                            lu_query = "update tiles set store_filename=?, extension=?, unix_epoch_timestamp=? where z=? and x=? and y=?"
+                            lookup_cursor.execute(lu_query, [store_name, extension, integer_timestamp, z, x, y])
+                    else:   # tile is not yet in the database, so just store it
+                        # get a store that can store this tile
+                        store_name, store_connection = self._get_name_connection_to_available_store(data_size)
+                        # write in the store
+                        store_cursor = store_connection.cursor()
+                        store_cursor.execute(store_query, [z, x, y, sqlite3.Binary(tile_data), extension, integer_timestamp])
+                        # write in the lookup db
+                        lookup_query = "insert into tiles (z, x, y, store_filename, extension, unix_epoch_timestamp) values (?, ?, ?, ?, ?, ?)"
+                        lookup_cursor.execute(lookup_query, [z, x, y, store_name, extension, integer_timestamp])
+                    # a stored tile counts as accessed
+                    lookup_cursor.execute(access_query, [z, x, y, integer_timestamp])
+                    # account for the tile in the in-memory store size
+                    self._store_sizes[store_name] = self._store_sizes.get(store_name, 0) + data_size
+                    used_store_names.add(store_name)
+                # commit the storage databases first and only then the lookup database
+                for store_name in used_store_names:
+                    self._storage_databases[store_name].commit()
                 lookup_connection.commit()
-                # write in the store
-                store_query = "insert into tiles (z, x, y, tile, extension, unix_epoch_timestamp) values (?, ?, ?, ?, ?, ?)"
-                store_cursor = store_connection.cursor()
-                store_cursor.execute(store_query, [z, x, y, sqlite3.Binary(tile_data), extension, integer_timestamp])
-                store_connection.commit()
+            except Exception:
+                log.exception("writing a batch of %d tiles to %s failed", len(batch), self)
+                for store_name in used_store_names:
+                    self._storage_databases[store_name].rollback()
+                lookup_connection.rollback()
+            # re-sync the in-memory store sizes with the real database file sizes
+            # (just a single stat per used store and batch)
+            for store_name in used_store_names:
+                self._store_sizes[store_name] = os.path.getsize(os.path.join(self.store_path, store_name))
+        # the batch is now either stored or lost, so drop it from the pending tiles
+        # (unless the tile has been queued again in the meantime)
+        with self._pending_tiles_lock:
+            for item in batch:
+                key = item[0:3]
+                if self._pending_tiles.get(key) is item:
+                    del self._pending_tiles[key]
+
+    def _record_access(self, zxy_iterable):
+        """Remember that the given tiles have been accessed
+
+        The access times are only written to the database in batches
+        by _write_access_times(), which the writer thread calls at least
+        once per commit interval.
+        """
+        timestamp = int(time.time())
+        with self._access_times_lock:
+            for zxy in zxy_iterable:
+                self._access_times[zxy] = timestamp
+
+    def _write_access_times(self):
+        """Write the recorded tile access times to the lookup database"""
+        with self._access_times_lock:
+            if not self._access_times:
+                return
+            access_times = self._access_times
+            self._access_times = {}
+        with self._db_lock:
+            lookup_connection = self._lookup_db_connection
+            try:
+                lookup_connection.executemany(
+                    "insert or replace into access (z, x, y, unix_epoch_timestamp) values (?, ?, ?, ?)",
+                    ((z, x, y, timestamp) for (z, x, y), timestamp in access_times.items()))
+                lookup_connection.commit()
+            except Exception:
+                log.exception("writing tile access times to %s failed", self)
+                lookup_connection.rollback()
+
+    def _get_pending_tile(self, z, x, y):
+        """Return a tile that is queued for writing or None"""
+        with self._pending_tiles_lock:
+            return self._pending_tiles.get((z, x, y))
+
+    def _get_read_pool(self, db_name):
+        """Return read connection pool for the given database file name"""
+        with self._read_pools_lock:
+            pool = self._read_pools.get(db_name)
+            if pool is None:
+                pool = _ReadConnectionPool(os.path.join(self.store_path, db_name))
+                self._read_pools[db_name] = pool
+            return pool
 
     def get_tile(self, lzxy):
         """Get tile data and timestamp corresponding to the given coordinate tuple from the database.
@@ -356,35 +662,143 @@ class SqliteTileStore(BaseTileStore):
         :rtype: a (bytes, int) tuple or None
         """
         _layer, z, x, y = lzxy
-        with self._db_lock:
-            lookup_connection = self._lookup_db_connection
-            lookup_cursor = lookup_connection.cursor()
-            lookup_result = lookup_cursor.execute(
+        pending_tile = self._get_pending_tile(z, x, y)
+        if pending_tile is not None:
+            # the tile is still waiting to be written to the database
+            return pending_tile[3], pending_tile[5]
+        with self._get_read_pool(LOOKUP_DB_NAME).connection() as lookup_connection:
+            lookup_result = lookup_connection.execute(
                 "select store_filename, unix_epoch_timestamp from tiles where z=? and x=? and y=?",
                 (z, x, y)).fetchone()
-            if lookup_result:  # the tile was found in the lookup db
-                # now search for in the specified store
-                store_name = lookup_result[0]
-                store_connection = self._storage_databases.get(store_name)
-                if store_connection is None:
-                    log.warning("store %s/%s is mentioned in lookup db for %s/%s/%s but does not exist",
-                                self.store_path, store_name, z, x, y)
-                    return None
-                store_cursor = store_connection.cursor()
-                # as the x,y & z are used as the primary key, all rows need to have a unique
-                # x, y & z combination and thus there can be only one result for a select
-                # over x, y & z
-                result = store_cursor.execute(
+        if lookup_result:  # the tile was found in the lookup db
+            # now search for in the specified store
+            store_name = lookup_result[0]
+            if store_name not in self._storage_databases:
+                log.warning("store %s/%s is mentioned in lookup db for %s/%s/%s but does not exist",
+                            self.store_path, store_name, z, x, y)
+                return None
+            # as the x,y & z are used as the primary key, all rows need to have a unique
+            # x, y & z combination and thus there can be only one result for a select
+            # over x, y & z
+            # - the storage databases are always committed before the lookup database,
+            #   so the tile can't be missing from the store once we have found it in the lookup db
+            with self._get_read_pool(store_name).connection() as store_connection:
+                result = store_connection.execute(
                     "select tile, unix_epoch_timestamp from tiles where z=? and x=? and y=?",
                     (z, x, y)).fetchone()
-                if result:
-                    if not utils.is_an_image(result[0]):
-                        log.warning("%s,%s,%s in %s/%s is probably not an image", x, y, z, self.store_path, store_name)
-                    return result
-                else:
-                    log.warning("%s,%s,%s is mentioned in lookup db but missing from store %s/%s", x, y, z, self.store_path, store_name)
-            else:  # the tile was not found in the lookup database
-                return None
+            if result:
+                if not utils.is_an_image(result[0]):
+                    log.warning("%s,%s,%s in %s/%s is probably not an image", x, y, z, self.store_path, store_name)
+                self._record_access([(z, x, y)])
+                return result
+            else:
+                log.warning("%s,%s,%s is mentioned in lookup db but missing from store %s/%s", x, y, z, self.store_path, store_name)
+        else:  # the tile was not found in the lookup database
+            return None
+
+    def get_tiles(self, lzxy_iterable):
+        """Get data and timestamps for many tiles at once
+
+        This takes just a single lookup query per zoom level and a single
+        query per zoom level and storage database.
+
+        :param lzxy_iterable: iterable of lzxy tuples
+        :returns: dictionary of (tile data, timestamp) tuples for the tiles found in the store,
+                  keyed by the corresponding lzxy tuple
+        :rtype: dict
+        """
+        tiles = {}
+        zooms = self._pop_pending_tiles(_group_by_zoom(lzxy_iterable), tiles, with_data=True)
+        for lzxy, tile_data, timestamp in self._query_storage_databases(zooms, "tile, unix_epoch_timestamp"):
+            tiles[lzxy] = (tile_data, timestamp)
+        self._record_access((lzxy[1], lzxy[2], lzxy[3]) for lzxy in tiles)
+        return tiles
+
+    def get_tile_sizes(self, lzxy_iterable):
+        """Get data sizes for many tiles at once
+
+        Just like get_tiles() this takes a single query per zoom level
+        and database, but the tile data is not loaded.
+
+        :param lzxy_iterable: iterable of lzxy tuples
+        :returns: dictionary of tile data sizes in bytes for the tiles found in the store,
+                  keyed by the corresponding lzxy tuple
+        :rtype: dict
+        """
+        pending_tiles = {}
+        zooms = self._pop_pending_tiles(_group_by_zoom(lzxy_iterable), pending_tiles, with_data=True)
+        sizes = dict((lzxy, len(tile_data)) for lzxy, (tile_data, _timestamp) in pending_tiles.items())
+        for lzxy, size in self._query_storage_databases(zooms, "length(tile)"):
+            sizes[lzxy] = size
+        return sizes
+
+    def _query_storage_databases(self, zooms, columns):
+        """Query the storage databases for many tiles
+
+        :param dict zooms: requested tiles grouped by _group_by_zoom()
+        :param str columns: columns of the tiles table to return
+        :returns: generator of (lzxy, <columns>) tuples for the tiles found
+        """
+        # find out in which storage databases the tiles are
+        store_requests = {}
+        with self._get_read_pool(LOOKUP_DB_NAME).connection() as lookup_connection:
+            for z, xy_dict in zooms.items():
+                for x, y, store_name in _query_zoom_level(lookup_connection, "store_filename", z, xy_dict):
+                    store_zooms = store_requests.setdefault(store_name, {})
+                    store_zooms.setdefault(z, {})[(x, y)] = xy_dict[(x, y)]
+        # fetch the tiles from the storage databases
+        for store_name, store_zooms in store_requests.items():
+            if store_name not in self._storage_databases:
+                log.warning("store %s/%s is mentioned in lookup db but does not exist",
+                            self.store_path, store_name)
+                continue
+            with self._get_read_pool(store_name).connection() as store_connection:
+                for z, xy_dict in store_zooms.items():
+                    for row in _query_zoom_level(store_connection, columns, z, xy_dict):
+                        yield (xy_dict[(row[0], row[1])],) + tuple(row[2:])
+
+    def tiles_stored(self, lzxy_iterable):
+        """Report which of the given tiles are stored
+
+        Just like tile_is_stored() this only checks the lookup database,
+        using a single query per zoom level.
+
+        :param lzxy_iterable: iterable of lzxy tuples
+        :returns: dictionary of timestamps for the tiles found in the store,
+                  keyed by the corresponding lzxy tuple
+        :rtype: dict
+        """
+        stored = {}
+        zooms = self._pop_pending_tiles(_group_by_zoom(lzxy_iterable), stored, with_data=False)
+        with self._get_read_pool(LOOKUP_DB_NAME).connection() as lookup_connection:
+            for z, xy_dict in zooms.items():
+                for x, y, timestamp in _query_zoom_level(lookup_connection, "unix_epoch_timestamp", z, xy_dict):
+                    stored[xy_dict[(x, y)]] = timestamp
+        return stored
+
+    def _pop_pending_tiles(self, zooms, results, with_data):
+        """Move tiles waiting in the write queue from zooms to results
+
+        :param dict zooms: requested tiles grouped by _group_by_zoom()
+        :param dict results: results dictionary keyed by lzxy
+        :param bool with_data: add (tile data, timestamp) tuples to results if True,
+                               just timestamps if False
+        :returns: zoom levels that still have some tiles left to look for
+        :rtype: dict
+        """
+        with self._pending_tiles_lock:
+            if not self._pending_tiles:
+                return zooms
+            for z, xy_dict in zooms.items():
+                for xy in list(xy_dict.keys()):
+                    pending_tile = self._pending_tiles.get((z, xy[0], xy[1]))
+                    if pending_tile is not None:
+                        lzxy = xy_dict.pop(xy)
+                        if with_data:
+                            results[lzxy] = (pending_tile[3], pending_tile[5])
+                        else:
+                            results[lzxy] = pending_tile[5]
+        return dict((z, xy_dict) for z, xy_dict in zooms.items() if xy_dict)
 
     def delete_tile(self, lzxy):
         """Try to delete tile corresponding to the lzxy coordinate tuple from the database
@@ -392,19 +806,23 @@ class SqliteTileStore(BaseTileStore):
         :param tuple lzxy: layer, z, x, y coordinate tuple describing a single tile
                            (layer is actually not used and can be None)
         """
+        # make sure the tile is not waiting in the write queue
+        self.flush()
         with self._db_lock:
             _layer, z, x, y = lzxy
             lookup_connection = self._lookup_db_connection
             lookup_cursor = lookup_connection.cursor()
-            store_name = lookup_cursor.execute(
+            lookup_result = lookup_cursor.execute(
                 "select store_filename from tiles where z=? and x=? and y=?", (z, x, y)
-            ).fetchone()[0]
-            if store_name:
+            ).fetchone()
+            store_name = lookup_result and lookup_result[0]
+            if store_name in self._storage_databases:
                 store_connection = self._storage_databases[store_name]
                 store_cursor = store_connection.cursor()
                 store_cursor.execute("delete from tiles where z=? and x=? and y=?", (z, x, y))
                 store_connection.commit()
             lookup_cursor.execute("delete from tiles where z=? and x=? and y=?", (z, x, y))
+            lookup_cursor.execute("delete from access where z=? and x=? and y=?", (z, x, y))
             lookup_connection.commit()
 
     def tile_is_stored(self, lzxy):
@@ -420,17 +838,140 @@ class SqliteTileStore(BaseTileStore):
         :rtype: bool
         """
         _layer, z, x, y = lzxy
-        lookup_connection = self._lookup_db_connection
-        lookup_cursor = lookup_connection.cursor()
+        pending_tile = self._get_pending_tile(z, x, y)
+        if pending_tile is not None:
+            return True, pending_tile[5]  # the tile is waiting to be written
         query = "select store_filename, unix_epoch_timestamp from tiles where z=? and x=? and y=?"
-        lookupResult = lookup_cursor.execute(query, (z, x, y)).fetchone()
+        with self._get_read_pool(LOOKUP_DB_NAME).connection() as lookup_connection:
+            lookupResult = lookup_connection.execute(query, (z, x, y)).fetchone()
         if lookupResult:
             return True, lookupResult[1]  # the tile is in the database
         else:
             return False # the tile is not in the database
 
+    def iter_tiles(self):
+        """Iterate over all tiles in the store, one storage database after another
+
+        :returns: generator of (z, x, y, tile data, timestamp) tuples
+        """
+        self.flush()
+        for store_name in sorted(self._storage_databases.keys()):
+            with self._get_read_pool(store_name).connection() as store_connection:
+                cursor = store_connection.execute("select z, x, y, tile, unix_epoch_timestamp from tiles")
+                for row in cursor:
+                    yield row
+
+    def get_size(self):
+        """Return the size of the tiles in the databases of the store in bytes
+
+        Free pages are not counted - they are either returned to the file system
+        by compact() or reused for new tiles.
+
+        :returns: store size in bytes
+        :rtype: int
+        """
+        size = 0
+        for db_name in [LOOKUP_DB_NAME] + list(self._storage_databases.keys()):
+            with self._get_read_pool(db_name).connection() as connection:
+                page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+                page_count = connection.execute("PRAGMA page_count").fetchone()[0]
+                free_count = connection.execute("PRAGMA freelist_count").fetchone()[0]
+            size += (page_count - free_count) * page_size
+        return size
+
+    def evict(self, max_size):
+        """Remove least recently used tiles until the store is not larger than max_size
+
+        The number of tiles to remove is estimated from the average tile size,
+        so usually all of them are removed at once and the databases are compacted
+        just once, as deleting tiles does not by itself make the database files
+        any smaller.
+
+        :param int max_size: maximum store size in bytes
+        :returns: number of removed tiles
+        :rtype: int
+        """
+        self.flush()
+        self._write_access_times()
+        removed_count = 0
+        # the oldest access times are taken from the access_time index
+        lru_query = "select a.z, a.x, a.y, t.store_filename from access a left join tiles t " \
+                    "on t.z=a.z and t.x=a.x and t.y=a.y " \
+                    "order by a.unix_epoch_timestamp limit ?"
+        for _round in range(MAX_EVICTION_ROUNDS):
+            size = self.get_size()
+            if size <= max_size:
+                break
+            with self._db_lock:
+                lookup_connection = self._lookup_db_connection
+                tile_count = lookup_connection.execute("select count(*) from access").fetchone()[0]
+                if not tile_count:
+                    break
+                excess_count = int(math.ceil(tile_count * (size - max_size) / float(size)))
+                rows = lookup_connection.execute(lru_query, (excess_count,)).fetchall()
+                tiles_by_store = {}
+                for z, x, y, store_name in rows:
+                    tiles_by_store.setdefault(store_name, []).append((z, x, y))
+                # delete from the storage databases first, so that the lookup database
+                # never points to a missing tile
+                for store_name, zxy_list in tiles_by_store.items():
+                    store_connection = self._storage_databases.get(store_name)
+                    if store_connection is not None:
+                        store_connection.executemany("delete from tiles where z=? and x=? and y=?", zxy_list)
+                        store_connection.commit()
+                zxy_list = [row[0:3] for row in rows]
+                lookup_connection.executemany("delete from tiles where z=? and x=? and y=?", zxy_list)
+                lookup_connection.executemany("delete from access where z=? and x=? and y=?", zxy_list)
+                lookup_connection.commit()
+                removed_count += len(rows)
+            self.compact()
+        if removed_count:
+            log.info("%d least recently used tiles evicted from %s", removed_count, self)
+        return removed_count
+
+    def compact(self):
+        """Return free pages in the databases back to the file system
+
+        Databases created before incremental vacuum support was added are skipped,
+        as converting them takes a full VACUUM, which would block all writes for minutes
+        for big stores. Their free pages are reused for new tiles instead.
+        """
+        db_names = [LOOKUP_DB_NAME] + list(self._storage_databases.keys())
+        with self._db_lock:
+            for db_name in db_names:
+                if db_name == LOOKUP_DB_NAME:
+                    connection = self._lookup_db_connection
+                else:
+                    connection = self._storage_databases[db_name]
+                try:
+                    if connection.execute("PRAGMA auto_vacuum").fetchone()[0] == INCREMENTAL_AUTO_VACUUM:
+                        # the pragma frees just a single page per step when run
+                        # with execute(), executescript() runs it to completion
+                        connection.executescript("PRAGMA incremental_vacuum;")
+                    # the database file is only truncated once the WAL is checkpointed
+                    connection.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+                except Exception:
+                    log.exception("compacting %s/%s failed", self.store_path, db_name)
+                if db_name != LOOKUP_DB_NAME:
+                    self._store_sizes[db_name] = os.path.getsize(os.path.join(self.store_path, db_name))
+
+    def flush(self):
+        """Wait for all tiles queued so far to be written to the database"""
+        if self._writer_thread.is_alive():
+            request = _FlushRequest()
+            self._write_queue.put(request)
+            request.done.wait()
+
     def close(self):
-        """Close all database connections"""
+        """Write all queued tiles and close all database connections"""
+        if self._writer_thread.is_alive():
+            self._write_queue.put(_STOP_WRITER)
+            self._writer_thread.join()
+        self._write_access_times()
+        with self._read_pools_lock:
+            for pool in self._read_pools.values():
+                pool.close()
+            self._read_pools = {}
         with self._db_lock:
             self._lookup_db_connection.close()
             for connection in self._storage_databases.values():
@@ -438,17 +979,21 @@ class SqliteTileStore(BaseTileStore):
 
     def clear(self):
         """Delete all database files belonging to this SQLite store"""
+        # make sure the connections are closed before we remove
+        # the data bases under them
+        self.close()
         with self._db_lock:
-            # make sure the connections are closed before we remove
-            # the data bases under them
-            self.close()
             with self._storage_db_management_lock:
                 # delete the lookup database
-                os.remove(self._lookup_db_path)
+                _remove_db_files(self._lookup_db_path)
                 self._lookup_db_path = None
                 self._lookup_db_connection = None
                 # delete the storage databases
                 for db_name in self._storage_databases.keys():
-                    os.remove(os.path.join(self.store_path, db_name))
+                    _remove_db_files(os.path.join(self.store_path, db_name))
                 self._storage_databases = {}
-                # TODO: the database should be able to handle writes after clear
+                self._store_sizes = {}
+        with self._access_times_lock:
+            self._access_times = {}
+        # create empty databases so that the store can be used again
+        self._open()
@@ -0,0 +1,446 @@
+# -*- coding: utf-8 -*-
+"""Persistent cache of tracklog summaries
+
+Parsing a big GPX file just to list it or to show it on an overview map
+is slow, so a summary of each loaded tracklog is stored in a small sqlite
+database: point count, bounding box, length, elevation statistics,
+cluster summaries, the periodic elevation profile and a simplified
+preview geometry.
+
+Summaries are keyed by the tracklog path and only valid as long as the
+modification time and size of the file match the ones it had when the summary
+was stored, so changed files are never summarized from stale data.
+
+The database has a schema version, a database with a different version
+(or a corrupted one) is just discarded, it is only a cache after all.
+Summaries from the old pickled tracklog cache can be imported once,
+the pickle is unpickled with only the old cache classes allowed.
+"""
+from __future__ import with_statement
+import os
+import sys
+import time
+import pickle
+import sqlite3
+import threading
+from array import array
+
+try:
+    import copyreg  # Python 3
+except ImportError:
+    import copy_reg as copyreg  # Python 2
+
+from core import geo
+from core.tilenames import ll2relativeXY
+from core.polyline_lod import simplify, DEFAULT_TOLERANCE, TILE_SIZE
+from core.gpx_reader import TrackStats
+
+import logging
+log = logging.getLogger("core.tracklog_cache")
+
+TRACKLOG_CACHE_VERSION = 1
+
+# cluster points to clusters about 5 kilometers in diameter
+CLUSTER_DISTANCE = 5
+
+# the preview geometry is detailed enough to be drawn
+# at this & lower zoom levels
+PREVIEW_ZOOM = 12
+# maximum distance of a dropped point from the preview geometry
+PREVIEW_TOLERANCE = DEFAULT_TOLERANCE  # in tile pixels at PREVIEW_ZOOM
+
+NaN = float("nan")
+
+if sys.version_info[0] > 2:
+    PYTHON3 = True
+
+    def _toBlob(data):
+        return data.tobytes()
+
+    def _arrayFromBlob(typecode, blob):
+        a = array(typecode)
+        a.frombytes(bytes(blob))
+        return a
+else:
+    PYTHON3 = False
+
+    def _toBlob(data):
+        return buffer(data.tostring())
+
+    def _arrayFromBlob(typecode, blob):
+        a = array(typecode)
+        a.fromstring(str(blob))
+        return a
+
+
+def _tuplesToBlob(items, width):
+    """Store a list of float tuples of the same width, None is stored as NaN"""
+    if items is None:
+        return None
+    values = array("d")
+    for item in items:
+        for value in item[:width]:
+            values.append(NaN if value is None else value)
+    return _toBlob(values)
+
+
+def _tuplesFromBlob(blob, width):
+    if blob is None:
+        return None
+    values = [None if value != value else value for value in _arrayFromBlob("d", blob)]
+    return [tuple(values[index:index + width]) for index in range(0, len(values), width)]
+
+
+def preview_points(lats, lons, zoom=PREVIEW_ZOOM, tolerance=PREVIEW_TOLERANCE):
+    """Simplify a track to a preview geometry
+
+    :param lats: point latitudes
+    :param lons: point longitudes
+    :param int zoom: zoom level the preview should be detailed enough for
+    :param float tolerance: maximum distance of a dropped point at the zoom level,
+                            in tile pixels
+    :returns: list of (lat, lon) tuples
+    :rtype: list
+    """
+    xs = []
+    ys = []
+    for lat, lon in zip(lats, lons):
+        x, y = ll2relativeXY(lat, lon)
+        xs.append(x)
+        ys.append(y)
+    kept = simplify(xs, ys, tolerance / float(TILE_SIZE * 2 ** zoom))
+    return [(lats[index], lons[index]) for index in kept]
+
+
+class TracklogSummary(object):
+    """Summary of a tracklog, so that it can be listed & previewed without parsing it
+
+    Summaries imported from the old tracklog cache only have the clusters,
+    route info & elevation profile, the rest is None.
+    """
+
+    def __init__(self, point_count=None, bounds=None, length=None, route_info=None,
+                 clusters=None, elevation_profile=None, preview=None):
+        """
+        :param int point_count: number of points
+        :param tuple bounds: (min lat, min lon, max lat, max lon) tuple or None if there are no points
+        :param float length: track length in meters
+        :param dict route_info: elevation statistics in the tracklog route info format
+                                or None if no point has elevation
+        :param list clusters: (centre lat, centre lon, radius in km) tuples
+        :param list elevation_profile: per_elev_list() style (distance, elevation, lat, lon) tuples
+        :param list preview: simplified track as (lat, lon) tuples
+        """
+        self.point_count = point_count
+        self.bounds = bounds
+        self.length = length
+        self.route_info = route_info
+        self.clusters = clusters
+        self.elevation_profile = elevation_profile
+        self.preview = preview
+
+    @classmethod
+    def from_points(cls, points, stats, clusters=None, elevation_profile=None):
+        """Summarize a loaded tracklog
+
+        :param points: points of the tracklog
+        :type points: core.point_array.PointArray
+        :param stats: statistics of the points
+        :type stats: core.gpx_reader.TrackStats
+        """
+        return cls(point_count=len(points), bounds=stats.bounds, length=stats.length,
+                   route_info=stats.route_info, clusters=clusters, elevation_profile=elevation_profile,
+                   preview=preview_points(points.lats, points.lons))
+
+    @property
+    def complete(self):
+        """True if all the summary data is available"""
+        return self.point_count is not None and self.length is not None and self.preview is not None
+
+    def __eq__(self, other):
+        return isinstance(other, TracklogSummary) and self.__dict__ == other.__dict__
+
+    def __ne__(self, other):
+        return not self == other
+
+
+def summarize_track(track, cluster_distance=CLUSTER_DISTANCE):
+    """Summarize the first segment of a track
+
+    :param track: track read from a GPX file, clusters are reused if already computed
+    :type track: core.gpx_reader.GPXTrack
+    :param cluster_distance: diameter of the clusters in kilometers
+    :rtype: TracklogSummary
+    """
+    points = track.points
+    if track.stats:
+        stats = track.stats[0]
+    else:
+        stats = TrackStats()
+    clusters = track.clusters
+    if clusters is None:
+        clusters = geo.cluster_lls(zip(points.lats, points.lons), cluster_distance)
+    # for each cluster find a circle encompassing all its points
+    circles = [geo.circle_around_point_cluster(cluster) for cluster in clusters]
+    elevation_profile = None
+    if stats.elevation_count:
+        elevation_profile = geo.per_elev_list_lle(points.lle_list())
+    return TracklogSummary.from_points(points, stats, circles, elevation_profile)
+
+
+class _LegacyItem(object):
+    """Stand-in for the classes stored in the old pickled tracklog cache"""
+    pass
+
+
+class _LegacyCacheUnpickler(pickle.Unpickler):
+    """Unpickler only allowing the old tracklog cache classes"""
+
+    ALLOWED_CLASSES = ("CacheItem", "ClusterOfPoints")
+    # needed to unpickle instances of new style classes
+    ALLOWED_GLOBALS = {
+        ("copy_reg", "_reconstructor"): copyreg._reconstructor,
+        ("copyreg", "_reconstructor"): copyreg._reconstructor,
+        ("__builtin__", "object"): object,
+        ("builtins", "object"): object,
+    }
+
+    def find_class(self, module, name):
+        if name in self.ALLOWED_CLASSES:
+            return _LegacyItem
+        elif (module, name) in self.ALLOWED_GLOBALS:
+            return self.ALLOWED_GLOBALS[(module, name)]
+        raise pickle.UnpicklingError("%s.%s not allowed in the tracklog cache" % (module, name))
+
+
+def _file_key(path):
+    """Return (mtime, size) of a file or None if it doesn't exist"""
+    try:
+        status = os.stat(path)
+    except OSError:
+        return None
+    return status.st_mtime, status.st_size
+
+
+class TracklogCache(object):
+    """Tracklog summaries stored in a sqlite database
+
+    NOTE: the cache is thread safe
+    """
+
+    def __init__(self, path):
+        """
+        :param str path: path to the cache database file
+        """
+        self._path = path
+        self._lock = threading.RLock()
+        self._connection = None
+
+    @property
+    def path(self):
+        return self._path
+
+    def _connect(self):
+        if self._connection is None:
+            folder = os.path.dirname(self._path)
+            if folder and not os.path.isdir(folder):
+                os.makedirs(folder)
+            try:
+                self._connection = self._open()
+            except sqlite3.DatabaseError:
+                log.exception("tracklog cache %s is not usable, recreating it", self._path)
+                if os.path.exists(self._path):
+                    os.remove(self._path)
+                self._connection = self._open()
+        return self._connection
+
+    def _open(self):
+        # tracklogs can be loaded from other threads than the one that opened the cache
+        connection = sqlite3.connect(self._path, check_same_thread=False)
+        try:
+            with connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS version (v integer)")
+                row = connection.execute("SELECT v FROM version").fetchone()
+                if row is None or row[0] != TRACKLOG_CACHE_VERSION:
+                    if row is not None:
+                        log.info("tracklog cache version %s != %d, discarding it", row[0], TRACKLOG_CACHE_VERSION)
+                    connection.execute("DROP TABLE IF EXISTS tracklog")
+                    connection.execute("DELETE FROM version")
+                    connection.execute("INSERT INTO version VALUES (?)", (TRACKLOG_CACHE_VERSION,))
+                connection.execute("""CREATE TABLE IF NOT EXISTS tracklog (
+                    path TEXT PRIMARY KEY,
+                    mtime REAL,
+                    size INTEGER,
+                    point_count INTEGER,
+                    min_lat REAL,
+                    min_lon REAL,
+                    max_lat REAL,
+                    max_lon REAL,
+                    length REAL,
+                    min_elevation REAL,
+                    max_elevation REAL,
+                    first_elevation REAL,
+                    last_elevation REAL,
+                    clusters BLOB,
+                    elevation_profile BLOB,
+                    preview BLOB,
+                    updated REAL)""")
+        except sqlite3.DatabaseError:
+            connection.close()
+            raise
+        return connection
+
+    def get(self, tracklog_path):
+        """Get summary of a tracklog
+
+        Summaries of files that have been changed or removed since
+        they were stored are dropped.
+
+        :param str tracklog_path: path to the tracklog file
+        :returns: the summary or None if there is no valid summary for the file
+        :rtype: TracklogSummary or None
+        """
+        key = _file_key(tracklog_path)
+        with self._lock:
+            try:
+                connection = self._connect()
+                row = connection.execute("""SELECT mtime, size, point_count, min_lat, min_lon, max_lat, max_lon,
+                    length, min_elevation, max_elevation, first_elevation, last_elevation,
+                    clusters, elevation_profile, preview FROM tracklog WHERE path=?""", (tracklog_path,)).fetchone()
+                if row is None:
+                    return None
+                if key is None or (row[0], row[1]) != key:
+                    log.debug("tracklog %s changed, dropping its summary", tracklog_path)
+                    with connection:
+                        connection.execute("DELETE FROM tracklog WHERE path=?", (tracklog_path,))
+                    return None
+            except sqlite3.DatabaseError:
+                log.exception("getting tracklog summary from cache failed")
+                return None
+        (_mtime, _size, point_count, min_lat, min_lon, max_lat, max_lon, length,
+         min_elevation, max_elevation, first_elevation, last_elevation,
+         clusters, elevation_profile, preview) = row
+        bounds = None
+        if min_lat is not None:
+            bounds = (min_lat, min_lon, max_lat, max_lon)
+        route_info = None
+        if min_elevation is not None:
+            route_info = {
+                'maxElevation': max_elevation,
+                'minElevation': min_elevation,
+                'middle': min_elevation + (max_elevation - min_elevation) / 2,
+                'firstElevation': first_elevation,
+                'lastElevation': last_elevation,
+            }
+        return TracklogSummary(point_count=point_count, bounds=bounds, length=length, route_info=route_info,
+                               clusters=_tuplesFromBlob(clusters, 3),
+                               elevation_profile=_tuplesFromBlob(elevation_profile, 4),
+                               preview=_tuplesFromBlob(preview, 2))
+
+    def put(self, tracklog_path, summary):
+        """Store summary of a tracklog, replacing any previous one
+
+        :param str tracklog_path: path to the tracklog file
+        :param TracklogSummary summary: summary of the current file content
+        :returns: True if the summary has been stored
+        :rtype: bool
+        """
+        key = _file_key(tracklog_path)
+        if key is None:
+            log.warning("can't cache summary of nonexistent tracklog %s", tracklog_path)
+            return False
+        bounds = summary.bounds or (None, None, None, None)
+        route_info = summary.route_info or {}
+        values = (tracklog_path, key[0], key[1], summary.point_count) + tuple(bounds) + (
+            summary.length,
+            route_info.get('minElevation'), route_info.get('maxElevation'),
+            route_info.get('firstElevation'), route_info.get('lastElevation'),
+            _tuplesToBlob(summary.clusters, 3),
+            _tuplesToBlob(summary.elevation_profile, 4),
+            _tuplesToBlob(summary.preview, 2),
+            time.time())
+        with self._lock:
+            try:
+                connection = self._connect()
+                with connection:
+                    connection.execute("INSERT OR REPLACE INTO tracklog VALUES "
+                                       "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", values)
+            except sqlite3.DatabaseError:
+                log.exception("storing tracklog summary to cache failed")
+                return False
+        return True
+
+    def delete(self, tracklog_path):
+        """Drop summary of a tracklog"""
+        with self._lock:
+            try:
+                connection = self._connect()
+                with connection:
+                    connection.execute("DELETE FROM tracklog WHERE path=?", (tracklog_path,))
+            except sqlite3.DatabaseError:
+                log.exception("removing tracklog summary from cache failed")
+
+    def prune(self, tracklog_paths):
+        """Drop summaries of all tracklogs not in the given list
+
+        :param tracklog_paths: paths of tracklogs that still exist
+        :returns: number of dropped summaries
+        :rtype: int
+        """
+        existing = set(tracklog_paths)
+        with self._lock:
+            try:
+                connection = self._connect()
+                garbage = [(row[0],) for row in connection.execute("SELECT path FROM tracklog")
+                           if row[0] not in existing]
+                if garbage:
+                    with connection:
+                        connection.executemany("DELETE FROM tracklog WHERE path=?", garbage)
+            except sqlite3.DatabaseError:
+                log.exception("pruning tracklog cache failed")
+                return 0
+        return len(garbage)
+
+    def migrate_pickle(self, pickle_path):
+        """Import summaries from the old pickled tracklog cache & remove it
+
+        The old cache has no modification times, so the summaries
+        are assumed to match the current content of existing files.
+
+        :param str pickle_path: path to the old cache file
+        :returns: number of imported summaries
+        :rtype: int
+        """
+        if not os.path.exists(pickle_path):
+            return 0
+        count = 0
+        try:
+            with open(pickle_path, "rb") as f:
+                if PYTHON3:
+                    # the old cache could have only been written by Python 2
+                    unpickler = _LegacyCacheUnpickler(f, encoding="latin1")
+                else:
+                    unpickler = _LegacyCacheUnpickler(f)
+                items = unpickler.load()
+            for tracklog_path, item in items.items():
+                if not os.path.isfile(tracklog_path):
+                    continue
+                clusters = [(cluster.centreX, cluster.centreY, cluster.radius) for cluster in item.clusters]
+                summary = TracklogSummary(route_info=item.routeInfo, clusters=clusters,
+                                          elevation_profile=item.perElevList)
+                if self.put(tracklog_path, summary):
+                    count += 1
+        except Exception:
+            log.exception("importing the old tracklog cache from %s failed", pickle_path)
+        log.info("imported %d tracklog summaries from %s", count, pickle_path)
+        try:
+            os.remove(pickle_path)
+        except OSError:
+            log.exception("can't remove the old tracklog cache %s", pickle_path)
+        return count
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
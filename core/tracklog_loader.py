@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""Background tracklog loading in a pool of worker processes
+
+Parsing GPX files & summarizing the tracks is pure Python work, so when
+dozens of tracklogs are loaded at once the GUI stalls - even loading them
+in a thread would not help much, as the thread would hold the GIL most
+of the time. The loader instead parses the files in a pool of worker
+processes, which also makes use of all the CPU cores. Point arrays
+are pickled as raw columns, so passing the loaded tracks back is cheap.
+
+Loading is driven by a ModRanaThread, which feeds the paths to the pool,
+reports progress and hands the loaded tracks to a callback. Only a few
+paths are queued in the pool at a time, so loading can be cancelled -
+paths not yet sent to the pool are then dropped, as are results
+of files that are being parsed at the moment. A path that is already
+being loaded is not loaded again.
+
+Worker processes are only running while some tracklogs are being loaded.
+They are started with the forkserver or spawn start method where available,
+as forking a process that runs GUI toolkit threads is not safe. If they can't
+be started on the platform, tracklogs are loaded directly in the loading thread.
+"""
+from __future__ import with_statement
+import sys
+import threading
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+try:  # Python 2
+    import Queue as queue
+except ImportError:  # Python 3
+    import queue
+
+from core import threads
+from core.gpx_reader import read_gpx
+from core.tracklog_cache import summarize_track, CLUSTER_DISTANCE
+
+import logging
+log = logging.getLogger("core.tracklog_loader")
+
+PYTHON3 = sys.version_info[0] > 2
+
+DEFAULT_THREAD_NAME = "tracklogLoader"
+# how many tracklogs are queued in the pool per worker process
+QUEUED_PER_PROCESS = 2
+# how often the loading thread checks if the loader has been closed
+POLL_INTERVAL = 0.5  # in seconds
+# worker process start methods in order of preference,
+# the fork start method is only used if none of these is available
+PREFERRED_START_METHODS = ("forkserver", "spawn")
+
+
+def load_tracklog(path, summarize=True):
+    """Load a GPX tracklog - run in the worker processes
+
+    :param str path: path to the tracklog file
+    :param bool summarize: also summarize the tracklog
+    :returns: (path, track, summary, error) tuple, error is None unless loading failed
+    :rtype: tuple
+    """
+    try:
+        track = read_gpx(path, CLUSTER_DISTANCE if summarize else None)
+        summary = None
+        if summarize:
+            summary = summarize_track(track)
+            # the summary has the cluster circles, no need to pass all the clustered points back
+            track.clusters = None
+        return path, track, summary, None
+    except Exception:
+        # the exception might not be picklable, just report what happened
+        error = sys.exc_info()[1]
+        return path, None, None, "%s: %s" % (type(error).__name__, error)
+
+
+def _get_context():
+    """Get a multiprocessing context for starting the worker processes
+
+    :returns: a context using one of the preferred start methods, the multiprocessing
+              module itself on Pythons without start methods (forking the workers)
+              or None if worker processes can't be started
+    """
+    get_context = getattr(multiprocessing, "get_context", None)
+    if get_context is None:  # Python <3.4
+        return multiprocessing
+    if not sys.executable:
+        # eq. when embedded in the QML GUI there might be no Python
+        # interpreter for starting the worker processes with
+        return None
+    start_methods = multiprocessing.get_all_start_methods()
+    for start_method in PREFERRED_START_METHODS:
+        if start_method in start_methods:
+            return get_context(start_method)
+    return multiprocessing
+
+
+def _cpu_count():
+    try:
+        return multiprocessing.cpu_count()
+    except (AttributeError, NotImplementedError):
+        return 1
+
+
+class TracklogLoader(object):
+    """Loads tracklogs in the background
+
+    NOTE: the loader is thread safe
+    """
+
+    def __init__(self, loaded, processes=None, use_processes=True, name=DEFAULT_THREAD_NAME):
+        """
+        :param loaded: called from a loading thread with (path, track, summary)
+                       for each loaded tracklog, track & summary are None if loading failed
+        :param int processes: number of worker processes, one per CPU core by default
+        :param bool use_processes: load tracklogs in worker processes if possible
+        :param str name: name of the loading threads
+        """
+        self._loaded = loaded
+        if processes is None and multiprocessing is not None:
+            processes = _cpu_count()
+        self._processes = max(processes or 1, 1)
+        self._use_processes = use_processes and multiprocessing is not None
+        self._name = name
+        self._lock = threading.RLock()
+        self._pool = None
+        self._active_batches = 0
+        # paths queued or being loaded
+        self._in_flight = set()
+        self._cancelled = set()
+        self._closed = False
+
+    @property
+    def processes(self):
+        return self._processes
+
+    @property
+    def in_flight(self):
+        """Paths of tracklogs that are queued or being loaded"""
+        with self._lock:
+            return set(self._in_flight)
+
+    def load(self, paths, summarize=None, callback=None):
+        """Start loading tracklogs in the background
+
+        :param paths: paths of the tracklogs to load
+        :param summarize: function telling if a tracklog given by path needs to be summarized,
+                          all tracklogs are summarized by default
+        :param callback: called with the list of loaded paths once done
+        :returns: name of the loading thread or None if all the tracklogs
+                  are already being loaded
+        """
+        with self._lock:
+            if self._closed:
+                log.error("can't load tracklogs, the loader has been closed")
+                return None
+            batch = []
+            for path in paths:
+                if path in self._in_flight:
+                    # requested again after being cancelled
+                    self._cancelled.discard(path)
+                elif path not in batch:
+                    batch.append(path)
+            if not batch:
+                return None
+            self._in_flight.update(batch)
+            self._active_batches += 1
+        thread = threads.ModRanaThread(name=self._name)
+        thread.target = lambda: self._load_batch(thread, batch, summarize)
+        if callback is None:
+            # progress is only reported for threads with a callback
+            callback = self._batch_done
+        thread.callback = callback
+        return threads.threadMgr.add(thread)
+
+    def _batch_done(self, loaded_paths):
+        log.info("%d tracklogs loaded", len(loaded_paths))
+
+    def cancel(self, paths=None):
+        """Cancel loading of tracklogs
+
+        :param paths: paths of tracklogs not to load, all tracklogs if None
+        """
+        with self._lock:
+            if paths is None:
+                self._cancelled.update(self._in_flight)
+            else:
+                self._cancelled.update(self._in_flight.intersection(paths))
+
+    def close(self):
+        """Cancel all loading & stop the worker processes"""
+        with self._lock:
+            self._closed = True
+            self._cancelled.update(self._in_flight)
+            pool = self._pool
+            self._pool = None
+        if pool is not None:
+            pool.terminate()
+
+    def _get_pool(self):
+        """Get the worker process pool, starting it if needed
+
+        :returns: the pool or None if tracklogs should be loaded in the loading thread
+        """
+        with self._lock:
+            if self._pool is None and self._use_processes and not self._closed:
+                context = _get_context()
+                if context is None:
+                    log.info("no Python interpreter for tracklog loading processes, loading tracklogs in a thread")
+                    self._use_processes = False
+                    return None
+                try:
+                    self._pool = context.Pool(self._processes)
+                except Exception:
+                    # eq. no shared memory support on some Android devices
+                    log.exception("can't start tracklog loading processes, loading tracklogs in a thread")
+                    self._use_processes = False
+            return self._pool
+
+    def _release_pool(self):
+        """Stop the worker processes once there is nothing to load"""
+        with self._lock:
+            self._active_batches -= 1
+            if self._active_batches:
+                return
+            pool = self._pool
+            self._pool = None
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    def _finish(self, path):
+        """Mark a path as no longer being loaded
+
+        :returns: True if the path has been cancelled
+        """
+        with self._lock:
+            self._in_flight.discard(path)
+            if path in self._cancelled:
+                self._cancelled.discard(path)
+                return True
+            return False
+
+    def _submit(self, pool, path, summarize, results):
+        if pool is None:
+            results.put(load_tracklog(path, summarize))
+        elif PYTHON3:
+            def failed(error):
+                results.put((path, None, None, "%s: %s" % (type(error).__name__, error)))
+            pool.apply_async(load_tracklog, (path, summarize), callback=results.put, error_callback=failed)
+        else:
+            pool.apply_async(load_tracklog, (path, summarize), callback=results.put)
+
+    def _load_batch(self, thread, batch, summarize):
+        """Load a batch of tracklogs - run in the loading thread"""
+        loaded_paths = []
+        unfinished = set(batch)
+        try:
+            pool = self._get_pool()
+            results = queue.Queue()
+            max_queued = self._processes * QUEUED_PER_PROCESS
+            queued = 0
+            done = 0
+            index = 0
+            thread.status = "loading %d tracklogs" % len(batch)
+            thread.progress = 0.0
+            while index < len(batch) or queued:
+                # keep the workers busy, but don't queue everything at once,
+                # so that loading can be cancelled
+                while index < len(batch) and queued < max_queued:
+                    path = batch[index]
+                    index += 1
+                    with self._lock:
+                        cancelled = path in self._cancelled
+                    if cancelled:
+                        self._finish(path)
+                        unfinished.discard(path)
+                        done += 1
+                        continue
+                    self._submit(pool, path, summarize is None or summarize(path), results)
+                    queued += 1
+                if not queued:
+                    break
+                try:
+                    path, track, summary, error = results.get(timeout=POLL_INTERVAL)
+                except queue.Empty:
+                    if self._closed:
+                        log.info("tracklog loader closed, %d tracklogs not loaded", len(batch) - done)
+                        break
+                    continue
+                queued -= 1
+                done += 1
+                if error is not None:
+                    log.error("loading tracklog %s failed: %s", path, error)
+                unfinished.discard(path)
+                if not self._finish(path):
+                    self._loaded(path, track, summary)
+                    if track is not None:
+                        loaded_paths.append(path)
+                thread.progress = done / float(len(batch))
+                thread.status = "%d of %d tracklogs loaded" % (done, len(batch))
+        finally:
+            # paths not loaded due to the loader being closed
+            for path in unfinished:
+                self._finish(path)
+            self._release_pool()
+        return loaded_paths
@@ -9,6 +9,7 @@ import re
 import shutil
 
 from core import constants
+from core import http_pools
 from core import qrc
 from core.backports.six import b
 from core.backports import six
@@ -167,6 +168,17 @@ def is_the_string_an_image(s):
     :returns: True is string is likely an image, False otherwise
     :rtype: bool
     """
+    return get_image_mime_type(s) is not None
+
+def get_image_mime_type(s):
+    """Get MIME type of an image in a string.
+
+    By reading its magic number.
+
+    :param str s: string to be checked
+    :returns: MIME type of the image or None if the string is likely not an image
+    :rtype: str or None
+    """
 
     if PYTHON3: # in Python 3 we directly get bytes
         h = s
@@ -182,15 +194,17 @@ def is_the_string_an_image(s):
 
     # as most tiles are PNGs, check for PNG first
     if h[:8] == b("\211PNG\r\n\032\n"):
-        return True
+        return "image/png"
     elif h[6:10] in (b('JFIF'), b('Exif')): # JPEG in JFIF or Exif format
-        return True
+        return "image/jpeg"
     elif h[:6] in (b('GIF87a'), b('GIF89a')): # GIF ('87 and '89 variants)
-        return True
-    elif h[:2] in (b('MM'), b('II'), b('BM')): # tiff or BMP
-        return True
+        return "image/gif"
+    elif h[:2] in (b('MM'), b('II')): # tiff
+        return "image/tiff"
+    elif h[:2] == b('BM'): # BMP
+        return "image/bmp"
     else: # probably not an image file
-        return False
+        return None
 
 def create_folder_path(new_path):
     """Create a path for a directory and all needed parent folders.
@@ -302,19 +316,17 @@ def free_space_in_path(path):
         return None
 
 def create_connection_pool(url, max_threads=1):
-    """Create the connection pool -> to facilitate socket reuse
+    """Get a connection pool -> to facilitate socket reuse
+
+    NOTE: the pool is shared with all other users of the same
+          scheme, host and port, see core.http_pools
 
     :param string url: root URL for the threadpool
     :param int max_threads: pool capacity
     :returns: connection pool instance
     """
-    # only import urllib3 once needed
-    if sys.version_info[:2] <= (2, 5):
-        from core.backports import urllib3_python25 as urllib3
-    else:
-        import urllib3
-    return urllib3.connection_from_url(url, timeout=constants.INTERNET_CONNECTIVITY_TIMEOUT,
-                                       maxsize=max_threads, block=False)
+    return http_pools.registry.get(url, size=max_threads)
+
 def get_time_hash_string():
     """Get a "hash" like time based string useable for use in file names.
 
@@ -10,6 +10,8 @@ import core.exceptions
 import core.paths
 from core import geo
 from core import constants
+from core.point_index import PointIndex
+from core.point_array import PointArray
 from upoints import gpx
 from core.point import Point, TurnByTurnPoint
 from core.instructions_generator import detect_monav_turns
@@ -85,18 +87,21 @@ class Way(object):
       points (similar to trackpoints vs waypoints in GPX)
 
     Note about how points and message points are stored:
-    - regular points are stored as (latitude, longitude, elevation) tuples for performance reasons
+    - regular points are stored in a compact PointArray and returned as
+      (latitude, longitude, elevation) tuples
     - message points are stored as Point objects with the expectation there will generally
       be less of them than regular points, so performance should be good enough
     """
 
     def __init__(self, points=None):
-        if not points: points = []
-        self._points = points # stored as LLE tuples
+        self._points = PointArray(points)
+        # (point array, list) tuples, extended as points are appended
+        self._points_lle = None
         self._points_radians_ll = None
         self._points_radians_lle = None
         self._message_points = []
         self._message_points_lle = None
+        self._point_index = None
         self._length = None # in meters
         self._duration = None # in seconds
 
@@ -104,10 +109,40 @@ class Way(object):
     def points_lle(self):
         """Return the way points as LLE tuples.
 
+        The list is cached and extended as points are appended,
+        use the points property to access the points without creating a list.
+
         :return: way as LLE tuples
         :rtype: list of tuples
         """
-        return self._points
+        self._points_lle = self._extend_cached_list(self._points_lle, self._points.lle_list)
+        return self._points_lle[1]
+
+    @property
+    def points(self):
+        """Return a read only view of the way points.
+
+        The view is a sequence of LLE tuples that supports slicing
+        without copying the points.
+
+        :return: view of the way points
+        :rtype: core.point_array.PointArrayView
+        """
+        return self._points.view()
+
+    def _extend_cached_list(self, cached, get_list):
+        """Update a (point array, list) cache tuple.
+
+        Points can only be appended or replaced by a new point array,
+        so the cached list just needs to be extended with the new points
+        if the point array is still the same.
+        """
+        if cached is None or cached[0] is not self._points:
+            return self._points, get_list(0)
+        points_list = cached[1]
+        if len(points_list) < len(self._points):
+            points_list.extend(get_list(len(points_list)))
+        return cached
 
     @property
     def points_radians_ll(self):
@@ -119,9 +154,9 @@ class Way(object):
         :return: way as LL tuples in radians
         :rtype: list of tuples
         """
-        if self._points_radians_ll is None:
-            self._points_radians_ll = self.get_points_lle_radians(drop_elevation=True)
-        return self._points_radians_ll
+        self._points_radians_ll = self._extend_cached_list(
+            self._points_radians_ll, lambda start: self._points.radians_list(True, start))
+        return self._points_radians_ll[1]
 
     @property
     def points_radians_lle(self):
@@ -133,9 +168,9 @@ class Way(object):
         :return: way as LLE tuples in radians (elevation is of course still in meters)
         :rtype: list of tuples
         """
-        if self._points_radians_lle is None:
-            self._points_radians_lle = self.get_points_lle_radians(drop_elevation=False)
-        return self._points_radians_lle
+        self._points_radians_lle = self._extend_cached_list(
+            self._points_radians_lle, lambda start: self._points.radians_list(False, start))
+        return self._points_radians_lle[1]
 
     def get_points_lle_radians(self, drop_elevation=False):
         """Return the way as LLE tuples in radians.
@@ -144,8 +179,7 @@ class Way(object):
         :return: LLE tuples
         :rtype: list of tuples
         """
-        radians = geo.lle_tuples2radians(self._points, drop_elevation)
-        return radians
+        return self._points.radians_list(drop_elevation)
 
     def get_point_by_index(self, index):
         """Get a regular point by index.
@@ -155,8 +189,7 @@ class Way(object):
         :rtype: a point instance
         :raises: IndexError
         """
-        p = self._points[index]
-        (lat, lon, elevation) = (p[0], p[1], p[2])
+        (lat, lon, elevation) = self._points[index]
         return Point(lat, lon, elevation)
 
     @update_cache
@@ -166,7 +199,7 @@ class Way(object):
         :param point: a Point class instance
         """
         lat, lon, elevation = point.getLLE()
-        self._points.append((lat, lon, elevation))
+        self._points.append(lat, lon, elevation)
 
     @update_cache
     def add_point_lle(self, lat, lon, elevation=None):
@@ -177,7 +210,7 @@ class Way(object):
         :param elevation: elevation
         :type elevation: float or None
         """
-        self._points.append((lat, lon, elevation))
+        self._points.append(lat, lon, elevation)
 
     @property
     def point_count(self):
@@ -193,7 +226,7 @@ class Way(object):
     @update_cache
     def clear(self):
         """Clear are regular way points."""
-        self._points = []
+        self._points = PointArray()
 
     @property
     def duration(self):
@@ -215,11 +248,11 @@ class Way(object):
     def _update_cache(self):
         """Update the various caches"""
 
-        # drop the radian & message point caches,
+        # drop the message point cache & spatial index,
         # they will be regenerated once requested again
+        # - point list caches follow the point array on their own
         self._message_points_lle = None
-        self._points_radians_ll = None
-        self._points_radians_lle = None
+        self._point_index = None
 
     @update_cache
     def add_message_point(self, point):
@@ -306,21 +339,67 @@ class Way(object):
         """
         return len(self._message_points)
 
+    @property
+    def point_index(self):
+        """Spatial index of the regular points.
+
+        The index is built once requested and rebuilt once the points change.
+
+        :return: spatial index of the regular points
+        :rtype: core.point_index.PointIndex
+        """
+        index = self._point_index
+        # points might have been appended without a cache update
+        if index is None or len(index) != len(self._points):
+            index = PointIndex(self._points)
+            self._point_index = index
+        return index
+
+    def nearest(self, lat, lon):
+        """Get the regular point closest to a position.
+
+        :param float lat: latitude
+        :param float lon: longitude
+        :return: (distance in kilometers, point index) tuple or None for an empty way
+        :rtype: tuple or None
+        """
+        return self.point_index.nearest(lat, lon)
+
+    def k_nearest(self, lat, lon, k):
+        """Get k regular points closest to a position.
+
+        :param float lat: latitude
+        :param float lon: longitude
+        :param int k: how many points to return
+        :return: list of (distance in kilometers, point index) tuples, closest first
+        :rtype: list
+        """
+        return self.point_index.k_nearest(lat, lon, k)
+
+    def within_radius(self, lat, lon, radius):
+        """Get all regular points within a radius from a position.
+
+        :param float lat: latitude
+        :param float lon: longitude
+        :param float radius: radius in kilometers
+        :return: list of (distance in kilometers, point index) tuples, closest first
+        :rtype: list
+        """
+        return self.point_index.within_radius(lat, lon, radius)
+
     def get_closest_point(self, point):
         """Get the geographically closest way point to a point."""
-        if self.points_lle:
-            result = geo.get_closest_lle(point.getLLE(), self.points_lle)
-            if result:
-                return Point(lat=result[0], lon=result[1], elevation=result[2])
-            else:
-                return None
+        result = self.nearest(point.lat, point.lon)
+        if result:
+            return self.get_point_by_index(result[1])
         else:
             return None
 
     def get_closest_message_point(self, point):
         """Get the geographically closest message point to a point."""
         if self.message_points:
-            return geo.get_closest_point(point, self.message_points)
+            index = geo.closest_index(point.lat, point.lon, self.message_points_lle)
+            return self._message_points[index]
         else:
             return None
 
@@ -355,9 +434,9 @@ class Way(object):
             # Handle trackpoints
             trackpoints = gpx.Trackpoints()
             # check for stored timestamps
-            if self._points and len(self._points[0]) >= 4: # LLET
+            if self._points.has_time: # LLET
                 trackpoints.append(
-                    [gpx.Trackpoint(x[0], x[1], None, None, x[2], x[3]) for x in self._points]
+                    [gpx.Trackpoint(x[0], x[1], None, None, x[2], x[3]) for x in self._points.llet_list()]
                 )
 
             else: # LLE
@@ -490,17 +569,8 @@ class Way(object):
         # to (lat, lon) tuples
         if monav_result:
             # route points
-            route_points = []
-            m_length = 0 # in meters
-            if monav_result.nodes:
-                first_node = monav_result.nodes[0]
-                prev_lat, prev_lon = first_node.latitude, first_node.longitude
-                # there is one from first to first calculation on start,
-                # but as it should return 0, it should not be an issue
-                for node in monav_result.nodes:
-                    route_points.append((node.latitude, node.longitude, None))
-                    m_length += geo.distance(prev_lat, prev_lon, node.latitude, node.longitude) * 1000
-                    prev_lat, prev_lon = node.latitude, node.longitude
+            route_points = [(node.latitude, node.longitude, None) for node in monav_result.nodes]
+            m_length = geo.path_length(route_points) * 1000 # in meters
 
             way = cls(route_points)
             way._set_duration(monav_result.seconds)
@@ -633,19 +703,19 @@ class Way(object):
             # route points & message points are generated at once
             # * empty string as message => no message point, just route point
             route_points = [(start[0], start[1], None)]
+            route_points.extend((lat, lon, elevation) for lat, lon, elevation, _message in middle_points)
+            route_points.append((destination[0], destination[1], None))
+            # in kilometers, route_points[index + 1] is middle_points[index]
+            along_track = geo.along_track_distances(route_points)
             message_points = []
-            m_length = 0 # in meters
-            last_lat, last_lon = start[0], start[1]
-            for point in middle_points:
+            for index, point in enumerate(middle_points):
                 lat, lon, elevation, message = point
-                m_length += geo.distance(last_lat, last_lon, lat, lon) * 1000
-                route_points.append((lat, lon, elevation))
                 if message != "": # is it a message point ?
                     point = TurnByTurnPoint(lat, lon, elevation, message)
-                    point.distance_from_start = m_length
+                    point.distance_from_start = float(along_track[index + 1]) * 1000
                     message_points.append(point)
-                last_lat, last_lon = lat, lon
-            route_points.append((destination[0], destination[1], None))
+            # up to the last middle point, not including the destination
+            m_length = float(along_track[-2]) * 1000 # in meters
             way = cls(route_points)
             way.add_message_points(message_points)
             # huge guestimation (avg speed 60 km/h = 16.7 m/s)
@@ -730,67 +800,68 @@ class AppendOnlyWay(Way):
     are stored in the output file
 
     Point storage & point appending
-    -> points are added both to the main point list and the increment temporary list
-    -> on every flush, the increment list is added to the file in storage and cleared
-    -> like this, we don't need to combine the two lists when we need to return all points
-    -> only possible downside is duplicate space needed for the points if flush is never called,
-       as the same points would be stored both in points and increment
-    -> if flush is called regularly (which is the expected behaviour when using this class),
-       this should not be an issue
+    -> points are appended to the point array in amortised O(1)
+    -> the index of the first point not yet written to the file is kept,
+       so on every flush just the points after it are written
+    -> like this no extra per-point storage is needed for the not yet saved points
     """
 
     def __init__(self, points=None):
-        if not points: points = []
         Way.__init__(self)
 
-        self._points = [] # stored as (lat, lon, elevation, timestamp) tuples
-        self.increment = [] # not yet saved increment, also LLET
         self.file = None
         self._file_path = None
         self.writer = None
         self._points_lock = threading.RLock()
+        # points before this index have been written to the file
+        self._flushed = 0
+        self._points_llet = None
 
         if points:
             with self._points_lock:
                 # mark all points added on startup with a single timestamp
                 timestamp = geo.timestamp_utc()
-                # convert to LLET
-                points = [(x[0], x[1], x[2], timestamp) for x in points]
-
-                # mark points as not yet saved
-                self.increment = points
-                # and also add to main point list
-                self._points = points
+                # points are not yet saved, as the flush cursor is at the start
+                self._points.extend((x[0], x[1], x[2], timestamp) for x in points)
 
     @property
     def points_lle(self):
-        # drop the timestamp
-        return [(x[0], x[1], x[2]) for x in self._points]
+        with self._points_lock:
+            return Way.points_lle.fget(self)
 
     @property
     def points_llet(self):
         """returns all points in LLET format, both saved an not yet saved to storage"""
-        return self._points
+        with self._points_lock:
+            self._points_llet = self._extend_cached_list(self._points_llet, self._points.llet_list)
+            return self._points_llet[1]
 
     @property
-    def point_count(self):
-        return len(self._points)
+    def increment(self):
+        """Points not yet saved to storage in LLET format"""
+        with self._points_lock:
+            return self._points.llet_list(self._flushed)
+
+    @property
+    def unsaved_point_count(self):
+        """Number of points not yet saved to storage"""
+        return len(self._points) - self._flushed
 
     def add_point(self, point):
-        with self._points_lock:
-            lat, lon, elevation = point.getLLE()
-            self._points.append((lat, lon, elevation, geo.timestamp_utc()))
-            self.increment.append((lat, lon, elevation, geo.timestamp_utc()))
+        lat, lon, elevation = point.getLLE()
+        self.add_point_llet(lat, lon, elevation, geo.timestamp_utc())
 
     def add_point_lle(self, lat, lon, elevation=None):
-        with self._points_lock:
-            self._points.append((lat, lon, elevation, geo.timestamp_utc()))
-            self.increment.append((lat, lon, elevation, geo.timestamp_utc()))
+        self.add_point_llet(lat, lon, elevation, geo.timestamp_utc())
 
     def add_point_llet(self, lat, lon, elevation, timestamp):
         with self._points_lock:
-            self._points.append((lat, lon, elevation, timestamp))
-            self.increment.append((lat, lon, elevation, timestamp))
+            self._points.append(lat, lon, elevation, timestamp)
+
+    def clear(self):
+        with self._points_lock:
+            Way.clear(self)
+            self._flushed = 0
 
     @property
     def file_path(self):
@@ -812,12 +883,12 @@ class AppendOnlyWay(Way):
 
     def flush(self):
         """Flush all points that are only in memory to storage."""
-        # get the pointsLock, the current increment to local variable and clear the original
+        # get the pointsLock, copy the not yet saved points & move the flush cursor
         # we release the lock afterwards so that other threads can start adding more points right away
         with self._points_lock:
-            increment = self.increment
-            self.increment = []
-            # write the rows
+            increment = self._points.llet_list(self._flushed)
+            self._flushed = len(self._points)
+        # write the rows
         self.writer.writerows(increment)
         # make sure it actually gets written to storage
         self.file.flush()
@@ -825,7 +896,7 @@ class AppendOnlyWay(Way):
 
     def close(self):
         # save any increments
-        if self.increment:
+        if self.unsaved_point_count:
             self.flush()
             # close the file
         self.file.close()
@@ -849,7 +920,9 @@ class AppendOnlyWay(Way):
         self.file = None
         self.writer = None
         self._file_path = None
-        self.increment = []
+        # drop any not yet saved points from the increment
+        with self._points_lock:
+            self._flushed = len(self._points)
 
 
 #from: http://seewah.blogspot.com/2009/11/gpolyline-decoding-in-python.html
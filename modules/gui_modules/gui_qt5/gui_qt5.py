@@ -44,6 +44,7 @@ from core import modrana_log
 from core import utils
 from core import paths
 from core import point
+from core.tile_provider import TileIdParser, TileDataCache, NotificationCoalescer
 
 import logging
 no_prefix_log = logging.getLogger()
@@ -117,6 +118,12 @@ class QMLGUI(GUIModule):
 
         # NOTE: what about multi-display devices ? :)
 
+        # the same tile ids are checked & loaded again and again
+        # while the map is panned, so remember parsed tile ids
+        # and recently shown tiles
+        self._tileIds = TileIdParser(lambda layerId: self.modules.mapLayers.getLayerById(layerId))
+        self._tileData = TileDataCache()
+
         ## add image providers
 
         self._imageProviders = {
@@ -179,6 +186,13 @@ class QMLGUI(GUIModule):
         self.firstTimeSignal()
 
         self.modules.location.positionUpdate.connect(self._pythonPositionUpdateCB)
+        # parsed tile ids & cached tile data reference layer objects,
+        # so they need to be dropped once the layers are reloaded
+        self.modules.mapLayers.layersChanged.connect(self._layersChangedCB)
+
+    def _layersChangedCB(self):
+        self._tileIds.clear()
+        self._tileData.clear()
 
     def _shutdown(self):
         """Called by PyOtherSide once the QML side is shutdown.
@@ -344,26 +358,36 @@ class QMLGUI(GUIModule):
         :returns: lzxy tuple
         :rtype: tuple
         """
-        split = tileId.split("/")
-        # pinchMapId = split[0]
-        layerId = split[1]
-        z = int(split[2])
-        x = int(split[3])
-        y = int(split[4])
-        # TODO: local id:layer cache ?
-        layer = self.modules.mapLayers.getLayerById(layerId)
-        return layer, z, x, y
+        return self._tileIds.lzxy(tileId)
 
     def areTilesAvailable(self, tile_ids):
         """Report if tiles are available & request download for those that are not.
 
+        All tiles not in the tile data cache are checked with a single storage query.
+
+        NOTE: The batch is not the whole visible area, just the tiles QML has not
+              checked yet, so the tile download requests can't be ranked by distance
+              from the viewport like with the GTK GUI, just by zoom level.
+
         :param list tile_ids: list of tile ids to check
         :return: a distionary of tile states, True = available, False = will be downloaded
         :rtype: dict
         """
         available_tiles = {}
+        lzxys = {}
         for tile_id in tile_ids:
-            available_tiles[tile_id] = self.isTileAvailable(tile_id)
+            lzxy = self._tileId2lzxy(tile_id)
+            if lzxy in self._tileData:
+                available_tiles[tile_id] = True
+            else:
+                lzxys[tile_id] = lzxy
+        stored = self.modules.mapTiles.tilesInStorage(set(lzxys.values()))
+        for tile_id, lzxy in lzxys.items():
+            if lzxy in stored:
+                available_tiles[tile_id] = True
+            else:
+                self._addTileDownloadRequest(lzxy, tile_id)
+                available_tiles[tile_id] = False
         return available_tiles
 
     def isTileAvailable(self, tileId):
@@ -377,7 +401,7 @@ class QMLGUI(GUIModule):
         :rtype: bool
         """
         lzxy = self._tileId2lzxy(tileId)
-        if self.modules.mapTiles.tileInStorage(lzxy):
+        if lzxy in self._tileData or self.modules.mapTiles.tileInStorage(lzxy):
             return True
         else:
             self._addTileDownloadRequest(lzxy, tileId)
@@ -703,6 +727,8 @@ class TileImageProvider(ImageProvider):
 
         self.gui.firstTimeSignal.connect(self._firstTimeCB)
         self._tileNotFoundImage = bytearray([0, 255, 255, 255])
+        # notify QML about downloaded tiles in batches
+        self._downloadNotifications = NotificationCoalescer(self._sendTileNotifications)
 
     def _firstTimeCB(self):
         # connect to the tile downloaded callback so that we can notify
@@ -714,11 +740,21 @@ class TileImageProvider(ImageProvider):
 
     def _tileDownloadedCB(self, error, lzxy, tag):
         """Notify the QML context that a tile has been downloaded"""
+        # drop the previous version of the tile, if any
+        self.gui._tileData.remove(lzxy)
         pinchMapId = tag.split("/")[0]
-        #log.debug("SENDING: %s %s" % ("tileDownloaded:%s" % pinchMapId, tag))
         resoundingSuccess = error == constants.TILE_DOWNLOAD_SUCCESS
         fatalError = error == constants.TILE_DOWNLOAD_ERROR
-        pyotherside.send("tileDownloaded:%s" % pinchMapId, tag, resoundingSuccess, fatalError)
+        self._downloadNotifications.add(pinchMapId, [tag, resoundingSuccess, fatalError])
+
+    def _sendTileNotifications(self, pinchMapId, notifications):
+        """Send a batch of downloaded tile notifications to a map instance
+
+        :param str pinchMapId: map instance name
+        :param list notifications: list of [tile id, success, fatal error] lists
+        """
+        #log.debug("SENDING: %s %d tiles" % ("tilesDownloaded:%s" % pinchMapId, len(notifications)))
+        pyotherside.send("tilesDownloaded:%s" % pinchMapId, notifications)
 
     def getImage(self, imageId, requestedSize):
         """
@@ -728,26 +764,16 @@ class TileImageProvider(ImageProvider):
         #log.debug("TILE REQUESTED %s" % imageId)
         #log.debug(requestedSize)
         try:
-            # split the string provided by QML
-            split = imageId.split("/")
-            pinchMapId = split[0]
-            layerId = split[1]
-            z = int(split[2])
-            x = int(split[3])
-            y = int(split[4])
-
-            # TODO: local id:layer cache ?
-            layer = self.gui.modules.mapLayers.getLayerById(layerId)
-
-            # construct the tag
-            #tag = (pinchMapId, layerId, z, x, y)
-            #tag = (pinchMapId, layerId, z, x, y)
+            lzxy = self.gui._tileId2lzxy(imageId)
+            imageSize = (256,256)
+            # recently shown tiles don't need to be loaded from storage again
+            tileData = self.gui._tileData.get(lzxy)
+            if tileData is not None:
+                return tileData, imageSize, pyotherside.format_data
 
             # get the tile from the tile module
-            tileData = self.gui.modules.mapTiles.getTile((layer, z, x, y),
-                                                         asynchronous=True, tag=imageId,
+            tileData = self.gui.modules.mapTiles.getTile(lzxy, asynchronous=True, tag=imageId,
                                                          download=False)
-            imageSize = (256,256)
             if tileData is None:
                 # The tile was not found locally
                 # * in persistent storage (files/sqlite db)
@@ -761,7 +787,8 @@ class TileImageProvider(ImageProvider):
                 return self._tileNotFoundImage, (1,1), pyotherside.format_argb32
                 #log.debug("%s NOT FOUND" % imageId)
             #log.debug("RETURNING STUFF %d %s" % (imageSize[0], imageId))
-            return bytearray(tileData), imageSize, pyotherside.format_data
+            # the cached tile data can be handed over to PyOtherSide without copying
+            return self.gui._tileData.add(lzxy, tileData), imageSize, pyotherside.format_data
         except Exception:
             log.error("tile image provider: loading tile failed")
             log.error(imageId)
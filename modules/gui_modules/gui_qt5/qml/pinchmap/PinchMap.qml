@@ -247,7 +247,7 @@ Rectangle {
     //   handlers it should not slow down Python -> QML message
     //   handling
     Component.onCompleted: {
-        rWin.python.setHandler("tileDownloaded:" + pinchmap.name, pinchmap.tileDownloadedCB)
+        rWin.python.setHandler("tilesDownloaded:" + pinchmap.name, pinchmap.tilesDownloadedCB)
         // instantiate the nested backing data model for tiles
         updateTilesModel()
     }
@@ -346,11 +346,15 @@ Rectangle {
         }
     }
 
-    function tileDownloadedCB(tileId, resoundingSuccess, fatalError) {
-        // notify tile delegates waiting for tile data to be available
-        var tile = pinchmap.currentTiles[tileId]
-        if (tile) {
-            tile.tileDownloaded([resoundingSuccess, fatalError])
+    function tilesDownloadedCB(notifications) {
+        // notify tile delegates waiting for tile data to be available,
+        // notifications come in batches of [tileId, resoundingSuccess, fatalError]
+        for (var i = 0; i < notifications.length; i++) {
+            var notification = notifications[i]
+            var tile = pinchmap.currentTiles[notification[0]]
+            if (tile) {
+                tile.tileDownloaded([notification[1], notification[2]])
+            }
         }
     }
 
@@ -20,15 +20,16 @@
 from modules.base_module import RanaModule
 from core import geo
 from core import utils
+from core.polyline_lod import PolylineLOD
+from core.gpx_reader import read_gpx, TrackStats
+from core.tracklog_cache import TracklogCache, TracklogSummary, summarize_track, PREVIEW_ZOOM, CLUSTER_DISTANCE
+from core.tracklog_loader import TracklogLoader
 import math
 import os
 import glob
-
-try:
-    import cPickle as pickle  # Python 2
-except ImportError:
-    import pickle  # Python 3
 import shutil
+import threading
+import time
 from time import clock
 from time import gmtime, strftime
 
@@ -45,7 +46,13 @@ class LoadTracklogs(RanaModule):
     def __init__(self, *args, **kwargs):
         RanaModule.__init__(self, *args, **kwargs)
         self.tracklogs = {}  # dictionary of all loaded tracklogs, path is the key
-        self.cache = {}
+        self.cache = None  # persistent tracklog summaries
+        self._previews = {}  # path -> preview pyramid
+        # the background loader adds tracklogs from its own thread while
+        # they are being drawn, so guard the tracklogs, previews & cache
+        self._tracklogsLock = threading.RLock()
+        self._loader = None  # background tracklog loader
+        self._loadFailed = set()  # paths of tracklogs that failed to load in the background
         self._tracklog_list = []
         self._tracklog_path_list = []
         self._category_list = []
@@ -62,22 +69,15 @@ class LoadTracklogs(RanaModule):
 
                 # Zeroth, is the tracklog already loaded ?
                 if path not in self.tracklogs.keys():
-                    # First, is the cache loaded ?
-                    if self.cache == {}:
-                        self._load_cache()
-                    else:
-                        self.log.warning("not loading tracklog cache (already loaded)")
-                        # Second, try to load the tracklog (if its not loaded)
-
+                    # First, try to load the tracklog (if its not loaded)
                     try:
                         self.load_tracklog(path)
                         self.log.info("tracklog successfully loaded")
                     except Exception:
                         self.log.exception("loading tracklog from path: %s failed", path)
 
-                    # Third, assure consistency of the cache
+                    # Second, assure consistency of the cache
                     self.log.info("** Assuring tracklog cache consistency")
-                    self.save()
                     self._clean_cache()
                     self.log.info("** Tracklog cache consistency assured")
                 #    elif message == 'renameActiveTracklog':
@@ -87,6 +87,13 @@ class LoadTracklogs(RanaModule):
                 #        # get current tracklog filename, sans extension
                 #        # start an entry box
 
+    def shutdown(self):
+        """Stop background loading & close the tracklog cache on shutdown"""
+        if self._loader is not None:
+            self._loader.close()
+        if self.cache is not None:
+            self.cache.close()
+
     def _get_tf_sub_path(self, subPath):
         """Return a tracklog folder sub path.
 
@@ -131,46 +138,68 @@ class LoadTracklogs(RanaModule):
     # tracklog cache
 
     def _load_cache(self):
-        """Unpickle the cache from file."""
-        self.log.info("** Loading tracklog cache")
-        start = clock()
-        try:
-            f = open(self.get_tracklog_cache_path(), 'rb')
-            self.cache = pickle.load(f)
-            f.close()
-        except Exception:
-            self.log.exception("loading cache from file failed")
-            self.cache = {}
-        self.log.info("** Loading tracklog cache took %1.2f ms", 1000 * (clock() - start))
+        """Open the tracklog summary cache, importing the old pickled cache if present."""
+        with self._tracklogsLock:
+            if self.cache is None:
+                self.log.info("** Opening tracklog cache")
+                self.cache = TracklogCache(self.get_tracklog_cache_path())
+                self.cache.migrate_pickle(self.get_old_tracklog_cache_path())
+            return self.cache
 
     def _clean_cache(self):
         """Remove files that are not present from the cache."""
-        paths = self._tracklog_path_list
-        garbage = filter(lambda x: x not in paths, self.cache)
-        for g in garbage:
-            del self.cache[g]
+        # an empty list most likely means the tracklogs have not been listed (yet)
+        if self._tracklog_path_list:
+            self._load_cache().prune(self._tracklog_path_list)
 
     def delete_tracklog_from_cache(self, tracklogFile):
         """Self explanatory."""
-        if tracklogFile in self.cache:
-            del self.cache[tracklogFile]
+        self._load_cache().delete(tracklogFile)
+        with self._tracklogsLock:
+            self._previews.pop(tracklogFile, None)
 
     def get_tracklog_cache_path(self):
+        return os.path.join(self.modrana.paths.cache_folder_path, 'tracklog_cache.db')
+
+    def get_old_tracklog_cache_path(self):
         return os.path.join(self.modrana.paths.cache_folder_path, 'tracklog_cache.txt')
 
+    def get_tracklog_summary(self, path):
+        """Return cached summary of a tracklog without loading it.
+
+        :returns: the summary or None if the tracklog has not been summarized yet
+                  or has changed since
+        :rtype: core.tracklog_cache.TracklogSummary or None
+        """
+        return self._load_cache().get(path)
+
+    def get_preview_lod(self, path):
+        """Return level of detail pyramid of the cached tracklog preview for drawing.
+
+        The preview is only detailed enough for zoom levels up to PREVIEW_ZOOM.
+
+        :returns: the pyramid or None if there is no cached preview for the tracklog
+        """
+        with self._tracklogsLock:
+            lod = self._previews.get(path)
+        if lod is None:
+            summary = self.get_tracklog_summary(path)
+            if summary is not None and summary.preview is not None:
+                lod = PolylineLOD.fromLL(summary.preview, maxZoom=PREVIEW_ZOOM)
+                with self._tracklogsLock:
+                    self._previews[path] = lod
+        return lod
+
     # active tracklog
 
     def get_active_tracklog(self):
         path = self.get_active_tracklog_path()
         # is the tracklog loaded ?
-        if path not in self.tracklogs.keys():
-            self.load_tracklog(path)
-            self.save()
-            # was the tracklog loaded successfully ?
-        if path not in self.tracklogs.keys():
-            return None
-        else:
-            return self.tracklogs[path]
+        tracklog = self.get_loaded_tracklog(path)
+        if tracklog is None:
+            # None if the tracklog could not be loaded
+            tracklog = self.load_tracklog(path)
+        return tracklog
 
     def get_active_tracklog_path(self):
         path = self.get('activeTracklogPath', None)
@@ -181,8 +210,9 @@ class LoadTracklogs(RanaModule):
 
     def get_tracklog_for_path(self, path):
         """Return a tracklog corresponding to the path specified."""
-        if path in self.tracklogs.keys():
-            return self.tracklogs[path]
+        tracklog = self.get_loaded_tracklog(path)
+        if tracklog is not None:
+            return tracklog
         else:
             # try to load the track
             track = self.load_tracklog(path)
@@ -197,7 +227,7 @@ class LoadTracklogs(RanaModule):
 
         # this should be ideally done better in the future
         track = self.get_tracklog_for_path(path)
-        track_points = [{'latitude': point.latitude, 'longitude': point.longitude} for point in track.trackpointsList[0]]
+        track_points = [{'latitude': lat, 'longitude': lon} for lat, lon in zip(track.points.lats, track.points.lons)]
         return track_points
 
     def get_tracklog_list(self):
@@ -216,7 +246,20 @@ class LoadTracklogs(RanaModule):
 
     def get_loaded_tracklog_path_list(self):
         """Return a list of loaded tracklog paths."""
-        return self.tracklogs.keys()
+        # tracklogs might be added from the background loading thread
+        with self._tracklogsLock:
+            return list(self.tracklogs.keys())
+
+    def get_loaded_tracklog(self, path):
+        """Return a tracklog corresponding to the path specified if it is loaded, None otherwise."""
+        with self._tracklogsLock:
+            return self.tracklogs.get(path)
+
+    def unload_tracklog(self, path):
+        """Drop a loaded tracklog & its preview, if any."""
+        with self._tracklogsLock:
+            self.tracklogs.pop(path, None)
+            self._previews.pop(path, None)
 
     def get_index_for_path(self, path):
         """Get index for the tracklog with corresponding path from the main tracklog lists."""
@@ -252,10 +295,13 @@ class LoadTracklogs(RanaModule):
                 size = utils.bytes_to_pretty_unit_string(os.path.getsize(path))
                 extension = os.path.splitext(path)[1]
                 cat = folder
+                # length is only known for already summarized tracklogs
+                summary = self.get_tracklog_summary(path)
                 item = {'path': path,
                         'filename': filename,
                         'lastModified': lastModified,
                         'size': size,
+                        'length': summary.length if summary is not None else None,
                         'type': extension[1:],
                         'cat': cat}
                 availableFiles.append(item)
@@ -269,6 +315,10 @@ class LoadTracklogs(RanaModule):
         self.log.info("**")
         self._tracklog_path_list = pathList
         self._tracklog_list = availableFiles
+        # tracklogs might have been changed or replaced
+        with self._tracklogsLock:
+            self._previews = {}
+            self._loadFailed = set()
 
     def get_category_list(self):
         """Return the list of available categories."""
@@ -361,40 +411,66 @@ class LoadTracklogs(RanaModule):
     #    self.save()
     #    print("Loading tracklogs took %1.2f ms" % (1000 * (clock() - start)))
 
-    def save(self):
-        try:
-            f = open(self.get_tracklog_cache_path(), 'w')
-            pickle.dump(self.cache, f)
-            f.close()
-        except Exception:
-            self.log.exception("can't store tracklog data to cache, tracklogs will be loaded from files next time")
-
     # load tracklogs
 
     def loadPathList(self, pathList):
-        self.log.info("** Loading tracklogs list")
-        start = clock()
-        count = len(pathList)
-        index = 1
-        self.sendMessage('notification:loading %d tracklogs#1' % count)
-        for path in pathList:
-            self.load_tracklog(path, False)
-            self.sendMessage('notification:%d of %d loaded#1' % (index, count))
-            index += 1
-
-        elapsed = (1000 * (clock() - start))
-        self.log.info("** Loading tracklogs took %1.2f ms", elapsed)
-        self.save()
-        self._clean_cache()
-        self.sendMessage('notification:%d tracks loaded in %1.2f ms#1' % (count, elapsed))
+        """Load tracklogs in the background.
+
+        Tracklogs that are already loaded, being loaded or failed to load are skipped,
+        progress is reported by the loading thread.
+        """
+        with self._tracklogsLock:
+            pathList = [path for path in pathList if path not in self.tracklogs and path not in self._loadFailed]
+        if not pathList:
+            return
+        # just to be sure, refresh the tracklog list if needed
+        if self._tracklog_list == []:
+            self.list_available_tracklogs()
+        if self._loader is None:
+            self._loader = TracklogLoader(self._tracklogLoaded)
+        cache = self._load_cache()
+
+        def needsSummary(path):
+            summary = cache.get(path)
+            return summary is None or summary.clusters is None
+
+        start = time.time()
+
+        def batchDone(loadedPaths):
+            elapsed = 1000 * (time.time() - start)
+            self.log.info("** Loading %d tracklogs took %1.2f ms", len(loadedPaths), elapsed)
+            self._clean_cache()
+            self.sendMessage('notification:%d tracks loaded in %1.2f ms#1' % (len(loadedPaths), elapsed))
+
+        if self._loader.load(pathList, needsSummary, batchDone):
+            self.log.info("** Loading tracklogs list")
+            self.sendMessage('notification:loading %d tracklogs#1' % len(pathList))
+
+    def cancelLoading(self, pathList=None):
+        """Cancel background loading of the given tracklogs, all of them if None."""
+        if self._loader is not None:
+            self._loader.cancel(pathList)
+
+    def _tracklogLoaded(self, path, track, summary):
+        """Called from the background loading thread once a tracklog is loaded."""
+        if track is None:
+            with self._tracklogsLock:
+                self._loadFailed.add(path)
+            return
+        cache = self._load_cache()
+        if summary is None:
+            summary = cache.get(path)
+        else:
+            cache.put(path, summary)
+        tracklog = GPXTracklog(track, path, "GPX", cache, summary)
+        with self._tracklogsLock:
+            self.tracklogs[path] = tracklog
+            self._previews.pop(path, None)
+        # show the tracklog once loaded
+        self.set('needRedraw', True)
 
     def load_tracklog(self, path, notify=True):
         """Load a GPX file to datastructure."""
-        # is the cache loaded
-        if self.cache == {}:
-            # load the cache
-            self._load_cache()
-
         # just to be sure, refresh the tracklog list if needed
         if self._tracklog_list == []:
             self.list_available_tracklogs()
@@ -413,13 +489,14 @@ class LoadTracklogs(RanaModule):
             self.sendMessage('notification:loading %s#1' % path)
 
         if file:  # TODO: add handling of other than GPX files
-            # import the GPX module only when really needed
-            from upoints import gpx
-
-            track = gpx.Trackpoints()  # create new Trackpoints object
-            # lets assume we have only GPX 1.1 files TODO: 1.1 and 1.0
+            # clusters are only needed if they are not cached yet
+            summary = self.get_tracklog_summary(path)
+            if summary is not None and summary.clusters is not None:
+                clusterDistance = None
+            else:
+                clusterDistance = CLUSTER_DISTANCE
             try:
-                track.import_locations(file)  # load a gpx file into it
+                track = read_gpx(file, clusterDistance)  # stream the points from the GPX file
             except Exception:
                 self.log.exception("loading tracklog failed")
                 if notify:
@@ -429,8 +506,10 @@ class LoadTracklogs(RanaModule):
 
             type = "GPX"  # TODO: more formats support
 
-            track = GPXTracklog(track, path, type, self.cache, self.save)
-            self.tracklogs[path] = track
+            track = GPXTracklog(track, path, type, self._load_cache(), summary)
+            with self._tracklogsLock:
+                self.tracklogs[path] = track
+                self._previews.pop(path, None)
             self.log.info("Loading tracklog \n%s\ntook %1.2f ms", path, (1000 * (clock() - start)))
             if notify:
                 self.sendMessage('notification:loaded in %1.2f ms' % (1000 * (clock() - start)))
@@ -539,7 +618,7 @@ class LoadTracklogs(RanaModule):
         return clusters
 
 
-class Tracklog():
+class Tracklog(object):
     """A basic class representing a tracklog."""
 
     def __init__(self, trackpointsList, filename, type):
@@ -583,8 +662,16 @@ class Tracklog():
 class GPXTracklog(Tracklog):
     """A class representing a GPX tracklog."""
 
-    def __init__(self, trackpointsList, filename, type, cache, save):
-        Tracklog.__init__(self, trackpointsList, filename, type)
+    def __init__(self, track, filename, type, cache, summary=None):
+        """
+        :param track: track read from the GPX file
+        :type track: core.gpx_reader.GPXTrack
+        :param cache: tracklog summary cache
+        :type cache: core.tracklog_cache.TracklogCache
+        :param summary: cached summary of the tracklog, if any
+        :type summary: core.tracklog_cache.TracklogSummary
+        """
+        Tracklog.__init__(self, None, filename, type)
         Tracklog.type = 'GPX'
         self.routeInfo = None  # a dictionary for storing route information
         # TODO: set this automatically
@@ -592,7 +679,14 @@ class GPXTracklog(Tracklog):
         filename = self.filename
 
         self.cache = cache
-        self.save = save
+
+        self.track = track
+        # points of the first track segment
+        self.points = track.points
+        if track.stats:
+            self.stats = track.stats[0]
+        else:
+            self.stats = TrackStats()
 
         self.clusters = []
 
@@ -600,80 +694,92 @@ class GPXTracklog(Tracklog):
 
         self.perElevList = None
 
+        self.lod = None  # simplified track for drawing
+
         # do we have any points to process ?
-        if self.trackpointsList == []:
+        if not self.points:
             # no points, we are done :)
             return
 
-        if filename in cache:
-            gpx_log.info("** loading tracklog from cache")
-            self.clusters = cache[filename].clusters
-            self.routeInfo = cache[filename].routeInfo
-            if self.routeInfo is not None:
-                self.elevation = True
-            self.perElevList = cache[filename].perElevList
-
+        if summary is not None and summary.clusters is not None:
+            gpx_log.info("** using cached or precomputed tracklog summary")
+            if not summary.complete:
+                # imported from the old cache, add what is missing
+                summary = TracklogSummary.from_points(self.points, self.stats, summary.clusters,
+                                                      summary.elevation_profile)
+                cache.put(filename, summary)
         else:
             gpx_log.info("* creating clusters,routeInfo and per_elev_list: %s", filename)
-            clusterDistance = 5  # cluster points to clusters about 5 kilometers in diameter
-            self.clusters = []
-
             try:
-                rawClusters = geo.cluster_trackpoints(trackpointsList, clusterDistance)  # we cluster the points
-                for cluster in rawClusters:  # now we find for each cluster a circle encompassing all points
-                    (centreX, centreY, radius) = geo.circle_around_point_cluster(cluster)
-                    self.clusters.append(ClusterOfPoints(cluster, centreX, centreY, radius))
-
-                self.checkElevation()
-
-                if self.elevation is True:
-                    self.getPerElev()
-                else:
-                    self.perElevList = None
+                summary = summarize_track(track, CLUSTER_DISTANCE)
             except Exception:
                 gpx_log.exception("tracklog post-processing failed")
+                summary = None
+            else:
+                cache.put(filename, summary)
+
+        if summary is not None:
+            self.clusters = [ClusterOfPoints(None, centreX, centreY, radius)
+                             for centreX, centreY, radius in summary.clusters]
+            self.routeInfo = summary.route_info
+            self.elevation = self.routeInfo is not None
+            self.perElevList = summary.elevation_profile
+
+    @property
+    def trackpointsList(self):
+        """upoints Trackpoints for the tracklog, created from the points once requested
+
+        Use the points attribute instead where possible,
+        creating a Trackpoint object for every point is slow.
+        """
+        if self._trackpointsList is None:
+            self._trackpointsList = self.track.to_trackpoints()
+        return self._trackpointsList
+
+    @trackpointsList.setter
+    def trackpointsList(self, trackpointsList):
+        self._trackpointsList = trackpointsList
 
-            ci = CacheItem(self.clusters, self.routeInfo, self.perElevList)
-            cache[filename] = ci
+    def setElevation(self, index, elevation):
+        """set elevation of a point, call modified() once done with changes"""
+        if elevation is None:
+            elevation = float("nan")
+        self.points.elevations[index] = elevation
 
     def modified(self):
         """the tracklog has been modified, recount all the statistics and clusters"""
         # TODO: implement this ? :D
+        self.lod = None
+        self._trackpointsList = None
         self.checkElevation()  # update the elevation statistics
         if self.elevation is True:
             self.getPerElev()  # update the periodic elevation data
 
     def checkElevation(self):
-        pointsWithElevation = list(filter(lambda x: x.elevation is not None, self.trackpointsList[0]))
-        if pointsWithElevation:  # do we have some points with known elevation ?
-            self.elevation = True
-            self.routeInfo = {}
-            # there we have the points, that contain the highest, lowest, first and last point
-            firstPoint = pointsWithElevation[0]
-            lastPoint = pointsWithElevation[len(pointsWithElevation) - 1]
-            # now we use some lambdas, to find the lowest and highest point
-            maxElevationPoint = (max(pointsWithElevation, key=lambda x: x.elevation))
-            minElevationPoint = (min(pointsWithElevation, key=lambda x: x.elevation))
-            # just the highest/lowest elevations in numerical form
-            maxElevation = float(maxElevationPoint.elevation)
-            minElevation = float(minElevationPoint.elevation)
-            difference = maxElevation - minElevation
-            middle = minElevation + (difference / 2)
-            firstElevation = float(firstPoint.elevation)
-            lastElevation = float(lastPoint.elevation)
-            # because there are many possible statistics about a given route with elevation,
-            # we will store them in a dictionary, so new ones can be quickly added as needed
-            #      self.routeInfo['firstPoint'] = firstPoint
-            #      self.routeInfo['lastPoint'] = lastPoint
-            #      self.routeInfo['maxElevationPoint'] = maxElevationPoint
-            #      self.routeInfo['minElevationPoint'] = minElevationPoint
-            self.routeInfo['maxElevation'] = maxElevation
-            self.routeInfo['minElevation'] = minElevation
-            self.routeInfo['middle'] = middle
-            self.routeInfo['firstElevation'] = firstElevation
-            self.routeInfo['lastElevation'] = lastElevation
+        stats = TrackStats()
+        for lat, lon, elevation in self.points:
+            stats.add(lat, lon, elevation)
+        self.stats = stats
+        self._setElevationStats()
+
+    def _setElevationStats(self):
+        # because there are many possible statistics about a given route with elevation,
+        # we will store them in a dictionary, so new ones can be quickly added as needed
+        self.routeInfo = self.stats.route_info
+        self.elevation = self.routeInfo is not None
+
+    def getLength(self):
+        """return length of the tracklog in meters, None if it has no points"""
+        if self.points:
+            return self.stats.length
         else:
-            self.elevation = False
+            return None
+
+    def getLOD(self):
+        """return level of detail pyramid of the track for drawing"""
+        if self.lod is None:
+            self.lod = PolylineLOD.fromLL(self.points)
+        return self.lod
 
     def replaceFile(self):
         """
@@ -684,28 +790,19 @@ class GPXTracklog(Tracklog):
         f = open(self.filename, "w")  # open the old file
         xmlTree = self.trackpointsList.export_gpx_file()  # get the element tree
         xmlTree.write(f)  # overwrite the old file with the new structure
+        f.close()
         gpx_log.info("%s has been replaced by the current in memory version", self.filename)
-        del self.cache[self.filename]  # the file has been modified, so it must be cached again
-        self.save()  # save the cache to disk
+        self.cache.delete(self.filename)  # the file has been modified, so it must be cached again
 
     def getPerElev(self):
-        self.perElevList = geo.per_elev_list(self.trackpointsList)
-
-
-class CacheItem():
-    """class representing a cache item"""
-
-    def __init__(self, clusters, routeInfo=None, perElevList=None):
-        self.clusters = clusters
-        self.routeInfo = routeInfo
-        self.perElevList = perElevList
+        self.perElevList = geo.per_elev_list_lle(self.points.lle_list())
 
 
 class ClusterOfPoints():
     """A basic class representing a cluster of nearby points."""
 
     def __init__(self, pointsList, centreX, centreY, radius):
-        self.pointsList = pointsList  # points in the cluster
+        self.pointsList = pointsList  # points in the cluster, None if not kept
         """coordinates of the circle encompassing all points"""
         self.centreX = centreX
         self.centreY = centreY
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+# Persistent journal of a batch tile download
+"""Persistent journal of a batch tile download
+
+The journal is a small sqlite database holding the batch definition
+(layer id & the list of tiles), a bitmap with one bit per tile that is set once
+the tile has been processed and a few counters. The batch download pool marks
+tiles as done in memory and checkpoints the journal to disk periodically,
+so that a batch interrupted by a crash, a suspend or the application exiting
+can be resumed, only processing the tiles that were not done yet.
+
+Tiles that failed to download are not marked as done, so they are retried
+once the batch is resumed.
+"""
+from __future__ import with_statement
+import os
+import sys
+import time
+import threading
+import sqlite3
+from array import array
+
+import logging
+log = logging.getLogger("mod.mapData.journal")
+
+# checkpoint at least this often
+CHECKPOINT_INTERVAL = 5  # seconds
+# or once this many tiles have been done since the last checkpoint
+CHECKPOINT_TILE_COUNT = 500
+
+JOURNAL_VERSION = 1
+
+if sys.version_info[0] > 2:
+    def _toBlob(data):
+        if isinstance(data, bytearray):
+            return bytes(data)
+        return data.tobytes()
+
+    def _arrayFromBlob(typecode, blob):
+        a = array(typecode)
+        a.frombytes(bytes(blob))
+        return a
+else:
+    def _toBlob(data):
+        if isinstance(data, bytearray):
+            return buffer(data)
+        return buffer(data.tostring())
+
+    def _arrayFromBlob(typecode, blob):
+        a = array(typecode)
+        a.fromstring(str(blob))
+        return a
+
+
+class BatchJournal(object):
+    """Persistent state of a single batch download
+
+    NOTE: the journal is thread safe, so tiles can be marked as done
+          directly from the download threads
+    """
+
+    def __init__(self, path, clock=time.time):
+        """
+        :param str path: path to the journal database file
+        :param clock: function returning current time in seconds
+        """
+        self._path = path
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._connection = None
+        self._layerId = None
+        # flat list of x, y, z coordinates of all tiles in the batch
+        self._coordinates = array("i")
+        self._done = bytearray()
+        self._doneCount = 0
+        self._downloadedDataSize = 0
+        # (x, y, z) -> tile index, built once needed
+        self._index = None
+        self._dirty = False
+        self._lastCheckpoint = 0
+        self._doneSinceCheckpoint = 0
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def layerId(self):
+        return self._layerId
+
+    @property
+    def tileCount(self):
+        return len(self._coordinates) // 3
+
+    @property
+    def doneCount(self):
+        return self._doneCount
+
+    @property
+    def pendingCount(self):
+        return self.tileCount - self._doneCount
+
+    @property
+    def downloadedDataSize(self):
+        return self._downloadedDataSize
+
+    def _connect(self):
+        if self._connection is None:
+            folder = os.path.dirname(self._path)
+            if folder and not os.path.isdir(folder):
+                os.makedirs(folder)
+            # checkpoints can be triggered from any of the download threads
+            self._connection = sqlite3.connect(self._path, check_same_thread=False)
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS batch (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                version INTEGER,
+                layer_id TEXT,
+                tiles BLOB,
+                done BLOB,
+                done_count INTEGER,
+                downloaded_size INTEGER,
+                updated REAL)""")
+            self._connection.commit()
+        return self._connection
+
+    def create(self, layerId, items):
+        """Start a new journal, replacing any journal stored in the file
+
+        :param str layerId: id of the layer the batch is downloading
+        :param items: iterable of (x, y, z) tile tuples
+        """
+        with self._lock:
+            self._layerId = layerId
+            self._coordinates = array("i")
+            for item in items:
+                self._coordinates.extend(item)
+            self._done = bytearray((self.tileCount + 7) // 8)
+            self._doneCount = 0
+            self._downloadedDataSize = 0
+            self._index = None
+            connection = self._connect()
+            with connection:
+                connection.execute("DELETE FROM batch")
+                connection.execute("INSERT INTO batch VALUES (0, ?, ?, ?, ?, 0, 0, ?)",
+                                   (JOURNAL_VERSION, layerId, _toBlob(self._coordinates),
+                                    _toBlob(self._done), self._clock()))
+            self._dirty = False
+            self._lastCheckpoint = self._clock()
+            self._doneSinceCheckpoint = 0
+        log.info("batch journal created for %d tiles of layer %s", self.tileCount, layerId)
+
+    def load(self):
+        """Load the journal from the file
+
+        :returns: True if an unfinished batch has been loaded, False otherwise
+        :rtype: bool
+        """
+        if not os.path.isfile(self._path):
+            return False
+        with self._lock:
+            try:
+                row = self._connect().execute(
+                    "SELECT version, layer_id, tiles, done, done_count, downloaded_size FROM batch"
+                ).fetchone()
+            except sqlite3.Error:
+                log.exception("batch journal %s can't be loaded", self._path)
+                return False
+            if row is None or row[0] != JOURNAL_VERSION:
+                return False
+            _version, self._layerId, tiles, done, self._doneCount, self._downloadedDataSize = row
+            self._coordinates = _arrayFromBlob("i", tiles)
+            self._done = bytearray(done)
+            self._index = None
+            self._dirty = False
+            self._lastCheckpoint = self._clock()
+            self._doneSinceCheckpoint = 0
+            return self.pendingCount > 0
+
+    def _item(self, index):
+        offset = index * 3
+        return tuple(self._coordinates[offset:offset + 3])
+
+    def pendingItems(self):
+        """Get all tiles that have not been done yet
+
+        :returns: list of (x, y, z) tile tuples
+        :rtype: list
+        """
+        with self._lock:
+            done = self._done
+            return [self._item(index) for index in range(self.tileCount)
+                    if not done[index >> 3] & (1 << (index & 7))]
+
+    def markDone(self, item, size=0):
+        """Mark a tile as done (downloaded or already available)
+
+        The journal is checkpointed if enough time passed or enough
+        tiles have been done since the last checkpoint.
+
+        :param tuple item: (x, y, z) tile tuple
+        :param int size: how much data has been downloaded for the tile
+        """
+        with self._lock:
+            if self._index is None:
+                self._index = dict((self._item(index), index) for index in range(self.tileCount))
+            index = self._index.get(tuple(item))
+            if index is None:
+                return
+            mask = 1 << (index & 7)
+            if self._done[index >> 3] & mask:
+                return
+            self._done[index >> 3] |= mask
+            self._doneCount += 1
+            self._downloadedDataSize += size or 0
+            self._dirty = True
+            self._doneSinceCheckpoint += 1
+            if self._doneSinceCheckpoint >= CHECKPOINT_TILE_COUNT or \
+                    self._clock() - self._lastCheckpoint >= CHECKPOINT_INTERVAL:
+                self.checkpoint()
+
+    def checkpoint(self):
+        """Write the current state of the batch to the journal file"""
+        with self._lock:
+            if not self._dirty or self._connection is None:
+                return
+            with self._connection:
+                self._connection.execute("UPDATE batch SET done=?, done_count=?, downloaded_size=?, updated=?",
+                                         (_toBlob(self._done), self._doneCount,
+                                          self._downloadedDataSize, self._clock()))
+            self._dirty = False
+            self._lastCheckpoint = self._clock()
+            self._doneSinceCheckpoint = 0
+
+    def close(self):
+        """Checkpoint & close the journal file"""
+        with self._lock:
+            if self._connection is not None:
+                self.checkpoint()
+                self._connection.close()
+                self._connection = None
+
+    def discard(self):
+        """Close & remove the journal file - the batch is finished or abandoned"""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+            self._dirty = False
+            if os.path.isfile(self._path):
+                os.remove(self._path)
+        log.info("batch journal discarded")
@@ -19,11 +19,12 @@
 #---------------------------------------------------------------------------
 from __future__ import with_statement # for python 2.5
 from modules.base_module import RanaModule
-from time import clock
+try:  # Python 3.3+
+    from time import perf_counter as clock
+except ImportError:
+    from time import clock
 import time
 import os
-import copy
-from core import geo
 from core import utils
 from core import tiles
 from core import constants
@@ -31,6 +32,8 @@ from core.tilenames import *
 import threading
 from .pools import BatchSizeCheckPool
 from .pools import BatchTileDownloadPool
+from .batch_journal import BatchJournal
+from .tile_set import TileSet, tilesAroundRoute
 
 # socket timeout
 import socket
@@ -46,6 +49,9 @@ DL_LOCATION_ROUTE = "route"
 # maximum zoom level used when no maximum is specified for a layer
 MAX_ZOOMLEVEL = 17
 
+# journal of the last batch download, so that it can be resumed if interrupted
+BATCH_JOURNAL_FILENAME = "batch_download_journal.sqlite"
+
 def getModule(*args, **kwargs):
     return MapData(*args, **kwargs)
 
@@ -55,7 +61,9 @@ class MapData(RanaModule):
 
     def __init__(self, *args, **kwargs):
         RanaModule.__init__(self, *args, **kwargs)
-        self._tileDownloadRequests = set()
+        # tiles to download, kept as a tile set so that large
+        # batches don't have to be listed tile by tile
+        self._tileDownloadRequests = TileSet()
         self._tileDownloadRequestsLock = threading.RLock()
 
         self._checkPool = BatchSizeCheckPool()
@@ -74,10 +82,48 @@ class MapData(RanaModule):
         self.midZ = 15
         self.maxZ = MAX_ZOOMLEVEL
 
+        # journal of an interrupted batch download that can be resumed
+        self._resumableJournal = None
+        self._downloadPool.batchDone.connect(self._checkResumableBatch)
+
+    def firstTime(self):
+        self._downloadPool.journalPath = os.path.join(self.modrana.paths.profile_path, BATCH_JOURNAL_FILENAME)
+        if self._checkResumableBatch():
+            self.notify("Unfinished batch download found (%d tiles left), resume it from the data menu"
+                        % self.resumableTileCount, 5000)
+
+    def _checkResumableBatch(self):
+        """Check if there is an interrupted batch download that can be resumed
+
+        :returns: True if an interrupted batch has been found, False otherwise
+        :rtype: bool
+        """
+        self._dropResumableJournal()
+        if not self._downloadPool.journalPath:
+            return False
+        journal = BatchJournal(self._downloadPool.journalPath)
+        if journal.load():
+            self._resumableJournal = journal
+            self.log.info("found interrupted batch download with %d of %d tiles left",
+                          journal.pendingCount, journal.tileCount)
+            self._resumableBatchChanged()
+            return True
+        else:
+            journal.close()
+            return False
+
+    def _resumableBatchChanged(self):
+        """Rebuild the data menu so that it only offers to resume
+        a batch download if there is one to resume
+        """
+        menus = self.m.get('menu', None)
+        if menus:
+            menus.setupDataMenu()
+
     def addDownloadRequests(self, requests):
         """Add download requests to the download request set
 
-        :param list requests: a list of lzxy tuples representing download requests
+        :param TileSet requests: tiles to download
         """
 
         with self._tileDownloadRequestsLock:
@@ -94,7 +140,18 @@ class MapData(RanaModule):
 
     @property
     def requestCount(self):
-        return len(self._tileDownloadRequests)
+        with self._tileDownloadRequestsLock:
+            return len(self._tileDownloadRequests)
+
+    @property
+    def resumableTileCount(self):
+        """Number of tiles left in an interrupted batch download
+        that can be resumed, 0 if there is no such batch
+        """
+        if self._resumableJournal:
+            return self._resumableJournal.pendingCount
+        else:
+            return 0
 
     @property
     def checkSizeRunning(self):
@@ -120,17 +177,6 @@ class MapData(RanaModule):
         """Get layer description from the mapLayers module"""
         return self.m.get("mapLayers").getLayerById(layerId)
 
-    def listTiles(self, route):
-        """List all tiles touched by a polyline"""
-        _tiles = {}
-        for pos in route:
-            (lat, lon) = pos
-            (tx, ty) = tileXY(lat, lon, 15)
-            tile = "%d,%d" % (tx, ty)
-            if not tile in _tiles:
-                _tiles[tile] = True
-        return _tiles.keys()
-
     def handleMessage(self, message, messageType, args):
         if message == "refreshTilecount":
             self.refreshTilecount()
@@ -140,6 +186,9 @@ class MapData(RanaModule):
         elif message == "download":
             self.startBatchDownload()
 
+        elif message == "resumeBatch":
+            self.resumeBatchDownload()
+
         elif message == "stopDownloadThreads":
             self.stopBatchDownload()
 
@@ -160,190 +209,21 @@ class MapData(RanaModule):
             self.scroll = 0
             self.set("needRedraw", True)
 
-    def addOtherZoomlevels(self, tiles, tilesZ, maxZ, minZ):
-        """expand the tile coverage to other zoomlevels
-        maxZ = maximum NUMERICAL zoom, 17 for example
-        minZ = minimum NUMERICAL zoom, 0 for example
-        we use two different methods to get the needed tiles:
-        * splitting the tiles from one zoomlevel down to the other
-        * rounding the tiles coordinates to get tiles from one zoomlevel up
-        we choose a zoomlevel (tilesZ) and then split down and round down from it
-        * tilesZ is determined in the handle message method,
-        it is the zoomlevel on which we compute which tiles are in our download radius
-        -> if tilesZ is too low, this initial tile finding can take too long
-        -> if tilesZ is too high, the tiles could be much larger than our dl. radius and we would
-        be downloading much more tiles than needed
-        => for now, if we get tilesZ (called midZ in handle message) that is lower than 15,
-        we set it to the lowest zoomlevel, so we get don't get too much unneeded tiles when splitting
-        """
-        start = clock()
-        extendedTiles = tiles.copy()
-
-        # start of the tile splitting code
-        previousZoomlevelTiles = None # we will split the tiles from the previous zoomlevel
-        self.log.info("splitting down")
-        for z in range(tilesZ, maxZ): # to max zoom (fo each z we split one zoomlevel down)
-            newTilesFromSplit = set() # tiles from the splitting go there
-            if previousZoomlevelTiles is None: # this is the first iteration
-                previousZoomlevelTiles = tiles.copy()
-            for tile in previousZoomlevelTiles:
-                x = tile[0]
-                y = tile[1]
-                # now we split each tile to 4 tiles on a higher zoomlevel nr
-                # see: http://wiki.openstreetmap.org/wiki/Slippy_map_tilenames#Subtiles
-                # for a tile with coordinates x,y:
-                # 2x,2y  |2x+1,2y
-                # 2x,2y+1|2x+1,2y+1
-                leftUpperTile = (2 * x, 2 * y, z + 1)
-                rightUpperTile = (2 * x + 1, 2 * y, z + 1)
-                leftLowerTile = (2 * x, 2 * y + 1, z + 1)
-                rightLowerTile = (2 * x + 1, 2 * y + 1, z + 1)
-                newTilesFromSplit.add(leftUpperTile)
-                newTilesFromSplit.add(rightUpperTile)
-                newTilesFromSplit.add(leftLowerTile)
-                newTilesFromSplit.add(rightLowerTile)
-            extendedTiles.update(newTilesFromSplit) # add the new tiles to the main set
-            self.log.info("we are at z=%d, %d new tiles from %d", z, len(newTilesFromSplit), z + 1)
-            previousZoomlevelTiles = newTilesFromSplit # set the new tiles s as prev. tiles for next iteration
-
-        # start of the tile coordinates rounding code
-        previousZoomlevelTiles = None # we will the tile coordinates to get tiles for the upper level
-        self.log.info("rounding up")
-        r = range(minZ, tilesZ) # we go from the tile-z up, e.g. a sequence progressively smaller integers
-        r.reverse()
-        for z in r:
-            newTilesFromRounding = set() # tiles from the rounding go there
-            if previousZoomlevelTiles is None: # this is the first iteration
-                previousZoomlevelTiles = tiles.copy()
-            for tile in previousZoomlevelTiles:
-                x = tile[0]
-                y = tile[1]
-                # as per: http://wiki.openstreetmap.org/wiki/Slippy_map_tilenames#Subtiles
-                # we divide each coordinate with 2 to get the upper tile
-                # some upper tiles can be found up to four times, so this could be most probably
-                # optimized if need be (for charting the Jupiter, Sun or a Dyson sphere ? :)"""
-                upperTileX = int(x / 2.0)
-                upperTileY = int(y / 2.0)
-                upperTile = (upperTileX, upperTileY, z)
-                newTilesFromRounding.add(upperTile)
-            extendedTiles.update(newTilesFromRounding) # add the new tiles to the main set
-            self.log.info("we are at z=%d, %d new tiles", z, len(newTilesFromRounding))
-            previousZoomlevelTiles = newTilesFromRounding # set the new tiles s as prev. tiles for next iteration
-
-            self.log.info("nr of tiles after extend: %d", len(extendedTiles))
-        self.log.info("Extend took %1.2f ms", 1000 * (clock() - start))
-
-        del tiles
-
-        return extendedTiles
-
-    def expand(self, tileset, amount=1):
-        """Given a list of tiles, expand the coverage around those tiles"""
-        tiles = {}
-        tileset = [[int(b) for b in a.split(",")] for a in tileset]
-        for tile in tileset:
-            (x, y) = tile
-            for dx in range(-amount, amount + 1):
-                for dy in range(-amount, amount + 1):
-                    tiles["%d,%d" % (x + dx, y + dy)] = True
-        return tiles.keys()
-
-    def spiral(self, x, y, z, distance):
-        (x, y) = (int(round(x)), int(round(y)))
-        # for now we are downloading just tiles,
-        # so I modified this to round the coordinates right after we get them
-
-        class spiraller(object):
-            def __init__(self, x, y, z):
-                self.x = x
-                self.y = y
-                self.z = z
-                self.tiles = [(x, y, z)]
-
-            def moveX(self, dx, direction):
-                for i in range(dx):
-                    self.x += direction
-                    self.touch(self.x, self.y, self.z)
-
-            def moveY(self, dy, direction):
-                for i in range(dy):
-                    self.y += direction
-                    self.touch(self.x, self.y, self.z)
-
-            def touch(self, x, y, z):
-                self.tiles.append((x, y, z))
-
-        s = spiraller(x, y, z)
-        for d in range(1, distance + 1):
-            s.moveX(1, 1) # 1 right
-            s.moveY(d * 2 - 1, -1) # d*2-1 up
-            s.moveX(d * 2, -1)   # d*2 left
-            s.moveY(d * 2, 1)    # d*2 down
-            s.moveX(d * 2, 1)    # d*2 right
-        return s.tiles
-
     def getTilesForRoute(self, route, radius, z):
-        """get tilenames for tiles around the route for given radius and zoom"""
-        # now we look whats the distance between each two trackpoints,
-        # if it is larger than the tracklog radius, we add additional interpolated points,
-        # so we get continuous coverage for the tracklog
-        first = True
-        interpolatedPoints = []
-        for point in route:
-            if first: # the first point has no previous point
-                (lastLat, lastLon) = point[0], point[1]
-                first = False
-                continue
-            thisLat, thisLon = point[0], point[1]
-            distBtwPoints = geo.distance(lastLat, lastLon, thisLat, thisLon)
-            # if the distance between points was greater than the given radius for tiles,
-            # there would be no continuous coverage for the route
-            if distBtwPoints > radius:
-                # so we call this recursive function to interpolate points between
-                # points that are too far apart
-                interpolatedPoints.extend(self.addPointsToLine(lastLat, lastLon, thisLat, thisLon, radius))
-            (lastLat, lastLon) = (thisLat, thisLon)
-            # because we don't care about what order are the points in this case,
-        # we just add the interpolated points to the end
-        route.extend(interpolatedPoints)
+        """Get tiles around the route for given radius and zoom
+
+        :param route: list of (lat, lon, ...) tuples
+        :param int radius: radius around the route in tiles
+        :param int z: zoom level
+        :returns: tiles around the route
+        :rtype: TileSet
+        """
         start = clock()
-        tilesToDownload = set()
-        for point in route: #now we iterate over all points of the route
-            lat, lon = point[0], point[1]
-            # be advised: the xy in this case are not screen coordinates but tile coordinates
-            (x, y) = ll2xy(lat, lon, z)
-            # the spiral gives us tiles around coordinates for a given radius
-            currentPointTiles = self.spiral(x, y, z, radius)
-            # now we take the resulting list  and process it in such a way,
-            # that the tiles coordinates can be stored in a set,
-            # so we will save only unique tiles
-            outputSet = set(map(lambda x: tuple(x), currentPointTiles))
-            tilesToDownload.update(outputSet)
+        tilesToDownload = tilesAroundRoute(route, radius, z)
         self.log.info("Listing tiles took %1.2f ms", 1000 * (clock() - start))
         self.log.info("unique tiles %d", len(tilesToDownload))
         return tilesToDownload
 
-    def addPointsToLine(self, lat1, lon1, lat2, lon2, maxDistance):
-        """experimental (recursive) function for adding additional points between two coordinates,
-        until their distance is less or or equal to maxDistance
-        (this is actually a wrapper for a local recursive function)"""
-        pointsBetween = []
-
-        def localAddPointsToLine(lat1, lon1, lat2, lon2, maxDistance):
-            distance = geo.distance(lat1, lon1, lat2, lon2)
-            if distance <= maxDistance: # the termination criterion
-                return
-            else:
-                middleLat = (lat1 + lat2) / 2.0 # fin the midpoint between the two points
-                middleLon = (lon1 + lon2) / 2.0
-                pointsBetween.append((middleLat, middleLon))
-                # process the 2 new line segments
-                localAddPointsToLine(lat1, lon1, middleLat, middleLon, maxDistance)
-                localAddPointsToLine(middleLat, middleLon, lat2, lon2, maxDistance)
-
-        localAddPointsToLine(lat1, lon1, lat2, lon2, maxDistance) # call the local function
-        return pointsBetween
-
     # GTK GUI stuff
 
     @property
@@ -415,8 +295,8 @@ class MapData(RanaModule):
             return "%s has been downloaded" % prettyMB
         elif self.running:
             if self.checkSizeRunning:
-                prettyMB = utils.bytes_to_pretty_unit_string(self._checkPool.downloadSize)
-                return "batch size is ~%s, %d tiles found locally" % (prettyMB, self._checkPool.foundLocally)
+                return "batch size is ~%s, %d tiles found locally" % (self._estimatedSizeText(),
+                                                                       self._checkPool.foundLocally)
             elif self.batchDownloadRunning:
                 prettyMB = utils.bytes_to_pretty_unit_string(self._downloadPool.downloadedDataSize)
                 if self._checkPool.downloadSize:
@@ -426,17 +306,29 @@ class MapData(RanaModule):
                     approxDlSize = self.approxDownloadSize
                     if approxDlSize >= 0:
                         prettyMB = "%s/~%s" % (prettyMB, utils.bytes_to_pretty_unit_string(approxDlSize))
-                return "%s downloaded" % prettyMB
+                hostStatus = self._downloadPool.hostStatus
+                if hostStatus:
+                    # the tileserver is struggling, let the user know why the download is slow
+                    return "%s downloaded, %s" % (prettyMB, hostStatus)
+                else:
+                    return "%s downloaded" % prettyMB
         else:
             if self._checkPool.ended:
                 if self._checkPool.downloadSize:
-                    prettyMB = utils.bytes_to_pretty_unit_string(self._checkPool.downloadSize)
-                    return "Total size is ~%s (<i>click to recheck</i>)." % prettyMB
+                    return "Total size is ~%s (<i>click to recheck</i>)." % self._estimatedSizeText()
                 else:
                     return ""
             else:
                 return "Total size of tiles is unknown (<i>click to check</i>)."
 
+    def _estimatedSizeText(self):
+        """Estimated batch size, with the confidence interval if the size is not exact"""
+        prettyMB = utils.bytes_to_pretty_unit_string(self._checkPool.downloadSize)
+        error = self._checkPool.downloadSizeError
+        if error:
+            prettyMB = "%s +/- %s" % (prettyMB, utils.bytes_to_pretty_unit_string(error))
+        return prettyMB
+
     @property
     def _boxAction(self):
         if not self.running:
@@ -570,6 +462,7 @@ class MapData(RanaModule):
     def shutdown(self):
         self.stopBatchDownload()
         self.stopBatchSizeEstimation()
+        self._dropResumableJournal()
 
     def refreshTilecount(self):
         """The batch download parameters were changed,
@@ -637,79 +530,106 @@ class MapData(RanaModule):
         self.maxZ = maxZ
 
         if location == DL_LOCATION_HERE:
-            self._addTilesAroundPosition()
+            tilesToDownload = self._tilesAroundPosition()
 
         elif location == DL_LOCATION_TRACK:
-            self._addTilesAroundTrack()
+            tilesToDownload = self._tilesAroundTrack()
 
         elif location == DL_LOCATION_ROUTE: # download around
-            self._addTilesAroundRoute()
+            tilesToDownload = self._tilesAroundRoute()
 
         elif location == DL_LOCATION_VIEW:
-            self._addTilesAroundView()
+            tilesToDownload = self._tilesAroundView()
+
+        else:
+            tilesToDownload = None
+
+        if tilesToDownload:
+            start = clock()
+            # now get the tiles from other zoomlevels as specified
+            zoomlevelExtendedTiles = tilesToDownload.withZoomLevels(self.minZ, self.maxZ)
+            self.log.info("%d tiles on zoom levels %d-%d, extend took %1.2f ms",
+                          len(zoomlevelExtendedTiles), self.minZ, self.maxZ, 1000 * (clock() - start))
+            self.addDownloadRequests(zoomlevelExtendedTiles) # load the tiles to the download queue
 
         self._checkPool.reset()
         self._downloadPool.reset()
 
         self.set("needsRefresh", True)
 
-    def _addTilesAroundPosition(self):
-        """Add tiles around current geographic coordinates (if known)"""
-        # Find which tile we're on
+    def _tilesAroundPosition(self):
+        """Get tiles around current geographic coordinates (if known)
+
+        :returns: tiles on the middle zoom level or None if position is not known
+        :rtype: TileSet or None
+        """
         size = int(self.get("downloadSize", 4))
         pos = self.get("pos", None)
         if pos is not None:
             (lat, lon) = pos
-            # be advised: the xy in this case are not screen coordinates but tile coordinates
-            (x, y) = ll2xy(lat, lon, self.midZ)
-            tilesAroundHere = set(self.spiral(x, y, self.midZ, size)) # get tiles around our position as a set
-            # now get the tiles from other zoomlevels as specified
-            zoomlevelExtendedTiles = self.addOtherZoomlevels(tilesAroundHere, self.midZ, self.maxZ, self.minZ)
-            self.addDownloadRequests(zoomlevelExtendedTiles) # load the files to the download queue
+            return self._tilesAroundPoint(lat, lon, size)
+        else:
+            return None
+
+    def _tilesAroundPoint(self, lat, lon, size):
+        # be advised: the xy in this case are not screen coordinates but tile coordinates
+        (x, y) = tileXY(lat, lon, self.midZ)
+        return TileSet([(x, y, self.midZ)]).dilated(size)
 
-    def _addTilesAroundTrack(self):
-        """Get tiles around the active (?) tracklog
-        TODO: this looks kinda weird :)
+    def _tilesAroundTrack(self):
+        """Get tiles around the active tracklog
+
+        :returns: tiles on the middle zoom level or None if there is no active tracklog
+        :rtype: TileSet or None
         """
         loadTl = self.m.get('loadTracklogs', None) # get the tracklog module
         GPXTracklog = loadTl.get_active_tracklog()
+        if GPXTracklog is None:
+            return None
         size = int(self.get("downloadSize", 4))
         # get all tracklog points
-        trackpointsListCopy = map(lambda x: (x.latitude, x.longitude, None), GPXTracklog.trackpointsList[0])[:]
-        tilesToDownload = self.getTilesForRoute(trackpointsListCopy, size, self.midZ)
-        zoomlevelExtendedTiles = self.addOtherZoomlevels(tilesToDownload, self.midZ, self.maxZ, self.minZ)
-        self.addDownloadRequests(zoomlevelExtendedTiles) # load the files to the download queue
+        points = GPXTracklog.points
+        trackpoints = [(lat, lon, None) for lat, lon in zip(points.lats, points.lons)]
+        return self.getTilesForRoute(trackpoints, size, self.midZ)
+
+    def _tilesAroundRoute(self):
+        """Get tiles around currently active turn-by-turn route (if any)
 
-    def _addTilesAroundRoute(self):
-        """Add tiles around currently active turn-by-turn route (if any)"""
+        :returns: tiles on the middle zoom level or None if there is no active route
+        :rtype: TileSet or None
+        """
         routeModule = self.m.get('route', None) # get the tracklog module
         size = int(self.get("downloadSize", 4))
         if routeModule:
             route = routeModule.get_directions()
             if route:
-                tilesToDownload = self.getTilesForRoute(route.points_lle, size, self.midZ)
-                zoomlevelExtendedTiles = self.addOtherZoomlevels(tilesToDownload, self.midZ, self.maxZ, self.minZ)
-                self.addDownloadRequests(zoomlevelExtendedTiles) # load the files to the download queue
+                return self.getTilesForRoute(route.points_lle, size, self.midZ)
             else:
                 self.set('menu', 'main')
                 self.notify("No active route", 3000)
+        return None
 
-    def _addTilesAroundView(self):
-        """Add tiles around center of the current main map view"""
+    def _tilesAroundView(self):
+        """Get tiles around center of the current main map view
+
+        :returns: tiles on the middle zoom level
+        :rtype: TileSet
+        """
         proj = self.m.get('projection', None)
         size = int(self.get("downloadSize", 4))
         (screenCenterX, screenCenterY) = proj.screenPos(0.5, 0.5) # get pixel coordinates for the screen center
         (lat, lon) = proj.xy2ll(screenCenterX, screenCenterY) # convert to geographic coordinates
-        (x, y) = ll2xy(lat, lon, self.midZ) # convert to tile coordinates
-        tilesAroundView = set(self.spiral(x, y, self.midZ, size)) # get tiles around these coordinates
-        # now get the tiles from other zoomlevels as specified
-        zoomlevelExtendedTiles = self.addOtherZoomlevels(tilesAroundView, self.midZ, self.maxZ, self.minZ)
-        self.addDownloadRequests(zoomlevelExtendedTiles) # load the files to the download queue
+        return self._tilesAroundPoint(lat, lon, size)
 
     def startBatchDownload(self):
         """Start threaded batch tile download"""
         layerId = self.get('layer', "mapnik")
-        self._downloadPool.layer = self._getLayerById(layerId)
+        layer = self._getLayerById(layerId)
+        if layer is not None and not layer.url:
+            self.log.error("can't do batch download - layer %s has no tile server", layerId)
+            self.notify("Layer %s can't be downloaded" % layer.label, 3000)
+            return
+        self._downloadPool.layer = layer
 
         self.log.info("starting download")
         if len(self._tileDownloadRequests) == 0:
@@ -724,6 +644,8 @@ class MapData(RanaModule):
             return
 
         self.log.info("starting batch tile download")
+        # a new batch replaces the journal of any interrupted batch
+        self._dropResumableJournal()
         # process all download request and discard processed requests from the pool
         self._downloadPool.startBatch(self._tileDownloadRequests)
 
@@ -749,6 +671,37 @@ class MapData(RanaModule):
         # so all the threads (even when doing it with a single thread) hanged on the block
         # it seems to be working alright + its pretty fast too
 
+    def resumeBatchDownload(self):
+        """Resume an interrupted batch tile download"""
+        journal = self._resumableJournal
+        if journal is None:
+            self.log.error("can't resume batch download - no interrupted batch found")
+            return
+        if self.running:
+            self.log.error("can't resume batch download - batch operation already in progress")
+            return
+        layer = self._getLayerById(journal.layerId)
+        if layer is None:
+            self.log.error("can't resume batch download - unknown layer: %s", journal.layerId)
+            self.notify("Can't resume batch download - layer %s not found" % journal.layerId, 3000)
+            return
+        self.log.info("resuming batch tile download of %d tiles", journal.pendingCount)
+        self._resumableJournal = None
+        self._resumableBatchChanged()
+        with self._tileDownloadRequestsLock:
+            self._tileDownloadRequests.clear()
+            self._tileDownloadRequests.update(TileSet(journal.pendingItems()))
+        self._checkPool.reset()
+        self._downloadPool.reset()
+        self._downloadPool.layer = layer
+        self._downloadPool.startBatch(self._tileDownloadRequests, journal=journal)
+
+    def _dropResumableJournal(self):
+        if self._resumableJournal:
+            self._resumableJournal.close()
+            self._resumableJournal = None
+            self._resumableBatchChanged()
+
     def stopBatchDownload(self):
         """Stop threaded batch tile download"""
         self.log.info("stopping batch tile download")
@@ -793,10 +746,10 @@ class MapData(RanaModule):
             return
 
         with self._tileDownloadRequestsLock:
-            # start check on a shallow copy that we can process
+            # start check on a copy that we can process
             # iterate over it but also pop locally available
             # tiles from the the original set
-            requestsCopy = copy.copy(self._tileDownloadRequests)
+            requestsCopy = self._tileDownloadRequests.copy()
         self.log.info("starting batch size estimation")
         self._checkPool.startBatch(requestsCopy)
 
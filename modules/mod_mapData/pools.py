@@ -2,6 +2,7 @@
 # Tile checking & batch download pools
 from __future__ import with_statement
 
+import sys
 import threading
 import time
 from core import constants
@@ -9,18 +10,32 @@ from core import threads
 from core import tiles
 from core.signal import Signal
 from core import utils
+from core import http_pools
+from core.negative_cache import PERMANENT_ERRORS, ERROR_NOT_IMAGE
+from core.host_controller import HostUnavailable
 from core.pool import ThreadPool
+from .batch_journal import BatchJournal
+from .size_estimator import BatchSizeEstimator
 from core.singleton import modrana
 
 import logging
 log = logging.getLogger("mod.mapData.pools")
 
 MAX_RETRIES = 3
-RETRY_WAIT = 0.1  # 100 ms
+# how many tiles to check for local availability at once
+LOCAL_CHECK_CHUNK_SIZE = 1000
 
 DEFAULT_THREAD_POOL_NAME = "modRanaBatchPool"
 _threadPoolIndex = 1
 
+class TileDownloadFailedException(Exception):
+    def __init__(self, url, status):
+        self.url = url
+        self.status = status
+
+    def __str__(self):
+        return "tileserver returned HTTP status %d\nURL:%s" % (self.status, self.url)
+
 class TileNotImageException(Exception):
     def __init__(self, url):
         self.parameter = 1
@@ -162,9 +177,10 @@ class TileBatchPool(BatchPool):
     def __init__(self, name):
         BatchPool.__init__(self, name)
         self._layer = None
-        self._connPool = None
+        self._hostController = None
         self._mapDataM = None
         self._storeTilesM = None
+        self._mapTilesM = None
         self._ended = False
         self.batchDone.connect(self._batchDoneCB)
 
@@ -180,6 +196,35 @@ class TileBatchPool(BatchPool):
             self._storeTilesM = modrana.m.get("storeTiles")
         return self._storeTilesM
 
+    @property
+    def _negativeCache(self):
+        """Negative cache of recently failed tile downloads
+        (shared with the automatic tile downloader)
+        """
+        if not self._mapTilesM:
+            self._mapTilesM = modrana.m.get("mapTiles")
+        return self._mapTilesM.negativeCache
+
+    @property
+    def _hostControllers(self):
+        """Per-host download controllers
+        (shared with the automatic tile downloader)
+        """
+        if not self._mapTilesM:
+            self._mapTilesM = modrana.m.get("mapTiles")
+        return self._mapTilesM.hostControllers
+
+    @property
+    def hostStatus(self):
+        """Description of the tileserver host state
+        or an empty string if the host is healthy
+        """
+        controller = self._hostController
+        if controller:
+            return controller.statusText()
+        else:
+            return ""
+
     @property
     def layer(self):
         return self._layer
@@ -207,26 +252,50 @@ class TileBatchPool(BatchPool):
     def _cleanup(self):
         super(TileBatchPool, self)._cleanup()
         self._layer = None
-        self._connPool = None
+        self._hostController = None
 
     def _processBatch(self):
-        # setup the connection pool
         if self.layer is None:
             log.error("tile batch pool: layer is None, aborting")
             return
-        self._connPool = utils.create_connection_pool(getAnUrl(self._batch, self._layer))
+        url = getAnUrl(self._batch, self._layer)
+        if url:
+            self._hostController = self._hostControllers.get(url)
 
 class BatchSizeCheckPool(TileBatchPool):
+    """Check how much data needs to be downloaded for a batch
+
+    By default the batch size is estimated from a sample of the tiles
+    on each zoom level (see BatchSizeEstimator), the size of every single
+    tile is only checked in the exact mode.
+    """
+
     def __init__(self):
         TileBatchPool.__init__(self,
                                name=constants.THREAD_POOL_BATCH_SIZE_CHECK
         )
         self._downloadSize = 0
         self._foundLocally = 0
+        self._estimator = None
 
     @property
     def downloadSize(self):
-        return self._downloadSize
+        estimator = self._estimator
+        if estimator:
+            return estimator.estimate()[0]
+        else:
+            return self._downloadSize
+
+    @property
+    def downloadSizeError(self):
+        """Half-width of the download size confidence interval in bytes,
+        0 if the size is exact and None if it is not known
+        """
+        estimator = self._estimator
+        if estimator:
+            return estimator.estimate()[1]
+        else:
+            return 0
 
     @property
     def foundLocally(self):
@@ -237,6 +306,7 @@ class BatchSizeCheckPool(TileBatchPool):
         # clear variables from previous run
         self._downloadSize = 0
         self._foundLocally = 0
+        self._estimator = None
 
     def _maxThreads(self):
         return int(modrana.get('maxSizeThreads', constants.DEFAULT_THREAD_COUNT_BATCH_SIZE_CHECK))
@@ -251,45 +321,89 @@ class BatchSizeCheckPool(TileBatchPool):
         # again, so we need to reset the size estimate
         super(BatchSizeCheckPool, self)._processBatch()
         self._downloadSize = 0
+        mode = modrana.get('batchSizeCheckMode', constants.DEFAULT_BATCH_SIZE_CHECK_MODE)
+        if mode == constants.BATCH_SIZE_CHECK_EXACT:
+            self._estimator = None
+        else:
+            self._estimator = BatchSizeEstimator()
+        # check which tiles are available locally in chunks,
+        # rather than one by one from the size checking threads
+        chunk = []
         for item in self._batch:
             if self._shutdown:
                 break
+            chunk.append(item)
+            if len(chunk) >= LOCAL_CHECK_CHUNK_SIZE:
+                self._processChunk(chunk)
+                chunk = []
+        if chunk and not self._shutdown:
+            self._processChunk(chunk)
+        if self._estimator and not self._shutdown:
+            self._submitSamples()
+
+    def _processChunk(self, chunk):
+        """Remove locally available tiles from the request set
+        and submit size checks for the rest
+        (or add them to the estimator when sampling)
+        """
+        lzxyItems = dict(((self._layer, z, x, y), (x, y, z)) for (x, y, z) in chunk)
+        storedTiles = self._storeTiles.tiles_stored(lzxyItems.keys())
+        for lzxy, item in lzxyItems.items():
+            if lzxy in storedTiles:
+                # remove locally available tiles from request set
+                self._mapData.removeTileDownloadRequest(item)
+                with self._mutex:
+                    self._foundLocally+=1
+                    self._doneCount+=1
+                if self._estimator:
+                    self._estimator.addStoredTile(item)
+            elif self._estimator:
+                self._estimator.addMissingTile(item)
             else:
                 self._pool.submit(self._handleItemWrapper, item)
 
+    def _submitSamples(self):
+        """Learn tile sizes from locally stored tiles of the layer
+        and submit size checks for a sample of the tiles to download
+        """
+        estimator = self._estimator
+        storedSample = estimator.storedSample()
+        if storedSample:
+            lzxys = [(self._layer, z, x, y) for (x, y, z) in storedSample]
+            for lzxy, size in self._storeTiles.get_tile_sizes(lzxys).items():
+                estimator.addStoredSize(lzxy[1], size)
+        remoteSample = estimator.remoteSample()
+        log.info("estimating batch size from %d local & %d remote tile samples",
+                 len(storedSample), len(remoteSample))
+        # tiles not in the sample are done once sampled
+        with self._mutex:
+            self._doneCount += estimator.tileCount - len(remoteSample)
+        for item in remoteSample:
+            self._pool.submit(self._handleItemWrapper, item)
+
     def _handleItem(self, item):
         x, y, z = item
         lzxy = (self._layer, z, x, y)
         size = self._checkTileSize(lzxy)
         if size:
-            with self._mutex:
-                self._downloadSize+=size
-        elif size is None:
-            # remove locally available tiles from request set
-            self._mapData.removeTileDownloadRequest(item)
-            with self._mutex:
-                self._foundLocally+=1
+            if self._estimator:
+                self._estimator.addRemoteSize(z, size)
+            else:
+                with self._mutex:
+                    self._downloadSize+=size
 
     def _checkTileSize(self, lzxy):
-        """Get a size of a tile from HTTP header,
-        if the tile is locally available remove it form the
-        download request set
+        """Get a size of a tile from HTTP header
 
-        :returns: size in bytes, None if tile is available and
-                  0 if the header check raised an exception
-        :rtype: int or None
+        :returns: size in bytes or 0 if the header check raised an exception
+        :rtype: int
         """
         size = 0
         url = "unknown url"
         try:
             url = tiles.getTileUrl(lzxy)
-            # does the tile exist ?
-            if self._storeTiles.tile_is_stored(lzxy): # if the file does not exist
-                size = None # it exists, return None
-            else:
-                # the tile does not exist, get its HTTP header
-                request = self._connPool.urlopen('HEAD', url)
-                size = int(request.getheaders()['content-length'])
+            request = http_pools.registry.get(url, size=self._maxThreads()).urlopen('HEAD', url)
+            size = int(request.getheaders()['content-length'])
         except IOError:
             log.error("Could not open document: %s", url)
             # the url errored out, so we just say it  has zero size
@@ -309,6 +423,10 @@ class BatchTileDownloadPool(TileBatchPool):
         self._initialBatchSize = 0
         self._downloadedDataSize = 0
         self._failedCount = 0
+        # path to the batch journal file, if set, progress of the batch
+        # is journaled so that the batch can be resumed if interrupted
+        self.journalPath = None
+        self._journal = None
 
     @property
     def downloadedDataSize(self):
@@ -334,14 +452,42 @@ class BatchTileDownloadPool(TileBatchPool):
     def _maxThreads(self):
         return int(modrana.get('maxDlThreads', constants.DEFAULT_THREAD_COUNT_AUTOMATIC_TILE_DOWNLOAD))
 
+    def startBatch(self, batch, journal=None, **kwargs):
+        """Process a batch
+
+        :param batch: TileSet of (x, y, z) tiles, processed tiles are popped from it
+        :param journal: journal of an interrupted batch to resume,
+                        the batch should contain the pending tiles of the journal
+        :type journal: BatchJournal or None
+        """
+        with self._mutex:
+            if not self._running:
+                self._journal = journal
+        super(BatchTileDownloadPool, self).startBatch(batch, **kwargs)
+
     def _processBatch(self):
         """While processing the download batch we remove
         the requests one by one and process them
         """
         super(BatchTileDownloadPool, self)._processBatch()
 
-
-        self._initialBatchSize = len(self._batch)
+        if self._journal:
+            # resuming an interrupted batch
+            with self._mutex:
+                self._initialBatchSize = self._journal.tileCount
+                self._doneCount = self._journal.doneCount
+                self._downloadedDataSize = self._journal.downloadedDataSize
+            log.info("resuming batch download, %d of %d tiles already done",
+                     self._doneCount, self._initialBatchSize)
+        else:
+            self._initialBatchSize = len(self._batch)
+            if self.journalPath and self._layer:
+                journal = BatchJournal(self.journalPath)
+                try:
+                    journal.create(self._layer.id, self._batch)
+                    self._journal = journal
+                except Exception:
+                    log.exception("can't create batch journal, the batch will not be resumable")
 
         while not self._shutdown:
             try:
@@ -357,24 +503,55 @@ class BatchTileDownloadPool(TileBatchPool):
         # TODO: use zxy for item
         lzxy = (self._layer, z, x, y)
         size = False
+        journal = self._journal
+        negativeCache = self._negativeCache
+        if negativeCache.isBlocked(lzxy):
+            # the tile failed to download recently, don't try again just yet
+            with self._mutex:
+                self._failedCount+=1
+            return
+        controller = self._hostControllers.get(tiles.getTileUrl(lzxy))
         # 1. attempt + 3 retries
-        for i in range(0, MAX_RETRIES+1):
+        attempt = 0
+        while attempt <= MAX_RETRIES and not self._shutdown:
             try:
                 size = self._saveTileForURL(lzxy)
+            except HostUnavailable:
+                # the tileserver is backing off - wait until it should be
+                # available again, without using up the retries of the tile
+                self._wait(controller.retryDelay(attempt))
+                continue
+            except (TileDownloadFailedException, TileNotImageException):
+                log.exception("tile download failed in batch download thread:")
             except Exception:
                 log.exception("exception in batch download thread:")
+                negativeCache.recordException(lzxy, sys.exc_info()[1])
+            if size is None:  # nothing to download
+                if journal:
+                    journal.markDone(item)
+                return
             if size != False:  # download successful
                 with self._mutex:
                     self._downloadedDataSize+=size
+                if journal:
+                    journal.markDone(item, size)
+                break
+            failure = negativeCache.getFailure(lzxy)
+            if failure and failure[0] in PERMANENT_ERRORS:
+                # retrying will not help
                 break
             # wait a bit before retry
-            time.sleep(RETRY_WAIT)
+            self._wait(controller.retryDelay(attempt))
+            attempt+=1
         if size == False:
             with self._mutex:
                 self._failedCount+=1
 
     def _saveTileForURL(self, lzxy):
-        """save a tile for url created from its coordinates"""
+        """save a tile for url created from its coordinates
+
+        :returns: downloaded data size or None if the tile does not need to be downloaded
+        """
         url = tiles.getTileUrl(lzxy)
 
         goAhead = False
@@ -390,7 +567,10 @@ class BatchTileDownloadPool(TileBatchPool):
             # only download tiles in the area that already exist
             goAhead = self._storeTiles.tile_is_stored(lzxy)
         if goAhead: # if the file does not exist
-            request = self._connPool.request('get', url)
+            connPool = http_pools.registry.get(url, size=self._maxThreads())
+            request = self._hostControllers.get(url).request(connPool, 'get', url)
+            if self._negativeCache.recordResponse(lzxy, request.status):
+                raise TileDownloadFailedException(url, request.status)
             size = int(request.getheaders()['content-length'])
             content = request.data
             # The tileserver sometimes returns a HTML error page
@@ -406,13 +586,31 @@ class BatchTileDownloadPool(TileBatchPool):
                 self._storeTiles.store_tile_data(lzxy, content)
             else:
                 # its not ana image, raise exception
+                self._negativeCache.addFailure(lzxy, ERROR_NOT_IMAGE)
                 raise TileNotImageException(url)
             return size # something was actually downloaded and saved
         else:
-            return False # nothing was downloaded
+            return None # nothing needs to be downloaded
+
+    def _wait(self, delay):
+        """Wait for the given time, unless the batch is stopped"""
+        deadline = time.time() + delay
+        while not self._shutdown:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, 0.5))
 
     def _cleanup(self):
         super(BatchTileDownloadPool, self)._cleanup()
+        if self._journal:
+            if self._journal.pendingCount:
+                # the batch has been interrupted or some tiles failed,
+                # keep the journal so that the batch can be resumed
+                self._journal.close()
+            else:
+                self._journal.discard()
+            self._journal = None
         self._failedCount = 0
         self._initialBatchSize = 0
         # tell the mapData module a batch tile
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+# Statistical batch size estimation
+"""Statistical batch size estimation
+
+Checking the size of every tile in a large batch takes a HTTP request
+per tile, so instead the tiles that need to be downloaded are split to strata
+by zoom level & the size of a random sample of each stratum is checked.
+Sizes of tiles of the same layer & zoom level already available locally
+are used as additional samples, so that zoom levels that have been browsed
+before need fewer (or no) size checks on the tileserver.
+
+The estimated batch size is the sum of the per-zoom mean tile size multiplied
+by the number of tiles on the zoom level and comes with a confidence interval
+based on the sample variance of each zoom level.
+"""
+from __future__ import with_statement
+import math
+import random
+import threading
+
+import logging
+log = logging.getLogger("mod.mapData.size_estimator")
+
+# how many tile sizes to collect per zoom level
+SAMPLES_PER_ZOOM = 100
+# how many tile sizes to check on the tileserver per zoom level
+# even if enough locally stored tiles are available
+# (the locally stored tiles are likely from the most browsed areas,
+# which might not be representative of the rest of the batch)
+MIN_REMOTE_SAMPLES = 20
+# 95 % confidence interval
+CONFIDENCE_Z = 1.96
+
+
+class _Stratum(object):
+    """Tiles to download & size samples for a single zoom level"""
+
+    def __init__(self):
+        # number of tiles to download on the zoom level
+        self.count = 0
+        # reservoir samples of tiles to download & of stored tiles
+        self.missingSample = []
+        self.storedCount = 0
+        self.storedSample = []
+        # sums of sizes and squared sizes, remote samples are counted separately
+        # as the sizes of all remote samples add up to an exact total
+        self.n = 0
+        self.sum = 0
+        self.sumSq = 0
+        self.remoteN = 0
+        self.remoteSum = 0
+
+    def addSize(self, size):
+        self.n += 1
+        self.sum += size
+        self.sumSq += size * size
+
+    def meanAndVariance(self):
+        mean = self.sum / float(self.n)
+        if self.n > 1:
+            variance = max(self.sumSq - self.n * mean * mean, 0) / (self.n - 1)
+        else:
+            # a single sample says nothing about the spread,
+            # so assume the standard deviation is as big as the mean
+            variance = mean * mean
+        return mean, variance
+
+
+def _reservoirAdd(sample, seen, item, size, rng):
+    """Algorithm R reservoir sampling step
+
+    :param list sample: the reservoir
+    :param int seen: number of items seen before this one
+    """
+    if len(sample) < size:
+        sample.append(item)
+    else:
+        index = int(rng.random() * (seen + 1))
+        if index < size:
+            sample[index] = item
+
+
+class BatchSizeEstimator(object):
+    """Estimate the size of a batch from per-zoom samples of tile sizes
+
+    Usage:
+    * report all tiles with addMissingTile() & addStoredTile()
+    * look up sizes of the storedSample() tiles & report them with addStoredSize()
+    * check sizes of the remoteSample() tiles & report them with addRemoteSize()
+    * the estimate() is available at any time & improves as sizes are added
+
+    NOTE: the estimator is thread safe, so sizes can be reported directly
+          from the size checking threads
+    """
+
+    def __init__(self, samplesPerZoom=SAMPLES_PER_ZOOM, minRemoteSamples=MIN_REMOTE_SAMPLES, rng=None):
+        """
+        :param int samplesPerZoom: how many tile sizes to collect per zoom level
+        :param int minRemoteSamples: how many tile sizes to check remotely per zoom level
+        :param rng: random number generator (random.Random instance)
+        """
+        self._samplesPerZoom = samplesPerZoom
+        self._minRemoteSamples = min(minRemoteSamples, samplesPerZoom)
+        self._random = rng or random.Random()
+        self._lock = threading.Lock()
+        # zoom level -> _Stratum
+        self._strata = {}
+
+    @property
+    def tileCount(self):
+        """Number of tiles to download"""
+        with self._lock:
+            return sum(stratum.count for stratum in self._strata.values())
+
+    def _stratum(self, z):
+        stratum = self._strata.get(z)
+        if stratum is None:
+            stratum = _Stratum()
+            self._strata[z] = stratum
+        return stratum
+
+    def addMissingTile(self, item):
+        """Add a tile that needs to be downloaded
+
+        :param tuple item: (x, y, z) tile tuple
+        """
+        with self._lock:
+            stratum = self._stratum(item[2])
+            _reservoirAdd(stratum.missingSample, stratum.count, item, self._samplesPerZoom, self._random)
+            stratum.count += 1
+
+    def addStoredTile(self, item):
+        """Add a tile that is already stored locally
+
+        :param tuple item: (x, y, z) tile tuple
+        """
+        with self._lock:
+            stratum = self._stratum(item[2])
+            _reservoirAdd(stratum.storedSample, stratum.storedCount, item, self._samplesPerZoom, self._random)
+            stratum.storedCount += 1
+
+    def storedSample(self):
+        """Get locally stored tiles, the sizes of which should be looked up
+
+        Stored tiles are only needed for zoom levels with tiles to download.
+
+        :returns: list of (x, y, z) tile tuples
+        :rtype: list
+        """
+        with self._lock:
+            items = []
+            for stratum in self._strata.values():
+                if stratum.count:
+                    items.extend(stratum.storedSample)
+            return items
+
+    def addStoredSize(self, z, size):
+        """Add size of a locally stored tile
+
+        :param int z: zoom level of the tile
+        :param int size: tile size in bytes
+        """
+        with self._lock:
+            self._stratum(z).addSize(size)
+
+    def remoteSample(self):
+        """Get a random sample of the tiles to download, the sizes of which
+        should be checked on the tileserver
+
+        Zoom levels with enough sizes of locally stored tiles
+        only need the minimal number of remote samples.
+
+        :returns: list of (x, y, z) tile tuples
+        :rtype: list
+        """
+        with self._lock:
+            items = []
+            for stratum in self._strata.values():
+                size = max(self._samplesPerZoom - stratum.n, self._minRemoteSamples)
+                sample = list(stratum.missingSample)
+                self._random.shuffle(sample)
+                items.extend(sample[:size])
+            return items
+
+    def addRemoteSize(self, z, size):
+        """Add size of a tile to download as reported by the tileserver
+
+        :param int z: zoom level of the tile
+        :param int size: tile size in bytes
+        """
+        with self._lock:
+            stratum = self._stratum(z)
+            stratum.addSize(size)
+            stratum.remoteN += 1
+            stratum.remoteSum += size
+
+    def estimate(self):
+        """Estimate the size of all the tiles to download
+
+        Zoom levels without any size samples use the mean size
+        of all samples from the other zoom levels.
+
+        :returns: (estimated size, confidence interval half-width) tuple in bytes,
+                  the interval half-width is None if there is nothing to base the estimate on
+        :rtype: tuple
+        """
+        with self._lock:
+            pooled = _Stratum()
+            for stratum in self._strata.values():
+                pooled.n += stratum.n
+                pooled.sum += stratum.sum
+                pooled.sumSq += stratum.sumSq
+            total = 0.0
+            variance = 0.0
+            for stratum in self._strata.values():
+                if not stratum.count:
+                    continue
+                if stratum.remoteN >= stratum.count:
+                    # every tile has been checked, so this is exact
+                    total += stratum.remoteSum
+                    continue
+                sampled = stratum if stratum.n else pooled
+                if not sampled.n:
+                    return 0, None
+                mean, sampleVariance = sampled.meanAndVariance()
+                total += stratum.count * mean
+                # only the remotely checked tiles come from the tiles to download,
+                # so only they count for the finite population correction
+                correction = 1.0 - stratum.remoteN / float(stratum.count)
+                variance += stratum.count * stratum.count * sampleVariance / sampled.n * correction
+            return int(round(total)), int(round(CONFIDENCE_Z * math.sqrt(variance)))
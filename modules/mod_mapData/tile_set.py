@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+# Compact sets of map tiles
+"""Compact sets of map tiles
+
+Batch download areas (the surroundings of a position, a track or a route
+over a range of zoom levels) easily cover hundreds of thousands of tiles,
+which are expensive to handle one by one as Python tuples.
+
+A tile set instead stores each row of tiles on a zoom level as a sorted list
+of non-overlapping inclusive x intervals. The surroundings of a route are just
+a few intervals per row, so union, dilation & zoom level projection work
+on intervals and the number of tiles can be computed without listing them.
+Tiles are only listed once the set is iterated, so a tile set can also serve
+as the request set of a batch download - tiles are popped from it one by one
+as they are being downloaded.
+
+Routes & tracks are turned to tile sets by rasterising each segment
+of the polyline in tile space, so the result covers every tile the
+polyline passes through, no matter how far apart its points are.
+"""
+from bisect import bisect_right
+from math import floor
+
+from core.tilenames import ll2xy
+
+
+def _mergeIntervals(intervals):
+    """Merge overlapping & adjacent intervals
+
+    :param list intervals: list of (start, end) inclusive intervals in any order
+    :returns: sorted list of non-overlapping & non-adjacent intervals
+    :rtype: list
+    """
+    intervals = sorted(intervals)
+    merged = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _intervalsFromXs(xs):
+    """Turn x coordinates to a list of intervals
+
+    :param xs: iterable of x coordinates in any order, possibly with duplicates
+    :returns: sorted list of non-overlapping & non-adjacent intervals
+    :rtype: list
+    """
+    intervals = []
+    for x in sorted(set(xs)):
+        if intervals and x == intervals[-1][1] + 1:
+            intervals[-1] = (intervals[-1][0], x)
+        else:
+            intervals.append((x, x))
+    return intervals
+
+
+def _rasterizeSegment(rows, x1, y1, x2, y2):
+    """Add all tiles a line segment passes through (supercover) to rows
+
+    The segment is walked row by row - within a single tile row
+    a straight segment covers a contiguous range of x coordinates.
+
+    :param dict rows: y -> list of (first x, last x) intervals
+    :param float x1, y1, x2, y2: segment end points in fractional tile coordinates
+    """
+    if y1 > y2:
+        x1, y1, x2, y2 = x2, y2, x1, y1
+    firstRow = int(floor(y1))
+    lastRow = int(floor(y2))
+    if firstRow == lastRow:
+        rows.setdefault(firstRow, []).append((int(floor(min(x1, x2))), int(floor(max(x1, x2)))))
+        return
+    slope = (x2 - x1) / (y2 - y1)
+    for row in range(firstRow, lastRow + 1):
+        # part of the segment inside the row
+        startX = x1 + (max(y1, row) - y1) * slope
+        endX = x1 + (min(y2, row + 1) - y1) * slope
+        if startX > endX:
+            startX, endX = endX, startX
+        rows.setdefault(row, []).append((int(floor(startX)), int(floor(endX))))
+
+
+class TileSet(object):
+    """A set of (x, y, z) tiles stored as x intervals per tile row
+
+    NOTE: row interval lists are never modified in place, just replaced,
+          so they can be shared between rows and tile sets
+
+    NOTE: the tile set is not thread safe, users need to provide their own locking
+          (the number of tiles is cached once computed & kept up to date by
+          pop() & discard(), so reading the length while tiles are popped is safe)
+    """
+
+    def __init__(self, tiles=()):
+        """
+        :param tiles: iterable of (x, y, z) tile tuples
+        """
+        # z -> {y : sorted list of (first x, last x) intervals}
+        self._zooms = {}
+        # number of tiles, None if not known
+        self._count = None
+        rows = {}
+        for x, y, z in tiles:
+            rows.setdefault((z, y), []).append(x)
+        for (z, y), xs in rows.items():
+            self._zooms.setdefault(z, {})[y] = _intervalsFromXs(xs)
+
+    @classmethod
+    def fromPolyline(cls, points, z):
+        """Get all tiles a polyline passes through
+
+        :param points: iterable of (x, y) fractional tile coordinates on the zoom level
+        :param int z: zoom level
+        :returns: tiles covered by the polyline
+        :rtype: TileSet
+        """
+        rows = {}
+        previous = None
+        for point in points:
+            if previous is None:
+                _rasterizeSegment(rows, point[0], point[1], point[0], point[1])
+            else:
+                _rasterizeSegment(rows, previous[0], previous[1], point[0], point[1])
+            previous = point
+        maxCoordinate = 2 ** z - 1
+        tileRows = {}
+        for y, intervals in rows.items():
+            if 0 <= y <= maxCoordinate:
+                intervals = [(max(start, 0), min(end, maxCoordinate)) for start, end in intervals
+                             if end >= 0 and start <= maxCoordinate]
+                if intervals:
+                    tileRows[y] = _mergeIntervals(intervals)
+        tileSet = cls()
+        if tileRows:
+            tileSet._zooms[z] = tileRows
+        return tileSet
+
+    @property
+    def zoomLevels(self):
+        """Sorted list of zoom levels with some tiles"""
+        return sorted(z for z, rows in self._zooms.items() if rows)
+
+    def __len__(self):
+        count = self._count
+        if count is None:
+            count = 0
+            for rows in self._zooms.values():
+                for intervals in rows.values():
+                    for start, end in intervals:
+                        count += end - start + 1
+            self._count = count
+        return count
+
+    def __bool__(self):
+        return any(self._zooms.values())
+
+    __nonzero__ = __bool__  # Python 2
+
+    def __iter__(self):
+        for z in sorted(self._zooms):
+            rows = self._zooms[z]
+            for y in sorted(rows):
+                for start, end in rows[y]:
+                    for x in range(start, end + 1):
+                        yield (x, y, z)
+
+    def __contains__(self, tile):
+        x, y, z = tile
+        intervals = self._zooms.get(z, {}).get(y)
+        if not intervals:
+            return False
+        index = bisect_right(intervals, (x, float("inf"))) - 1
+        return index >= 0 and intervals[index][1] >= x
+
+    def count(self, z):
+        """Number of tiles on the given zoom level"""
+        count = 0
+        for intervals in self._zooms.get(z, {}).values():
+            for start, end in intervals:
+                count += end - start + 1
+        return count
+
+    def _addRow(self, z, y, intervals):
+        self._count = None
+        rows = self._zooms.setdefault(z, {})
+        existing = rows.get(y)
+        if existing:
+            rows[y] = _mergeIntervals(existing + intervals)
+        else:
+            rows[y] = intervals
+
+    def addRectangle(self, z, x1, y1, x2, y2):
+        """Add all tiles in a rectangle (inclusive) on a zoom level"""
+        intervals = [(x1, x2)]
+        for y in range(y1, y2 + 1):
+            self._addRow(z, y, intervals)
+
+    def discard(self, tile):
+        """Remove a tile from the set if present"""
+        x, y, z = tile
+        rows = self._zooms.get(z)
+        intervals = rows.get(y) if rows else None
+        if not intervals:
+            return
+        index = bisect_right(intervals, (x, float("inf"))) - 1
+        if index < 0 or intervals[index][1] < x:
+            return
+        start, end = intervals[index]
+        split = [(start, x - 1), (x + 1, end)]
+        intervals = intervals[:index] + [(a, b) for a, b in split if a <= b] + intervals[index + 1:]
+        if intervals:
+            rows[y] = intervals
+        else:
+            del rows[y]
+        if self._count is not None:
+            self._count -= 1
+
+    def pop(self):
+        """Remove and return an arbitrary tile from the set
+
+        :returns: (x, y, z) tile tuple
+        :raises KeyError: if the set is empty
+        """
+        while self._zooms:
+            z = next(iter(self._zooms))
+            rows = self._zooms[z]
+            if not rows:
+                del self._zooms[z]
+                continue
+            y = next(iter(rows))
+            intervals = rows[y]
+            start, end = intervals[-1]
+            if start < end:
+                rows[y] = intervals[:-1] + [(start, end - 1)]
+            elif len(intervals) > 1:
+                rows[y] = intervals[:-1]
+            else:
+                del rows[y]
+            if self._count is not None:
+                self._count -= 1
+            return end, y, z
+        raise KeyError("pop from an empty tile set")
+
+    def clear(self):
+        """Remove all tiles from the set"""
+        self._zooms = {}
+        self._count = 0
+
+    def update(self, other):
+        """Add all tiles from another tile set to this one"""
+        for z, rows in other._zooms.items():
+            for y, intervals in rows.items():
+                self._addRow(z, y, intervals)
+
+    def union(self, other):
+        """Union of this and another tile set
+
+        :returns: a new tile set
+        :rtype: TileSet
+        """
+        result = self.copy()
+        result.update(other)
+        return result
+
+    __or__ = union
+
+    def copy(self):
+        result = TileSet()
+        result._zooms = dict((z, dict(rows)) for z, rows in self._zooms.items())
+        result._count = self._count
+        return result
+
+    def dilated(self, amount):
+        """Expand the tile set by the given number of tiles in every direction
+
+        Each tile is replaced by a square of (2 * amount + 1)^2 tiles around it,
+        the result is clipped to the valid tile coordinates of each zoom level.
+
+        :param int amount: by how many tiles to expand
+        :returns: a new tile set
+        :rtype: TileSet
+        """
+        result = TileSet()
+        for z, rows in self._zooms.items():
+            maxCoordinate = 2 ** z - 1
+            newRows = {}
+            for y, intervals in rows.items():
+                expanded = [(max(start - amount, 0), min(end + amount, maxCoordinate))
+                            for start, end in intervals]
+                for newY in range(max(y - amount, 0), min(y + amount, maxCoordinate) + 1):
+                    newRows.setdefault(newY, []).extend(expanded)
+            result._zooms[z] = dict((y, _mergeIntervals(intervals)) for y, intervals in newRows.items())
+        return result
+
+    def projected(self, z):
+        """Project all tiles of the set to the given zoom level
+
+        Tiles from lower zoom levels are split to the tiles covering the same area,
+        tiles from higher zoom levels are replaced by the tiles they are part of
+        (see http://wiki.openstreetmap.org/wiki/Slippy_map_tilenames#Subtiles).
+
+        :param int z: the zoom level
+        :returns: a new tile set with tiles only on the given zoom level
+        :rtype: TileSet
+        """
+        result = TileSet()
+        for sourceZ, rows in self._zooms.items():
+            if sourceZ <= z:
+                factor = 2 ** (z - sourceZ)
+                for y, intervals in rows.items():
+                    split = [(start * factor, (end + 1) * factor - 1) for start, end in intervals]
+                    for newY in range(y * factor, (y + 1) * factor):
+                        result._addRow(z, newY, split)
+            else:
+                shift = sourceZ - z
+                newRows = {}
+                for y, intervals in rows.items():
+                    newRows.setdefault(y >> shift, []).extend((start >> shift, end >> shift)
+                                                              for start, end in intervals)
+                for newY, intervals in newRows.items():
+                    result._addRow(z, newY, _mergeIntervals(intervals))
+        return result
+
+    def withZoomLevels(self, minZ, maxZ):
+        """Project the tile set to a range of zoom levels
+
+        :param int minZ: the lowest zoom level (inclusive)
+        :param int maxZ: the highest zoom level (inclusive)
+        :returns: a new tile set with the tiles on all the zoom levels
+        :rtype: TileSet
+        """
+        result = TileSet()
+        for z in range(minZ, maxZ + 1):
+            result._zooms[z] = self.projected(z)._zooms.get(z, {})
+        return result
+
+
+def tilesAroundRoute(route, radius, z):
+    """Get tiles around a route or track
+
+    The route is rasterised in tile space & the covered tiles
+    are dilated by the radius.
+
+    :param route: iterable of (lat, lon, ...) tuples
+    :param int radius: radius around the route in tiles
+    :param int z: zoom level
+    :returns: tiles around the route on the given zoom level
+    :rtype: TileSet
+    """
+    points = (ll2xy(point[0], point[1], z) for point in route)
+    return TileSet.fromPolyline(points, z).dilated(radius)
@@ -19,12 +19,15 @@
 #---------------------------------------------------------------------------
 import os
 import sys
+import glob
+import sqlite3
 import traceback
 
 from modules.base_module import RanaModule
 from core.signal import Signal
 from core.backports import six
 from core.layers import MapLayer, MapLayerGroup
+from core.tile_storage.mbtiles_store import MBTilesStore, MBTILES_EXTENSION
 from .overlay_groups import OverlayGroup
 
 # lists keys that need to be defined for a layer
@@ -50,6 +53,11 @@ MAP_LAYER_GROUP_REQUIRED_KEYS = set([
     'label'
 ])
 
+# MBTiles files found in the map folder
+# are added as layers to this group
+MBTILES_GROUP_ID = "mbtiles"
+MBTILES_GROUP_LABEL = "MBTiles"
+
 
 def getModule(*args, **kwargs):
     return MapLayers(*args, **kwargs)
@@ -178,6 +186,37 @@ class MapLayers(RanaModule):
             self.log.error('map layer config has no valid layers,'
                            ' using Mapnik fallback layer')
             self._layers['mapnik'] = self._getFallbackLayer()
+        self._parseMBTilesLayers()
+
+    def _parseMBTilesLayers(self):
+        """Add a layer for each MBTiles file placed in its own subfolder
+        of the map folder that is not used by any of the configured layers
+
+        The layer configuration is based on the MBTiles metadata and as the
+        layers have no URL, their tiles are never downloaded.
+        """
+        usedFolders = set(layer.folder_name for layer in self._layers.values())
+        mapFolderPath = self.modrana.paths.map_folder_path
+        mbtilesPaths = sorted(glob.glob(os.path.join(mapFolderPath, "*", "*" + MBTILES_EXTENSION)))
+        for path in mbtilesPaths:
+            folderName = os.path.basename(os.path.dirname(path))
+            # the tile storage module only uses the first MBTiles file in a folder
+            if folderName in usedFolders or not MBTilesStore.is_store(path):
+                continue
+            try:
+                store = MBTilesStore(path)
+                try:
+                    config = store.get_layer_config(folderName)
+                finally:
+                    store.close()
+            except (sqlite3.Error, ValueError):
+                self.log.exception('reading MBTiles metadata failed: %s', path)
+                continue
+            config['group'] = MBTILES_GROUP_ID
+            layerId = "mbtiles_%s" % folderName
+            self._layers[layerId] = MapLayer(layerId, config)
+            usedFolders.add(folderName)
+            self.log.info('MBTiles file %s added as layer %s', path, layerId)
 
     def _parseGroups(self):
         """Parse all map layer group definitions"""
@@ -189,6 +228,9 @@ class MapLayers(RanaModule):
             for groupId, groupDefinition in six.iteritems(groupsDict):
                 if self._hasRequiredKeys(groupDefinition, MAP_LAYER_GROUP_REQUIRED_KEYS):
                     self._groups[groupId] = MapLayerGroup(self, groupId, groupDefinition)
+        if list(self.getLayersByGroupId(MBTILES_GROUP_ID)):
+            self._groups[MBTILES_GROUP_ID] = MapLayerGroup(self, MBTILES_GROUP_ID,
+                                                           {'label': MBTILES_GROUP_LABEL})
 
     def _getFallbackLayer(self):
         """In case that loading the map configuration
@@ -31,14 +31,14 @@ except ImportError:  # Python 3
     from urllib.request import urlopen
     from urllib.error import HTTPError, URLError
 
-if sys.version_info[:2] <= (2, 5):
-    from core.backports import urllib3_python25 as urllib3
-else:
-    import urllib3
 from core import utils
 from core import rectangles
 from core import tiles
 from core import constants
+from core import http_pools
+from core.tile_cache import TileCache, decodedSize, DECODED_TILE_SIZE, PLACEHOLDER_TILE_SIZE
+from core.negative_cache import NegativeTileCache, ERROR_NOT_IMAGE, ERROR_HOST_UNAVAILABLE
+from core.host_controller import HostControllers, HostUnavailable
 from core.tilenames import *
 from core.backports import six
 from core.signal import Signal
@@ -99,19 +99,22 @@ class MapTiles(RanaModule):
 
     def __init__(self, *args, **kwargs):
         RanaModule.__init__(self, *args, **kwargs)
-        self.images = [{}, {}] # the first dict contains normal image data, the second contains special tiles
-        self.imagesLock = threading.RLock()
         # we need to limit the size of the tile cache to avoid a memory leak
+        # - the cache size option is in tiles, but the cache is budgeted by bytes,
+        #   so the budget corresponds to the given number of decoded tile images
         memoryTileCacheSize = int(self.get("memoryTileCacheSize", constants.DEFAULT_MEMORY_TILE_CACHE_SIZE))
-        self.log.info("in memory tile cache size: %d", memoryTileCacheSize)
-        self.maxImagesInMemory = memoryTileCacheSize
-        self.imagesTrimmingAmount = constants.DEFAULT_MEMORY_TILE_CACHE_TRIM_SIZE
-        # how many tiles to remove once the maximum is reached
-        # so that trim does not run always run after adding a tile
-        # TODO: analyse memory usage,
-        #       set appropriate value,
-        #       platform dependent value,
-        #       user configurable
+        self.log.info("in memory tile cache size: %d tiles (%d kB)",
+                      memoryTileCacheSize, memoryTileCacheSize * DECODED_TILE_SIZE // 1024)
+        self._tileCache = TileCache(memoryTileCacheSize * DECODED_TILE_SIZE)
+        # the first item contains normal image data, the second contains special tiles
+        self.images = [self._tileCache, {}]
+        self.imagesLock = threading.RLock()
+        # recently failed tile downloads, so that we don't
+        # try to download them over and over again
+        self._negativeCache = NegativeTileCache()
+        # per-host concurrency limits & circuit breakers,
+        # so that struggling tileservers are not hammered
+        self._hostControllers = HostControllers()
         self.tileSide = 256 # by default, the tiles are squares, side=256
         self.scalingInfo = (1, 15, 256)
         self.downloadRequestTimeout = 30 # in seconds
@@ -139,7 +142,9 @@ class MapTiles(RanaModule):
 
         self._storeTiles = None
 
-        self.connPools = {} # connection pool dictionary
+        # layer id -> tile download connection timeout
+        self._connectionTimeouts = {}
+        self._requestHeaders = None
 
         self.cacheImageSurfaces = gs.GUIString == "GTK"
 
@@ -166,6 +171,20 @@ class MapTiles(RanaModule):
     def tileDownloaded(self):
         return self._tileDownloaded
 
+    @property
+    def negativeCache(self):
+        """Negative cache of recently failed tile downloads,
+        shared by the automatic and batch tile downloaders
+        """
+        return self._negativeCache
+
+    @property
+    def hostControllers(self):
+        """Per-host download controllers,
+        shared by the automatic and batch tile downloaders
+        """
+        return self._hostControllers
+
     def firstTime(self):
         self.mapViewModule = self.m.get('mapView', None)
         scale = self.get('mapScale', 1)
@@ -185,8 +204,12 @@ class MapTiles(RanaModule):
         taskQueueSize = int(self.get("autoDownloadQueueSize",
                                      constants.DEFAULT_AUTOMATIC_TILE_DOWNLOAD_QUEUE_SIZE))
         self.log.debug("automatic tile download queue size: %d", taskQueueSize)
+        cancelMargin = int(self.get("tileDownloadCancelMargin",
+                                    constants.DEFAULT_TILE_DOWNLOAD_CANCEL_MARGIN))
         self._downloader = Downloader(maxThreads,
-                                      taskBufferSize=taskQueueSize)
+                                      taskBufferSize=taskQueueSize,
+                                      cancelMargin=cancelMargin)
+        self._downloader.setZoom(self.scalingInfo[1])
         self._startTileLoadingManager()
 
         if gs.GUIString == "GTK":
@@ -203,7 +226,8 @@ class MapTiles(RanaModule):
         :rtype: data or None
         """
         # check if the tile is in the recently-downloaded cache
-        cacheItem = self.images[0].get(lzxy, None)
+        with self.imagesLock:
+            cacheItem = self._tileCache.get(lzxy)
         if cacheItem:
         #      self.log.debug("got tile FROM memory CACHE")
             return cacheItem[0]
@@ -213,6 +237,12 @@ class MapTiles(RanaModule):
             #self.log.debug("got tile FROM disk CACHE")
             # tile was available from storage
             return tileData
+        if download and not lzxy[0].url:
+            # the layer has no tile server (eq. it only has tiles from a MBTiles file)
+            return None
+        if download and self._negativeCache.isBlocked(lzxy):
+            # the tile failed to download recently, don't try again just yet
+            return None
         if download:
             if asynchronous:
                 # asynchronous download
@@ -238,9 +268,28 @@ class MapTiles(RanaModule):
         tileUrl = tiles.getTileUrl(lzxy)
         # self.log.debug("GET TILE")
         # self.log.debug(tileUrl)
-        response = self._getConnPool(lzxy[0], tileUrl).request('GET', tileUrl)
+        controller = self._hostControllers.get(tileUrl)
+        try:
+            # connection pools are shared by all layers on the same host
+            connPool = http_pools.registry.get(tileUrl, size=constants.DEFAULT_MAX_CONCURRENT_REQUESTS_PER_HOST)
+            response = controller.request(connPool, 'GET', tileUrl,
+                                          slotTimeout=constants.TILE_DOWNLOAD_TIMEOUT,
+                                          headers=self._getRequestHeaders(),
+                                          timeout=self._getConnectionTimeout(lzxy[0]))
+        except HostUnavailable:
+            # the tileserver is backing off, retry once it should be available again
+            e = sys.exc_info()[1]
+            self.log.debug("not downloading tile: %s", e)
+            self._negativeCache.addFailure(lzxy, ERROR_HOST_UNAVAILABLE, ttl=e.retryIn or None)
+            return None
+        except Exception:
+            self._negativeCache.recordException(lzxy, sys.exc_info()[1])
+            raise
         # self.log.debug("RESPONSE")
         # self.log.debug(response)
+        if self._negativeCache.recordResponse(lzxy, response.status):
+            self.log.warning("tileserver returned HTTP status %d for tile url: %s", response.status, tileUrl)
+            return None
         tileData = response.data
         if tileData:
             # check if the data is actually an image, and not an error page
@@ -255,45 +304,40 @@ class MapTiles(RanaModule):
                 msg+= "NOTE: this probably means that the tileserver returned an\n"
                 msg+= "error page in place of the tile, because it doesn't like you\n"
                 self.log.warning(msg)
+                self._negativeCache.addFailure(lzxy, ERROR_NOT_IMAGE)
                 return None
         else:
             return None
 
-    def _getConnPool(self, layer, baseUrl):
-        """Get a connection pool for the given layer id
-        Each layer ID has it's own connection pool
-        (as each connection pool handles only one base URL)
-        and non-existent pools are automatically created once requested
-        NOTE: connection pools reuse open connections
+    def _getRequestHeaders(self):
+        if self._requestHeaders is None:
+            self._requestHeaders = {'User-Agent': self.modrana.configs.user_agent}
+        return self._requestHeaders
 
-        :param str layerId: pool id (mapped to layer id)
-        :param str baseUrl: a URL used to initialize the connection pool
-                           (basically just the domain name needs to be correct)
+    def _getConnectionTimeout(self, layer):
+        """Get tile download connection timeout for the given layer
+
+        NOTE: connection pools are shared by all layers on the same host
+              (and with other modRana components), so the timeout
+              is set for each request
+
+        :param layer: the layer
+        :returns: timeout in seconds or None if there should be no timeout
         """
-        pool = self.connPools.get(layer.id, None)
-        if pool:
-            return pool
-        else: # create pool
-            #headers = { 'User-Agent' : "Mozilla/5.0 (compatible; MSIE 5.5; Linux)" }
-            userAgent = self.modrana.configs.user_agent
-            headers = {'User-Agent': userAgent}
-            connection_timeout = constants.TILE_DOWNLOAD_TIMEOUT
+        timeout = self._connectionTimeouts.get(layer.id, False)
+        if timeout is False:
+            timeout = constants.TILE_DOWNLOAD_TIMEOUT
             if layer.connection_timeout is not None:  # some value was set in the config
                 if layer.connection_timeout < 0:  # -1 == no timeout
-                    connection_timeout = None  # None means no timeout for Urllib 3 connection pools
+                    timeout = None  # None means no timeout for Urllib 3 requests
                 else:
-                    connection_timeout = layer.connection_timeout
-            if connection_timeout is None:
-                self.log.debug("creating tile download pool for %s without a connection timeout", layer.id)
+                    timeout = layer.connection_timeout
+            if timeout is None:
+                self.log.debug("downloading tiles for %s without a connection timeout", layer.id)
             else:
-                self.log.debug("creating tile download pool for %s with connection timeout %s s", layer.id, connection_timeout)
-            newPool = urllib3.connection_from_url(url=baseUrl,
-                                                  headers=headers,
-                                                  maxsize=10,
-                                                  timeout=connection_timeout,
-                                                  block=False)
-            self.connPools[layer.id] = newPool
-            return newPool
+                self.log.debug("downloading tiles for %s with connection timeout %s s", layer.id, timeout)
+            self._connectionTimeouts[layer.id] = timeout
+        return timeout
 
     def addTileDownloadRequest(self, lzxy, tag=None):
         """Add a download request to the download manager queue
@@ -316,7 +360,8 @@ class MapTiles(RanaModule):
         :returns: True if tile is cached, False otherwise
         :rtype: bool
         """
-        return lzxy in self.images[0]
+        with self.imagesLock:
+            return lzxy in self._tileCache
 
     def tileInStorage(self, lzxy):
         """Report if tile is available from local persistent storage
@@ -326,6 +371,17 @@ class MapTiles(RanaModule):
         """
         return self._storeTiles.tile_is_stored(lzxy)
 
+    def tilesInStorage(self, lzxys):
+        """Report which tiles are available from local persistent storage
+
+        All the tiles are checked at once, with a single query per tile store.
+
+        :param lzxys: iterable of tile description tuples
+        :returns: set of lzxy tuples of the stored tiles
+        :rtype: set
+        """
+        return self._storeTiles.tiles_stored(lzxys)
+
     def _updateScalingCB(self, key='mapScale', oldValue=1, newValue=1):
         """as this only needs to be updated once on startup and then only
         when scaling settings change this callback driven method is used"""
@@ -345,6 +401,9 @@ class MapTiles(RanaModule):
         tileSide = self.tileSide * scale
 
         self.scalingInfo = (scale, z, tileSide)
+        if self._downloader:
+            # let the downloader know which zoom level is visible
+            self._downloader.setZoom(z)
 
     def _startTileLoadingManager(self):
         """Start the consumer thread for download requests"""
@@ -382,12 +441,21 @@ class MapTiles(RanaModule):
                         sprint("tile not found locally %s", lzxy)
                         # tile not found locally and needs to be downloaded from network
                         # Are we allowed to download it ? (network=='full')
-                        if self.get('network', 'full') == 'full':
+                        if not lzxy[0].url:
+                            sprint("layer %s has no URL - not adding dl request for %s", lzxy[0], lzxy)
+                        elif self._negativeCache.isBlocked(lzxy):
+                            # the tile failed to download recently, report the error
+                            # (and show the error tile) without queueing a download
+                            sprint("tile %s failed to download recently, not downloading", lzxy)
+                            error = self._downloader.downloadFailed(lzxy)
+                            self.tileDownloaded(error, lzxy, tag)
+                        elif self.get('network', 'full') == 'full':
                             sprint("auto tile dl enabled - adding dl request for %s", lzxy)
                             # switch the status tile to "Waiting for download slot"
                             if self.cacheImageSurfaces:
                                 with self.imagesLock:
-                                    self.images[0][lzxy] = self.waitingTile
+                                    self._tileCache.add(lzxy, self.waitingTile[0], self.waitingTile[1],
+                                                        PLACEHOLDER_TILE_SIZE)
                             droppedRequest = self._downloader.downloadTile(lzxy, tag)
                             if droppedRequest:
                                 # this tile download request has been dropped from
@@ -438,8 +506,9 @@ class MapTiles(RanaModule):
         # tile cache status debugging
         if self.get('reportTileCacheStatus', False): # TODO: set to False by default
             self.log.debug("** tile cache status report **")
-            self.log.debug("threads: %d, images: %d, special tiles: %d, dl request queue:%d" % (
-                self._downloader.maxThreads, len(self.images[0]), len(self.images[1]), self._downloader.qsize))
+            self.log.debug("threads: %d, images: %d (%d/%d kB), special tiles: %d, dl request queue:%d" % (
+                self._downloader.maxThreads, len(self._tileCache), self._tileCache.size // 1024,
+                self._tileCache.maxSize // 1024, len(self.images[1]), self._downloader.qsize))
 
     def drawMap(self, cr):
         """Draw map tile images"""
@@ -489,6 +558,15 @@ class MapTiles(RanaModule):
                 # we need the "clean" coordinates for the following conversion
                 (px1, px2, py1, py2) = cleanProjectionCoords
                 (pdx, pdy) = (px2 - px1, py2 - py1)
+
+                # let the tile downloader know what is visible,
+                # so that it can download the visible tiles first
+                if self.get("rotateMap", False) and (self.get("centred", False)):
+                    # all tiles within the screen diagonal can become visible
+                    halfWidth = halfHeight = hypot(pdx, pdy) / 2.0
+                else:
+                    halfWidth, halfHeight = pdx / 2.0, pdy / 2.0
+                self._downloader.setViewport(z, px1 + pdx / 2.0, py1 + pdy / 2.0, halfWidth, halfHeight)
                 # upper left tile coordinates to screen coordinates
                 cx1, cy1 = (sw * (cx - px1) / pdx,
                             sh * (cy - py1) / pdy) #this is basically the pxpy2xy function from mod_projection inlined
@@ -562,7 +640,7 @@ class MapTiles(RanaModule):
                                     visibleCounter += 1
                                     (x, y, x1, y1) = (tx, ty, cx1 + tileSide * ix, cy1 + tileSide * iy)
                                     name = (layerInfo, z, x, y)
-                                    tileImage = self.images[0].get(name)
+                                    tileImage = self._tileCache.get(name)
                                     if tileImage:
                                         # tile found in memory cache, draw it
                                         drawImage(cr, tileImage[0], x1, y1, scale)
@@ -578,8 +656,8 @@ class MapTiles(RanaModule):
                                             layerOver = layerInfo[1][0]
                                             nameBack = (layer1, z, x, y)
                                             nameOver = (layer2, z, x, y)
-                                            backImage = self.images[0].get(nameBack)
-                                            overImage = self.images[0].get(nameOver)
+                                            backImage = self._tileCache.get(nameBack)
+                                            overImage = self._tileCache.get(nameOver)
                                             if backImage and overImage: # both images available
                                                 # we check the the metadata to filter out the "Downloading... special tiles
                                                 if backImage[1]['type'] == "normal" and overImage[1]['type'] == "normal":
@@ -645,7 +723,7 @@ class MapTiles(RanaModule):
 
                                 # Try to load and display images
                                 name = (layerInfo, z, x, y)
-                                tileImage = self.images[0].get(name)
+                                tileImage = self._tileCache.get(name)
                                 if tileImage:
                                     # tile found in memory cache, draw it
                                     drawImage(cr, tileImage[0], x1, y1, scale)
@@ -660,8 +738,8 @@ class MapTiles(RanaModule):
                                         layerOver = layerInfo[1][0]
                                         nameBack = (layer1, z, x, y)
                                         nameOver = (layer2, z, x, y)
-                                        backImage = self.images[0].get(nameBack)
-                                        overImage = self.images[0].get(nameOver)
+                                        backImage = self._tileCache.get(nameBack)
+                                        overImage = self._tileCache.get(nameOver)
                                         if backImage and overImage: # both images available
                                             # we check the the metadata to filter out the "Downloading..." special tiles
                                             if backImage[1]['type'] == "normal" and overImage[1]['type'] == "normal":
@@ -730,9 +808,11 @@ class MapTiles(RanaModule):
         if self.cacheImageSurfaces:
             # make sure no one fiddles with the cache while we are working with it
             with self.imagesLock:
-                if name in self.images[dictIndex]:
-                    del self.images[dictIndex][name]
+                if dictIndex == 0:
+                    removed = self._tileCache.remove(name)
                 else:
+                    removed = self.images[dictIndex].pop(name, None) is not None
+                if not removed:
                     self.log.debug("can't remove unknown %s from memory tile cache", name)
 
     def _drawCompositeImage(self, cr, backImage, overImage, x, y, scale, alpha1=1.0, alpha2=1.0, dictIndex1=0, dictIndex2=0):
@@ -836,13 +916,18 @@ class MapTiles(RanaModule):
         if expireTimestamp:
             metadata['expireTimestamp'] = expireTimestamp
         with self.imagesLock: #make sure no one fiddles with the cache while we are working with it
-            self.images[dictIndex][name] = (surface, metadata) # store the image in memory
-
-            # check cache size,
-            # if there are too many images, delete them
-            if len(self.images[0]) > self.maxImagesInMemory:
-                self._trimCache()
-                # new tile available, make redraw request TODO: what overhead does this create ?
+            if dictIndex == 0:
+                # store the image in memory, the least recently used
+                # images are dropped once the cache gets full
+                if imageType in (NORMAL_TILE, COMPOSITE_TILE):
+                    size = decodedSize(surface)
+                else:
+                    # status & error tiles just reference the shared special tile images
+                    size = PLACEHOLDER_TILE_SIZE
+                self._tileCache.add(name, surface, metadata, size)
+            else:
+                self.images[dictIndex][name] = (surface, metadata)
+            # new tile available, make redraw request TODO: what overhead does this create ?
             self._tileLoadedNotify(imageType)
 
     def _tileLoadedNotify(self, imageType):
@@ -857,35 +942,11 @@ class MapTiles(RanaModule):
             else: # redraw regardless of type with overlay off
                 self.set('needRedraw', True)
 
-    def _trimCache(self):
-        """To avoid a memory leak, the maximum size of the image cache is fixed
-           when we reach the maximum size, we start removing images,
-           starting from the oldest ones with an amount of images specified
-           in imagesTrimmingAmount, so that trim does not run every time
-           an image is added to a full cache
-           -> only the normal image cache needs trimming (images[0]),
-           as the special image cache (images[1]) is just created once and not updated dynamically
-           NOTE: the storeInMemory method which is calling this function
-                 already locked images, so we don't have to"""
-        trimmingAmount = self.imagesTrimmingAmount
-        imagesLength = len(self.images[0])
-        if trimmingAmount >= imagesLength:
-            # this means that the trimming amount was set higher,
-            # than current length of the cache
-            # the result is basically flushing the cache every time it fills back
-            # well, I don't have an idea why would someone want to do that
-            self.images[0] = {}
-        else:
-            oldestKeys = sorted(self.images[0], key=lambda image: self.images[0][image][1]['addedTimestamp'])[
-                         0:trimmingAmount]
-            for key in oldestKeys:
-                del self.images[0][key]
-
     def _clearTileCache(self):
         """completely clear the in memory image cache"""
         with self.imagesLock:
-            self.log.info('fully clearing the in memory tile cache (%d tiles)', len(self.images[0]))
-            self.images[0] = {}
+            self.log.info('fully clearing the in memory tile cache (%d tiles)', len(self._tileCache))
+            self._tileCache.clear()
 
     def _removeTilesFromCache(self, imageTypes):
         """Remove tiles of the given types from the in memory tile cache.
@@ -894,13 +955,9 @@ class MapTiles(RanaModule):
         """
         with self.imagesLock:
             self.log.info("removing %s from the tile cache", imageTypes)
-            removedCounter = 0
-            keys = list(self.images[0].keys())
-            for key in keys:
-                if self.images[0][key][1]["type"] in imageTypes:
-                    del self.images[0][key]
-                    removedCounter += 1
-            self.log.debug("removed %d tiles from total of %d", removedCounter, len(keys))
+            tileCount = len(self._tileCache)
+            removedCounter = self._tileCache.removeTypes(imageTypes)
+            self.log.debug("removed %d tiles from total of %d", removedCounter, tileCount)
 
     def _pixbuf2cairoImageSurface(self, pixbuf):
         """Convert a GTK Pixbuf into a Cairo ImageSurface
@@ -27,11 +27,13 @@ if sys.version_info[:2] <= (2, 5):
     from core.backports import urllib3_python25 as urllib3
 else:
     import urllib3
-from core.pool import LifoThreadPool
+from core.pool import PriorityThreadPool
+from core.tile_scheduler import ViewportTileScheduler
 from core.singleton import modrana
 from core import tiles
 from core import gs
 from core import constants
+from core.negative_cache import PERMANENT_ERRORS
 
 import logging
 log = logging.getLogger("mod.mapTiles.tile_downloader")
@@ -42,19 +44,24 @@ if gs.GUIString == "GTK":
 
 class Downloader(object):
     def __init__(self, maxThreads, taskBufferSize=0,
-                 taskTimeout=0):
+                 taskTimeout=0, cancelMargin=constants.DEFAULT_TILE_DOWNLOAD_CANCEL_MARGIN):
         self._mapTiles = modrana.m.get("mapTiles")
         self._storeTiles = modrana.m.get("storeTiles")
+        # tile download requests are ranked by distance from the visible area,
+        # so that visible tiles are downloaded first and requests for tiles
+        # that are no longer anywhere near the visible area can be cancelled
+        self._scheduler = ViewportTileScheduler(cancelMargin=cancelMargin)
         # if task buffer size is set, start leaking
-        # old tile download requests from the bottom of the
-        # request stack once it becomes full, as we don't want
+        # the worst ranked tile download requests once the
+        # request queue becomes full, as we don't want
         # the work queue to block and discarding old tile
         # download requests is not an issue
         leak = taskBufferSize >= 0
-        self._pool = LifoThreadPool(maxThreads,
-                                    name=constants.THREAD_POOL_AUTOMATIC_TILE_DOWNLOAD,
-                                    taskBufferSize=taskBufferSize,
-                                    leak=leak)
+        self._pool = PriorityThreadPool(maxThreads,
+                                        rankFunction=self._rankRequest,
+                                        name=constants.THREAD_POOL_AUTOMATIC_TILE_DOWNLOAD,
+                                        taskBufferSize=taskBufferSize,
+                                        leak=leak)
         # in seconds, 0 == no task timeout
         self._taskTimeout = taskTimeout
         self._running = set()
@@ -67,6 +74,46 @@ class Downloader(object):
     def shutdown(self):
         self._pool.shutdown(now=True)
 
+    def _rankRequest(self, lzxy, tag, timestamp, overwrite):
+        return self._scheduler.rank(lzxy, timestamp)
+
+    def setViewport(self, z, centreX, centreY, halfWidth, halfHeight):
+        """Report the currently visible area, so that download requests
+        can be ranked by distance from it
+
+        NOTE: Only the GTK GUI reports the viewport (from MapTiles.drawMap()).
+              The Qt 5 GUI draws the map in QML and just asks for batches
+              of tiles, so with it requests are only ranked by zoom level
+              (see setZoom()).
+
+        :param int z: zoom level of the visible tiles
+        :param float centreX: x coordinate of the viewport centre in tiles
+        :param float centreY: y coordinate of the viewport centre in tiles
+        :param float halfWidth: half of the viewport width in tiles
+        :param float halfHeight: half of the viewport height in tiles
+        """
+        if self._scheduler.setViewport(z, centreX, centreY, halfWidth, halfHeight):
+            self._rerank()
+
+    def setZoom(self, z):
+        """Report the current zoom level
+
+        :param int z: current zoom level
+        """
+        if self._scheduler.setZoom(z):
+            self._rerank()
+
+    def _rerank(self):
+        """Re-rank the waiting download requests & cancel requests
+        for tiles that are too far from the visible area
+        """
+        for _fn, args, _kwargs in self._pool.rerank():
+            lzxy, tag = args[0], args[1]
+            # remove the "Waiting..." tile from the image cache, so that a new
+            # download request is made if the tile becomes visible again
+            self._mapTiles.removeImageFromMemory(lzxy)
+            self._tileDownloaded(constants.TILE_DOWNLOAD_CANCELLED, lzxy, tag)
+
     def _tileDownloaded(self, error, lzxy, tag):
         #log.debug("DOWNLOADER: CALLING SIGNAL: %s %s" % (tag, success))
         self._mapTiles.tileDownloaded(error, lzxy, tag)
@@ -125,13 +172,11 @@ class Downloader(object):
             try:
                 self._downloadTile(lzxy)
                 error = constants.TILE_DOWNLOAD_SUCCESS
-            except urllib3.exceptions.HTTPError:
-                # server returned a HTTP error, this means we got
-                # to the server but it didn't like us for some reason,
-                error = self._fatalDownloadError(lzxy)
-            except URLError:
-                # this is most probably caused by a loss of network connectivity
-                error = self._temporaryDownloadError(lzxy)
+            except (urllib3.exceptions.HTTPError, URLError):
+                # either the server returned a HTTP error or an error page,
+                # or there was a network error - the tile has been added to the
+                # negative cache with the error class & TTL corresponding to the error
+                error = self.downloadFailed(lzxy)
 
             # something other is wrong (most probably a corrupt tile)
             except Exception:
@@ -187,31 +232,46 @@ class Downloader(object):
             # change the status tile to "Downloading..."
             self._mapTiles.storeInMemory(self._mapTiles.downloadingTile[0], lzxy, imageType="downloading")
 
-    def _temporaryDownloadError(self, lzxy):
-        if self._imageSurface:
-            tileNetworkErrorSurface = self._mapTiles.images[1]['tileNetworkError'][0]
-            expireTimestamp = time.time() + 10
-            self._mapTiles.storeInMemory(tileNetworkErrorSurface, lzxy, 'error',
-                                         expireTimestamp) # retry after 10 seconds
-            # as not to DOS the system when we temporarily loose internet connection or other such error
-            # occurs, we load a temporary error tile with expiration timestamp instead of the tile image
-            # TODO: actually remove tiles according to expiration timestamp :)
-        return constants.TILE_DOWNLOAD_TEMPORARY_ERROR
-
-    def _fatalDownloadError(self, lzxy):
-        if self._imageSurface:
-            tileDownloadFailedSurface = self._mapTiles.images[1]['tileDownloadFailed'][0]
-            expireTimestamp = time.time() + 10
-            self._mapTiles.storeInMemory(tileDownloadFailedSurface, lzxy, 'semiPermanentError',
-                                         expireTimestamp)
-            # like this, when tile download fails due to a http error,
-            # the error tile is loaded instead
-            # like this:
-            #  - modRana does not immediately try to download a tile that errors out
-            #  - the error tile is shown without modifying the pipeline too much
-            #  - modRana will eventually try to download the tile again,
-            #    after it is flushed with old tiles from the memory
-        return constants.TILE_DOWNLOAD_ERROR
+    def downloadFailed(self, lzxy):
+        """Handle a tile that failed to download
+
+        If image surfaces are used, an error tile is placed to the image cache
+        in place of the tile. The error tile expires at the same time as the
+        failure recorded in the negative cache, so the download is retried
+        once the tile is requested again after that.
+
+        :param tuple lzxy: tile description tuple
+        :returns: tile download error constant
+        :rtype: int
+        """
+        failure = self._mapTiles.negativeCache.getFailure(lzxy)
+        if failure is None:
+            # the failure was not recorded, retry after 10 seconds
+            errorClass, expireTimestamp = None, time.time() + 10
+        else:
+            errorClass, expireTimestamp = failure
+        if errorClass is None or errorClass in PERMANENT_ERRORS:
+            # the server returned an error, this means we got
+            # to the server but it didn't like us for some reason
+            # - like this, when tile download fails due to a http error,
+            #   the error tile is loaded instead
+            # - modRana does not immediately try to download a tile that errors out
+            # - the error tile is shown without modifying the pipeline too much
+            if self._imageSurface:
+                tileDownloadFailedSurface = self._mapTiles.images[1]['tileDownloadFailed'][0]
+                self._mapTiles.storeInMemory(tileDownloadFailedSurface, lzxy, 'semiPermanentError',
+                                             expireTimestamp)
+            return constants.TILE_DOWNLOAD_ERROR
+        else:
+            # this is most probably caused by a loss of network connectivity
+            # - as not to DOS the system when we temporarily loose internet connection
+            #   or other such error occurs, we load a temporary error tile with expiration
+            #   timestamp instead of the tile image
+            if self._imageSurface:
+                tileNetworkErrorSurface = self._mapTiles.images[1]['tileNetworkError'][0]
+                self._mapTiles.storeInMemory(tileNetworkErrorSurface, lzxy, 'error',
+                                             expireTimestamp)
+            return constants.TILE_DOWNLOAD_TEMPORARY_ERROR
 
     def _printErrorMessage(self, e, lzxy):
         url = tiles.getTileUrl(lzxy)
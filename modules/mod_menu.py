@@ -1164,6 +1164,10 @@ class Menus(RanaModule):
         self.setupDataSubMenu()
         if self.get("batchMenuEntered", None) == True:
             self.addItem('data', 'back to dl', 'generic', 'set:menu:mapData#batchTileDl')
+        mapData = self.m.get('mapData', None)
+        if mapData and mapData.resumableTileCount:
+            self.addItem('data', 'resume batch', 'generic',
+                         'set:downloadType:data|mapData:resumeBatch|set:menu:mapData#batchTileDl')
 
     def setupRouteMenu(self):
         self.clearMenu('route')
@@ -4,11 +4,8 @@ import traceback
 
 try:  # Python 2
     from urllib import urlencode
-    from urllib2 import urlopen, Request, build_opener, HTTPError, URLError
 except ImportError:  # Python 3
-    from urllib.request import urlopen, Request, build_opener
     from urllib.parse import urlencode
-    from urllib.error import HTTPError, URLError
 
 import logging
 log = logging.getLogger("mod.onlineServices.geonames")
@@ -25,6 +22,7 @@ except Exception:
 
 from core.point import Point
 from core import constants
+from core import http_pools
 
 class GeonamesWikipediaPoint(Point):
     """
@@ -79,8 +77,7 @@ def fetchJson(query_url, params=None, headers=None):
     encoded_params = urlencode(params)
     url = query_url + encoded_params
     log.debug(url)
-    request = Request(url, headers=headers)
-    response = urlopen(request).read().decode("utf-8")
+    response = http_pools.registry.getData(url, headers=headers).decode("utf-8")
     return url, json.loads(response)
 
 
@@ -106,11 +103,10 @@ def elevSRTM(lat, lon):
     """get elevation in meters for the specified latitude and longitude from geonames"""
     url = 'http://ws.geonames.org/srtm3?lat=%f&lng=%f' % (lat, lon)
     try:
-        query = urlopen(url)
+        return http_pools.registry.getData(url)
     except Exception:
         log.exception("getting elevation from geonames returned an error")
         return 0
-    return query.read()
 
 
 def elevBatchSRTM(latLonList, threadCB=None, userAgent=None):
@@ -141,13 +137,11 @@ def elevBatchSRTM(latLonList, threadCB=None, userAgent=None):
         url = 'http://ws.geonames.org/srtm3?lats=%s&lngs=%s' % (lats, lons)
         query = None
         results = []
+        headers = {}
+        if userAgent:
+            headers['User-Agent'] = userAgent
         try:
-            request = Request(url)
-            opener = build_opener()
-            if userAgent:
-                request.add_header('User-Agent', userAgent)
-            query = opener.open(request)
-
+            query = http_pools.registry.getData(url, headers=headers)
         except Exception:
             log.exception("getting elevation from geonames returned an error")
             results = "0"
@@ -155,8 +149,7 @@ def elevBatchSRTM(latLonList, threadCB=None, userAgent=None):
                 results += " 0"
         try:
             if query:
-                results = query.read().split('\r\n')
-                query.close()
+                results = query.decode("utf-8").split('\r\n')
         except Exception:
             log.exception("elevation string from geonames has a wrong format")
             results = "0"
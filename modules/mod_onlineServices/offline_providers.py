@@ -3,6 +3,7 @@
 import time
 import re
 from core import constants
+from core import http_pools
 from core.point import Point
 from core import requirements
 
@@ -15,11 +16,8 @@ from core.providers import POIProvider, DummyController
 
 try:  # Python 2
     from urllib import urlencode
-    from urllib2 import urlopen, Request, HTTPError, URLError
 except ImportError:  # Python 3
-    from urllib.request import urlopen, Request
     from urllib.parse import urlencode
-    from urllib.error import HTTPError, URLError
 
 OSM_SCOUT_SERVER_POI_SEARCH_URL = "http://localhost:8553/v1/search?"
 OSM_SCOUT_SERVER_LOCAL_SEARCH_URL = "http://localhost:8553/v1/guide?"
@@ -46,10 +44,10 @@ class GeocodingOSMScoutServer(POIProvider):
                 'search': term
             }
             queryUrl = OSM_SCOUT_SERVER_POI_SEARCH_URL + urlencode(params)
-            reply = urlopen(queryUrl)
+            reply = http_pools.registry.getData(queryUrl)
             if reply:
                 # json in Python 3 really needs it encoded like this
-                replyData = reply.read().decode("utf-8")
+                replyData = reply.decode("utf-8")
                 jsonReply = json.loads(replyData)
                 for result in jsonReply:
                     name = result.get("title")
@@ -132,10 +130,10 @@ class OSMScoutServerLocalSearch(POIProvider):
             query_url = OSM_SCOUT_SERVER_LOCAL_SEARCH_URL + urlencode(params)
             log.debug("OSM Scout Server local search query URL:")
             log.debug(query_url)
-            reply = urlopen(query_url)
+            reply = http_pools.registry.getData(query_url)
             if reply:
                 # json in Python 3 really needs it encoded like this
-                replyData = reply.read().decode("utf-8")
+                replyData = reply.decode("utf-8")
                 jsonReply = json.loads(replyData)
                 for result in jsonReply.get("results"):
                     name = result.get("title")
@@ -5,6 +5,7 @@ import re
 from core import constants
 from core.point import Point
 from core import requirements
+from core import http_pools
 from modules.mod_onlineServices import geonames
 
 try:
@@ -16,17 +17,14 @@ from core.providers import POIProvider, DummyController
 
 try:  # Python 2
     from urllib import urlencode
-    from urllib2 import urlopen, Request, HTTPError, URLError
 except ImportError:  # Python 3
-    from urllib.request import urlopen, Request
     from urllib.parse import urlencode
-    from urllib.error import HTTPError, URLError
 
 import logging
 log = logging.getLogger("mod.onlineServices.providers")
 
-NOMINATIM_GEOCODING_URL = "http://nominatim.openstreetmap.org/search?"
-NOMINATIM_REVERSE_GEOCODING_URL = "http://nominatim.openstreetmap.org/reverse?"
+NOMINATIM_GEOCODING_URL = "https://nominatim.openstreetmap.org/search?"
+NOMINATIM_REVERSE_GEOCODING_URL = "https://nominatim.openstreetmap.org/reverse?"
 
 
 #local search result handling
@@ -260,10 +258,10 @@ class GeocodingNominatim(POIProvider):
                 'addressdetails': 0
             }
             queryUrl = NOMINATIM_GEOCODING_URL + urlencode(params)
-            reply = urlopen(queryUrl)
+            reply = http_pools.registry.getData(queryUrl)
             if reply:
                 # json in Python 3 really needs it encoded like this
-                replyData = reply.read().decode("utf-8")
+                replyData = reply.decode("utf-8")
                 jsonReply = json.loads(replyData)
                 for result in jsonReply:
                     # split a prefix from the display name
@@ -311,10 +309,10 @@ class ReverseGeocodingNominatim(POIProvider):
                 'addressdetails': 0
             }
             queryUrl = NOMINATIM_REVERSE_GEOCODING_URL + urlencode(params)
-            reply = urlopen(queryUrl)
+            reply = http_pools.registry.getData(queryUrl)
             if reply:
                 # json in Python 3 really needs it encoded like this
-                replyData = reply.read().decode("utf-8")
+                replyData = reply.decode("utf-8")
                 result = json.loads(replyData)
                 # split a prefix from the display name
                 description = result.get("display_name")
@@ -571,7 +571,18 @@ class Options(RanaModule):
                 (30, "30 seconds", notifyRestartNeeded),
                 (60, "1 minute", notifyRestartNeeded)],
                group,
-               150)
+               constants.DEFAULT_SQLITE_TILE_DATABASE_COMMIT_INTERVAL)
+        addOpt("Tile storage size limit per layer", "tileStorageLayerSizeLimit",
+               [(0, "no limit (default)"),
+                (100, "100 MB"),
+                (250, "250 MB"),
+                (500, "500 MB"),
+                (1000, "1 GB"),
+                (2000, "2 GB"),
+                (5000, "5 GB"),
+                (10000, "10 GB")],
+               group,
+               constants.DEFAULT_TILE_STORAGE_LAYER_SIZE_LIMIT)
 
         # * the view category *
         catView = addCat("View", "view", "view")
@@ -1011,6 +1022,12 @@ class Options(RanaModule):
                group,
                10)
 
+        addOpt("Batch size check", "batchSizeCheckMode",
+               [(constants.BATCH_SIZE_CHECK_SAMPLE, "estimate from a sample (default)"),
+                (constants.BATCH_SIZE_CHECK_EXACT, "check every tile (slow)")],
+               group,
+               constants.DEFAULT_BATCH_SIZE_CHECK_MODE)
+
         # * the Sound category *
         catSound = addCat("Sound", "sound", "sound")
         # * sound output
@@ -1125,6 +1142,14 @@ class Options(RanaModule):
                 (1000, "1000", notifyRestartNeeded)],
                group,
                100)
+        addOpt("Cancel tile downloads outside of the screen by", "tileDownloadCancelMargin",
+               [(0, "never cancel", notifyRestartNeeded),
+                (1, "1 tile", notifyRestartNeeded),
+                (2, "2 tiles (default)", notifyRestartNeeded),
+                (5, "5 tiles", notifyRestartNeeded),
+                (10, "10 tiles", notifyRestartNeeded)],
+               group,
+               constants.DEFAULT_TILE_DOWNLOAD_CANCEL_MARGIN)
         addBoolOpt("Remove dups before batch dl", "checkTiles", group, False)
         # ** tracklog drawing
         group = addGroup("Tracklogs", "tracklogs", catDebug, "generic")
@@ -31,6 +31,7 @@ from core import constants
 from core.point import Waypoint, TurnByTurnPoint
 from core.signal import Signal
 from core.way import Way
+from core.polyline_lod import PolylineLOD
 from core.backports.six import u
 from core import routing_providers
 from core import gs
@@ -95,6 +96,7 @@ class Route(RanaModule):
         """restorer initial routing state
         -> used in init and when rerouting"""
         self._pxpy_route = [] # route in screen coordinates
+        self._route_lod = None # simplified route for drawing
         self._directions = [] # directions object
         self.set('midText', [])
         self._duration_string = None # in seconds
@@ -623,6 +625,7 @@ class Route(RanaModule):
                 proj = self.m.get('projection', None)
                 if proj:
                     self._pxpy_route = [proj.ll2pxpyRel(x[0], x[1]) for x in result.route.points_lle]
+                    self._route_lod = PolylineLOD(self._pxpy_route)
                 self.process_and_save_directions(result.route)
                 self._osd_menu_state = OSD_CURRENT_ROUTE
                 self.start_navigation()
@@ -893,62 +896,9 @@ class Route(RanaModule):
             cr.set_line_width(10)
 
             # draw the points from the polyline as a polyline :)
-
-            (px, py) = self._pxpy_route[0]
-            (x, y) = proj.pxpyRel2xy(px, py)
-            cr.move_to(x, y)
-
-            # well, this SHOULD be faster and this is a performance critical section after all...
-            #    map(lambda x: cr.line_to(x[0],x[1]), route[1:]) # lambda drawing :)
-            # according to numerous sources, list comprehensions should be faster than for loops and map+lambda
-            # if its faster in this case too has not been determined
-
-            # routing result drawing algorithm
-            # adapted from TangoGPS source (tracks.c)
-            # works surprisingly good
-
-            z = proj.zoom
-            # these setting seem to work the best for routing results:
-            # (they have a different structure than logging traces,
-            # eq. long segments delimited by only two points, etc)
-            # basically, routing results have only the really needed points -> less points than traces
-            if self._handmade or len(self._pxpy_route) < 20:
-                # handmade routes usually have very few points and we don't want to skip any
-                # also handle very short routes that might have the same issue
-                modulo = 1
-            elif 16 > z > 10:
-                modulo = 2 ** (14 - z)
-            elif z <= 10:
-                modulo = 16
-            else:
-                modulo = 1
-
-                #    maxDraw = 300
-                #    drawCount = 0
-            counter = 0
-
-            for point in self._pxpy_route[1:]: #draw the track
-                counter += 1
-                if counter % modulo == 0:
-                #      if 1:
-                #        drawCount+=1
-                #        if drawCount>maxDraw:
-                #          break
-                    (px, py) = point
-                    (x, y) = proj.pxpyRel2xy(px, py)
-                    cr.line_to(x, y)
-
-                    # make a line to the last point (the modulo method sometimes skips the end of the track)
-                    #    [cr.line_to(x[0],x[1])for x in route[1:]] # list comprehension drawing :D
-
-                    #    self.log.debug(drawCount)
-                    #    self.log.debug(modulo)
-
-            # make sure the last point is connected
-            (px, py) = self._pxpy_route[-1]
-            (x, y) = proj.pxpyRel2xy(px, py)
-            cr.line_to(x, y)
-
+            # - only the visible parts of the route, simplified for the current zoom level
+            if self._route_lod is not None:
+                self._route_lod.draw(cr, proj.zoom, proj.px1, proj.py1, proj.px2, proj.py2, proj.scale, margin=10)
             cr.stroke()
 
             # draw the step points over the polyline
@@ -72,7 +72,7 @@ class RouteProfile(RanaModule):
         menus.drawButton(cr, x1, y1, dx, dy, "", "center:back;0.2;0.3>generic:;0.5;;0.5;;",
                          "set:menu:tracklogManager#tracklogInfo")
 
-        if tracklog.trackpointsList == []:
+        if not tracklog.points:
             # there are no points to graph, so we quit
             return
 
@@ -19,6 +19,7 @@
 #---------------------------------------------------------------------------
 from modules.base_module import RanaModule
 from core import geo
+from core.tracklog_cache import PREVIEW_ZOOM
 import math
 #from time import clock
 # only import GKT libs if GTK GUI is used
@@ -132,16 +133,32 @@ class ShowTracklogs(RanaModule):
         loadedTracklogsPathList = loadTl.get_loaded_tracklog_path_list()
 
         # find what tracklogs are not loaded and load them
-        notLoaded = filter(lambda x: x not in loadedTracklogsPathList, visibleTracklogs)
+        notLoaded = [path for path in visibleTracklogs if path not in loadedTracklogsPathList]
+        previews = {}
+        if notLoaded and self.get('showTracklog', None) == 'simple':
+            # show cached previews of tracklogs that are not loaded
+            for path in notLoaded:
+                lod = loadTl.get_preview_lod(path)
+                if lod is not None:
+                    previews[path] = lod
+            if proj.zoom <= PREVIEW_ZOOM:
+                # the previews are detailed enough at this zoom level,
+                # so the tracklogs don't need to be loaded just to show them
+                notLoaded = [path for path in notLoaded if path not in previews]
         if notLoaded:
             # remove possible nonexistent tracks from the not loaded tracks
             notLoaded = self.removeNonexistentTracks(notLoaded)
-            # load the existing not loaded tracks
+            # load the existing not loaded tracks in the background,
+            # they are drawn once loaded
             loadTl.loadPathList(notLoaded)
 
         for path in visibleTracklogs.keys():
-            GPXTracklog = loadTl.get_tracklog_for_path(path)
             colorName = visibleTracklogs[path]['colorName']
+            GPXTracklog = loadTl.get_loaded_tracklog(path)
+            if GPXTracklog is None:
+                if path in previews:
+                    self.drawLOD(cr, previews[path], colorName)
+                continue
 
             if self.get('showTracklog', None) == 'simple':
                 self.drawSimpleTrack(cr, GPXTracklog, colorName)
@@ -241,63 +258,24 @@ class ShowTracklogs(RanaModule):
             self.log.info("skipping drawing of one track (tracklog or projection == None)")
             return
 
-        (screenCentreX, screenCentreY, screenRadius) = proj.screenRadius()
         #    cr.set_source_rgb(0,0, 0.5)
-        cr.set_source_color(gtk.gdk.color_parse(colorName))
-        cr.set_line_width(self.lineWidth)
-        numberOfClusters = len(GPXTracklog.clusters) # how many clusters do we have in this tracklog ?
-        for cluster in GPXTracklog.clusters: # we draw all clusters in tracklog
-
-            # do we see this cluster ?
-            clusterCentreX = cluster.centreX
-            clusterCentreY = cluster.centreY
-            clusterRadius = cluster.radius
-            screenToClusterDistance = geo.distance(screenCentreX, screenCentreY, clusterCentreX, clusterCentreY)
-            if (screenToClusterDistance - (screenRadius + clusterRadius)) >= 0:
-                continue # we don't see this cluster se we skip it
-            clusterNr = GPXTracklog.clusters.index(cluster)
-            #self.log.debug("Cluster nr %d" % clusterNr)
-            # now we need to draw lines to connect neighboring clusters
-            prevClusterNr = clusterNr - 1
-            nextClusterNr = clusterNr + 1
-            if prevClusterNr >= 0: # the 0th cluster has no previous cluster
-                prevCluster = GPXTracklog.clusters[prevClusterNr]
-                thisClusterLen = len(cluster.pointsList)
-                prevClusterFirstPoint = prevCluster.pointsList[0]
-                thisClusterLastPoint = cluster.pointsList[thisClusterLen - 1]
-                (x1, y1) = proj.ll2xy(thisClusterLastPoint['latitude'], thisClusterLastPoint['longitude'])
-                (x2, y2) = proj.ll2xy(prevClusterFirstPoint['latitude'], prevClusterFirstPoint['longitude'])
-                self.drawLineSegment(cr, x1, y1, x2, y2) # now we connect the two clusters
-                #self.point(cr, x1, y1)
-                #self.point(cr, x2, y2)
-
-            if nextClusterNr <= (numberOfClusters - 1): # the last cluster has no next cluster
-                nextCluster = GPXTracklog.clusters[nextClusterNr]
-                nextClusterLen = len(nextCluster.pointsList)
-                nextClusterLastPoint = nextCluster.pointsList[nextClusterLen - 1]
-                thisClusterFirstPoint = cluster.pointsList[0]
-                (x1, y1) = proj.ll2xy(thisClusterFirstPoint['latitude'], thisClusterFirstPoint['longitude'])
-                (x2, y2) = proj.ll2xy(nextClusterLastPoint['latitude'], nextClusterLastPoint['longitude'])
-                self.drawLineSegment(cr, x1, y1, x2, y2) # now we connect the two clusters
-                #self.point(cr, x1, y1)
-                #self.point(cr, x2, y2)
-
-                # get a list of onscreen coordinates
-            #      points = map(lambda x: proj.ll2xy(x['latitude'], x['longitude']), cluster.pointsList)
-            points = [proj.ll2xy(x['latitude'], x['longitude']) for x in cluster.pointsList]
-            # draw these coordinates
-            (x, y) = points[0]
-            cr.move_to(x, y) # go the the first point
-            [cr.line_to(x[0], x[1]) for x in points[1:]] # extend the line over the other points in the cluster
-
-        cr.stroke()
-        cr.fill()
+        self.drawLOD(cr, GPXTracklog.getLOD(), colorName)
 
     #    if pointsDrawn > 0:
     #    self.log.debug("Nr of trackpoints drawn: %d" % pointsDrawn)
     #    self.log.debug("Redraw took %1.2f ms" % (1000 * (clock() - start)))
 
 
+    def drawLOD(self, cr, lod, colorName='navy'):
+        """draw a track level of detail pyramid"""
+        proj = self.m.get('projection', None)
+        cr.set_source_color(gtk.gdk.color_parse(colorName))
+        cr.set_line_width(self.lineWidth)
+        # draw just the visible parts of the track, simplified for the current zoom level
+        lod.draw(cr, proj.zoom, proj.px1, proj.py1, proj.px2, proj.py2, proj.scale, margin=self.lineWidth)
+        cr.stroke()
+        cr.fill()
+
     def drawColoredTracklog(self, cr, GPXTracklog):
         """show color depending on height"""
         if GPXTracklog.elevation == False: # we cant draw colored tracklog without elevation data
@@ -318,8 +296,7 @@ class ShowTracklogs(RanaModule):
         first = currentRouteInfo['firstElevation']
         last = currentRouteInfo['lastElevation']
 
-        for point in GPXTracklog.trackpointsList[0]:
-            (lat, lon) = (point.latitude, point.longitude)
+        for lat, lon, elevation in GPXTracklog.points:
             (x, y) = proj.ll2xy(lat, lon) # point on the map to screen coordinates
             #print("first point:%s m ,last point:%s m , max:%s m min:%s m") % (first_point.elevation, last_point.elevation, max_elev_point.elevation, min_elev_point.elevation)
             if first:
@@ -338,7 +315,7 @@ class ShowTracklogs(RanaModule):
                 cr.fill()
 
                 cr.set_line_width(self.lineWidth)
-                current_elevation = float(point.elevation)
+                current_elevation = float(elevation)
                 # the maximum height is solid red, that is 1,0,0 in RGB,
                 # the mid-height is 0,0,1 and the minimum height is 0,1,0
                 # we use the following functions to get appropriate numbers for coloring
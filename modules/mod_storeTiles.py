@@ -32,9 +32,10 @@ except Exception:
     log.exception("sqlite import failed")
 
 import os
+import glob
 import time
 from collections import defaultdict
-from threading import RLock
+from threading import RLock, Event
 
 try:  # Python 2.7+
     from collections import OrderedDict as OrderedDict
@@ -43,8 +44,10 @@ except ImportError:
 
 from core import constants
 from core import utils
+from core import threads
 from core.tile_storage.files_store import FileBasedTileStore
 from core.tile_storage.sqlite_store import SqliteTileStore
+from core.tile_storage.mbtiles_store import MBTilesStore, MBTILES_EXTENSION
 
 def getModule(*args, **kwargs):
     return StoreTiles(*args, **kwargs)
@@ -84,9 +87,21 @@ class StoreTiles(RanaModule):
         self._llog = self._no_op
         self.modrana.watch('tileLoadingDebug', self._tile_loading_debug_changed_cb, runNow=True)
         self.modrana.watch('tileStorageType', self._primary_tile_storage_type_changed_cb, runNow=True)
+
+        # the evictor thread periodically removes least recently used
+        # tiles from layers that are over the size limit
+        self._evictor_stop = Event()
+        t = threads.ModRanaThread(name=constants.THREAD_TILE_STORAGE_EVICTOR,
+                                  target=self._evictor_run)
+        self._evictor_thread_name = threads.threadMgr.add(t)
         # device modules are loaded and initialized and configs are parsed before "normal"
         # modRana modules are initialized, so we can cache the map folder path in init
 
+    @property
+    def _sqlite_commit_interval(self):
+        return int(self.get('sqliteTileDatabaseCommitInterval',
+                            constants.DEFAULT_SQLITE_TILE_DATABASE_COMMIT_INTERVAL))
+
     def _get_existing_stores_for_layer(self, layer):
         """Check for any existing stores for the given layer in persistent storage
            and return a dictionary with the found stores under file storage type keys.
@@ -108,7 +123,18 @@ class StoreTiles(RanaModule):
         # check if the path contains a sqlite tile store
         if SqliteTileStore.is_store(layer_folder_path):
             self._llog("sqlite tile store has been found for layer %s" % layer)
-            store_tuple = (constants.TILE_STORAGE_SQLITE, SqliteTileStore(layer_folder_path))
+            store_tuple = (constants.TILE_STORAGE_SQLITE, SqliteTileStore(
+                layer_folder_path, commit_interval=self._sqlite_commit_interval
+            ))
+            store_tuples.append(store_tuple)
+        # check for a MBTiles file (eq. pre-seeded tiles) in the layer folder
+        mbtiles_paths = sorted(glob.glob(os.path.join(layer_folder_path, "*" + MBTILES_EXTENSION)))
+        mbtiles_paths = [path for path in mbtiles_paths if MBTilesStore.is_store(path)]
+        if mbtiles_paths:
+            if len(mbtiles_paths) > 1:
+                self.log.warning("more than one MBTiles file found for layer %s, using %s", layer, mbtiles_paths[0])
+            self._llog("MBTiles store has been found for layer %s" % layer)
+            store_tuple = (constants.TILE_STORAGE_MBTILES, MBTilesStore(mbtiles_paths[0]))
             store_tuples.append(store_tuple)
 
         self._llog("%d existing stores have been found for layer %s" % (len(store_tuples), layer), start)
@@ -142,7 +168,9 @@ class StoreTiles(RanaModule):
                     self._llog("adding file based store for layer %s" % layer)
                 else:  # sqlite tile store
                     store_type = constants.TILE_STORAGE_SQLITE
-                    store = SqliteTileStore(layer_folder_path)
+                    store = SqliteTileStore(
+                        layer_folder_path, commit_interval=self._sqlite_commit_interval
+                    )
                     self._llog("adding file based store for layer %s" % layer)
                 # add the store to the stores dict while keeping the primary-storage-type first ordering
                 self._add_store_for_layer(layer, (store_type, store))
@@ -207,6 +235,20 @@ class StoreTiles(RanaModule):
         pass
 
     def get_tile_data(self, lzxy):
+        tile_tuple = self.get_tile_data_and_timestamp(lzxy)
+        if tile_tuple is not None:
+            return tile_tuple[0]
+        else:
+            return None
+
+    def get_tile_data_and_timestamp(self, lzxy):
+        """Get tile data together with the time it has been stored
+
+        :param tuple lzxy: layer, z, x, y coordinate tuple describing a single tile
+        :returns: (tile data, timestamp) or None if the tile is not stored
+                  (or has timed out)
+        :rtype: a (bytes, number) tuple or None
+        """
         start = time.clock()
         layer = lzxy[0]
         self._llog("tile requested: %s" % str(lzxy))
@@ -233,10 +275,10 @@ class StoreTiles(RanaModule):
                         return None # pretend the tile is not stored
                     else:  # still fresh enough
                         self._llog("tile is still fresh enough: %s" % str(lzxy), start)
-                        return tile_data
+                        return tile_tuple
                 else:  # the tile is always fresh
                     self._llog("returning tile data for: %s" % str(lzxy), start)
-                    return tile_data
+                    return tile_tuple
         # nothing found in any store (or no stores)
         self._llog("tile not found: %s" % str(lzxy), start)
         return None
@@ -275,6 +317,100 @@ class StoreTiles(RanaModule):
         self._llog("we have not found tile: %s" % str(lzxy), start)
         return False
 
+    def _tile_timed_out(self, layer, timestamp):
+        """Report if a tile with the given timestamp is too old for the given layer"""
+        if layer.timeout is None:
+            return False  # the tile is always fresh
+        # layer.timeout is in hours, convert to seconds
+        return timestamp < time.time() - layer.timeout*60*60
+
+    def _group_by_layer(self, lzxy_iterable):
+        layers = defaultdict(list)
+        for lzxy in lzxy_iterable:
+            layers[lzxy[0]].append(lzxy)
+        return layers
+
+    def get_tiles_data(self, lzxy_iterable):
+        """Get data for many tiles at once
+
+        Each store is queried just once for all the tiles not yet found
+        in any of the stores checked before it.
+
+        :param lzxy_iterable: iterable of lzxy tuples
+        :returns: dictionary of tile data keyed by lzxy for tiles that have been found
+        :rtype: dict
+        """
+        start = time.clock()
+        tiles = {}
+        for layer, missing_tiles in self._group_by_layer(lzxy_iterable).items():
+            with self._tile_storage_management_lock:
+                stores = self._get_stores_for_reading(layer)
+            for store in stores:
+                if not missing_tiles:
+                    break
+                found_tiles = store.get_tiles(missing_tiles)
+                for lzxy, (tile_data, timestamp) in found_tiles.items():
+                    if self._tile_timed_out(layer, timestamp):
+                        # pretend the tile is not stored
+                        self.log.debug("not loading timed-out tile: %s" % str(lzxy))
+                    else:
+                        tiles[lzxy] = tile_data
+                missing_tiles = [lzxy for lzxy in missing_tiles if lzxy not in found_tiles]
+        self._llog("%d tiles found in bulk" % len(tiles), start)
+        return tiles
+
+    def tiles_stored(self, lzxy_iterable):
+        """Report which of the given tiles are stored
+
+        Each store is queried just once for all the tiles not yet found
+        in any of the stores checked before it.
+
+        :param lzxy_iterable: iterable of lzxy tuples
+        :returns: set of lzxy tuples of the stored tiles
+        :rtype: set
+        """
+        start = time.clock()
+        stored = set()
+        for layer, missing_tiles in self._group_by_layer(lzxy_iterable).items():
+            with self._tile_storage_management_lock:
+                stores = self._get_stores_for_reading(layer)
+            for store in stores:
+                if not missing_tiles:
+                    break
+                found_tiles = store.tiles_stored(missing_tiles)
+                for lzxy, timestamp in found_tiles.items():
+                    # timed out tiles are reported as not stored
+                    if not self._tile_timed_out(layer, timestamp):
+                        stored.add(lzxy)
+                missing_tiles = [lzxy for lzxy in missing_tiles if lzxy not in found_tiles]
+        self._llog("%d tiles stored found in bulk" % len(stored), start)
+        return stored
+
+    def get_tile_sizes(self, lzxy_iterable):
+        """Get data sizes of many stored tiles at once
+
+        NOTE: timed-out tiles are included, they are still good
+              enough for estimating how large the tiles of a layer are
+
+        :param lzxy_iterable: iterable of lzxy tuples
+        :returns: dictionary of tile data sizes in bytes keyed by lzxy
+                  for tiles that have been found
+        :rtype: dict
+        """
+        start = time.clock()
+        sizes = {}
+        for layer, missing_tiles in self._group_by_layer(lzxy_iterable).items():
+            with self._tile_storage_management_lock:
+                stores = self._get_stores_for_reading(layer)
+            for store in stores:
+                if not missing_tiles:
+                    break
+                found_tiles = store.get_tile_sizes(missing_tiles)
+                sizes.update(found_tiles)
+                missing_tiles = [lzxy for lzxy in missing_tiles if lzxy not in found_tiles]
+        self._llog("%d tile sizes found in bulk" % len(sizes), start)
+        return sizes
+
     def store_tile_data(self, lzxy, tile_data):
         start = time.clock()
         self._llog("store tile data for: %s" % str(lzxy))
@@ -283,8 +419,46 @@ class StoreTiles(RanaModule):
         store.store_tile_data(lzxy, tile_data)
         self._llog("stored tile data for: %s" % str(lzxy), start)
 
+    def _evictor_run(self):
+        while not self._evictor_stop.wait(constants.TILE_STORAGE_EVICTION_INTERVAL):
+            try:
+                self.evict_tiles()
+            except Exception:
+                self.log.exception("tile eviction failed")
+        self.log.debug("tile storage evictor thread shutting down")
+
+    def evict_tiles(self):
+        """Remove least recently used tiles from layers that are over the size limit
+
+        If there is more than one store for a layer, the stores are shrunk
+        in proportion to their size.
+        """
+        size_limit = int(self.get('tileStorageLayerSizeLimit', constants.DEFAULT_TILE_STORAGE_LAYER_SIZE_LIMIT))
+        if not size_limit:
+            return  # no limit
+        size_limit = size_limit * 1024 * 1024  # MiB to bytes
+        with self._tile_storage_management_lock:
+            layer_stores = [(layer, list(stores.values())) for layer, stores in self._stores.items()]
+        for layer, stores in layer_stores:
+            if self._evictor_stop.is_set():
+                break
+            # stores that can't report their size (such as read only MBTiles) are never evicted
+            store_sizes = [(store, store.get_size()) for store in stores]
+            store_sizes = [(store, size) for store, size in store_sizes if size is not None]
+            total_size = sum(size for _store, size in store_sizes)
+            if total_size <= size_limit:
+                continue
+            self.log.info("tiles for layer %s take %d bytes, over the limit of %d bytes, evicting",
+                          layer, total_size, size_limit)
+            excess = total_size - size_limit
+            for store, size in store_sizes:
+                store.evict(size - excess * size // total_size)
+
     def shutdown(self):
         start = time.clock()
+        # stop the evictor thread
+        self._evictor_stop.set()
+        threads.threadMgr.wait(self._evictor_thread_name)
         # close all stores
         self.log.debug("closing tile stores")
         layer_count = 0
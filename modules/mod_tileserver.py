@@ -17,92 +17,233 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #---------------------------------------------------------------------------
-import random
-import sys
-from threading import Thread
-from core.backports import six
-
-SimpleHTTPServer = six.moves.SimpleHTTPServer
-SocketServer = six.moves.socketserver
+import socket
+import threading
+from email.utils import parsedate_tz, mktime_tz
 
 try:  # Python 2
-    from urllib2 import HTTPError
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
 except ImportError:  # Python 3
-    from urllib.error import HTTPError
-try:
-    from  cStringIO import StringIO # python 2
-except ImportError:
-    from io import StringIO # python 3
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
 
+from core import utils
 from modules.base_module import RanaModule
-from modules import tileserver_callback_proxy
+
+import logging
+log = logging.getLogger("mod.tileserver")
+
+DEFAULT_PORT = 9009
+# how long can clients use a tile before asking if it changed
+TILE_MAX_AGE = 60 * 60  # in seconds
+# close keep-alive connections idle for longer than this
+KEEP_ALIVE_TIMEOUT = 30  # in seconds
+MAX_ZOOM = 30
 
 
 def getModule(*args, **kwargs):
     return Tileserver(*args, **kwargs)
 
 
+def parseTilePath(path):
+    """Parse tile coordinates from a tileserver request path
+
+    Supported URL schemes:
+    * /<layer id>/<z>/<x>/<y>.<extension> - tile of the given layer
+    * /<z>/<x>/<y>.<extension> - tile of the current layer
+    * both can be prefixed with /tms for TMS tile numbering (y axis going up)
+    The extension is optional.
+
+    :param str path: request path
+    :returns: (layer id or None for current layer, z, x, y) tuple
+              with XYZ tile coordinates or None if the path is not valid
+    :rtype: tuple or None
+    """
+    parts = path.split("?", 1)[0].strip("/").split("/")
+    tms = parts[0] == "tms"
+    if tms:
+        parts = parts[1:]
+    if len(parts) == 4:
+        layerId = parts.pop(0)
+    elif len(parts) == 3:
+        layerId = None
+    else:
+        return None
+    try:
+        z = int(parts[0])
+        x = int(parts[1])
+        y = int(parts[2].split(".", 1)[0])
+    except ValueError:
+        return None
+    if not 0 <= z <= MAX_ZOOM:
+        return None
+    tileCount = 2 ** z
+    if not (0 <= x < tileCount and 0 <= y < tileCount):
+        return None
+    if tms:
+        y = tileCount - 1 - y
+    return layerId, z, x, y
+
+
+class TileRequestHandler(BaseHTTPRequestHandler):
+    """Serve tiles over HTTP/1.1 with keep-alive & cache validators"""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "modRanaTileserver/1.0"
+    # close idle keep-alive connections
+    timeout = KEEP_ALIVE_TIMEOUT
+    # send headers & body of a response together (the buffer is flushed after
+    # each request) and don't let small responses wait for delayed ACKs
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._sendTile(sendBody=True)
+
+    def do_HEAD(self):
+        self._sendTile(sendBody=False)
+
+    def _sendTile(self, sendBody):
+        tile = parseTilePath(self.path)
+        if tile is None:
+            self._sendEmpty(400)
+            return
+        try:
+            result = self.server.getTile(*tile)
+        except Exception:
+            log.exception("tile lookup failed for %s", self.path)
+            self._sendEmpty(500)
+            return
+        if result is None:
+            self._sendEmpty(404)
+            return
+        tileData, timestamp = result
+        timestamp = int(timestamp)
+        etag = '"%x-%x"' % (timestamp, len(tileData))
+        if self._notModified(etag, timestamp):
+            self.send_response(304)
+            self._sendCacheHeaders(etag, timestamp)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", utils.get_image_mime_type(tileData) or "application/octet-stream")
+        self.send_header("Content-Length", str(len(tileData)))
+        self._sendCacheHeaders(etag, timestamp)
+        self.end_headers()
+        if sendBody:
+            self.wfile.write(tileData)
+
+    def _sendCacheHeaders(self, etag, timestamp):
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", self.date_time_string(timestamp))
+        self.send_header("Cache-Control", "max-age=%d" % TILE_MAX_AGE)
+
+    def _notModified(self, etag, timestamp):
+        """Check the request cache validators
+
+        If-None-Match takes precedence over If-Modified-Since, as per RFC 7232.
+
+        :returns: True if the client already has the current tile
+        :rtype: bool
+        """
+        ifNoneMatch = self.headers.get("If-None-Match")
+        if ifNoneMatch is not None:
+            if ifNoneMatch.strip() == "*":
+                return True
+            # weak comparison
+            tags = [tag.strip() for tag in ifNoneMatch.split(",")]
+            return etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+        ifModifiedSince = self.headers.get("If-Modified-Since")
+        if ifModifiedSince is not None:
+            parsed = parsedate_tz(ifModifiedSince)
+            if parsed is not None:
+                return timestamp <= mktime_tz(parsed)
+        return False
+
+    def _sendEmpty(self, status):
+        # send an empty body with explicit length, so that the connection can be kept alive
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        log.debug("%s - %s", self.address_string(), format % args)
+
+
+class TileServer(ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server serving tiles from a tile lookup function"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, getTile):
+        """
+        :param tuple address: (host, port) tuple to listen on
+        :param getTile: function taking (layer id, z, x, y) returning
+                        (tile data, timestamp) tuple or None if the tile is not available,
+                        the layer id is None for the current layer
+        """
+        HTTPServer.__init__(self, address, TileRequestHandler)
+        self.getTile = getTile
+
+
 class Tileserver(RanaModule):
     """A modRana built-in tileserver"""
 
     def __init__(self, *args, **kwargs):
         RanaModule.__init__(self, *args, **kwargs)
-
-        tileserver_callback_proxy.cb = self
-
         self.port = None
         self.server = None
         self.serverThread = None
-        self._mapTiles = None
 
         if self.modrana.gui.needsLocalhostTileserver():
-            self.startServer(9009)
-
-    def firstTime(self):
-        self._mapTiles = self.m.get('mapTiles', None) # mapTiles module shortcut
-
-
-    def runServer(self):
-        self.log.info("starting localhost tileserver")
+            self.startServer(DEFAULT_PORT)
 
-        self.port = 9009
-        #    self.tileserverPort = random.randint(8000,9000)
+    def _getTile(self, layerId, z, x, y):
+        """Get a stored tile for the tileserver
 
-
-        #    Handler = SimpleHTTPServer.SimpleHTTPRequestHandler
-
-
-        try:
-            self.log.info("starting on port %d", self.port)
-            self.httpd = Server(("", self.tileserverPort), self)
-        except Exception:
-            self.log.exception("starting server on port %d failed", self.port)
-            self.port = random.randint(9000, 10000)
-            self.log.info("generating random port")
-            self.log.info("starting on port %d", self.port)
-            self.server = Server(("", self.port), self)
-
-        self.log.info("running at port: %d", self.port)
-        self.server.serve_forever()
-
-
-    def startServer(self, port):
+        :returns: (tile data, timestamp) tuple or None if the tile is not stored
         """
-        start the tileserver
+        if layerId is None:
+            layerId = self.get('layer', 'mapnik')
+        mapLayers = self.m.get('mapLayers', None)
+        storeTiles = self.m.get('storeTiles', None)
+        if mapLayers is None or storeTiles is None:
+            return None
+        layer = mapLayers.getLayerById(layerId)
+        if layer is None:
+            return None
+        return storeTiles.get_tile_data_and_timestamp((layer, z, x, y))
+
+    def startServer(self, port=DEFAULT_PORT):
+        """Start the tileserver
+
+        :param int port: port to listen on, if not available a free port is used
         """
-        self.log.info("starting localhost tileserver")
-        t = Thread(target=self.runServer)
-        t.daemon = True
-        t.start()
-        self.serverThread = t
+        if self.server:
+            self.log.debug("tileserver already running")
+            return
+        self.log.info("starting localhost tileserver on port %d", port)
+        try:
+            self.server = TileServer(("127.0.0.1", port), self._getTile)
+        except socket.error:
+            self.log.exception("starting tileserver on port %d failed, using a free port", port)
+            self.server = TileServer(("127.0.0.1", 0), self._getTile)
+        self.port = self.server.server_address[1]
+        self.serverThread = threading.Thread(target=self.server.serve_forever, name="modRanaTileserver")
+        self.serverThread.daemon = True
+        self.serverThread.start()
+        self.log.info("tileserver running at port: %d", self.port)
 
     def stopServer(self):
-        """
-        stop the tileserver
-        """
+        """Stop the tileserver"""
         if self.server:
-            self.server.socket.close()
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
             self.serverThread = None
+            self.port = None
 
     def getServerPort(self):
         """
@@ -112,51 +253,3 @@ class Tileserver(RanaModule):
 
     def shutdown(self):
         self.stopServer()
-
-
-class Server(SocketServer.TCPServer):
-#      def __init__(self, tuple, callback):
-#        SocketServer.TCPServer.init(tuple, "")
-#        self.callback = callback
-
-    class Proxy(SimpleHTTPServer.SimpleHTTPRequestHandler):
-        def __init__(self, request, client_address):
-            try:
-                SimpleHTTPServer.SimpleHTTPRequestHandler.__init__(self, request, client_address, self)
-            except:
-                SimpleHTTPServer.SimpleHTTPRequestHandler.__init__(self, request, client_address, self)
-
-        def do_GET(self):
-            split = self.path.split("/")
-            layer = split[1]
-            z = int(split[2])
-            x = int(split[3])
-            y = int(split[4].split(".")[0])
-            self.log.debug(self.path)
-            self.log.debug(tileserver_callback_proxy.cb._mapTiles)
-            try:
-                tileData = tileserver_callback_proxy.cb._mapTiles.getTile(layer, z, x, y)
-                if tileData:
-
-                    self.send_response(200)
-                    self.send_header("Content-type", "image/png")
-                    #self.send_header("Content-type", "application/octet-stream")
-                    self.send_header("Content-Length", len(tileData))
-                    #              self.send_header('Server', self.version_string())
-                    #              self.send_header('Date', self.date_time_string())
-                    self.end_headers()
-
-                    self.log.debug("GET returning file")
-
-                    self.wfile.write(StringIO(tileData).read())
-                    return True
-                else:
-                    self.log.debug("GET tile not found")
-                    return False
-            except HTTPError:
-                e = sys.exc_info()[1]
-                # forward the error code
-                self.send_response(e.code)
-
-    def finish_request(self, request, client_address):
-        self.Proxy(request, client_address)
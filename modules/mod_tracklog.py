@@ -22,8 +22,8 @@ import shutil
 import glob
 import time
 import os
-from collections import deque
 from core import geo
+from core.polyline_lod import PolylineLOD
 from core.way import Way, AppendOnlyWay
 from core import gs
 from core.signal import Signal
@@ -83,7 +83,7 @@ class Tracklog(RanaModule):
         self.traceColor = 'blue'
         self.lastTracePoint = None
         self.traceIndex = 0
-        self.pxpyIndex = deque()
+        self.traceLOD = PolylineLOD()
         self.lastX = 0
         self.lastY = 0
 
@@ -165,7 +165,7 @@ class Tracklog(RanaModule):
         self.avgSpeed = 0
         self.currentTempLog = []
         self.distance = 0
-        self.pxpyIndex.clear()
+        self.traceLOD.clear()
         logFolder = self.getLogFolderPath()
 
         name = self.generateLogName(name)
@@ -265,7 +265,7 @@ class Tracklog(RanaModule):
         """Clear the on-map log trace
         NOTE: currently does something only with GTK GUI
         """
-        self.pxpyIndex = []
+        self.traceLOD.clear()
 
     def _updateLogCB(self):
         """add current position at the end of the log"""
@@ -348,11 +348,7 @@ class Tracklog(RanaModule):
         proj = self.m.get('projection')
         if proj:
             (px, py) = proj.ll2pxpyRel(lat, lon)
-            index = self.traceIndex
-            # the pxpyIndex deque is created in reverse order
-            # so that it doesn't need to be reversed when its
-            # drawn on the map from current position to first point
-            self.pxpyIndex.appendleft((px, py, index))
+            self.traceLOD.append(px, py)
             self.traceIndex += 1
             self.lastTracePoint = (lat, lon)
 
@@ -459,7 +455,7 @@ class Tracklog(RanaModule):
         # on-map trace
         self.lastTracePoint = None
         self.traceIndex = 0
-        self.pxpyIndex.clear()
+        self.traceLOD.clear()
 
     #  def getVisiblePoints(self):
     #    # get only the points, that are currently visible
@@ -650,51 +646,17 @@ class Tracklog(RanaModule):
 
     def drawMapOverlay(self, cr):
         proj = self.m.get('projection', None)
-        if proj and self.pxpyIndex:
+        if proj and len(self.traceLOD):
             cr.set_source_color(gtk.gdk.color_parse(self.traceColor))
             cr.set_line_width(10)
-            # log trace drawing algorithm
-            # adapted from TangoGPS source (tracks.c)
-            # works surprisingly good :)
-            # TODO: use the modulo method for drawing stored tracklogs
+            # draw just the visible parts of the trace, simplified for the current zoom level
+            self.traceLOD.draw(cr, proj.zoom, proj.px1, proj.py1, proj.px2, proj.py2, proj.scale, margin=10)
+            # draw a line from the last trace point to current position (if known)
             posXY = proj.getCurrentPosXY()
             if posXY and self.loggingEnabled and not self.loggingPaused:
-                cr.move_to(*posXY) # start drawing from current position
-            else:
-                (px, py, index) = self.pxpyIndex[0] # start drawing from first trace point
-                (x, y) = proj.pxpyRel2xy(px, py)
-                cr.move_to(x, y)
-
-            z = proj.zoom
-
-            if 16 > z > 10:
-                modulo = 2 ** (16 - z)
-            elif z <= 10:
-                modulo = 32
-            else:
-                modulo = 1
-
-            maxDraw = 300
-            drawCount = 0
-            counter = 0
-
-            #draw the track
-            for point in self.pxpyIndex:  # pypyIndex is already in reverse order
-                counter += 1
-                if counter % modulo == 0:
-                    drawCount += 1
-                    if drawCount > maxDraw:
-                        break
-                    (px, py, index) = point
-                    (x, y) = proj.pxpyRel2xy(px, py)
-                    cr.line_to(x, y)
-                    # TODO: don't iterate, just get items based on index
-
-                    # draw a track to current position (if known):
-
-                #      self.log.info(z, modulo)
-                #      self.log.info(counter, drawCount)
-
+                (px, py) = self.traceLOD.lastPoint
+                cr.move_to(*proj.pxpyRel2xy(px, py))
+                cr.line_to(*posXY)
             cr.stroke()
             cr.fill()
 
@@ -66,7 +66,7 @@ class TracklogManager(RanaModule):
             self.log.info("getting elevation info for active tracklog")
             activeTracklog = self.LTModule.get_active_tracklog()
             # generate a list of (lat,lon) tuples
-            latLonList = map(lambda x: (x.latitude, x.longitude), activeTracklog.trackpointsList[0])
+            latLonList = list(zip(activeTracklog.points.lats, activeTracklog.points.lons))
             # look-up elevation data using Geonames asynchronously
             online = self.m.get("onlineServices", None)
             if online:
@@ -124,7 +124,7 @@ class TracklogManager(RanaModule):
         # from cache
         self.LTModule.delete_tracklog_from_cache(path)
         # from loaded tracklogs
-        del self.LTModule.tracklogs[path]
+        self.LTModule.unload_tracklog(path)
         # delete the tracklog file
         os.remove(path)
 
@@ -243,9 +243,8 @@ class TracklogManager(RanaModule):
 
             # * draw "show button" button
 
-            if track.trackpointsList and track.trackpointsList[0]:
-                firstPoint = track.trackpointsList[0][0]
-                (lat, lon) = (firstPoint.latitude, firstPoint.longitude)
+            if track.points:
+                (lat, lon) = track.points[0][:2]
                 action3 = "mapView:recentre %f %f|set:showTrackFilename:%s|showTracklogs:makeVisible|set:menu:None" % (
                 lat, lon, track.filename)
                 menus.drawButton(cr, x3, y3, dx, dy, "show on map", "generic", action3)
@@ -261,10 +260,7 @@ class TracklogManager(RanaModule):
             # * draw an info box
             menus.drawButton(cr, x4, y4 + dy, w, h1 - (y4 + dy), "", "generic", "set:menu:tracklogManager#tracklogInfo")
 
-            if track.trackpointsList:
-                pointCount = len(track.trackpointsList[0])
-            else:
-                pointCount = 0
+            pointCount = len(track.points)
 
             text = "number of points: %d\n" % pointCount
             if track.elevation == True:
@@ -325,6 +321,10 @@ class TracklogManager(RanaModule):
             'path']
         name = item['filename']
         description = 'type: ' + item['type'] + '   size:' + item['size'] + '   last modified:' + item['lastModified']
+        # length is known without loading the tracklog once it has been cached
+        units = self.m.get('units', None)
+        if units and item.get('length') is not None:
+            description += '   length:' + units.m2CurrentUnitString(item['length'], 2, False)
 
         return (
             name,
@@ -348,9 +348,7 @@ class TracklogManager(RanaModule):
     def _handleElevationLookupResults(self, key, results):
         onlineElevList, originalTracklog = results
         if onlineElevList:
-            index = 0
-            for onlinePoint in onlineElevList: # add the new elevation data to the tracklog
-                originalTracklog.trackpointsList[0][index].elevation = onlinePoint[2]
-                index += 1
+            for index, onlinePoint in enumerate(onlineElevList): # add the new elevation data to the tracklog
+                originalTracklog.setElevation(index, onlinePoint[2])
             originalTracklog.modified() # make the tracklog update
             originalTracklog.replaceFile() # replace the old tracklog file
\ No newline at end of file
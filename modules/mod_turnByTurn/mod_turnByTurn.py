@@ -25,6 +25,7 @@ from core import threads
 from core import constants
 from core.signal import Signal
 from core import gs
+from .route_index import RouteIndex
 import math
 import time
 from threading import RLock
@@ -78,6 +79,7 @@ class TurnByTurn(RanaModule):
     def _go_to_initial_state(self):
         """restore initial state"""
         self._route = None
+        self._route_index = None
         self._current_step_index_value = 0
         self._current_step_indicator = None
         self._espeak_first_and_half_trigger = False
@@ -403,7 +405,7 @@ class TurnByTurn(RanaModule):
             for step in temp_steps:
                 (lat2, lon2) = step.getLL()
                 step.current_distance = geo.distance(lat1, lon1, lat2, lon2) * 1000  # km to m
-            closest_step = sorted(temp_steps, key=lambda x: x.current_distance)[0]
+            closest_step = min(temp_steps, key=lambda x: x.current_distance)
 
             return closest_step
 
@@ -497,6 +499,8 @@ class TurnByTurn(RanaModule):
                 self._route = route
                 # get route in radians for automatic rerouting
                 self.radiansRoute = route.get_points_lle_radians(drop_elevation=True)
+                # segment index for quickly checking if the route is being followed
+                self._route_index = RouteIndex(self.radiansRoute)
                 # start rerouting watch
                 self._start_tbt_worker()
 
@@ -757,36 +761,30 @@ class TurnByTurn(RanaModule):
         start1 = time.clock()
         pos = self.get('pos', None)
         proj = self.m.get('projection', None)
-        if pos and proj:
+        route_index = self._route_index
+        if pos and proj and route_index is not None:
             pLat, pLon = pos
             # we use Radians to get rid of radian conversion overhead for
             # the geographic distance computation method
-            radians_ll = self.radiansRoute
             pLat = geo.radians(pLat)
             pLon = geo.radians(pLon)
-            if len(radians_ll) == 0:
+            if len(route_index) == 0:
                 self.log.error("Divergence: can't follow a zero point route")
                 return False
-            elif len(radians_ll) == 1:  # 1 point route
-                aLat, aLon = radians_ll[0]
-                min_distance = geo.distance_approx_radians(pLat, pLon, aLat, aLon)
-            else:  # 2+ points route
-                aLat, aLon = radians_ll[0]
-                bLat, bLon = radians_ll[1]
-                min_distance = geo.distance_point_to_line_radians(pLat, pLon, aLat, aLon, bLat, bLon)
-                aLat, aLon = bLat, bLon
-                for point in radians_ll[1:]:
-                    bLat, bLon = point
-                    dist = geo.distance_point_to_line_radians(pLat, pLon, aLat, aLon, bLat, bLon)
-                    if dist < min_distance:
-                        min_distance = dist
-                    aLat, aLon = bLat, bLon
-                # the multiplier tries to compensate for high speed movement
+            # the multiplier tries to compensate for high speed movement
             threshold = float(
                 self.get('reroutingThreshold', REROUTING_DEFAULT_THRESHOLD)) * self._rerouting_threshold_multiplier
-            self.log.debug("Divergence from route: %1.2f/%1.2f m computed in %1.0f ms",
-            min_distance * 1000, float(threshold), (1000 * (time.clock() - start1)))
-            return min_distance * 1000 < threshold
+            # only the segments around the last closest one are checked while following
+            # the route, the whole route is checked using the segment index otherwise
+            nearby_segment = route_index.segmentWithin(pLat, pLon, threshold / 1000.0)
+            if nearby_segment is None:
+                self.log.debug("Divergence from route: more than %1.2f m computed in %1.0f ms",
+                               float(threshold), (1000 * (time.clock() - start1)))
+                return False
+            else:
+                self.log.debug("Divergence from route: %1.2f/%1.2f m computed in %1.0f ms",
+                               nearby_segment[0] * 1000, float(threshold), (1000 * (time.clock() - start1)))
+                return True
 
     def _start_tbt_worker(self):
         with self._tbt_worker_lock:
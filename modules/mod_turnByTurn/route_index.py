@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""Route segment index for checking if a route is being followed
+
+Checking the distance of the current position from every segment of a route
+is the main navigation CPU cost on long routes. Instead the route segments
+are put to a uniform grid over their bounding boxes once per route and the
+segments around the one that was closest last time are checked first.
+The grid is only queried when the position is not near any of those,
+eq. when diverging from the route or after skipping part of it.
+
+Distances are computed with geo.distance_point_to_line_radians()
+just like before, the index only limits which segments are checked.
+"""
+from math import cos, floor, pi
+
+from core import geo
+
+# grid cell size in radians, about 1 km at the equator
+CELL_SIZE = 0.00015
+# segments with bounding boxes covering more cells than this
+# are not put to the grid but always checked
+MAX_CELLS_PER_SEGMENT = 64
+# how many segments around the last closest one to check first
+# - with densely spaced route points the closest segment can
+#   jump around a bit due to GPS noise
+WINDOW_BEHIND = 8
+WINDOW_AHEAD = 32
+# the margin around segments is widened a bit so that
+# it safely covers the spherical distance to segment end points
+LON_MARGIN_FACTOR = 1.01
+MIN_COS = 0.01
+
+
+class SegmentGrid(object):
+    """A uniform grid of polyline segments over their bounding boxes"""
+
+    def __init__(self, points, cellSize=CELL_SIZE):
+        """
+        :param list points: list of (lat, lon, ...) tuples in radians
+        :param float cellSize: grid cell size in radians
+        """
+        self._cellSize = cellSize
+        # (row, column) -> list of segment indexes
+        self._cells = {}
+        # segments too big to put to the grid
+        self._bigSegments = []
+        self._maxAbsLat = max(abs(point[0]) for point in points) if points else 0.0
+        for index in range(len(points) - 1):
+            aLat, aLon = points[index][0], points[index][1]
+            bLat, bLon = points[index + 1][0], points[index + 1][1]
+            firstRow, lastRow = self._cellRange(min(aLat, bLat), max(aLat, bLat))
+            firstColumn, lastColumn = self._cellRange(min(aLon, bLon), max(aLon, bLon))
+            if (lastRow - firstRow + 1) * (lastColumn - firstColumn + 1) > MAX_CELLS_PER_SEGMENT:
+                self._bigSegments.append(index)
+                continue
+            for row in range(firstRow, lastRow + 1):
+                for column in range(firstColumn, lastColumn + 1):
+                    self._cells.setdefault((row, column), []).append(index)
+
+    def _cellRange(self, start, end):
+        return int(floor(start / self._cellSize)), int(floor(end / self._cellSize))
+
+    def segmentsNear(self, lat, lon, maxDistance):
+        """Get segments that might be closer to a point than the given distance
+
+        :param float lat: point latitude in radians
+        :param float lon: point longitude in radians
+        :param float maxDistance: distance in kilometers
+        :returns: sorted list of segment indexes
+        :rtype: list
+        """
+        latMargin = maxDistance / geo.EARTH_RADIUS
+        maxCos = cos(min(max(self._maxAbsLat, abs(lat)) + latMargin, pi / 2))
+        lonMargin = LON_MARGIN_FACTOR * latMargin / max(maxCos, MIN_COS)
+        firstRow, lastRow = self._cellRange(lat - latMargin, lat + latMargin)
+        firstColumn, lastColumn = self._cellRange(lon - lonMargin, lon + lonMargin)
+        segments = set(self._bigSegments)
+        for row in range(firstRow, lastRow + 1):
+            for column in range(firstColumn, lastColumn + 1):
+                cellSegments = self._cells.get((row, column))
+                if cellSegments:
+                    segments.update(cellSegments)
+        return sorted(segments)
+
+
+class RouteIndex(object):
+    """Find route segments near the current position
+
+    The segment that was closest the last time is tracked, so that
+    when following the route just a few segments around it need to be checked.
+
+    NOTE: not thread safe, should be used from a single thread
+    """
+
+    def __init__(self, points):
+        """
+        :param list points: the route as a list of (lat, lon, ...) tuples in radians
+        """
+        self._points = points
+        self._grid = SegmentGrid(points)
+        self._currentSegment = 0
+        # how many times the grid had to be queried
+        self.gridQueryCount = 0
+
+    def __len__(self):
+        return len(self._points)
+
+    @property
+    def currentSegment(self):
+        """Index of the segment that was closest the last time"""
+        return self._currentSegment
+
+    def _segmentDistance(self, lat, lon, index):
+        a = self._points[index]
+        b = self._points[index + 1]
+        return geo.distance_point_to_line_radians(lat, lon, a[0], a[1], b[0], b[1])
+
+    def _closest(self, lat, lon, segments):
+        """Get (distance, segment index) for the closest of the given segments"""
+        closest = None
+        for index in segments:
+            distance = self._segmentDistance(lat, lon, index)
+            if closest is None or distance < closest[0]:
+                closest = (distance, index)
+        return closest
+
+    def segmentWithin(self, lat, lon, maxDistance):
+        """Find a route segment closer to a point than the given distance
+
+        The segments around the one found last time are checked first,
+        the whole route only if none of them is close enough.
+
+        :param float lat: point latitude in radians
+        :param float lon: point longitude in radians
+        :param float maxDistance: distance in kilometers
+        :returns: (distance in kilometers, segment index) tuple or None
+                  if no route segment is closer than maxDistance,
+                  the segment index is None for single point routes
+        :rtype: tuple or None
+        """
+        if not self._points:
+            return None
+        elif len(self._points) == 1:
+            distance = geo.distance_approx_radians(lat, lon, self._points[0][0], self._points[0][1])
+            if distance < maxDistance:
+                return distance, None
+            else:
+                return None
+        segmentCount = len(self._points) - 1
+        window = range(max(self._currentSegment - WINDOW_BEHIND, 0),
+                       min(self._currentSegment + WINDOW_AHEAD + 1, segmentCount))
+        closest = self._closest(lat, lon, window)
+        if closest is None or closest[0] >= maxDistance:
+            self.gridQueryCount += 1
+            closest = self._closest(lat, lon, self._grid.segmentsNear(lat, lon, maxDistance))
+        if closest is None or closest[0] >= maxDistance:
+            return None
+        self._currentSegment = closest[1]
+        return closest
@@ -1 +0,0 @@
-cb = None
\ No newline at end of file
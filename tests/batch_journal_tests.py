@@ -0,0 +1,232 @@
+import unittest
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+try:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from urlparse import urlparse
+except ImportError:  # Python 3
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import urlparse
+
+from core import threads
+from core.layers import MapLayer
+from core.negative_cache import NegativeTileCache
+from core.host_controller import HostControllers
+from modules.mod_mapData import pools
+from modules.mod_mapData import batch_journal
+from modules.mod_mapData.batch_journal import BatchJournal
+from tests.negative_cache_tests import FakeClock, ThreadingHTTPServer, PNG_HEADER
+
+TILE_COUNT = 60
+# how long the stub server takes to answer
+RESPONSE_DELAY = 0.02  # in seconds
+BATCH_TIMEOUT = 30  # in seconds
+
+
+class SlowTileHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        time.sleep(RESPONSE_DELAY)
+        with self.server.lock:
+            # tile downloads use absolute request URLs
+            self.server.paths.append(urlparse(self.path).path)
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(PNG_HEADER)))
+        self.end_headers()
+        self.wfile.write(PNG_HEADER)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeTileStore(object):
+    """Stores tile data under (x, y, z) tuples, like the batch items"""
+
+    def __init__(self):
+        self.tiles = {}
+        self.lock = threading.Lock()
+
+    def tile_is_stored(self, lzxy):
+        _layer, z, x, y = lzxy
+        return (x, y, z) in self.tiles
+
+    def store_tile_data(self, lzxy, data):
+        _layer, z, x, y = lzxy
+        with self.lock:
+            self.tiles[(x, y, z)] = data
+
+
+class FakeMapTiles(object):
+    def __init__(self):
+        self.negativeCache = NegativeTileCache()
+        self.hostControllers = HostControllers()
+
+
+class FakeModRana(object):
+    def __init__(self, modules, options):
+        self.m = modules
+        self._options = options
+
+    def get(self, key, default=None):
+        return self._options.get(key, default)
+
+
+class BatchJournalTests(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "journal.sqlite")
+        self.items = [(x, y, 15) for x in range(10) for y in range(10)]
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def journal_test(self):
+        journal = BatchJournal(self.path)
+        journal.create("mapnik", self.items)
+        self.assertEqual(journal.tileCount, 100)
+        self.assertEqual(journal.pendingCount, 100)
+        for item in self.items[:30]:
+            journal.markDone(item, 100)
+        # marking a tile twice or marking unknown tiles does nothing
+        journal.markDone(self.items[0], 100)
+        journal.markDone((1000, 1000, 15), 100)
+        journal.close()
+
+        loaded = BatchJournal(self.path)
+        self.assertTrue(loaded.load())
+        self.assertEqual(loaded.layerId, "mapnik")
+        self.assertEqual(loaded.tileCount, 100)
+        self.assertEqual(loaded.doneCount, 30)
+        self.assertEqual(loaded.downloadedDataSize, 3000)
+        self.assertEqual(loaded.pendingItems(), self.items[30:])
+        loaded.discard()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(BatchJournal(self.path).load())
+
+    def checkpoint_test(self):
+        """Only checkpointed progress should survive a crash"""
+        clock = FakeClock()
+        journal = BatchJournal(self.path, clock=clock)
+        journal.create("mapnik", self.items)
+        for item in self.items[:10]:
+            journal.markDone(item)
+        # time based checkpoint
+        clock.advance(batch_journal.CHECKPOINT_INTERVAL)
+        journal.markDone(self.items[10])
+        for item in self.items[11:20]:
+            journal.markDone(item)
+        # crash - the journal is not closed
+        crashed = BatchJournal(self.path)
+        self.assertTrue(crashed.load())
+        self.assertEqual(crashed.doneCount, 11)
+        self.assertEqual(crashed.pendingItems(), self.items[11:])
+        journal.close()
+        crashed.close()
+
+    def finished_batch_test(self):
+        """A journal with all tiles done has nothing to resume"""
+        journal = BatchJournal(self.path)
+        journal.create("mapnik", self.items)
+        for item in self.items:
+            journal.markDone(item)
+        journal.close()
+        self.assertFalse(BatchJournal(self.path).load())
+
+
+class ResumableBatchDownloadTests(unittest.TestCase):
+
+    def setUp(self):
+        threads.initThreading()
+        self.folder = tempfile.mkdtemp()
+        self.journalPath = os.path.join(self.folder, "journal.sqlite")
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), SlowTileHandler)
+        self.server.lock = threading.Lock()
+        self.server.paths = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.layer = MapLayer("stub", {"url": "http://127.0.0.1:%d/" % self.server.server_port,
+                                       "type": "png", "coordinates": "osm"})
+        self.store = FakeTileStore()
+        self.originalModRana = pools.modrana
+        self.mapData = FakeModRana({}, {})
+        pools.modrana = FakeModRana({"mapTiles": FakeMapTiles(), "storeTiles": self.store, "mapData": self.mapData},
+                                    {"maxDlThreads": 4})
+        self.originalCheckpointCount = batch_journal.CHECKPOINT_TILE_COUNT
+        batch_journal.CHECKPOINT_TILE_COUNT = 5
+        self.items = [(x, y, 15) for x in range(TILE_COUNT // 6) for y in range(6)]
+
+    def tearDown(self):
+        batch_journal.CHECKPOINT_TILE_COUNT = self.originalCheckpointCount
+        pools.modrana = self.originalModRana
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.folder)
+
+    def _runBatch(self, batch, journal=None, stopAfter=None, onStop=None):
+        pool = pools.BatchTileDownloadPool()
+        pool.journalPath = self.journalPath
+        pool.layer = self.layer
+        done = threading.Event()
+        pool.batchDone.connect(done.set)
+        pool.startBatch(batch, journal=journal)
+        if stopAfter:
+            deadline = time.time() + BATCH_TIMEOUT
+            while len(self.server.paths) < stopAfter and time.time() < deadline:
+                time.sleep(0.005)
+            if onStop:
+                onStop()
+            pool.stop()
+        self.assertTrue(done.wait(BATCH_TIMEOUT))
+        return pool
+
+    def _assertEachTileDownloadedOnce(self):
+        expected = sorted("/15/%d/%d.png" % (x, y) for (x, y, _z) in self.items)
+        self.assertEqual(sorted(self.server.paths), expected)
+
+    def interrupted_batch_test(self):
+        """A stopped batch should resume with exactly the missing tiles"""
+        self._runBatch(set(self.items), stopAfter=TILE_COUNT // 3)
+        self.assertTrue(0 < len(self.store.tiles) < TILE_COUNT)
+        journal = BatchJournal(self.journalPath)
+        self.assertTrue(journal.load())
+        self.assertEqual(journal.doneCount, len(self.store.tiles))
+        pending = journal.pendingItems()
+        self.assertEqual(set(pending), set(self.items) - set(self.store.tiles))
+
+        pool = self._runBatch(set(pending), journal=journal)
+        self._assertEachTileDownloadedOnce()
+        self.assertEqual(len(self.store.tiles), TILE_COUNT)
+        self.assertEqual(pool.failedDownloadCount, 0)
+        # the finished batch journal is removed
+        self.assertFalse(os.path.exists(self.journalPath))
+
+    def crashed_batch_test(self):
+        """A batch resumed from the last checkpoint before a crash should not
+        download tiles again, even if they were downloaded after the checkpoint
+        """
+        crashPath = os.path.join(self.folder, "crashed.sqlite")
+
+        def crash():
+            # snapshot the journal as it is on disk in this moment
+            source = sqlite3.connect(self.journalPath)
+            target = sqlite3.connect(crashPath)
+            source.backup(target)
+            target.close()
+            source.close()
+
+        self._runBatch(set(self.items), stopAfter=TILE_COUNT // 2, onStop=crash)
+        journal = BatchJournal(crashPath)
+        self.assertTrue(journal.load())
+        pending = journal.pendingItems()
+        self.assertTrue(len(pending) >= TILE_COUNT - len(self.store.tiles))
+        self._runBatch(set(pending), journal=journal)
+        self._assertEachTileDownloadedOnce()
+        self.assertEqual(len(self.store.tiles), TILE_COUNT)
@@ -0,0 +1,28 @@
+"""Geographic distance benchmarks
+
+Compares the single point distance functions called in a loop with
+the array distance functions on all the available backends
+(NumPy is used only if it is installed).
+
+Run from the modRana source folder:
+
+PYTHONPATH=core/bundle python -m tests.geo_benchmark
+"""
+from __future__ import print_function
+import random
+
+from core import geo
+from tests.point_index_tests import randomTrack
+
+POINT_COUNTS = [1000, 10000, 100000]
+
+
+def main():
+    for count in POINT_COUNTS:
+        points = randomTrack(count, random.Random(0))
+        geo.distance_benchmark(points)
+        print("")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,18 @@
 import unittest
+import random
 from core import geo
 from core.point import Point
+from tests.point_index_tests import randomTrack
+
+
+class TrackPoint(object):
+    """Like GPX track points loaded by upoints"""
+
+    def __init__(self, latitude, longitude, elevation):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.elevation = elevation
+
 
 class GeoTests(unittest.TestCase):
 
@@ -48,6 +60,101 @@ class GeoTests(unittest.TestCase):
         result = geo.get_closest_lle(reference_lle, lle_list)
         self.assertEqual(closest_lle, result)
 
+    def distances_test(self):
+        """Test the array distance functions against distance()."""
+        points = randomTrack(500, random.Random(0))
+        lat, lon = 49.25, 16.55
+        for backend in geo.BACKENDS:
+            result = geo.distances(lat, lon, points, backend=backend)
+            self.assertEqual(len(result), len(points))
+            for point, point_distance in zip(points, result):
+                self.assertAlmostEqual(point_distance, geo.distance(lat, lon, point[0], point[1]), places=9)
+
+            lengths = geo.segment_lengths(points, backend=backend)
+            self.assertEqual(len(lengths), len(points) - 1)
+            along_track = geo.along_track_distances(points, backend=backend)
+            self.assertEqual(len(along_track), len(points))
+            self.assertEqual(along_track[0], 0.0)
+            total = 0.0
+            for index in range(1, len(points)):
+                a = points[index - 1]
+                b = points[index]
+                segment_length = geo.distance(a[0], a[1], b[0], b[1])
+                total += segment_length
+                self.assertAlmostEqual(lengths[index - 1], segment_length, places=9)
+                self.assertAlmostEqual(along_track[index], total, places=9)
+            self.assertAlmostEqual(geo.path_length(points, backend=backend), total, places=9)
+            self.assertAlmostEqual(geo.combined_distance([point[:2] for point in points]), total, places=9)
+
+            closest = min(range(len(points)), key=lambda index: geo.distance(lat, lon, points[index][0],
+                                                                              points[index][1]))
+            self.assertEqual(geo.closest_index(lat, lon, points, backend=backend), closest)
+
+            # empty & single point lists
+            self.assertEqual(len(geo.distances(lat, lon, [], backend=backend)), 0)
+            self.assertEqual(len(geo.segment_lengths([], backend=backend)), 0)
+            self.assertEqual(len(geo.segment_lengths(points[:1], backend=backend)), 0)
+            self.assertEqual(len(geo.along_track_distances([], backend=backend)), 0)
+            self.assertEqual(list(geo.along_track_distances(points[:1], backend=backend)), [0.0])
+            self.assertEqual(geo.path_length([], backend=backend), 0.0)
+            self.assertIsNone(geo.closest_index(lat, lon, [], backend=backend))
+
+    def backends_test(self):
+        """Test array function backend selection."""
+        self.assertIn(geo.BACKEND_PYTHON, geo.BACKENDS)
+        with self.assertRaises(ValueError):
+            geo.distances(0, 0, [(1, 1)], backend="fortran")
+        # the pure Python backend returns lists
+        self.assertIsInstance(geo.distances(0, 0, [(1, 1)], backend=geo.BACKEND_PYTHON), list)
+
+    def numpy_backend_test(self):
+        """Both backends should return the same results."""
+        if geo.BACKEND_NUMPY not in geo.BACKENDS:
+            raise unittest.SkipTest("NumPy not available")
+        points = randomTrack(1000, random.Random(1))
+        for function in (lambda backend: geo.distances(49.2, 16.6, points, backend),
+                         lambda backend: geo.segment_lengths(points, backend),
+                         lambda backend: geo.along_track_distances(points, backend)):
+            python_result = function(geo.BACKEND_PYTHON)
+            numpy_result = function(geo.BACKEND_NUMPY)
+            self.assertEqual(len(python_result), len(numpy_result))
+            for a, b in zip(python_result, numpy_result):
+                self.assertAlmostEqual(a, b, places=9)
 
+    def per_elev_list_test(self):
+        """Test periodic elevation computation."""
+        # going north along a meridian with elevation rising 1 m per point
+        trackpoints = [TrackPoint(49.0 + index * 0.001, 16.0, 200.0 + index) for index in range(101)]
+        track_length = geo.path_length([(point.latitude, point.longitude) for point in trackpoints])
+        result = geo.per_elev_list([trackpoints], numPoints=50)
+        self.assertEqual(len(result), 51)
+        self.assertEqual(result[0], (0, 200.0, 49.0, 16.0))
+        self.assertAlmostEqual(result[-1][0], track_length)
+        self.assertEqual(result[-1][1:], (300.0, 49.1, 16.0))
+        for index, (point_distance, elevation, lat, lon) in enumerate(result):
+            # regular intervals with linearly interpolated elevation & coordinates
+            self.assertAlmostEqual(point_distance, index * track_length / 50)
+            self.assertAlmostEqual(elevation, 200.0 + 2 * index, places=6)
+            self.assertAlmostEqual(lat, 49.0 + index * 0.002, places=6)
+            self.assertEqual(lon, 16.0)
 
+        # points with unknown elevation are skipped when interpolating elevation
+        trackpoints[50].elevation = None
+        result = geo.per_elev_list([trackpoints], numPoints=50)
+        self.assertAlmostEqual(result[25][1], 250.0, places=6)
+        self.assertEqual(geo.per_elev_list([[]]), [])
 
+    def cluster_trackpoints_test(self):
+        """Test trackpoint clustering."""
+        trackpoints = [TrackPoint(lat, lon, None) for lat, lon, _elevation in randomTrack(300, random.Random(2))]
+        clusters = geo.cluster_trackpoints([trackpoints], 0.1)
+        # each point is in exactly one cluster
+        clustered = [(point['latitude'], point['longitude']) for cluster in clusters for point in cluster]
+        self.assertEqual(sorted(clustered), sorted((point.latitude, point.longitude) for point in trackpoints))
+        for cluster in clusters:
+            # the last point of a cluster is the one it has been created for
+            first = cluster[-1]
+            for point in cluster[:-1]:
+                self.assertLess(geo.distance(first['latitude'], first['longitude'],
+                                             point['latitude'], point['longitude']), 0.1)
+        self.assertEqual(geo.cluster_trackpoints([], 0.1), [])
@@ -0,0 +1,122 @@
+"""GPX loading benchmarks
+
+Loads the bundled example tracklogs and a multi-megabyte tracklog made
+by repeating the long example, once with upoints followed by computing
+the length, elevation statistics & clusters (as before) and once
+with the streaming reader. Reports loading times and peak memory use.
+
+Memory is measured with tracemalloc, which is only available on Python 3.
+upoints can't import GPX metadata on Python 3.9+, so metadata is dropped
+from the files first.
+
+Run from the modRana source folder:
+
+PYTHONPATH=core/bundle python -m tests.gpx_reader_benchmark
+"""
+from __future__ import print_function
+import os
+import re
+import shutil
+import tempfile
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from upoints import gpx
+
+from core import geo
+from core.gpx_reader import read_gpx
+
+EXAMPLE_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              "data", "tracklog_examples")
+EXAMPLE_FILES = ["example_short.gpx", "example_long_znojmo-brno.gpx"]
+# how many times the long example is repeated for the big tracklog
+REPEAT_COUNT = 200
+CLUSTER_DISTANCE = 5
+
+
+def upointsLoad(path):
+    """Load a tracklog like before - upoints & statistics computed afterwards"""
+    track = gpx.Trackpoints()
+    with open(path, "rt") as f:
+        track.import_locations(f)
+    points = [(point.latitude, point.longitude) for point in track[0]]
+    length = geo.path_length(points) * 1000
+    elevations = [point.elevation for point in track[0] if point.elevation is not None]
+    routeInfo = None
+    if elevations:
+        routeInfo = (max(elevations), min(elevations), elevations[0], elevations[-1])
+    clusters = geo.cluster_trackpoints(track, CLUSTER_DISTANCE)
+    return track, length, routeInfo, clusters
+
+
+def streamingLoad(path):
+    return read_gpx(path, CLUSTER_DISTANCE)
+
+
+def measure(load, path):
+    """Return (time in ms, peak memory in MB) of loading a tracklog"""
+    start = time.time()
+    load(path)
+    elapsed = 1000 * (time.time() - start)
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            # hold on to the result, so that it is part of the peak
+            _result = load(path)
+            peak = tracemalloc.get_traced_memory()[1] / 1e6
+        finally:
+            tracemalloc.stop()
+    return elapsed, peak
+
+
+def _memory(peak):
+    if peak is None:
+        return "     n/a"
+    return "%5.1f MB" % peak
+
+
+def prepareFiles(folder):
+    """Copy the examples without metadata & create the big tracklog"""
+    paths = []
+    for filename in EXAMPLE_FILES:
+        with open(os.path.join(EXAMPLE_FOLDER, filename), "rt") as f:
+            text = re.sub(r"<(\w+:)?metadata>.*?</(\w+:)?metadata>", "", f.read(), flags=re.DOTALL)
+        path = os.path.join(folder, filename)
+        with open(path, "wt") as f:
+            f.write(text)
+        paths.append(path)
+    # repeat the trackpoints of the long example
+    start = text.index("<ns0:trkpt")
+    end = text.rindex("</ns0:trkseg>")
+    bigPath = os.path.join(folder, "example_big.gpx")
+    with open(bigPath, "wt") as f:
+        f.write(text[:start])
+        for _i in range(REPEAT_COUNT):
+            f.write(text[start:end])
+        f.write(text[end:])
+    paths.append(bigPath)
+    return paths
+
+
+def main():
+    folder = tempfile.mkdtemp(prefix="modrana_gpx_benchmark")
+    try:
+        for path in prepareFiles(folder):
+            track = read_gpx(path)
+            print("%s: %.2f MB, %d points" % (os.path.basename(path), os.path.getsize(path) / 1e6,
+                                              track.point_count))
+            upointsTime, upointsPeak = measure(upointsLoad, path)
+            streamingTime, streamingPeak = measure(streamingLoad, path)
+            print("    upoints   %9.1f ms %s peak" % (upointsTime, _memory(upointsPeak)))
+            print("    streaming %9.1f ms %s peak" % (streamingTime, _memory(streamingPeak)))
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main()
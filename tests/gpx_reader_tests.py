@@ -0,0 +1,129 @@
+import unittest
+import calendar
+import os
+import re
+import io
+from math import isnan
+
+from upoints import gpx
+
+from core import geo
+from core.gpx_reader import read_gpx, parse_time
+
+EXAMPLE_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              "data", "tracklog_examples")
+EXAMPLE_FILES = ["example_short.gpx", "example_long_znojmo-brno.gpx"]
+
+GPX_11 = """<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" creator="test" xmlns="http://www.topografix.com/GPX/1/1">
+  <wpt lat="50.0" lon="15.0"><name>not a trackpoint</name></wpt>
+  <trk>
+    <name>test track</name>
+    <trkseg>
+      <trkpt lat="49.2" lon="16.6"><ele>200.5</ele><time>2020-01-01T10:00:00Z</time></trkpt>
+      <trkpt lat="49.201" lon="16.601"><time>2020-01-01T11:00:01+01:00</time><name>Home</name><desc>My place</desc></trkpt>
+      <trkpt lat="49.202" lon="16.603"><ele>210</ele><time>2020-01-01T10:00:02+0000</time></trkpt>
+      <trkpt lat="49.204" lon="16.602"><ele>190</ele></trkpt>
+    </trkseg>
+    <trkseg>
+      <trkpt lat="-33.9" lon="151.2"><ele>5</ele></trkpt>
+    </trkseg>
+  </trk>
+</gpx>
+"""
+
+GPX_10 = """<?xml version="1.0"?>
+<gpx version="1.0" xmlns="http://www.topografix.com/GPX/1/0">
+  <trk><trkseg>
+    <trkpt lat="1.5" lon="2.5"/>
+    <trkpt lat="x" lon="2.5"/>
+    <trkpt lat="1.6" lon="2.6"><time>yesterday</time></trkpt>
+  </trkseg></trk>
+</gpx>
+"""
+
+
+def upointsTrack(text):
+    """Load GPX data with upoints, just the first of the segment copies it returns for each GPX version"""
+    # importing metadata doesn't work with ElementTree on Python 3.9+
+    text = re.sub(r"<(\w+:)?metadata>.*?</(\w+:)?metadata>", "", text, flags=re.DOTALL)
+    track = gpx.Trackpoints()
+    track.import_locations(io.StringIO(text))
+    return track[0:len(track) // len(gpx.GPX_VERSIONS)]
+
+
+class GPXReaderTests(unittest.TestCase):
+
+    def _assertSameAsUpoints(self, text):
+        track = read_gpx(io.BytesIO(text.encode("utf-8")))
+        expected = upointsTrack(text)
+        self.assertEqual(len(track.segments), len(expected))
+        for segment, texts, expectedSegment in zip(track.segments, track.point_texts, expected):
+            self.assertEqual(len(segment), len(expectedSegment))
+            for index, point in enumerate(expectedSegment):
+                self.assertEqual(segment[index][0:2], (point.latitude, point.longitude))
+                self.assertEqual(segment.elevation(index), point.elevation)
+                self.assertEqual(texts.get(index, (None, None)), (point.name, point.description))
+                if point.time is None:
+                    self.assertTrue(isnan(segment.times[index]))
+                else:
+                    self.assertEqual(segment.times[index], calendar.timegm(point.time.utctimetuple()))
+        return track, expected
+
+    def parity_test(self):
+        track, expected = self._assertSameAsUpoints(GPX_11)
+        self.assertEqual([len(segment) for segment in track.segments], [4, 1])
+        # converting back gives the same points
+        for segment, expectedSegment in zip(track.to_trackpoints(), expected):
+            for point, expectedPoint in zip(segment, expectedSegment):
+                self.assertEqual((point.latitude, point.longitude, point.elevation, point.name, point.description),
+                                 (expectedPoint.latitude, expectedPoint.longitude, expectedPoint.elevation,
+                                  expectedPoint.name, expectedPoint.description))
+                self.assertEqual(point.time, expectedPoint.time)
+
+    def example_parity_test(self):
+        for filename in EXAMPLE_FILES:
+            with open(os.path.join(EXAMPLE_FOLDER, filename), "rt") as f:
+                text = f.read()
+            track, expected = self._assertSameAsUpoints(text)
+            points = [(point.latitude, point.longitude, point.elevation) for point in expected[0]]
+            stats = track.stats[0]
+            # statistics computed while reading match the ones computed afterwards
+            self.assertAlmostEqual(stats.length, geo.path_length(points) * 1000, places=6)
+            self.assertEqual(stats.bounds, (min(p[0] for p in points), min(p[1] for p in points),
+                                            max(p[0] for p in points), max(p[1] for p in points)))
+            elevations = [p[2] for p in points]
+            self.assertEqual(stats.route_info, {'maxElevation': max(elevations), 'minElevation': min(elevations),
+                                                'middle': (max(elevations) + min(elevations)) / 2.0,
+                                                'firstElevation': elevations[0],
+                                                'lastElevation': elevations[-1]})
+            clustered = read_gpx(os.path.join(EXAMPLE_FOLDER, filename), cluster_distance=5)
+            self.assertEqual(clustered.clusters, geo.cluster_trackpoints(expected, 5))
+
+    def gpx_10_test(self):
+        track = read_gpx(io.BytesIO(GPX_10.encode("utf-8")))
+        points = track.points
+        # the point without valid coordinates is skipped
+        self.assertEqual(points.lle_list(), [(1.5, 2.5, None), (1.6, 2.6, None)])
+        # unknown timestamp formats are kept as they are
+        self.assertEqual(points.timestamp(1), "yesterday")
+        stats = track.stats[0]
+        self.assertIsNone(stats.route_info)
+        self.assertEqual(stats.bounds, (1.5, 2.5, 1.6, 2.6))
+
+    def empty_test(self):
+        track = read_gpx(io.BytesIO(b'<gpx xmlns="http://www.topografix.com/GPX/1/1"></gpx>'), cluster_distance=5)
+        self.assertEqual(track.segments, [])
+        self.assertEqual(len(track.points), 0)
+        self.assertEqual(track.point_count, 0)
+        self.assertEqual(track.clusters, [])
+        with self.assertRaises(SyntaxError):
+            read_gpx(io.BytesIO(b"<gpx><trk>"))
+
+    def parse_time_test(self):
+        self.assertEqual(parse_time("2020-01-01T10:00:00Z"), 1577872800.0)
+        self.assertEqual(parse_time("2020-01-01T10:00:00"), 1577872800.0)
+        self.assertEqual(parse_time("2020-01-01T11:00:00+01:00"), 1577872800.0)
+        self.assertEqual(parse_time("2020-01-01T02:00:00.250-0800"), 1577872800.25)
+        self.assertIsNone(parse_time("2020-01-01"))
+        self.assertIsNone(parse_time("2020-13-01T10:00:00Z"))
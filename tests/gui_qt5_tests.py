@@ -0,0 +1,138 @@
+import unittest
+import sys
+import types
+import time
+import logging
+
+try:
+    import pyotherside
+except ImportError:
+    # the Qt 5 GUI module can be imported without Qt 5 & PyOtherSide
+    # once there is something in place of the PyOtherSide module
+    pyotherside = types.ModuleType("pyotherside")
+    sys.modules["pyotherside"] = pyotherside
+
+from core import constants
+from core.signal import Signal
+from modules.gui_modules.gui_qt5.gui_qt5 import QMLGUI, TileImageProvider
+from core.tile_provider import TileIdParser, TileDataCache, NotificationCoalescer
+from tests.tile_storage_tests import make_tile_data
+
+WINDOW = 0.05  # in seconds
+
+
+class FakeMapTiles(object):
+
+    def __init__(self, stored):
+        self.stored = stored
+        self.storageQueries = []
+        self.downloadRequests = []
+        self.tileDownloaded = Signal()
+
+    def tilesInStorage(self, lzxys):
+        lzxys = set(lzxys)
+        self.storageQueries.append(lzxys)
+        return set(lzxy for lzxy in lzxys if lzxy[1:] in self.stored)
+
+    def addTileDownloadRequest(self, lzxy, tag):
+        self.downloadRequests.append((lzxy, tag))
+
+
+class FakeModules(object):
+
+    def __init__(self, mapTiles):
+        self.mapTiles = mapTiles
+
+
+class FakeGUI(object):
+    """The bits of the Qt 5 GUI module the tile image provider uses"""
+
+    def __init__(self):
+        self.firstTimeSignal = Signal()
+        self._tileData = TileDataCache()
+
+
+class FakePyOtherSide(object):
+    """Records messages sent to QML"""
+
+    def __init__(self):
+        self.messages = []
+
+    def send(self, *args):
+        self.messages.append((time.time(), args))
+
+
+class GUIQt5Tests(unittest.TestCase):
+
+    def setUp(self):
+        self.pyotherside = FakePyOtherSide()
+        self._originalSend = getattr(pyotherside, "send", None)
+        pyotherside.send = self.pyotherside.send
+
+    def tearDown(self):
+        if self._originalSend is None:
+            del pyotherside.send
+        else:
+            pyotherside.send = self._originalSend
+
+    def _gui(self, stored):
+        gui = QMLGUI.__new__(QMLGUI)
+        gui._log = logging.getLogger("mod.gui.qt5")
+        gui.modules = FakeModules(FakeMapTiles(stored))
+        gui._tileIds = TileIdParser(lambda layerId: layerId)
+        gui._tileData = TileDataCache()
+        return gui
+
+    def availability_test(self):
+        """Tile availability should be checked with a single storage query"""
+        gui = self._gui(stored=set([(15, 1, 1), (15, 1, 2)]))
+        gui._tileData.add(("mapnik", 15, 1, 3), make_tile_data(15, 1, 3))
+        tileIds = ["map1/mapnik/15/1/%d" % y for y in range(1, 6)]
+        available = gui.areTilesAvailable(tileIds)
+        self.assertEqual(available, {"map1/mapnik/15/1/1": True, "map1/mapnik/15/1/2": True,
+                                     "map1/mapnik/15/1/3": True, "map1/mapnik/15/1/4": False,
+                                     "map1/mapnik/15/1/5": False})
+        mapTiles = gui.modules.mapTiles
+        # cached tiles are not looked up in storage
+        self.assertEqual(mapTiles.storageQueries, [set(("mapnik", 15, 1, y) for y in (1, 2, 4, 5))])
+        self.assertEqual(sorted(mapTiles.downloadRequests),
+                         [(("mapnik", 15, 1, 4), "map1/mapnik/15/1/4"), (("mapnik", 15, 1, 5), "map1/mapnik/15/1/5")])
+        self.assertEqual(gui.areTilesAvailable([]), {})
+
+    def layers_changed_test(self):
+        """Parsed tile ids & cached tile data should be dropped once map layers change"""
+        gui = self._gui(stored=set())
+        gui._tileData.add(("mapnik", 15, 1, 1), make_tile_data(15, 1, 1))
+        gui._tileIds.lzxy("map1/mapnik/15/1/1")
+        gui._layersChangedCB()
+        self.assertEqual(len(gui._tileIds), 0)
+        self.assertEqual(len(gui._tileData), 0)
+
+    def notification_batching_test(self):
+        """Downloaded tile notifications should be sent in batches, in order"""
+        gui = FakeGUI()
+        provider = TileImageProvider(gui)
+        provider._downloadNotifications = NotificationCoalescer(provider._sendTileNotifications, window=WINDOW)
+        gui._tileData.add(("mapnik", 15, 1, 1), make_tile_data(15, 1, 1))
+        start = time.time()
+        provider._tileDownloadedCB(constants.TILE_DOWNLOAD_SUCCESS, ("mapnik", 15, 1, 1), "map1/mapnik/15/1/1")
+        provider._tileDownloadedCB(constants.TILE_DOWNLOAD_ERROR, ("mapnik", 15, 1, 2), "map1/mapnik/15/1/2")
+        provider._tileDownloadedCB(constants.TILE_DOWNLOAD_SUCCESS, ("mapnik", 15, 1, 3), "map2/mapnik/15/1/3")
+        provider._tileDownloadedCB(constants.TILE_DOWNLOAD_SUCCESS, ("mapnik", 15, 1, 4), "map1/mapnik/15/1/4")
+        # the previous version of a downloaded tile is not used anymore
+        self.assertNotIn(("mapnik", 15, 1, 1), gui._tileData)
+        # nothing is sent until the window runs out
+        self.assertEqual(self.pyotherside.messages, [])
+        time.sleep(WINDOW * 4)
+        self.assertEqual([message for _timestamp, message in self.pyotherside.messages], [
+            ("tilesDownloaded:map1", [["map1/mapnik/15/1/1", True, False],
+                                      ["map1/mapnik/15/1/2", False, True],
+                                      ["map1/mapnik/15/1/4", True, False]]),
+            ("tilesDownloaded:map2", [["map2/mapnik/15/1/3", True, False]]),
+        ])
+        self.assertTrue(self.pyotherside.messages[0][0] - start >= WINDOW)
+        # the next notification starts a new batch
+        provider._tileDownloadedCB(constants.TILE_DOWNLOAD_SUCCESS, ("mapnik", 15, 1, 5), "map1/mapnik/15/1/5")
+        provider._downloadNotifications.flush()
+        self.assertEqual(self.pyotherside.messages[-1][1], ("tilesDownloaded:map1", [["map1/mapnik/15/1/5", True, False]]))
+        self.assertEqual(len(self.pyotherside.messages), 3)
@@ -0,0 +1,224 @@
+import unittest
+import threading
+import calendar
+from email.utils import formatdate
+
+try:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler
+except ImportError:  # Python 3
+    from http.server import BaseHTTPRequestHandler
+
+import urllib3
+
+from core.host_controller import HostController, HostControllers, HostUnavailable, \
+    outcomeForStatus, parseRetryAfter, SUCCESS, FAILURE, NEUTRAL, CLOSED, OPEN, HALF_OPEN, \
+    DECREASE_INTERVAL, CIRCUIT_OPEN_BASE_TIME
+from tests.negative_cache_tests import FakeClock, ThreadingHTTPServer, PNG_HEADER
+
+REQUEST_TIMEOUT = 0.5  # in seconds
+
+
+class FaultInjectingHandler(BaseHTTPRequestHandler):
+    """Answers with the faults listed in server.faults, (status, headers) tuples,
+    in order and with a tile once the faults run out
+    """
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requestCount += 1
+            if self.server.faults:
+                status, headers = self.server.faults.pop(0)
+            else:
+                status, headers = 200, {}
+        body = PNG_HEADER if status == 200 else b"<html>error</html>"
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class HostControllerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        # no jitter - always the upper bound of the backoff interval
+        self.controller = HostController("tiles.example.com", maxConcurrency=8, failureThreshold=3,
+                                         clock=self.clock, random=lambda: 1.0)
+
+    def outcome_test(self):
+        self.assertEqual(outcomeForStatus(200), SUCCESS)
+        self.assertEqual(outcomeForStatus(304), SUCCESS)
+        self.assertEqual(outcomeForStatus(404), NEUTRAL)
+        self.assertEqual(outcomeForStatus(403), NEUTRAL)
+        self.assertEqual(outcomeForStatus(429), FAILURE)
+        self.assertEqual(outcomeForStatus(500), FAILURE)
+        self.assertEqual(outcomeForStatus(503), FAILURE)
+
+    def retry_after_test(self):
+        self.assertEqual(parseRetryAfter("120"), 120)
+        self.assertEqual(parseRetryAfter(" 5 "), 5)
+        self.assertIsNone(parseRetryAfter(None))
+        self.assertIsNone(parseRetryAfter("soon"))
+        now = calendar.timegm((2020, 1, 1, 12, 0, 0))
+        self.assertEqual(parseRetryAfter(formatdate(now + 90, usegmt=True), now=now), 90)
+        # dates in the past mean no delay
+        self.assertEqual(parseRetryAfter(formatdate(now - 90, usegmt=True), now=now), 0)
+
+    def aimd_test(self):
+        """The limit should be halved on failure and slowly grow back on success"""
+        self.assertEqual(self.controller.limit, 8)
+        self.assertTrue(self.controller.acquire())
+        self.controller.release(FAILURE)
+        self.assertEqual(self.controller.limit, 4)
+        # concurrent failures within the decrease interval decrease the limit just once
+        self.assertTrue(self.controller.acquire())
+        self.controller.release(FAILURE)
+        self.assertEqual(self.controller.limit, 4)
+        # neutral outcomes keep the limit
+        self.assertTrue(self.controller.acquire())
+        self.controller.release(NEUTRAL)
+        self.assertEqual(self.controller.limit, 4)
+        self.clock.advance(DECREASE_INTERVAL)
+        self.assertTrue(self.controller.acquire())
+        self.controller.release(FAILURE)
+        self.assertEqual(self.controller.limit, 2)
+        # about one more slot for each full window of successful requests
+        for _i in range(3):
+            self.assertTrue(self.controller.acquire())
+            self.controller.release(SUCCESS)
+        self.assertEqual(self.controller.limit, 3)
+        for _i in range(100):
+            self.assertTrue(self.controller.acquire())
+            self.controller.release(SUCCESS)
+        self.assertEqual(self.controller.limit, 8)
+
+    def concurrency_limit_test(self):
+        """No more than limit requests should be in flight at once"""
+        for _i in range(8):
+            self.assertTrue(self.controller.acquire(timeout=0))
+        self.assertFalse(self.controller.acquire(timeout=0.01))
+        self.assertEqual(self.controller.inFlight, 8)
+        # a waiting request gets the slot once released
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(self.controller.acquire(timeout=5)))
+        waiter.start()
+        self.controller.release(SUCCESS)
+        waiter.join()
+        self.assertEqual(results, [True])
+        self.assertEqual(self.controller.inFlight, 8)
+
+    def circuit_breaker_test(self):
+        for _i in range(3):
+            self.assertTrue(self.controller.acquire())
+            self.controller.release(FAILURE)
+        self.assertEqual(self.controller.state, OPEN)
+        self.assertFalse(self.controller.acquire())
+        self.assertEqual(self.controller.retryIn(), CIRCUIT_OPEN_BASE_TIME)
+        self.assertTrue(self.controller.statusText())
+        # once the circuit open time is over, a single trial request is let through
+        self.clock.advance(CIRCUIT_OPEN_BASE_TIME)
+        self.assertTrue(self.controller.acquire())
+        self.assertEqual(self.controller.state, HALF_OPEN)
+        self.assertFalse(self.controller.acquire())
+        # a failed trial opens the circuit for twice as long
+        self.controller.release(FAILURE)
+        self.assertEqual(self.controller.state, OPEN)
+        self.assertEqual(self.controller.retryIn(), 2 * CIRCUIT_OPEN_BASE_TIME)
+        self.clock.advance(2 * CIRCUIT_OPEN_BASE_TIME)
+        self.assertTrue(self.controller.acquire())
+        self.controller.release(SUCCESS)
+        self.assertEqual(self.controller.state, CLOSED)
+        self.assertTrue(self.controller.acquire(timeout=0))
+
+    def backoff_jitter_test(self):
+        """Retry delays should grow exponentially & be spread by jitter"""
+        controller = HostController("tiles.example.com", clock=self.clock, random=lambda: 0.0)
+        self.assertEqual(controller.retryDelay(0), 0.05)
+        self.assertEqual(controller.retryDelay(3), 0.4)
+        self.assertEqual(self.controller.retryDelay(0), 0.1)
+        self.assertEqual(self.controller.retryDelay(3), 0.8)
+        self.assertEqual(self.controller.retryDelay(100), 30)
+        # retry delay covers the time the host asked us to back off
+        self.assertTrue(self.controller.acquire())
+        self.controller.release(FAILURE, retryAfter=20)
+        self.assertEqual(self.controller.retryDelay(0), 20)
+
+    def registry_test(self):
+        controllers = HostControllers()
+        controller = controllers.get("http://a.tile.example.com/1/2/3.png")
+        self.assertIs(controllers.get("http://A.tile.example.com/4/5/6.png"), controller)
+        self.assertIsNot(controllers.get("http://a.tile.example.com:8080/1/2/3.png"), controller)
+        self.assertIs(controllers.get("a.tile.example.com"), controller)
+        self.assertEqual(controllers.statusText(), "")
+
+    def _startServer(self, faults):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), FaultInjectingHandler)
+        server.lock = threading.Lock()
+        server.faults = faults
+        server.requestCount = 0
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        pool = urllib3.connection_from_url("http://127.0.0.1:%d" % server.server_port,
+                                           timeout=REQUEST_TIMEOUT, maxsize=1, block=False)
+        return server, pool
+
+    def _stopServer(self, server):
+        server.shutdown()
+        server.server_close()
+
+    def failing_server_test(self):
+        """A failing server should stop getting requests once the circuit opens"""
+        server, pool = self._startServer([(500, {})] * 5)
+        try:
+            for _i in range(3):
+                response = self.controller.request(pool, "GET", "/1/0/0.png", retries=False)
+                self.assertEqual(response.status, 500)
+            for _i in range(10):
+                self.assertRaises(HostUnavailable, self.controller.request, pool, "GET", "/1/0/0.png")
+            self.assertEqual(server.requestCount, 3)
+            # the trial request still fails, so the circuit opens again
+            self.clock.advance(CIRCUIT_OPEN_BASE_TIME)
+            self.assertEqual(self.controller.request(pool, "GET", "/1/0/0.png", retries=False).status, 500)
+            self.assertRaises(HostUnavailable, self.controller.request, pool, "GET", "/1/0/0.png")
+            self.assertEqual(server.requestCount, 4)
+            # the server recovers
+            self.clock.advance(2 * CIRCUIT_OPEN_BASE_TIME)
+            self.assertEqual(self.controller.request(pool, "GET", "/1/0/0.png", retries=False).status, 500)
+            self.clock.advance(4 * CIRCUIT_OPEN_BASE_TIME)
+            response = self.controller.request(pool, "GET", "/1/0/0.png", retries=False)
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.data, PNG_HEADER)
+            self.assertEqual(self.controller.state, CLOSED)
+        finally:
+            self._stopServer(server)
+
+    def rate_limiting_server_test(self):
+        """Retry-After of a rate limiting server should be honoured"""
+        server, pool = self._startServer([(429, {"Retry-After": "30"})])
+        try:
+            response = self.controller.request(pool, "GET", "/1/0/0.png", retries=False)
+            self.assertEqual(response.status, 429)
+            self.assertRaises(HostUnavailable, self.controller.request, pool, "GET", "/1/0/0.png")
+            self.assertEqual(self.controller.retryIn(), 30)
+            self.assertIn("retrying in 30 s", self.controller.statusText())
+            self.clock.advance(30)
+            self.assertEqual(self.controller.request(pool, "GET", "/1/0/0.png", retries=False).status, 200)
+            self.assertEqual(server.requestCount, 2)
+        finally:
+            self._stopServer(server)
+
+    def connection_error_test(self):
+        """Connection errors count as failures"""
+        server, pool = self._startServer([])
+        self._stopServer(server)
+        for _i in range(3):
+            self.assertRaises(urllib3.exceptions.HTTPError, self.controller.request,
+                              pool, "GET", "/1/0/0.png", retries=False)
+        self.assertEqual(self.controller.state, OPEN)
+        self.assertEqual(self.controller.inFlight, 0)
@@ -0,0 +1,240 @@
+import unittest
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import warnings
+
+try:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler
+except ImportError:  # Python 3
+    from http.server import BaseHTTPRequestHandler
+
+try:
+    import ssl
+except ImportError:
+    ssl = None
+
+import urllib3
+
+from core.http_pools import ConnectionPoolRegistry, HTTPStatusError, poolKey, REAP_INTERVAL, MAX_REDIRECTS
+from tests.negative_cache_tests import FakeClock, ThreadingHTTPServer, PNG_HEADER
+
+
+class CountingServer(ThreadingHTTPServer):
+    """Counts accepted connections, optionally wrapping them in TLS"""
+
+    sslContext = None
+
+    def get_request(self):
+        sock, address = ThreadingHTTPServer.get_request(self)
+        if self.sslContext:
+            sock = self.sslContext.wrap_socket(sock, server_side=True)
+        with self.lock:
+            self.connectionCount += 1
+        return sock, address
+
+
+class KeepAliveTileHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path.startswith("/missing"):
+            status, body = 404, b"<html>not found</html>"
+        else:
+            status, body = 200, PNG_HEADER
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class RedirectHandler(BaseHTTPRequestHandler):
+    """Redirects /loop to itself and everything else to the same path on server.target"""
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/loop":
+            location = "/loop"
+        else:
+            location = self.server.target + self.path
+        self.send_response(301)
+        self.send_header("Location", location)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def _createCertificate(folder):
+    """Create a self signed certificate with openssl
+
+    :returns: (certificate path, key path) tuple or None if openssl is not available
+    """
+    certPath = os.path.join(folder, "cert.pem")
+    keyPath = os.path.join(folder, "key.pem")
+    try:
+        subprocess.check_call(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+                               "-keyout", keyPath, "-out", certPath, "-days", "1",
+                               "-subj", "/CN=127.0.0.1"],
+                              stdout=open(os.devnull, "w"), stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return certPath, keyPath
+
+
+class ConnectionPoolRegistryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.registry = ConnectionPoolRegistry(clock=self.clock, timeout=5)
+
+    def tearDown(self):
+        self.registry.clear()
+
+    def _startServer(self, sslContext=None, handler=KeepAliveTileHandler):
+        server = CountingServer(("127.0.0.1", 0), handler)
+        server.lock = threading.Lock()
+        server.connectionCount = 0
+        server.sslContext = sslContext
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def pool_key_test(self):
+        self.assertEqual(poolKey("http://A.tile.example.com/1/2/3.png"), ("http", "a.tile.example.com", 80))
+        self.assertEqual(poolKey("https://tile.example.com/1/2/3.png"), ("https", "tile.example.com", 443))
+        self.assertEqual(poolKey("http://tile.example.com:8080/"), ("http", "tile.example.com", 8080))
+
+    def shared_pool_test(self):
+        """URLs on the same scheme, host & port should share a pool"""
+        pool = self.registry.get("http://tile.example.com/osm/1/2/3.png")
+        self.assertIs(self.registry.get("http://tile.example.com:80/cycle/1/2/3.png"), pool)
+        self.assertIsNot(self.registry.get("https://tile.example.com/osm/1/2/3.png"), pool)
+        self.assertIsNot(self.registry.get("http://tile.example.com:8080/osm/1/2/3.png"), pool)
+        self.assertEqual(len(self.registry), 3)
+
+    def pool_size_test(self):
+        """Pools should be sized to the largest size requested"""
+        pool = self.registry.get("http://tile.example.com/", size=5)
+        self.assertIs(self.registry.get("http://tile.example.com/", size=2), pool)
+        self.assertIs(self.registry.get("http://tile.example.com/"), pool)
+        largerPool = self.registry.get("http://tile.example.com/", size=10)
+        self.assertIsNot(largerPool, pool)
+        self.assertEqual(self.registry.stats()[("http", "tile.example.com", 80)]["size"], 10)
+
+    def idle_reaping_test(self):
+        self.registry.get("http://a.example.com/")
+        self.registry.get("http://b.example.com/")
+        self.clock.advance(REAP_INTERVAL)
+        # using a pool keeps it alive
+        self.registry.get("http://b.example.com/")
+        self.assertEqual(self.registry.reapIdle(), 0)
+        self.clock.advance(5 * 60 - REAP_INTERVAL)
+        self.assertEqual(self.registry.reapIdle(), 1)
+        self.assertEqual(len(self.registry), 1)
+        # idle pools are also reaped when pools are requested
+        self.clock.advance(5 * 60)
+        self.registry.get("http://c.example.com/")
+        self.assertEqual(len(self.registry), 1)
+        stats = self.registry.stats()
+        self.assertIsNone(stats[("http", "a.example.com", 80)]["idle"])
+        self.assertEqual(stats[("http", "c.example.com", 80)]["idle"], 0)
+
+    def held_pool_test(self):
+        """Pools replaced or dropped by the registry should still work for callers holding them"""
+        server = self._startServer()
+        url = "http://127.0.0.1:%d/osm/15/0/0.png" % server.server_port
+        pool = self.registry.get(url, size=1)
+        # replaced by a larger pool
+        self.assertIsNot(self.registry.get(url, size=4), pool)
+        self.assertEqual(pool.request("GET", "/osm/15/0/0.png").data, PNG_HEADER)
+        # dropped as idle
+        pool = self.registry.get(url)
+        self.clock.advance(5 * 60)
+        self.assertEqual(self.registry.reapIdle(), 1)
+        self.assertEqual(pool.request("GET", "/osm/15/0/1.png").data, PNG_HEADER)
+        self.assertEqual(pool.request("GET", "/osm/15/0/2.png").data, PNG_HEADER)
+
+    def http_reuse_test(self):
+        """Requests for different layers on the same host should reuse a single connection"""
+        server = self._startServer()
+        baseUrl = "http://127.0.0.1:%d" % server.server_port
+        for layer in ("osm", "cycle", "transport"):
+            for y in range(5):
+                data = self.registry.getData("%s/%s/15/0/%d.png" % (baseUrl, layer, y))
+                self.assertEqual(data, PNG_HEADER)
+        self.assertRaises(HTTPStatusError, self.registry.getData, "%s/missing.png" % baseUrl)
+        self.assertEqual(server.connectionCount, 1)
+        stats = self.registry.stats()[("http", "127.0.0.1", server.server_port)]
+        self.assertEqual(stats["connections"], 1)
+        self.assertEqual(stats["requests"], 16)
+
+    def redirect_test(self):
+        """Redirects to other hosts should be followed with the pool of the new host"""
+        server = self._startServer()
+        redirectingServer = self._startServer(handler=RedirectHandler)
+        redirectingServer.target = "http://localhost:%d" % server.server_port
+        data = self.registry.getData("http://127.0.0.1:%d/osm/15/0/0.png" % redirectingServer.server_port)
+        self.assertEqual(data, PNG_HEADER)
+        self.assertIn(("http", "localhost", server.server_port), self.registry.stats())
+        # redirect loops end at some point
+        with self.assertRaises(HTTPStatusError) as context:
+            self.registry.getData("http://127.0.0.1:%d/loop" % redirectingServer.server_port)
+        self.assertEqual(context.exception.status, 301)
+        self.assertEqual(redirectingServer.connectionCount, 1)
+        self.assertEqual(self.registry.stats()[("http", "127.0.0.1", redirectingServer.server_port)]["requests"],
+                         MAX_REDIRECTS + 2)
+
+    @unittest.skipIf(ssl is None or not hasattr(ssl, "SSLContext"), "TLS support not available")
+    def https_verification_test(self):
+        """Server certificates should be verified by default"""
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        certificate = _createCertificate(folder)
+        if certificate is None:
+            self.skipTest("openssl is not available")
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(*certificate)
+        server = self._startServer(sslContext=context)
+        url = "https://127.0.0.1:%d/osm/15/0/0.png" % server.server_port
+        # the self signed certificate can't be verified
+        self.assertRaises(urllib3.exceptions.SSLError, self.registry.getData, url, retries=False)
+        # unless the certificate authority is given
+        registry = ConnectionPoolRegistry(clock=self.clock, timeout=5, ca_certs=certificate[0])
+        self.addCleanup(registry.clear)
+        with warnings.catch_warnings():
+            # the test certificate only has a common name
+            warnings.simplefilter("ignore", urllib3.exceptions.SubjectAltNameWarning)
+            self.assertEqual(registry.getData(url), PNG_HEADER)
+
+    @unittest.skipIf(ssl is None or not hasattr(ssl, "SSLContext"), "TLS support not available")
+    def https_reuse_test(self):
+        """TLS connections should be reused across layers on the same host"""
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        certificate = _createCertificate(folder)
+        if certificate is None:
+            self.skipTest("openssl is not available")
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(*certificate)
+        server = self._startServer(sslContext=context)
+        registry = ConnectionPoolRegistry(clock=self.clock, timeout=5, cert_reqs="CERT_NONE")
+        self.addCleanup(registry.clear)
+        baseUrl = "https://127.0.0.1:%d" % server.server_port
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", urllib3.exceptions.InsecureRequestWarning)
+            for layer in ("osm", "cycle"):
+                for y in range(10):
+                    response = registry.request("GET", "%s/%s/15/0/%d.png" % (baseUrl, layer, y), size=4)
+                    self.assertEqual(response.data, PNG_HEADER)
+        self.assertEqual(server.connectionCount, 1)
+        self.assertEqual(registry.stats()[("https", "127.0.0.1", server.server_port)]["connections"], 1)
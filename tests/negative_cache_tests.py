@@ -0,0 +1,178 @@
+import unittest
+import threading
+import time
+
+try:  # Python 2
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:  # Python 3
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+import urllib3
+
+from core.negative_cache import NegativeTileCache, errorClassForStatus, ERROR_NOT_FOUND, \
+    ERROR_CLIENT, ERROR_SERVER, ERROR_TIMEOUT, ERROR_NOT_IMAGE, DEFAULT_TTLS
+
+PNG_HEADER = b"\211PNG\r\n\032\n"
+# how long the stub server waits before answering "slow" requests
+SLOW_RESPONSE_DELAY = 1.0  # in seconds
+REQUEST_TIMEOUT = 0.2  # in seconds
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ScriptedTileHandler(BaseHTTPRequestHandler):
+    """Returns scripted responses, the server.script dictionary maps request paths
+    to lists of status codes (or "slow" for a response that times out)
+    """
+
+    def do_GET(self):
+        responses = self.server.script.get(self.path, [])
+        response = responses.pop(0) if responses else 200
+        self.server.requests.append(self.path)
+        if response == "slow":
+            time.sleep(SLOW_RESPONSE_DELAY)
+            response = 200
+        body = PNG_HEADER if response == 200 else b"<html>error</html>"
+        try:
+            self.send_response(response)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except Exception:
+            pass  # the client gave up waiting
+
+    def log_message(self, *args):
+        pass
+
+
+def fetch_tile(pool, negative_cache, lzxy):
+    """Fetch a tile the same way the tile downloaders do
+
+    :returns: tile data or None if the tile is in the negative cache or failed
+    """
+    if negative_cache.isBlocked(lzxy):
+        return None
+    url = "/%d/%d/%d.png" % lzxy[1:]
+    try:
+        response = pool.request("GET", url, retries=False)
+    except Exception as e:
+        negative_cache.recordException(lzxy, e)
+        return None
+    if negative_cache.recordResponse(lzxy, response.status):
+        return None
+    if not response.data.startswith(PNG_HEADER):
+        negative_cache.addFailure(lzxy, ERROR_NOT_IMAGE)
+        return None
+    return response.data
+
+
+class NegativeTileCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = NegativeTileCache(clock=self.clock)
+
+    def error_class_test(self):
+        """HTTP status codes should map to the expected error classes"""
+        self.assertIsNone(errorClassForStatus(200))
+        self.assertIsNone(errorClassForStatus(304))
+        self.assertEqual(errorClassForStatus(404), ERROR_NOT_FOUND)
+        self.assertEqual(errorClassForStatus(410), ERROR_NOT_FOUND)
+        self.assertEqual(errorClassForStatus(403), ERROR_CLIENT)
+        self.assertEqual(errorClassForStatus(408), ERROR_TIMEOUT)
+        self.assertEqual(errorClassForStatus(429), ERROR_SERVER)
+        self.assertEqual(errorClassForStatus(503), ERROR_SERVER)
+
+    def not_found_ttl_test(self):
+        """Missing tiles should be remembered for a long time"""
+        lzxy = ("osm", 15, 1, 2)
+        self.cache.addFailure(lzxy, ERROR_NOT_FOUND)
+        self.assertEqual(self.cache.getFailure(lzxy)[0], ERROR_NOT_FOUND)
+        self.clock.advance(60 * 60)
+        self.assertTrue(self.cache.isBlocked(lzxy))
+        self.clock.advance(DEFAULT_TTLS[ERROR_NOT_FOUND][0])
+        self.assertFalse(self.cache.isBlocked(lzxy))
+
+    def timeout_backoff_test(self):
+        """Timeouts should be remembered shortly with exponential backoff"""
+        lzxy = ("osm", 15, 1, 2)
+        initial_ttl, max_ttl = DEFAULT_TTLS[ERROR_TIMEOUT]
+        expected_ttl = initial_ttl
+        for _i in range(10):
+            expire_timestamp = self.cache.addFailure(lzxy, ERROR_TIMEOUT)
+            self.assertEqual(expire_timestamp - self.clock.now, expected_ttl)
+            self.clock.advance(expected_ttl - 1)
+            self.assertTrue(self.cache.isBlocked(lzxy))
+            self.clock.advance(1)
+            self.assertFalse(self.cache.isBlocked(lzxy))
+            expected_ttl = min(expected_ttl * 2, max_ttl)
+        self.assertEqual(expected_ttl, max_ttl)
+        # a different error class starts from scratch
+        expire_timestamp = self.cache.addFailure(lzxy, ERROR_SERVER)
+        self.assertEqual(expire_timestamp - self.clock.now, DEFAULT_TTLS[ERROR_SERVER][0])
+        # and a successful download clears the failure
+        self.cache.recordResponse(lzxy, 200)
+        self.assertEqual(len(self.cache), 0)
+
+    def max_entries_test(self):
+        """Only the most recent failures should be remembered"""
+        cache = NegativeTileCache(maxEntries=10, clock=self.clock)
+        for y in range(20):
+            cache.addFailure(("osm", 15, 0, y), ERROR_NOT_FOUND)
+        self.assertEqual(len(cache), 10)
+        self.assertFalse(cache.isBlocked(("osm", 15, 0, 9)))
+        self.assertTrue(cache.isBlocked(("osm", 15, 0, 10)))
+
+    def scripted_server_test(self):
+        """Failures returned by a real HTTP server should be recorded & block retries"""
+        server = ThreadingHTTPServer(("127.0.0.1", 0), ScriptedTileHandler)
+        server.requests = []
+        server.script = {
+            "/15/0/0.png": [404, 404],
+            "/15/0/1.png": [503],
+            "/15/0/2.png": ["slow"],
+            "/15/0/3.png": [200],
+        }
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            pool = urllib3.connection_from_url("http://127.0.0.1:%d" % server.server_port,
+                                               timeout=REQUEST_TIMEOUT, maxsize=1, block=False)
+            lzxys = [("osm", 15, 0, y) for y in range(4)]
+            results = [fetch_tile(pool, self.cache, lzxy) for lzxy in lzxys]
+            self.assertEqual(results[:3], [None, None, None])
+            self.assertEqual(results[3], PNG_HEADER)
+            self.assertEqual(self.cache.getFailure(lzxys[0])[0], ERROR_NOT_FOUND)
+            self.assertEqual(self.cache.getFailure(lzxys[1])[0], ERROR_SERVER)
+            self.assertEqual(self.cache.getFailure(lzxys[2])[0], ERROR_TIMEOUT)
+            self.assertIsNone(self.cache.getFailure(lzxys[3]))
+            # panning over the failed tiles again should not hit the server
+            request_count = len(server.requests)
+            for lzxy in lzxys[:3]:
+                self.assertIsNone(fetch_tile(pool, self.cache, lzxy))
+            self.assertEqual(len(server.requests), request_count)
+            # once the short lived failures expire, the tiles are downloaded again,
+            # while the missing tile stays blocked
+            self.clock.advance(DEFAULT_TTLS[ERROR_SERVER][0])
+            self.assertIsNone(fetch_tile(pool, self.cache, lzxys[0]))
+            self.assertEqual(fetch_tile(pool, self.cache, lzxys[1]), PNG_HEADER)
+            self.assertEqual(fetch_tile(pool, self.cache, lzxys[2]), PNG_HEADER)
+            self.assertEqual(len(self.cache), 1)
+        finally:
+            server.shutdown()
+            server.server_close()
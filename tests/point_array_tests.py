@@ -0,0 +1,94 @@
+import unittest
+import pickle
+from math import radians
+
+from core.point_array import PointArray, timestamp_to_seconds, seconds_to_timestamp
+
+
+class PointArrayTests(unittest.TestCase):
+
+    def timestamp_test(self):
+        seconds = timestamp_to_seconds("2020-02-29T23:59:59")
+        self.assertEqual(seconds_to_timestamp(seconds), "2020-02-29T23:59:59")
+        # anything that would not convert back exactly can't be stored as a number
+        self.assertIsNone(timestamp_to_seconds("2020-02-30T10:00:00"))
+        self.assertIsNone(timestamp_to_seconds("2020-02-29T23:59:59Z"))
+        self.assertIsNone(timestamp_to_seconds("2020-02-29 23:59:59"))
+        self.assertIsNone(timestamp_to_seconds("yesterday"))
+        self.assertIsNone(timestamp_to_seconds(None))
+
+    def append_test(self):
+        points = PointArray([(49.0, 16.0), ("49.1", "16.1", "200.5")])
+        points.append(49.2, 16.2, None, "2020-01-01T10:00:00")
+        points.append(49.3, 16.3, 10.0, "10:00")
+        self.assertEqual(len(points), 4)
+        self.assertTrue(points.has_time)
+        self.assertEqual(points[0], (49.0, 16.0, None))
+        self.assertEqual(points[1], (49.1, 16.1, 200.5))
+        self.assertEqual(points[-1], (49.3, 16.3, 10.0))
+        self.assertEqual(points.llet_list(), [(49.0, 16.0, None, None),
+                                              (49.1, 16.1, 200.5, None),
+                                              (49.2, 16.2, None, "2020-01-01T10:00:00"),
+                                              (49.3, 16.3, 10.0, "10:00")])
+        self.assertEqual(points.llet(-2), (49.2, 16.2, None, "2020-01-01T10:00:00"))
+        self.assertEqual(list(points), points.lle_list())
+        self.assertEqual(points.lle_list(2), [(49.2, 16.2, None), (49.3, 16.3, 10.0)])
+        with self.assertRaises(IndexError):
+            points[4]
+        # a failed conversion doesn't add anything
+        with self.assertRaises(ValueError):
+            points.append("north", 16.0)
+        self.assertEqual(len(points), 4)
+        points.clear()
+        self.assertEqual(len(points), 0)
+        self.assertFalse(points.has_time)
+        self.assertEqual(points.lle_list(), [])
+
+    def view_test(self):
+        lle = [(float(i), float(i) / 2, float(i * 10)) for i in range(10)]
+        points = PointArray(lle)
+        view = points[2:8]
+        self.assertEqual(len(view), 6)
+        self.assertEqual(list(view), lle[2:8])
+        self.assertEqual(view.lle_list(), lle[2:8])
+        self.assertEqual(view[0], lle[2])
+        self.assertEqual(view[-1], lle[7])
+        self.assertEqual(list(view[1:3]), lle[3:5])
+        self.assertEqual(list(view[4:100]), lle[6:8])
+        self.assertEqual(list(view[5:2]), [])
+        self.assertEqual(view[::2], lle[2:8:2])
+        with self.assertRaises(IndexError):
+            view[6]
+        # points appended later are not part of the view
+        points.append(10.0, 5.0, 100.0)
+        self.assertEqual(len(view), 6)
+        self.assertEqual(len(points.view()), 11)
+
+    def radians_test(self):
+        points = PointArray([(10.0, 20.0, 1.0), (30.0, 40.0, None)])
+        self.assertEqual(points.radians_list(), [(radians(10.0), radians(20.0), 1.0),
+                                                 (radians(30.0), radians(40.0), None)])
+        # radians are derived just for the appended points
+        points.append(50.0, 60.0)
+        self.assertEqual(points.radians_list(drop_elevation=True, start=1),
+                         [(radians(30.0), radians(40.0)), (radians(50.0), radians(60.0))])
+        lats, lons = points.radians()
+        self.assertEqual(list(lats), [radians(10.0), radians(30.0), radians(50.0)])
+        self.assertEqual(len(lons), 3)
+
+    def memory_size_test(self):
+        points = PointArray((float(i), float(i), None, "2020-01-01T10:00:00") for i in range(1000))
+        # 4 columns of 8 byte numbers, with some spare room at the end
+        self.assertGreaterEqual(points.memory_size(), 32 * 1000)
+        self.assertLess(points.memory_size(), 2 * 32 * 1000)
+
+    def pickle_test(self):
+        points = PointArray([(49.0, 16.0, 200.0, "2020-01-01T10:00:00"), (49.1, 16.1, None, "10:00")])
+        points.radians()
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            copy = pickle.loads(pickle.dumps(points, protocol))
+            self.assertEqual(copy.llet_list(), points.llet_list())
+            self.assertTrue(copy.has_time)
+            self.assertLess(copy.memory_size(), points.memory_size())
+            # radians are derived again once needed
+            self.assertEqual(copy.radians_list(), points.radians_list())
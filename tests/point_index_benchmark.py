@@ -0,0 +1,61 @@
+"""Nearest point query benchmarks
+
+Compares finding the closest point of a tracklog by sorting all the points
+by distance (as before), by just taking the minimum and with the point index.
+
+Run from the modRana source folder:
+
+PYTHONPATH=core/bundle python -m tests.point_index_benchmark
+"""
+from __future__ import print_function
+import random
+import time
+
+from core import geo
+from core.point_index import PointIndex
+from tests.point_index_tests import randomTrack
+
+POINT_COUNTS = [1000, 10000, 100000]
+QUERY_COUNT = 100
+
+
+def sortedClosest(lle, lle_list):
+    """The previous implementation of geo.get_closest_lle()"""
+    lle_tuples_with_distance = []
+    for some_lle in lle_list:
+        distance_to_lle = geo.distance(lat1=some_lle[0], lon1=some_lle[1], lat2=lle[0], lon2=lle[1])
+        lle_tuples_with_distance.append((distance_to_lle, some_lle))
+    return sorted(lle_tuples_with_distance, key=lambda x: x[0])[0][1]
+
+
+def _run(label, function, queries):
+    start = time.time()
+    result = [function(lat, lon) for lat, lon in queries]
+    print("%10.3f ms per query - %s" % (1000 * (time.time() - start) / len(queries), label))
+    return result
+
+
+def point_count_benchmark(count):
+    rng = random.Random(0)
+    points = randomTrack(count, rng)
+    queries = [(point[0] + rng.uniform(-0.001, 0.001), point[1] + rng.uniform(-0.001, 0.001))
+               for point in rng.sample(points, QUERY_COUNT)]
+    print("# %d points, %d queries #" % (count, QUERY_COUNT))
+    old = _run("sorting all points", lambda lat, lon: sortedClosest((lat, lon), points), queries)
+    minimum = _run("minimum of all points", lambda lat, lon: geo.get_closest_lle((lat, lon), points), queries)
+    start = time.time()
+    index = PointIndex(points)
+    print("%10.3f ms - building the point index" % (1000 * (time.time() - start)))
+    nearest = _run("point index - nearest", lambda lat, lon: points[index.nearest(lat, lon)[1]], queries)
+    _run("point index - 10 nearest", lambda lat, lon: index.k_nearest(lat, lon, 10), queries)
+    _run("point index - within 100 m", lambda lat, lon: index.within_radius(lat, lon, 0.1), queries)
+    assert old == minimum == nearest
+
+
+def main():
+    for count in POINT_COUNTS:
+        point_count_benchmark(count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import unittest
+import random
+
+from core import geo
+from core.point import Point
+from core.point_index import PointIndex
+from core.way import Way, AppendOnlyWay
+from tests.tile_set_tests import loadGpxPoints
+
+
+def randomTrack(count, rng, lat=49.2, lon=16.6, step=0.0002):
+    """A random walk, like a recorded tracklog"""
+    points = []
+    for _i in range(count):
+        lat += rng.uniform(-step, step)
+        lon += rng.uniform(-step, step)
+        points.append((lat, lon, None))
+    return points
+
+
+def bruteForce(points, lat, lon):
+    """(distance, index) tuples for all points, closest first"""
+    return sorted((geo.distance(lat, lon, point[0], point[1]), index) for index, point in enumerate(points))
+
+
+class PointIndexTests(unittest.TestCase):
+
+    def _check(self, points, queries, k=5, radius=0.5):
+        index = PointIndex(points)
+        for lat, lon in queries:
+            expected = bruteForce(points, lat, lon)
+            self.assertEqual(index.nearest(lat, lon), expected[0])
+            self.assertEqual(index.k_nearest(lat, lon, k), expected[:k])
+            self.assertEqual(index.within_radius(lat, lon, radius),
+                             [item for item in expected if item[0] <= radius])
+
+    def track_test(self):
+        rng = random.Random(0)
+        points = randomTrack(3000, rng)
+        queries = [(point[0] + rng.uniform(-0.001, 0.001), point[1] + rng.uniform(-0.001, 0.001))
+                   for point in rng.sample(points, 50)]
+        # far away from the track
+        queries.extend([(49.5, 16.6), (48.0, 14.0), (-30.0, -60.0)])
+        self._check(points, queries)
+
+    def example_track_test(self):
+        points = loadGpxPoints()
+        rng = random.Random(1)
+        queries = [(rng.uniform(48.8, 49.3), rng.uniform(16.0, 16.7)) for _i in range(50)]
+        self._check(points, queries, k=10, radius=3.0)
+
+    def edge_cases_test(self):
+        self.assertIsNone(PointIndex([]).nearest(49.2, 16.6))
+        self.assertEqual(PointIndex([]).k_nearest(49.2, 16.6, 3), [])
+        self.assertEqual(PointIndex([]).within_radius(49.2, 16.6, 3), [])
+        # duplicate points
+        points = [(49.2, 16.6)] * 20 + [(49.3, 16.6)]
+        self._check(points, [(49.2, 16.6), (49.25, 16.6), (49.4, 16.7)], k=22)
+        # points around the poles & the 180th meridian
+        rng = random.Random(2)
+        points = [(rng.uniform(80, 90), rng.uniform(-180, 180)) for _i in range(200)]
+        points += [(rng.uniform(-10, 10), rng.choice((-179.9, 179.9))) for _i in range(50)]
+        queries = [(89.9, 0.0), (0.0, 180.0), (0.0, -179.99), (85.0, 90.0)]
+        self._check(points, queries, radius=500.0)
+        points = [(0.0, 179.99), (0.0, 179.0)]
+        self._check(points, [(0.0, -179.99)])
+
+
+class WayIndexTests(unittest.TestCase):
+
+    def way_test(self):
+        rng = random.Random(3)
+        way = Way(randomTrack(1000, rng))
+        lat, lon = 49.2, 16.6
+        expected = bruteForce(way.points_lle, lat, lon)
+        self.assertEqual(way.nearest(lat, lon), expected[0])
+        self.assertEqual(way.k_nearest(lat, lon, 3), expected[:3])
+        self.assertEqual(way.within_radius(lat, lon, 0.2), [item for item in expected if item[0] <= 0.2])
+        closest = way.get_closest_point(Point(lat, lon))
+        self.assertEqual(closest.getLLE(), way.points_lle[expected[0][1]])
+        # the index is invalidated by point changes
+        index = way.point_index
+        self.assertIs(way.point_index, index)
+        way.add_point_lle(lat, lon, 0.0)
+        self.assertIsNot(way.point_index, index)
+        self.assertEqual(way.nearest(lat, lon), (0.0, 1000))
+        way.clear()
+        self.assertIsNone(way.nearest(lat, lon))
+        self.assertIsNone(way.get_closest_point(Point(lat, lon)))
+
+    def append_only_way_test(self):
+        way = AppendOnlyWay()
+        way.add_point_lle(49.2, 16.6, 0.0)
+        self.assertEqual(way.nearest(49.2, 16.6)[1], 0)
+        way.add_point_lle(49.3, 16.6, 0.0)
+        self.assertEqual(way.nearest(49.3, 16.6)[1], 1)
@@ -0,0 +1,157 @@
+"""Polyline drawing benchmarks
+
+Draws a 50 000 point track to an 800x480 cairo image surface at several
+zoom levels, once by projecting all the points (as before) and once with
+the level of detail pyramid. Reports frame times, how many points were
+drawn and the visual error - the largest distance of a visible track point
+from the drawn polyline in pixels, measured and guaranteed.
+
+If pycairo is not installed, just the path building is timed.
+
+Run from the modRana source folder:
+
+PYTHONPATH=core/bundle python -m tests.polyline_lod_benchmark
+"""
+from __future__ import print_function
+import math
+import random
+import time
+
+try:
+    import cairo
+except ImportError:
+    cairo = None
+
+from core.tilenames import ll2xy, ll2relativeXY
+from core.polyline_lod import PolylineLOD, COORD_SCALE
+from tests.polyline_lod_tests import polylineDistance
+
+POINT_COUNT = 50000
+ZOOMS = [6, 9, 12, 15, 18]
+WIDTH = 800
+HEIGHT = 480
+SCALE = 256
+REPEAT = 5
+ERROR_SAMPLE_SIZE = 300
+
+
+class PathOnlyContext(object):
+    """Stands in for a cairo context when pycairo is not available"""
+
+    def move_to(self, x, y):
+        pass
+
+    def line_to(self, x, y):
+        pass
+
+    def set_source_rgb(self, r, g, b):
+        pass
+
+    def set_line_width(self, width):
+        pass
+
+    def stroke(self):
+        pass
+
+
+def longTrack(count, rng, lat=49.2, lon=16.6, step=0.0001):
+    """A track going in a slowly changing direction, about 10 m between points"""
+    points = []
+    heading = 0.0
+    for _i in range(count):
+        heading += rng.uniform(-0.2, 0.2)
+        lat += step * math.cos(heading)
+        lon += step * math.sin(heading) / math.cos(math.radians(lat))
+        points.append((lat, lon))
+    return points
+
+
+def _context():
+    if cairo is None:
+        return None, PathOnlyContext()
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, WIDTH, HEIGHT)
+    return surface, cairo.Context(surface)
+
+
+def _frame(drawPath):
+    """Draw a frame, return (time in ms, result of drawPath)"""
+    best = None
+    result = None
+    for _i in range(REPEAT):
+        surface, ctx = _context()
+        start = time.time()
+        ctx.set_source_rgb(0, 0, 0.5)
+        ctx.set_line_width(10)
+        result = drawPath(ctx)
+        ctx.stroke()
+        if surface is not None:
+            surface.flush()
+        elapsed = 1000 * (time.time() - start)
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def zoom_benchmark(lls, lod, zoom):
+    # viewport centred on the middle of the track
+    middle = lls[len(lls) // 2]
+    centreX, centreY = ll2xy(middle[0], middle[1], zoom)
+    px1 = centreX - 0.5 * WIDTH / SCALE
+    py1 = centreY - 0.5 * HEIGHT / SCALE
+    px2 = centreX + 0.5 * WIDTH / SCALE
+    py2 = centreY + 0.5 * HEIGHT / SCALE
+
+    def drawAll(ctx):
+        """The previous way - project & draw every point"""
+        points = []
+        for lat, lon in lls:
+            px, py = ll2xy(lat, lon, zoom)
+            points.append(((px - px1) * SCALE, (py - py1) * SCALE))
+        ctx.move_to(*points[0])
+        for x, y in points[1:]:
+            ctx.line_to(x, y)
+        return len(points)
+
+    def drawLOD(ctx):
+        return lod.draw(ctx, zoom, px1, py1, px2, py2, SCALE, margin=10)
+
+    allTime, allCount = _frame(drawAll)
+    lodTime, lodCount = _frame(drawLOD)
+
+    # visual error - sample visible track points & measure their distance
+    # from the simplified polyline in screen pixels
+    unit = SCALE * 2 ** zoom / float(COORD_SCALE)
+    runs = [([x * unit - px1 * SCALE for x in xs], [y * unit - py1 * SCALE for y in ys])
+            for xs, ys in lod.visibleRuns(zoom, px1, py1, px2, py2, margin=10)]
+    visible = []
+    for lat, lon in lls:
+        px, py = ll2xy(lat, lon, zoom)
+        x, y = (px - px1) * SCALE, (py - py1) * SCALE
+        if 0 <= x < WIDTH and 0 <= y < HEIGHT:
+            visible.append((x, y))
+    sample = random.Random(0).sample(visible, min(len(visible), ERROR_SAMPLE_SIZE))
+    maxError = 0.0
+    for x, y in sample:
+        maxError = max(maxError, min(polylineDistance(x, y, xs, ys) for xs, ys in runs))
+    print("zoom %2d: %8.2f ms all %6d points | %8.2f ms LOD %6d points | "
+          "error %.3f px (bound %.3f px)" % (zoom, allTime, allCount, lodTime, lodCount,
+                                            maxError, lod.errorBound(zoom) * SCALE / 256.0))
+
+
+def main():
+    if cairo is None:
+        print("pycairo not available, timing just the path building")
+    lls = longTrack(POINT_COUNT, random.Random(0))
+    start = time.time()
+    lod = PolylineLOD([ll2relativeXY(lat, lon) for lat, lon in lls])
+    print("%d points, pyramid created in %.1f ms" % (len(lod), 1000 * (time.time() - start)))
+    start = time.time()
+    for zoom in range(0, lod.maxZoom + 1):
+        lod.visibleRuns(zoom, 0, 0, 2 ** zoom, 2 ** zoom)
+    print("all levels simplified in %.1f ms" % (1000 * (time.time() - start)))
+    for zoom in ZOOMS:
+        zoom_benchmark(lls, lod, zoom)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import unittest
+import random
+from math import sqrt
+
+from core.tilenames import ll2relativeXY
+from core.polyline_lod import PolylineLOD, simplify, COORD_SCALE, TILE_SIZE
+from tests.point_index_tests import randomTrack
+
+
+class RecordingContext(object):
+    """Records path operations like a cairo context would get them"""
+
+    def __init__(self):
+        self.subpaths = []
+
+    def move_to(self, x, y):
+        self.subpaths.append([(x, y)])
+
+    def line_to(self, x, y):
+        self.subpaths[-1].append((x, y))
+
+
+def segmentDistance(px, py, ax, ay, bx, by):
+    dx = bx - ax
+    dy = by - ay
+    lengthSq = float(dx * dx + dy * dy)
+    t = 0.0
+    if lengthSq:
+        t = min(max(((px - ax) * dx + (py - ay) * dy) / lengthSq, 0.0), 1.0)
+    ex = px - ax - t * dx
+    ey = py - ay - t * dy
+    return sqrt(ex * ex + ey * ey)
+
+
+def polylineDistance(px, py, xs, ys):
+    if len(xs) == 1:
+        return segmentDistance(px, py, xs[0], ys[0], xs[0], ys[0])
+    return min(segmentDistance(px, py, xs[i], ys[i], xs[i + 1], ys[i + 1]) for i in range(len(xs) - 1))
+
+
+def relativeTrack(count, seed=0):
+    return [ll2relativeXY(lat, lon) for lat, lon, _elevation in randomTrack(count, random.Random(seed))]
+
+
+def worldCoordinates(points):
+    return [int(round(point[0] * COORD_SCALE)) for point in points], \
+           [int(round(point[1] * COORD_SCALE)) for point in points]
+
+
+class PolylineLODTests(unittest.TestCase):
+
+    def simplify_test(self):
+        # points on a line are dropped
+        self.assertEqual(simplify(list(range(10)), [2 * x for x in range(10)], 0.1), [0, 9])
+        self.assertEqual(simplify([0, 1], [0, 1], 10), [0, 1])
+        self.assertEqual(simplify([], [], 10), [])
+        rng = random.Random(0)
+        xs = [rng.randint(0, 1000) for _i in range(300)]
+        ys = [rng.randint(0, 1000) for _i in range(300)]
+        for tolerance in (1, 50, 200):
+            kept = simplify(xs, ys, tolerance)
+            self.assertEqual(kept[0], 0)
+            self.assertEqual(kept[-1], 299)
+            self.assertEqual(kept, sorted(set(kept)))
+            keptXs = [xs[index] for index in kept]
+            keptYs = [ys[index] for index in kept]
+            for x, y in zip(xs, ys):
+                self.assertLessEqual(polylineDistance(x, y, keptXs, keptYs), tolerance)
+
+    def error_bound_test(self):
+        points = relativeTrack(1000)
+        xs, ys = worldCoordinates(points)
+        lod = PolylineLOD(points, blockSize=100)
+        self.assertEqual(len(lod), 1000)
+        previousCount = None
+        for zoom in (4, 8, 12, 14):
+            runs = lod.visibleRuns(zoom, 0, 0, 2 ** zoom, 2 ** zoom)
+            # the whole track is visible
+            self.assertEqual(len(runs), 1)
+            runXs, runYs = runs[0]
+            self.assertEqual((runXs[0], runYs[0]), (xs[0], ys[0]))
+            self.assertEqual((runXs[-1], runYs[-1]), (xs[-1], ys[-1]))
+            # less simplification at higher zoom levels
+            if previousCount is not None:
+                self.assertGreaterEqual(len(runXs), previousCount)
+            previousCount = len(runXs)
+            pixel = COORD_SCALE / float(TILE_SIZE * 2 ** zoom)
+            bound = lod.errorBound(zoom) * pixel
+            maxError = max(polylineDistance(x, y, runXs, runYs) for x, y in zip(xs, ys))
+            self.assertLessEqual(maxError, bound)
+        self.assertLess(len(lod.visibleRuns(4, 0, 0, 16, 16)[0][0]), 100)
+        # above the maximum level of detail zoom all points are used
+        runs = lod.visibleRuns(lod.maxZoom + 1, 0, 0, 2 ** 19, 2 ** 19)
+        self.assertEqual(runs, [(xs, ys)])
+
+    def clipping_test(self):
+        points = relativeTrack(3000, seed=1)
+        xs, ys = worldCoordinates(points)
+        lod = PolylineLOD(points, blockSize=64)
+        zoom = 19
+        n = 2 ** zoom
+        # a viewport around a point in the middle of the track
+        centreX = points[1500][0] * n
+        centreY = points[1500][1] * n
+        px1, py1, px2, py2 = centreX - 2, centreY - 1, centreX + 2, centreY + 1
+        runs = lod.visibleRuns(zoom, px1, py1, px2, py2)
+        drawn = set()
+        for runXs, runYs in runs:
+            drawn.update(zip(runXs, runYs))
+        self.assertLess(len(drawn), len(points))
+        unit = COORD_SCALE / float(n)
+        for x, y in zip(xs, ys):
+            if px1 * unit <= x <= px2 * unit and py1 * unit <= y <= py2 * unit:
+                self.assertIn((x, y), drawn)
+        # nothing is visible far away from the track
+        self.assertEqual(lod.visibleRuns(zoom, 0, 0, 10, 10), [])
+
+    def append_test(self):
+        points = relativeTrack(700, seed=2)
+        lod = PolylineLOD(points, blockSize=50)
+        appended = PolylineLOD(blockSize=50)
+        self.assertIsNone(appended.lastPoint)
+        for px, py in points:
+            appended.append(px, py)
+            # levels of the last block are dropped once it changes
+            appended.visibleRuns(10, 0, 0, 1024, 1024)
+        self.assertEqual(len(appended), len(points))
+        for zoom in (3, 10, 15, 20):
+            n = 2 ** zoom
+            self.assertEqual(appended.visibleRuns(zoom, 0, 0, n, n), lod.visibleRuns(zoom, 0, 0, n, n))
+        lastX, lastY = appended.lastPoint
+        self.assertAlmostEqual(lastX, points[-1][0], places=8)
+        self.assertAlmostEqual(lastY, points[-1][1], places=8)
+        appended.clear()
+        self.assertEqual(len(appended), 0)
+        self.assertEqual(appended.visibleRuns(10, 0, 0, 1024, 1024), [])
+
+    def draw_test(self):
+        lls = [(49.2, 16.6), (49.201, 16.601), (49.2, 16.603)]
+        lod = PolylineLOD.fromLL(lls)
+        zoom = 17
+        scale = 256
+        n = 2 ** zoom
+        px, py = ll2relativeXY(49.2, 16.6)
+        px1, py1 = px * n - 100 / float(scale), py * n - 300 / float(scale)
+        px2, py2 = px1 + 800 / float(scale), py1 + 480 / float(scale)
+        ctx = RecordingContext()
+        self.assertEqual(lod.draw(ctx, zoom, px1, py1, px2, py2, scale), 3)
+        self.assertEqual(len(ctx.subpaths), 1)
+        # same coordinates as from the projection module
+        # (up to rounding to world coordinates)
+        rounding = scale * n / float(COORD_SCALE)
+        for (x, y), (lat, lon) in zip(ctx.subpaths[0], lls):
+            relX, relY = ll2relativeXY(lat, lon)
+            self.assertAlmostEqual(x, (relX * n - px1) * scale, delta=rounding)
+            self.assertAlmostEqual(y, (relY * n - py1) * scale, delta=rounding)
+        # a single point & no points
+        ctx = RecordingContext()
+        self.assertEqual(PolylineLOD.fromLL(lls[:1]).draw(ctx, zoom, px1, py1, px2, py2, scale), 1)
+        self.assertEqual(len(ctx.subpaths), 1)
+        self.assertEqual(PolylineLOD().draw(ctx, zoom, px1, py1, px2, py2, scale), 0)
@@ -0,0 +1,45 @@
+"""Route following benchmarks
+
+Replays a GPS trace along the Znojmo - Brno track densified to a 10k point route,
+with a detour from the route in the middle, and checks if the route is being
+followed for each position - once by checking every route segment as
+turn by turn navigation did before, once with the route segment index.
+
+Run from the modRana source folder:
+
+PYTHONPATH=core/bundle python -m tests.route_index_benchmark
+"""
+from __future__ import print_function
+import random
+import time
+
+from modules.mod_turnByTurn.route_index import RouteIndex
+from tests.route_index_tests import exampleRoute, gpsTrace, bruteForceDistance, THRESHOLD
+
+ROUTE_POINT_COUNT = 10000
+
+
+def _run(label, function, trace):
+    start = time.time()
+    result = function()
+    print("%8.3f ms per position - %s" % (1000 * (time.time() - start) / len(trace), label))
+    return result
+
+
+def main():
+    route = exampleRoute(ROUTE_POINT_COUNT)
+    trace = gpsTrace(route, random.Random(0), detour=(4000, 4300))
+    print("%d point route, %d positions" % (len(route), len(trace)))
+    start = time.time()
+    index = RouteIndex(route)
+    print("%8.1f ms - building the route index" % (1000 * (time.time() - start)))
+    old = _run("checking all segments", lambda: [bruteForceDistance(route, lat, lon) < THRESHOLD
+                                                   for lat, lon in trace], trace)
+    new = _run("route index", lambda: [index.segmentWithin(lat, lon, THRESHOLD) is not None
+                                       for lat, lon in trace], trace)
+    assert old == new
+    print("%d positions off route, %d route index grid queries" % (old.count(False), index.gridQueryCount))
+
+
+if __name__ == "__main__":
+    main()
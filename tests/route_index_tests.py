@@ -0,0 +1,118 @@
+import unittest
+import random
+import math
+
+from core import geo
+from modules.mod_turnByTurn.route_index import RouteIndex, SegmentGrid
+from tests.tile_set_tests import loadGpxPoints
+
+ROUTE_POINT_COUNT = 10000
+THRESHOLD = 0.03  # km, the default rerouting threshold
+
+
+def densify(points, count):
+    """Linearly interpolate a polyline to about the given number of points"""
+    perSegment = max(1, int(math.ceil(count / float(len(points) - 1))))
+    dense = []
+    for (lat1, lon1), (lat2, lon2) in zip(points, points[1:]):
+        for i in range(perSegment):
+            dense.append((lat1 + (lat2 - lat1) * i / float(perSegment),
+                          lon1 + (lon2 - lon1) * i / float(perSegment)))
+    dense.append(points[-1])
+    return dense
+
+
+def exampleRoute(count=ROUTE_POINT_COUNT):
+    """The Znojmo - Brno track densified to a long route, in radians"""
+    return [geo.ll2radians(lat, lon) for lat, lon in densify(loadGpxPoints(), count)]
+
+
+def gpsTrace(route, rng, noise=0.00000157, detour=None):
+    """Positions moving along a route in radians, with some GPS noise
+
+    :param tuple detour: (first, last) route point indexes between which
+                         positions are offset from the route by about 500 m
+    """
+    trace = []
+    for index in range(0, len(route), 7):
+        lat, lon = route[index]
+        if detour and detour[0] <= index <= detour[1]:
+            lat += 0.00008
+        trace.append((lat + rng.gauss(0, noise), lon + rng.gauss(0, noise)))
+    return trace
+
+
+def bruteForceDistance(route, lat, lon):
+    """The previous way of checking the distance from a route"""
+    if len(route) == 1:
+        return geo.distance_approx_radians(lat, lon, route[0][0], route[0][1])
+    return min(geo.distance_point_to_line_radians(lat, lon, a[0], a[1], b[0], b[1])
+               for a, b in zip(route, route[1:]))
+
+
+class RouteIndexTests(unittest.TestCase):
+
+    def grid_test(self):
+        """The grid should never miss a segment close enough"""
+        rng = random.Random(0)
+        route = exampleRoute(2000)
+        grid = SegmentGrid(route)
+        for _i in range(300):
+            lat, lon = rng.choice(route)
+            lat += rng.uniform(-0.0003, 0.0003)
+            lon += rng.uniform(-0.0003, 0.0003)
+            maxDistance = rng.choice((0.03, 0.3, 1.0))
+            candidates = set(grid.segmentsNear(lat, lon, maxDistance))
+            for index in range(len(route) - 1):
+                a, b = route[index], route[index + 1]
+                if geo.distance_point_to_line_radians(lat, lon, a[0], a[1], b[0], b[1]) < maxDistance:
+                    self.assertIn(index, candidates)
+
+    def big_segment_test(self):
+        """Long segments are always checked"""
+        route = [geo.ll2radians(49.0, 16.0), geo.ll2radians(49.0, 16.0001), geo.ll2radians(50.0, 17.0)]
+        index = RouteIndex(route)
+        lat, lon = geo.ll2radians(49.5, 16.5)
+        self.assertEqual(index.segmentWithin(lat, lon, 0.1)[1], 1)
+        self.assertIsNone(index.segmentWithin(lat + 0.001, lon, 0.1))
+
+    def follow_test(self):
+        """Results should match checking all segments"""
+        rng = random.Random(1)
+        route = exampleRoute(3000)
+        index = RouteIndex(route)
+        trace = gpsTrace(route, rng, detour=(1200, 1300))
+        offRouteCount = 0
+        for lat, lon in trace:
+            expected = bruteForceDistance(route, lat, lon) < THRESHOLD
+            result = index.segmentWithin(lat, lon, THRESHOLD)
+            self.assertEqual(result is not None, expected)
+            if result:
+                distance, segment = result
+                self.assertTrue(distance < THRESHOLD)
+                self.assertEqual(segment, index.currentSegment)
+            else:
+                offRouteCount += 1
+        # the detour
+        self.assertTrue(offRouteCount >= 10)
+        # the grid is used almost only when not following the route
+        self.assertTrue(index.gridQueryCount <= offRouteCount + len(trace) // 100)
+
+    def jump_test(self):
+        """Skipping part of the route should be handled by the grid"""
+        route = exampleRoute(2000)
+        index = RouteIndex(route)
+        lat, lon = route[1500]
+        self.assertIsNotNone(index.segmentWithin(lat, lon, THRESHOLD))
+        self.assertEqual(index.gridQueryCount, 1)
+        self.assertTrue(1498 <= index.currentSegment <= 1500)
+        lat, lon = route[1505]
+        self.assertIsNotNone(index.segmentWithin(lat, lon, THRESHOLD))
+        self.assertEqual(index.gridQueryCount, 1)
+
+    def small_route_test(self):
+        self.assertIsNone(RouteIndex([]).segmentWithin(0.8, 0.3, THRESHOLD))
+        point = geo.ll2radians(49.2, 16.6)
+        single = RouteIndex([point])
+        self.assertEqual(single.segmentWithin(point[0], point[1], THRESHOLD)[1], None)
+        self.assertIsNone(single.segmentWithin(point[0] + 0.001, point[1], THRESHOLD))
@@ -0,0 +1,196 @@
+import unittest
+import random
+import threading
+
+try:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from urlparse import urlparse
+except ImportError:  # Python 3
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import urlparse
+
+from core import constants
+from core import threads
+from core.layers import MapLayer
+from modules.mod_mapData import pools
+from modules.mod_mapData.size_estimator import BatchSizeEstimator, SAMPLES_PER_ZOOM, MIN_REMOTE_SAMPLES
+from tests.negative_cache_tests import ThreadingHTTPServer
+from tests.batch_journal_tests import FakeMapTiles, FakeModRana
+
+BATCH_TIMEOUT = 30  # in seconds
+
+
+def tileSize(x, y, z):
+    """Known size of a generated tile - tiles with "features" are much larger"""
+    size = 200 + z * 10 + (x * 7919 + y * 104729) % 300
+    if (x * 31 + y * 17) % 7 == 0:
+        size += 3000 + (x * y) % 2000
+    return size
+
+
+def generateTiles(zoomSizes):
+    """Generate a tile set
+
+    :param dict zoomSizes: zoom level -> side of the tile square on the zoom level
+    :returns: list of (x, y, z) tile tuples
+    """
+    return [(x, y, z) for z, side in zoomSizes.items() for x in range(side) for y in range(side)]
+
+
+class HeadHandler(BaseHTTPRequestHandler):
+    """Reports the known size of the generated tiles"""
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        # tile size checks use absolute request URLs
+        z, x, y = urlparse(self.path).path.rsplit(".", 1)[0].strip("/").split("/")
+        with self.server.lock:
+            self.server.requestCount += 1
+        self.send_response(200)
+        self.send_header("Content-Length", str(tileSize(int(x), int(y), int(z))))
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeTileStore(object):
+    def __init__(self, items):
+        self.items = set(items)
+
+    def tiles_stored(self, lzxys):
+        return set(lzxy for lzxy in lzxys if (lzxy[2], lzxy[3], lzxy[1]) in self.items)
+
+    def get_tile_sizes(self, lzxys):
+        return dict((lzxy, tileSize(lzxy[2], lzxy[3], lzxy[1])) for lzxy in lzxys
+                    if (lzxy[2], lzxy[3], lzxy[1]) in self.items)
+
+
+class FakeMapData(object):
+    def __init__(self):
+        self.removed = []
+
+    def removeTileDownloadRequest(self, item):
+        self.removed.append(item)
+
+
+class BatchSizeEstimatorTests(unittest.TestCase):
+
+    def _estimate(self, missing, stored=(), seed=0):
+        estimator = BatchSizeEstimator(rng=random.Random(seed))
+        for item in missing:
+            estimator.addMissingTile(item)
+        for item in stored:
+            estimator.addStoredTile(item)
+        for x, y, z in estimator.storedSample():
+            estimator.addStoredSize(z, tileSize(x, y, z))
+        remoteSample = estimator.remoteSample()
+        for x, y, z in remoteSample:
+            estimator.addRemoteSize(z, tileSize(x, y, z))
+        return estimator, remoteSample
+
+    def accuracy_test(self):
+        """The true size should be within the confidence interval for most tile sets"""
+        tiles = generateTiles({12: 30, 13: 60, 14: 90})
+        trueSize = sum(tileSize(*item) for item in tiles)
+        covered = 0
+        runs = 40
+        for seed in range(runs):
+            estimator, remoteSample = self._estimate(tiles, seed=seed)
+            self.assertEqual(len(remoteSample), 3 * SAMPLES_PER_ZOOM)
+            size, error = estimator.estimate()
+            self.assertTrue(error > 0)
+            # even with the very uneven tile sizes, a few hundred samples are good
+            # for a 30 % estimate of a batch of 12600 tiles
+            self.assertTrue(abs(size - trueSize) < 0.3 * trueSize, (size, trueSize))
+            if abs(size - trueSize) <= error:
+                covered += 1
+        # 95 % confidence interval
+        self.assertTrue(covered >= 0.85 * runs, covered)
+
+    def exact_small_batch_test(self):
+        """Zoom levels with fewer tiles than the sample size are checked completely"""
+        tiles = generateTiles({10: 5, 11: 9})
+        estimator, remoteSample = self._estimate(tiles)
+        self.assertEqual(len(remoteSample), len(tiles))
+        self.assertEqual(estimator.estimate(), (sum(tileSize(*item) for item in tiles), 0))
+
+    def stored_sizes_test(self):
+        """Sizes of stored tiles should replace most of the remote checks"""
+        tiles = generateTiles({15: 40})
+        stored, missing = tiles[:800], tiles[800:]
+        trueSize = sum(tileSize(*item) for item in missing)
+        estimator, remoteSample = self._estimate(missing, stored)
+        self.assertEqual(len(remoteSample), MIN_REMOTE_SAMPLES)
+        size, error = estimator.estimate()
+        self.assertTrue(abs(size - trueSize) < 0.3 * trueSize, (size, trueSize))
+        # stored tiles on zoom levels with nothing to download are not needed
+        estimator, remoteSample = self._estimate(missing, generateTiles({16: 5}))
+        self.assertEqual(estimator.storedSample(), [])
+
+    def unknown_zoom_test(self):
+        """Zoom levels without samples should use the mean of the other levels"""
+        estimator = BatchSizeEstimator()
+        # nothing to download
+        self.assertEqual(estimator.estimate(), (0, 0))
+        for item in generateTiles({5: 20}):
+            estimator.addMissingTile(item)
+        self.assertEqual(estimator.estimate(), (0, None))
+        estimator.addRemoteSize(6, 1000)
+        estimator.addRemoteSize(6, 3000)
+        size, error = estimator.estimate()
+        self.assertEqual(size, 400 * 2000)
+        self.assertTrue(error > 0)
+
+
+class BatchSizeCheckPoolTests(unittest.TestCase):
+
+    def setUp(self):
+        threads.initThreading()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), HeadHandler)
+        self.server.lock = threading.Lock()
+        self.server.requestCount = 0
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.layer = MapLayer("stub", {"url": "http://127.0.0.1:%d/" % self.server.server_port,
+                                       "type": "png", "coordinates": "osm"})
+        self.tiles = generateTiles({13: 20, 14: 40})
+        # some of the tiles have already been browsed
+        self.stored = set(item for item in self.tiles if item[0] < 5)
+        self.missing = [item for item in self.tiles if item not in self.stored]
+        self.mapData = FakeMapData()
+        self.originalModRana = pools.modrana
+
+    def tearDown(self):
+        pools.modrana = self.originalModRana
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _checkSize(self, mode):
+        pools.modrana = FakeModRana({"mapTiles": FakeMapTiles(), "storeTiles": FakeTileStore(self.stored),
+                                     "mapData": self.mapData},
+                                    {"maxSizeThreads": 4, "batchSizeCheckMode": mode})
+        pool = pools.BatchSizeCheckPool()
+        pool.layer = self.layer
+        done = threading.Event()
+        pool.batchDone.connect(done.set)
+        pool.startBatch(set(self.tiles))
+        self.assertTrue(done.wait(BATCH_TIMEOUT))
+        self.assertEqual(pool.foundLocally, len(self.stored))
+        self.assertEqual(sorted(self.mapData.removed), sorted(self.stored))
+        return pool
+
+    def sampled_size_test(self):
+        pool = self._checkSize(constants.BATCH_SIZE_CHECK_SAMPLE)
+        trueSize = sum(tileSize(*item) for item in self.missing)
+        self.assertTrue(self.server.requestCount <= 2 * SAMPLES_PER_ZOOM)
+        # the size is random, so allow for a wider interval to keep the test reliable
+        self.assertTrue(abs(pool.downloadSize - trueSize) <= 2 * pool.downloadSizeError,
+                        (pool.downloadSize, pool.downloadSizeError, trueSize))
+
+    def exact_size_test(self):
+        pool = self._checkSize(constants.BATCH_SIZE_CHECK_EXACT)
+        self.assertEqual(self.server.requestCount, len(self.missing))
+        self.assertEqual(pool.downloadSize, sum(tileSize(*item) for item in self.missing))
+        self.assertEqual(pool.downloadSizeError, 0)
@@ -0,0 +1,72 @@
+"""In memory tile cache benchmarks
+
+Compares the LRU tile cache with the previous implementation,
+that sorted all cached tiles by timestamp when trimming the cache.
+
+Run from the modRana source folder:
+
+PYTHONPATH=core/bundle python -m tests.tile_cache_benchmark
+"""
+from __future__ import print_function
+import time
+
+from core.tile_cache import TileCache
+
+CACHE_SIZES = [150, 500, 1000, 2000, 5000]
+TILE_SIZE = 256 * 256 * 4
+# how many tiles to insert for each cache size
+INSERT_COUNT = 20000
+# how many tiles were removed when trimming the old cache
+TRIM_SIZE = 30
+
+class TrimmingTileCache(object):
+    """The previous in memory tile cache implementation"""
+
+    def __init__(self, maxImages):
+        self.maxImages = maxImages
+        self.images = {}
+
+    def add(self, lzxy, item, imageType):
+        self.images[lzxy] = (item, {'addedTimestamp': time.time(), 'type': imageType})
+        if len(self.images) > self.maxImages:
+            oldestKeys = sorted(self.images, key=lambda image: self.images[image][1]['addedTimestamp'])[0:TRIM_SIZE]
+            for key in oldestKeys:
+                del self.images[key]
+
+    def get(self, lzxy):
+        return self.images.get(lzxy)
+
+def _tiles(count):
+    return [("osm", 15, i % 100, i // 100) for i in range(count)]
+
+def _run(label, cacheSize, function):
+    start = time.time()
+    function()
+    print("%1.2f us per tile - %s (cache size %d)" % (1000000 * (time.time() - start) / INSERT_COUNT,
+                                                      label, cacheSize))
+
+def insert_evict_benchmark(cacheSize):
+    tiles = _tiles(INSERT_COUNT)
+    oldCache = TrimmingTileCache(cacheSize)
+    newCache = TileCache(cacheSize * TILE_SIZE)
+
+    def oldInsert():
+        for lzxy in tiles:
+            oldCache.add(lzxy, None, "normal")
+            oldCache.get(lzxy)
+
+    def newInsert():
+        metadata = {"type": "normal"}
+        for lzxy in tiles:
+            newCache.add(lzxy, None, metadata, TILE_SIZE)
+            newCache.get(lzxy)
+
+    _run("old insert & evict", cacheSize, oldInsert)
+    _run("LRU insert & evict", cacheSize, newInsert)
+
+def main():
+    for cacheSize in CACHE_SIZES:
+        insert_evict_benchmark(cacheSize)
+
+if __name__ == "__main__":
+    main()
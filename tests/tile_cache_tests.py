@@ -0,0 +1,94 @@
+import unittest
+
+from core.tile_cache import TileCache, decodedSize, DECODED_TILE_SIZE
+
+TILE_SIZE = 100
+
+def add_tile(cache, lzxy, tile_type="normal"):
+    return cache.add(lzxy, "tile %s" % (lzxy,), {"type": tile_type}, TILE_SIZE)
+
+
+class TileCacheTests(unittest.TestCase):
+
+    def lru_eviction_test(self):
+        """Least recently used tiles should be evicted once the cache is over budget"""
+        cache = TileCache(3 * TILE_SIZE)
+        for y in range(3):
+            add_tile(cache, ("osm", 15, 0, y))
+        # touch the oldest tile so that the second one is evicted instead
+        self.assertEqual(cache.get(("osm", 15, 0, 0))[0], "tile ('osm', 15, 0, 0)")
+        self.assertEqual(add_tile(cache, ("osm", 15, 0, 3)), 1)
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.size, 3 * TILE_SIZE)
+        self.assertNotIn(("osm", 15, 0, 1), cache)
+        self.assertIn(("osm", 15, 0, 0), cache)
+        # peek should not change the eviction order
+        cache.peek(("osm", 15, 0, 2))
+        add_tile(cache, ("osm", 15, 0, 4))
+        self.assertNotIn(("osm", 15, 0, 2), cache)
+
+    def byte_budget_test(self):
+        """The cache should be budgeted by tile size, not tile count"""
+        cache = TileCache(10 * TILE_SIZE)
+        cache.add(("osm", 15, 0, 0), "big tile", {"type": "normal"}, 8 * TILE_SIZE)
+        for y in range(1, 3):
+            add_tile(cache, ("osm", 15, 0, y))
+        self.assertEqual(len(cache), 3)
+        # adding one more small tile evicts the big one
+        add_tile(cache, ("osm", 15, 0, 3))
+        self.assertNotIn(("osm", 15, 0, 0), cache)
+        self.assertEqual(cache.size, 3 * TILE_SIZE)
+        # a single tile bigger than the budget is still kept
+        cache.add(("osm", 15, 0, 4), "huge tile", {"type": "normal"}, 20 * TILE_SIZE)
+        self.assertEqual(len(cache), 1)
+        # replacing a tile should not leak its size
+        add_tile(cache, ("osm", 15, 0, 4))
+        add_tile(cache, ("osm", 15, 0, 4))
+        self.assertEqual(cache.size, TILE_SIZE)
+        # shrinking the budget evicts tiles right away
+        for y in range(5):
+            add_tile(cache, ("osm", 16, 0, y))
+        cache.maxSize = 2 * TILE_SIZE
+        self.assertEqual(len(cache), 2)
+
+    def remove_test(self):
+        """Tiles should be removable one by one and by type"""
+        cache = TileCache(100 * TILE_SIZE)
+        for layer in ("osm", "cycle"):
+            for y in range(10):
+                add_tile(cache, (layer, 15, 0, y), tile_type="normal" if y % 2 else "loadingTile")
+        self.assertTrue(cache.remove(("osm", 15, 0, 0)))
+        self.assertFalse(cache.remove(("osm", 15, 0, 0)))
+        self.assertEqual(len(cache), 19)
+        self.assertEqual(cache.removeTypes(["loadingTile", "specialTile"]), 9)
+        self.assertEqual(cache.removeTypes(["loadingTile"]), 0)
+        self.assertEqual(cache.size, 10 * TILE_SIZE)
+        # replacing a tile moves it to the new type
+        add_tile(cache, ("osm", 15, 0, 1), tile_type="loadingTile")
+        self.assertEqual(cache.removeTypes(["normal"]), 9)
+        self.assertEqual(cache.removeTypes(["loadingTile"]), 1)
+        # removed types can be cached again
+        add_tile(cache, ("osm", 15, 0, 0), tile_type="loadingTile")
+        self.assertEqual(cache.removeTypes(["loadingTile"]), 1)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
+        self.assertIsNone(cache.get(("cycle", 15, 0, 1)))
+
+    def decoded_size_test(self):
+        """Raw tile data should be sized by length, other items as decoded tiles"""
+        self.assertEqual(decodedSize(b"12345"), 5)
+        self.assertEqual(decodedSize(object()), DECODED_TILE_SIZE)
+
+    def expiry_test(self):
+        """Tiles with an expire timestamp should be dropped once they expire"""
+        now = [1000.0]
+        cache = TileCache(10 * TILE_SIZE, clock=lambda: now[0])
+        cache.add(("osm", 15, 0, 0), "error tile", {"type": "error", "expireTimestamp": 1010.0}, TILE_SIZE)
+        add_tile(cache, ("osm", 15, 0, 1))
+        self.assertIsNotNone(cache.get(("osm", 15, 0, 0)))
+        now[0] = 1010.0
+        self.assertIsNone(cache.get(("osm", 15, 0, 0)))
+        self.assertNotIn(("osm", 15, 0, 0), cache)
+        self.assertIsNotNone(cache.get(("osm", 15, 0, 1)))
+        self.assertEqual(cache.size, TILE_SIZE)
@@ -0,0 +1,164 @@
+"""Tile download scheduling benchmark
+
+Replays pan sequences against a local tile server stub and measures
+how long it takes for the final viewport to be completely downloaded
+once panning stops, comparing the viewport ranked download queue
+with the previous LiFo download queue.
+
+Run from the modRana source folder:
+
+PYTHONPATH=core/bundle python -m tests.tile_download_benchmark
+"""
+from __future__ import print_function
+import threading
+import time
+import logging
+
+try:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler
+except ImportError:  # Python 3
+    from http.server import BaseHTTPRequestHandler
+
+import urllib3
+
+from core import constants
+from core import threads
+from core.pool import LifoThreadPool, PriorityThreadPool
+from core.tile_scheduler import ViewportTileScheduler
+from tests.negative_cache_tests import ThreadingHTTPServer, PNG_HEADER
+
+# how long the tile server stub takes to answer a request
+TILE_LATENCY = 0.05  # in seconds
+FRAME_INTERVAL = 0.04  # in seconds
+# visible area in tiles (a 1920x1080 screen)
+VIEWPORT_HALF_WIDTH = 4.0
+VIEWPORT_HALF_HEIGHT = 2.5
+LAYER = "osm"
+
+def _pan(z, startX, startY, dx, dy, frames):
+    return [(z, startX + dx * i, startY + dy * i) for i in range(frames)]
+
+# recorded pan sequences as (z, viewport centre x, viewport centre y) per frame
+PAN_SEQUENCES = {
+    "slow pan east": _pan(15, 17800.0, 11100.0, 0.25, 0.0, 30),
+    "fast fling north-west": _pan(15, 17800.0, 11100.0, -1.5, -1.0, 20),
+    "pan, zoom in & pan": _pan(14, 8900.0, 5550.0, 0.5, 0.0, 10) +
+                          _pan(15, 17810.0, 11100.0, 0.0, 0.5, 10),
+}
+
+
+class TileHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        time.sleep(TILE_LATENCY)
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(PNG_HEADER)))
+        self.end_headers()
+        self.wfile.write(PNG_HEADER)
+
+    def log_message(self, *args):
+        pass
+
+
+def _visibleTiles(z, centreX, centreY):
+    x1, x2 = int(centreX - VIEWPORT_HALF_WIDTH), int(centreX + VIEWPORT_HALF_WIDTH)
+    y1, y2 = int(centreY - VIEWPORT_HALF_HEIGHT), int(centreY + VIEWPORT_HALF_HEIGHT)
+    return [(LAYER, z, x, y) for x in range(x1, x2 + 1) for y in range(y1, y2 + 1)]
+
+
+class ReplayClient(object):
+    """Requests visible tiles the same way the map screen does"""
+
+    def __init__(self, port, ranked):
+        self._connPool = urllib3.connection_from_url("http://127.0.0.1:%d" % port,
+                                                     maxsize=constants.DEFAULT_THREAD_COUNT_AUTOMATIC_TILE_DOWNLOAD,
+                                                     block=False)
+        self._lock = threading.Lock()
+        self.requested = set()
+        self.downloaded = set()
+        self._scheduler = None
+        taskBufferSize = constants.DEFAULT_AUTOMATIC_TILE_DOWNLOAD_QUEUE_SIZE
+        maxThreads = constants.DEFAULT_THREAD_COUNT_AUTOMATIC_TILE_DOWNLOAD
+        if ranked:
+            self._scheduler = ViewportTileScheduler()
+            self._pool = PriorityThreadPool(maxThreads,
+                                            rankFunction=lambda lzxy, timestamp: self._scheduler.rank(lzxy, timestamp),
+                                            taskBufferSize=taskBufferSize, leak=True)
+        else:
+            self._pool = LifoThreadPool(maxThreads, taskBufferSize=taskBufferSize, leak=True)
+
+    def _download(self, lzxy, timestamp):
+        _layer, z, x, y = lzxy
+        self._connPool.request("GET", "/%d/%d/%d.png" % (z, x, y))
+        with self._lock:
+            self.downloaded.add(lzxy)
+
+    def _dropped(self, lzxy):
+        # dropped requests are made again once the tile is visible
+        with self._lock:
+            self.requested.discard(lzxy)
+
+    def showViewport(self, z, centreX, centreY):
+        if self._scheduler is not None:
+            if self._scheduler.setViewport(z, centreX, centreY, VIEWPORT_HALF_WIDTH, VIEWPORT_HALF_HEIGHT):
+                for _fn, args, _kwargs in self._pool.rerank():
+                    self._dropped(args[0])
+        for lzxy in _visibleTiles(z, centreX, centreY):
+            with self._lock:
+                if lzxy in self.requested:
+                    continue
+                self.requested.add(lzxy)
+            leaked = self._pool.submit(self._download, lzxy, time.time())
+            if leaked:
+                self._dropped(leaked[1][0])
+
+    def shutdown(self):
+        self._pool.shutdown(now=True, asynchronous=False)
+
+
+def replay(port, ranked, frames):
+    """Replay a pan sequence
+
+    :returns: time to complete the final viewport & number of tiles downloaded
+    """
+    client = ReplayClient(port, ranked)
+    try:
+        for z, centreX, centreY in frames:
+            client.showViewport(z, centreX, centreY)
+            time.sleep(FRAME_INTERVAL)
+        panEnd = time.time()
+        finalTiles = set(_visibleTiles(*frames[-1]))
+        while True:
+            with client._lock:
+                if finalTiles <= client.downloaded:
+                    break
+            # keep redrawing the final viewport, like the map screen does
+            client.showViewport(*frames[-1])
+            time.sleep(0.005)
+        return time.time() - panEnd, len(client.downloaded)
+    finally:
+        client.shutdown()
+
+
+def main():
+    # thread & connection pool debug messages would drown the results
+    logging.getLogger().setLevel(logging.WARNING)
+    threads.initThreading()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), TileHandler)
+    serverThread = threading.Thread(target=server.serve_forever)
+    serverThread.daemon = True
+    serverThread.start()
+    try:
+        for label, frames in sorted(PAN_SEQUENCES.items()):
+            print("# %s (%d frames) #" % (label, len(frames)))
+            for queueLabel, ranked in (("LiFo queue", False), ("viewport ranked queue", True)):
+                completeTime, downloaded = replay(server.server_port, ranked, frames)
+                print("%1.0f ms to complete the final viewport, %d tiles downloaded - %s" % (
+                    completeTime * 1000, downloaded, queueLabel))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
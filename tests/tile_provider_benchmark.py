@@ -0,0 +1,104 @@
+"""Qt 5 tile image provider benchmarks
+
+Replays the tile ids a pinch map requests while being panned back & forth
+over a stored area - each tile that scrolls into view is first checked
+for availability and then loaded by the image provider.
+
+Compares the previous image provider, that parsed every tile id, looked up its layer,
+went to the tile storage twice for every tile & copied the tile data, with cached
+tile id parsing & tile data.
+
+Run from the modRana source folder:
+
+PYTHONPATH=core/bundle python -m tests.tile_provider_benchmark
+"""
+from __future__ import print_function
+import tempfile
+import shutil
+import time
+
+from core.tile_provider import TileIdParser, TileDataCache
+from core.tile_storage.sqlite_store import SqliteTileStore
+from tests.tile_storage_tests import LAYER, make_tile_data
+
+# a 1920x1080 screen with one tile of margin on each side
+VIEWPORT_WIDTH = 10
+VIEWPORT_HEIGHT = 7
+STORED_AREA_SIZE = 40
+ZOOM = 15
+# how many times to pan over the area & back
+PAN_COUNT = 10
+LAYER_ID = "mapnik"
+
+
+def getLayerById(layerId):
+    return LAYER if layerId == LAYER_ID else None
+
+
+def _tileIds():
+    """Tile ids scrolling into view as the map is panned right & back left"""
+    positions = list(range(0, STORED_AREA_SIZE - VIEWPORT_WIDTH))
+    visible = set()
+    tileIds = []
+    for _i in range(PAN_COUNT):
+        for offset in positions + positions[::-1]:
+            viewport = set((x, y) for x in range(offset, offset + VIEWPORT_WIDTH)
+                           for y in range(VIEWPORT_HEIGHT))
+            tileIds.extend("map1/%s/%d/%d/%d" % (LAYER_ID, ZOOM, x, y) for x, y in sorted(viewport - visible))
+            visible = viewport
+    return tileIds
+
+
+def oldProvider(store, tileIds):
+    for tileId in tileIds:
+        # availability check
+        split = tileId.split("/")
+        lzxy = (getLayerById(split[1]), int(split[2]), int(split[3]), int(split[4]))
+        if store.tile_is_stored(lzxy):
+            # image provider
+            split = tileId.split("/")
+            lzxy = (getLayerById(split[1]), int(split[2]), int(split[3]), int(split[4]))
+            bytearray(store.get_tile(lzxy)[0])
+
+
+def newProvider(store, tileIds):
+    tileIdParser = TileIdParser(getLayerById)
+    tileData = TileDataCache()
+    for tileId in tileIds:
+        # availability check
+        lzxy = tileIdParser.lzxy(tileId)
+        if lzxy in tileData or store.tile_is_stored(lzxy):
+            # image provider
+            lzxy = tileIdParser.lzxy(tileId)
+            data = tileData.get(lzxy)
+            if data is None:
+                tileData.add(lzxy, store.get_tile(lzxy)[0])
+
+
+def _run(label, function, tileIds):
+    start = time.time()
+    function(tileIds)
+    print("%1.2f us per tile - %s" % (1000000 * (time.time() - start) / len(tileIds), label))
+
+
+def main():
+    store_path = tempfile.mkdtemp(prefix="modrana_tile_provider_benchmark")
+    try:
+        store = SqliteTileStore(store_path)
+        for x in range(STORED_AREA_SIZE):
+            for y in range(VIEWPORT_HEIGHT):
+                store.store_tile_data((LAYER, ZOOM, x, y), make_tile_data(ZOOM, x, y))
+        store.flush()
+        tileIds = _tileIds()
+        print("%d tile requests, %d distinct tiles" % (len(tileIds), len(set(tileIds))))
+        _run("parsing every tile id & loading every tile from storage",
+             lambda tileIds: oldProvider(store, tileIds), tileIds)
+        _run("cached tile id parsing & tile data",
+             lambda tileIds: newProvider(store, tileIds), tileIds)
+        store.close()
+    finally:
+        shutil.rmtree(store_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import unittest
+import threading
+
+import time
+
+from core.tile_provider import parseTileId, imageData, TileIdParser, TileDataCache, NotificationCoalescer
+from tests.tile_storage_tests import make_tile_data
+
+
+class FakeLayers(object):
+
+    def __init__(self, layerIds):
+        self.layers = dict((layerId, object()) for layerId in layerIds)
+        self.lookups = []
+
+    def getLayerById(self, layerId):
+        self.lookups.append(layerId)
+        return self.layers.get(layerId)
+
+
+class TileProviderTests(unittest.TestCase):
+
+    def parse_test(self):
+        self.assertEqual(parseTileId("map1/mapnik/15/17800/11200"), ("map1", "mapnik", 15, 17800, 11200))
+        self.assertRaises(ValueError, parseTileId, "map1/mapnik/15/17800")
+        self.assertRaises(ValueError, parseTileId, "map1/mapnik/a/b/c")
+
+    def image_data_test(self):
+        data = make_tile_data(15, 1, 2)
+        self.assertEqual(bytes(imageData(data)), data)
+        self.assertEqual(bytes(imageData(memoryview(data))), data)
+        array = bytearray(data)
+        self.assertIs(imageData(array), array)
+
+    def id_parser_test(self):
+        layers = FakeLayers(["mapnik"])
+        parser = TileIdParser(layers.getLayerById, maxSize=2)
+        mapnik = layers.layers["mapnik"]
+        self.assertEqual(parser.lzxy("map1/mapnik/3/1/2"), (mapnik, 3, 1, 2))
+        self.assertEqual(parser.lzxy("map1/mapnik/3/1/2"), (mapnik, 3, 1, 2))
+        self.assertEqual(layers.lookups, ["mapnik"])
+        # the least recently used id is forgotten
+        parser.lzxy("map1/mapnik/3/1/3")
+        parser.lzxy("map1/mapnik/3/1/2")
+        parser.lzxy("map1/mapnik/3/1/4")
+        self.assertEqual(len(parser), 2)
+        parser.lzxy("map1/mapnik/3/1/2")
+        self.assertEqual(len(layers.lookups), 3)
+        parser.lzxy("map1/mapnik/3/1/3")
+        self.assertEqual(len(layers.lookups), 4)
+        # unknown layers are looked up again next time
+        self.assertEqual(parser.lzxy("map1/unknown/3/1/2"), (None, 3, 1, 2))
+        layers.layers["unknown"] = object()
+        self.assertEqual(parser.lzxy("map1/unknown/3/1/2"), (layers.layers["unknown"], 3, 1, 2))
+        parser.clear()
+        self.assertEqual(len(parser), 0)
+        self.assertRaises(ValueError, parser.lzxy, "mapnik/3/1/2")
+
+    def data_cache_test(self):
+        tileSize = len(make_tile_data(15, 10, 10))
+        cache = TileDataCache(maxSize=3 * tileSize)
+        for x in range(10, 14):
+            cached = cache.add(("mapnik", 15, x, 10), make_tile_data(15, x, 10))
+            self.assertEqual(cache.get(("mapnik", 15, x, 10)), cached)
+        self.assertEqual(len(cache), 3)
+        self.assertIsNone(cache.get(("mapnik", 15, 10, 10)))
+        self.assertIn(("mapnik", 15, 13, 10), cache)
+        self.assertEqual(bytes(cache.get(("mapnik", 15, 11, 10))), make_tile_data(15, 11, 10))
+        cache.remove(("mapnik", 15, 11, 10))
+        self.assertNotIn(("mapnik", 15, 11, 10), cache)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def concurrent_test(self):
+        """Image providers are called from multiple threads"""
+        layers = FakeLayers(["mapnik"])
+        parser = TileIdParser(layers.getLayerById, maxSize=50)
+        cache = TileDataCache(maxSize=50 * len(make_tile_data(15, 10, 10)))
+        errors = []
+
+        def provider(offset):
+            try:
+                for i in range(2000):
+                    x = (offset + i) % 100
+                    lzxy = parser.lzxy("map1/mapnik/15/%d/10" % x)
+                    data = cache.get(lzxy)
+                    if data is None:
+                        data = cache.add(lzxy, make_tile_data(15, x, 10))
+                    if bytes(data) != make_tile_data(15, x, 10):
+                        errors.append(lzxy)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=provider, args=(offset,)) for offset in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertTrue(len(parser) <= 50)
+
+    def coalescer_test(self):
+        sent = []
+
+        def send(key, notifications):
+            sent.append((key, notifications))
+            if key == "broken":
+                raise Exception("sending failed")
+
+        coalescer = NotificationCoalescer(send, window=0.02)
+        coalescer.add("map1", 1)
+        coalescer.add("broken", 2)
+        coalescer.add("map0", 3)
+        coalescer.add("map1", 4)
+        self.assertEqual(sent, [])
+        time.sleep(0.1)
+        # one batch per key, in the order the keys showed up
+        self.assertEqual(sent, [("map1", [1, 4]), ("broken", [2]), ("map0", [3])])
+        # a failed send doesn't break the coalescer
+        coalescer.add("map0", 5)
+        coalescer.flush()
+        self.assertEqual(sent[-1], ("map0", [5]))
+        coalescer.flush()
+        self.assertEqual(len(sent), 4)
+
+    def concurrent_coalescer_test(self):
+        sent = []
+        coalescer = NotificationCoalescer(lambda key, notifications: sent.append((key, notifications)),
+                                          window=0.001)
+
+        def notify(i):
+            for j in range(200):
+                coalescer.add("map%d" % (i % 2), (i, j))
+
+        threads = [threading.Thread(target=notify, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        coalescer.flush()
+        notifications = {"map0": [], "map1": []}
+        for key, batch in sent:
+            notifications[key].extend(batch)
+        # nothing is lost & notifications from each thread are kept in order
+        for i in range(4):
+            fromThread = [j for k, j in notifications["map%d" % (i % 2)] if k == i]
+            self.assertEqual(fromThread, list(range(200)))
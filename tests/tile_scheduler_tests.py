@@ -0,0 +1,122 @@
+import unittest
+import threading
+import time
+
+from core.tile_scheduler import ViewportTileScheduler
+from core.queues import RankedQueue
+from core.pool import PriorityThreadPool
+from core import threads
+
+
+class ViewportTileSchedulerTests(unittest.TestCase):
+
+    def viewport_ranking_test(self):
+        """Tiles closer to the viewport centre and on the viewport zoom level should come first"""
+        scheduler = ViewportTileScheduler(cancelMargin=2)
+        scheduler.setViewport(15, 100.0, 200.0, 2.0, 1.5)
+        centre = scheduler.rank(("osm", 15, 99, 199), 1)
+        edge = scheduler.rank(("osm", 15, 101, 200), 2)
+        outside = scheduler.rank(("osm", 15, 103, 200), 3)
+        other_zoom = scheduler.rank(("osm", 14, 50, 100), 4)
+        self.assertTrue(centre < edge < outside < other_zoom)
+        # tiles too far from the viewport are cancelled
+        self.assertIsNone(scheduler.rank(("osm", 15, 105, 200), 5))
+        self.assertIsNone(scheduler.rank(("osm", 16, 210, 400), 5))
+        # a lower zoom level tile covering the viewport is never cancelled
+        self.assertIsNotNone(scheduler.rank(("osm", 10, 3, 6), 5))
+        # with the same distance, newer requests come first
+        self.assertTrue(scheduler.rank(("osm", 15, 99, 199), 10) < centre)
+        # cancelling can be disabled
+        scheduler.cancelMargin = 0
+        self.assertIsNotNone(scheduler.rank(("osm", 15, 105, 200), 5))
+
+    def view_change_test(self):
+        """Only view changes that can change the ranking should be reported"""
+        scheduler = ViewportTileScheduler()
+        # without a viewport, tiles are ranked by zoom level & timestamp
+        self.assertTrue(scheduler.rank(("osm", 15, 0, 0), 2) < scheduler.rank(("osm", 15, 50, 50), 1))
+        self.assertTrue(scheduler.setZoom(15))
+        self.assertTrue(scheduler.rank(("osm", 15, 0, 0), 1) < scheduler.rank(("osm", 14, 0, 0), 2))
+        self.assertTrue(scheduler.setViewport(15, 100.2, 200.2, 2.0, 1.5))
+        # moving within a tile does not change the ranking enough to be worth re-ranking
+        self.assertFalse(scheduler.setViewport(15, 100.7, 200.3, 2.0, 1.5))
+        self.assertTrue(scheduler.setViewport(15, 101.1, 200.3, 2.0, 1.5))
+        # zooming keeps the viewport centre
+        self.assertFalse(scheduler.setZoom(15))
+        self.assertTrue(scheduler.setZoom(16))
+        self.assertEqual(scheduler.viewport, (16, 202.2, 400.6, 2.0, 1.5))
+
+
+class RankedQueueTests(unittest.TestCase):
+
+    def ranking_test(self):
+        """Items should be returned best rank first, leaked worst rank first & dropped on re-rank"""
+        ranks = {"a": (3,), "b": (1,), "c": (2,), "d": (4,)}
+        queue = RankedQueue(ranks.get, maxsize=3, leak=True)
+        for item in ("a", "b", "c"):
+            queue.put(item)
+        # the queue is full, so the worst ranked item leaks
+        self.assertEqual(queue.put("d"), "d")
+        ranks["e"] = (0,)
+        self.assertEqual(queue.put("e"), "a")
+        self.assertEqual(queue.get(), "e")
+        # re-rank with changed ranks
+        ranks["b"] = None
+        ranks["c"] = (0,)
+        self.assertEqual(queue.rerank(), ["b"])
+        self.assertEqual(queue.qsize(), 1)
+        self.assertEqual(queue.get(), "c")
+
+    def rerank_join_test(self):
+        """join() should return once all the remaining items are dropped on re-rank"""
+        ranks = {"a": (1,), "b": (2,)}
+        queue = RankedQueue(ranks.get)
+        queue.put("a")
+        queue.put("b")
+        self.assertEqual(queue.get(), "a")
+        queue.task_done()
+        joined = threading.Event()
+        thread = threading.Thread(target=lambda: (queue.join(), joined.set()))
+        thread.daemon = True
+        thread.start()
+        # let the thread start waiting
+        time.sleep(0.1)
+        self.assertFalse(joined.is_set())
+        ranks["b"] = None
+        self.assertEqual(queue.rerank(), ["b"])
+        self.assertTrue(joined.wait(5))
+
+
+class PriorityThreadPoolTests(unittest.TestCase):
+
+    def setUp(self):
+        if threads.threadMgr is None:
+            threads.initThreading()
+
+    def priority_test(self):
+        """Waiting tasks should be processed best rank first"""
+        blocker = threading.Event()
+        processed = []
+        done = threading.Event()
+
+        def task(rank):
+            if rank is None:
+                blocker.wait()
+            else:
+                processed.append(rank)
+                if len(processed) == 3:
+                    done.set()
+
+        pool = PriorityThreadPool(1, rankFunction=lambda rank: (rank,) if rank is not None else (-1,),
+                                  taskBufferSize=10)
+        try:
+            # block the only worker so that the other tasks wait in the queue
+            pool.submit(task, None)
+            for rank in (3, 1, 2):
+                pool.submit(task, rank)
+            blocker.set()
+            self.assertTrue(done.wait(5))
+            self.assertEqual(processed, [1, 2, 3])
+        finally:
+            blocker.set()
+            pool.shutdown(now=True, asynchronous=False)
@@ -0,0 +1,103 @@
+"""Batch area planning benchmarks
+
+Compares listing the tiles around a route on zoom levels 15-17
+using route rasterisation & tile sets with the previous implementation,
+that densified the route, listed tiles in a spiral around every route point
+& split them to other zoom levels one by one.
+
+Both a synthetic 500 km route & the bundled Znojmo - Brno track are used.
+
+Run from the modRana source folder:
+
+PYTHONPATH=core/bundle python -m tests.tile_set_benchmark
+"""
+from __future__ import print_function
+import math
+import time
+
+from core import geo
+from modules.mod_mapData.tile_set import tilesAroundRoute
+from tests.tile_set_tests import legacyRouteTiles, loadGpxPoints
+
+ROUTE_LENGTH = 500  # km
+# distance between route points
+POINT_DISTANCE = 0.1  # km
+MIN_Z = 15
+MID_Z = 15
+MAX_Z = 17
+RADIUS = 4  # in tiles, the default download size
+
+
+def _route():
+    """A wiggly route going north east from Brno"""
+    lat, lon = 49.19, 16.61
+    points = [(lat, lon)]
+    travelled = 0
+    i = 0
+    while travelled < ROUTE_LENGTH:
+        bearing = math.radians(45 + 40 * math.sin(i / 50.0))
+        lat += POINT_DISTANCE * math.cos(bearing) / 111.2
+        lon += POINT_DISTANCE * math.sin(bearing) / (111.2 * math.cos(math.radians(lat)))
+        travelled += geo.distance(points[-1][0], points[-1][1], lat, lon)
+        points.append((lat, lon))
+        i += 1
+    return points
+
+
+def addOtherZoomlevels(tiles, tilesZ, maxZ, minZ):
+    """The previous way of extending tiles to other zoom levels"""
+    extendedTiles = tiles.copy()
+    previousZoomlevelTiles = tiles.copy()
+    for z in range(tilesZ, maxZ):
+        newTilesFromSplit = set()
+        for tile in previousZoomlevelTiles:
+            x = tile[0]
+            y = tile[1]
+            newTilesFromSplit.add((2 * x, 2 * y, z + 1))
+            newTilesFromSplit.add((2 * x + 1, 2 * y, z + 1))
+            newTilesFromSplit.add((2 * x, 2 * y + 1, z + 1))
+            newTilesFromSplit.add((2 * x + 1, 2 * y + 1, z + 1))
+        extendedTiles.update(newTilesFromSplit)
+        previousZoomlevelTiles = newTilesFromSplit
+    previousZoomlevelTiles = tiles.copy()
+    for z in reversed(range(minZ, tilesZ)):
+        newTilesFromRounding = set()
+        for tile in previousZoomlevelTiles:
+            newTilesFromRounding.add((int(tile[0] / 2.0), int(tile[1] / 2.0), z))
+        extendedTiles.update(newTilesFromRounding)
+        previousZoomlevelTiles = newTilesFromRounding
+    return extendedTiles
+
+
+def oldPlanning(route):
+    return addOtherZoomlevels(legacyRouteTiles(route, RADIUS, MID_Z), MID_Z, MAX_Z, MIN_Z)
+
+
+def newPlanning(route):
+    return tilesAroundRoute(route, RADIUS, MID_Z).withZoomLevels(MIN_Z, MAX_Z)
+
+
+def _run(label, function):
+    start = time.time()
+    result = function()
+    print("%8.1f ms - %s" % (1000 * (time.time() - start), label))
+    return result
+
+
+def route_benchmark(label, route):
+    print("%s with %d points, radius %d tiles, zoom levels %d-%d" %
+          (label, len(route), RADIUS, MIN_Z, MAX_Z))
+    oldTiles = _run("old planning (densify, spiral & per-tile zoom extension)", lambda: oldPlanning(route))
+    tileSet = _run("route rasterisation & tile set planning", lambda: newPlanning(route))
+    count = _run("tile set count", lambda: len(tileSet))
+    _run("tile set listing", lambda: set(tileSet))
+    print("%d tiles (old), %d tiles (tile set)" % (len(oldTiles), count))
+
+
+def main():
+    route_benchmark("%d km synthetic route" % ROUTE_LENGTH, _route())
+    route_benchmark("Znojmo - Brno track", loadGpxPoints())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+import unittest
+import os
+import random
+from xml.etree import ElementTree
+
+from core import geo
+from core.tilenames import ll2xy, tileXY
+from modules.mod_mapData.tile_set import TileSet, tilesAroundRoute
+
+EXAMPLE_GPX_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "data", "tracklog_examples", "example_long_znojmo-brno.gpx")
+
+
+def loadGpxPoints(path=EXAMPLE_GPX_PATH):
+    """Load track points from a GPX file
+
+    :returns: list of (lat, lon) tuples
+    """
+    return [(float(element.get("lat")), float(element.get("lon")))
+            for element in ElementTree.parse(path).iter() if element.tag.endswith("trkpt")]
+
+
+def spiral(x, y, z, distance):
+    """The previous way of listing tiles around a point"""
+    (x, y) = (int(round(x)), int(round(y)))
+
+    class spiraller(object):
+        def __init__(self, x, y, z):
+            self.x = x
+            self.y = y
+            self.z = z
+            self.tiles = [(x, y, z)]
+
+        def moveX(self, dx, direction):
+            for i in range(dx):
+                self.x += direction
+                self.touch(self.x, self.y, self.z)
+
+        def moveY(self, dy, direction):
+            for i in range(dy):
+                self.y += direction
+                self.touch(self.x, self.y, self.z)
+
+        def touch(self, x, y, z):
+            self.tiles.append((x, y, z))
+
+    s = spiraller(x, y, z)
+    for d in range(1, distance + 1):
+        s.moveX(1, 1)
+        s.moveY(d * 2 - 1, -1)
+        s.moveX(d * 2, -1)
+        s.moveY(d * 2, 1)
+        s.moveX(d * 2, 1)
+    return s.tiles
+
+
+def addPointsToLine(lat1, lon1, lat2, lon2, maxDistance):
+    """The previous way of densifying routes"""
+    pointsBetween = []
+
+    def localAddPointsToLine(lat1, lon1, lat2, lon2, maxDistance):
+        distance = geo.distance(lat1, lon1, lat2, lon2)
+        if distance <= maxDistance:
+            return
+        else:
+            middleLat = (lat1 + lat2) / 2.0
+            middleLon = (lon1 + lon2) / 2.0
+            pointsBetween.append((middleLat, middleLon))
+            localAddPointsToLine(lat1, lon1, middleLat, middleLon, maxDistance)
+            localAddPointsToLine(middleLat, middleLon, lat2, lon2, maxDistance)
+
+    localAddPointsToLine(lat1, lon1, lat2, lon2, maxDistance)
+    return pointsBetween
+
+
+def legacyRouteTiles(route, radius, z):
+    """The previous way of listing tiles around a route - densify
+    the route & list tiles in a spiral around every point
+    """
+    route = list(route)
+    interpolatedPoints = []
+    for (lastLat, lastLon), (lat, lon) in zip(route, route[1:]):
+        if geo.distance(lastLat, lastLon, lat, lon) > radius:
+            interpolatedPoints.extend(addPointsToLine(lastLat, lastLon, lat, lon, radius))
+    tiles = set()
+    for lat, lon in route + interpolatedPoints:
+        (x, y) = ll2xy(lat, lon, z)
+        tiles.update(spiral(x, y, z, radius))
+    return tiles
+
+
+def naiveDilate(tiles, amount):
+    dilated = set()
+    for x, y, z in tiles:
+        maxCoordinate = 2 ** z - 1
+        for dx in range(-amount, amount + 1):
+            for dy in range(-amount, amount + 1):
+                if 0 <= x + dx <= maxCoordinate and 0 <= y + dy <= maxCoordinate:
+                    dilated.add((x + dx, y + dy, z))
+    return dilated
+
+
+def naiveProject(tiles, z):
+    projected = set()
+    for x, y, sourceZ in tiles:
+        if sourceZ <= z:
+            factor = 2 ** (z - sourceZ)
+            for dx in range(factor):
+                for dy in range(factor):
+                    projected.add((x * factor + dx, y * factor + dy, z))
+        else:
+            factor = 2 ** (sourceZ - z)
+            projected.add((x // factor, y // factor, z))
+    return projected
+
+
+class TileSetTests(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(0)
+        # a random walk, like the tiles along a route
+        self.tiles = set()
+        x, y = 1000, 1000
+        for _i in range(300):
+            x += rng.choice((-1, 0, 1, 1))
+            y += rng.choice((-1, 0, 1))
+            self.tiles.add((x, y, 12))
+        # some sparse tiles on another zoom level
+        self.tiles.update((rng.randrange(0, 2 ** 10), rng.randrange(0, 2 ** 10), 10) for _i in range(50))
+
+    def basic_test(self):
+        tileSet = TileSet(self.tiles)
+        self.assertEqual(len(tileSet), len(self.tiles))
+        self.assertEqual(set(tileSet), self.tiles)
+        self.assertEqual(len(list(tileSet)), len(self.tiles))
+        for tile in self.tiles:
+            self.assertIn(tile, tileSet)
+        self.assertNotIn((5000, 5000, 12), tileSet)
+        self.assertNotIn((1000, 1000, 13), tileSet)
+        self.assertEqual(tileSet.zoomLevels, [10, 12])
+        self.assertEqual(tileSet.count(10), len([t for t in self.tiles if t[2] == 10]))
+        self.assertFalse(TileSet())
+        self.assertTrue(tileSet)
+
+    def removal_test(self):
+        tileSet = TileSet(self.tiles)
+        remaining = set(self.tiles)
+        # the count is kept up to date while tiles are removed
+        self.assertEqual(len(tileSet), len(remaining))
+        for tile in list(remaining)[::3]:
+            tileSet.discard(tile)
+            remaining.discard(tile)
+        # discarding tiles not in the set does nothing
+        tileSet.discard((5000, 5000, 12))
+        tileSet.discard((1000, 1000, 13))
+        self.assertEqual(len(tileSet), len(remaining))
+        self.assertEqual(set(tileSet), remaining)
+        copy = tileSet.copy()
+        popped = set()
+        while tileSet:
+            popped.add(tileSet.pop())
+            self.assertEqual(len(tileSet), len(remaining) - len(popped))
+        self.assertEqual(popped, remaining)
+        self.assertRaises(KeyError, tileSet.pop)
+        # the copy is not affected
+        self.assertEqual(set(copy), remaining)
+        copy.clear()
+        self.assertEqual(len(copy), 0)
+        self.assertFalse(copy)
+
+    def union_test(self):
+        tiles = list(self.tiles)
+        first, second = TileSet(tiles[:200]), TileSet(tiles[150:])
+        union = first | second
+        self.assertEqual(set(union), self.tiles)
+        # the operands are not modified
+        self.assertEqual(set(first), set(tiles[:200]))
+        first.update(second)
+        self.assertEqual(set(first), self.tiles)
+        rectangle = TileSet()
+        rectangle.addRectangle(3, 1, 2, 4, 3)
+        rectangle.addRectangle(3, 3, 3, 6, 4)
+        expected = set((x, y, 3) for x in range(1, 5) for y in range(2, 4))
+        expected.update((x, y, 3) for x in range(3, 7) for y in range(3, 5))
+        self.assertEqual(set(rectangle), expected)
+        self.assertEqual(len(rectangle), len(expected))
+
+    def dilate_test(self):
+        tileSet = TileSet(self.tiles)
+        for amount in (0, 1, 4):
+            dilated = tileSet.dilated(amount)
+            expected = naiveDilate(self.tiles, amount)
+            self.assertEqual(len(dilated), len(expected))
+            self.assertEqual(set(dilated), expected)
+        # tiles are clipped on the edge of the world
+        corner = TileSet([(0, 0, 2), (3, 3, 2)]).dilated(1)
+        self.assertEqual(set(corner), naiveDilate([(0, 0, 2), (3, 3, 2)], 1))
+
+    def projection_test(self):
+        tileSet = TileSet(self.tiles)
+        for z in (8, 10, 11, 12, 14):
+            projected = tileSet.projected(z)
+            expected = naiveProject(self.tiles, z)
+            self.assertEqual(projected.zoomLevels, [z])
+            self.assertEqual(len(projected), len(expected))
+            self.assertEqual(set(projected), expected)
+        zoomRange = TileSet([(5, 7, 3)]).withZoomLevels(1, 5)
+        expected = set()
+        for z in range(1, 6):
+            expected.update(naiveProject([(5, 7, 3)], z))
+        self.assertEqual(set(zoomRange), expected)
+        self.assertEqual(len(zoomRange), 1 + 1 + 1 + 4 + 16)
+
+
+class RouteCorridorTests(unittest.TestCase):
+
+    def rasterize_test(self):
+        """Every tile the polyline passes through should be covered"""
+        points = [(10.5, 10.5), (14.2, 11.9), (14.2, 30.7), (3.9, 2.1), (3.95, 2.15)]
+        tileSet = TileSet.fromPolyline(points, 6)
+        expected = set()
+        for (x1, y1), (x2, y2) in zip(points, points[1:]):
+            steps = 10000
+            for i in range(steps + 1):
+                expected.add((int(x1 + (x2 - x1) * i / float(steps)),
+                              int(y1 + (y2 - y1) * i / float(steps)), 6))
+        self.assertTrue(expected <= set(tileSet))
+        # a supercover line is never more than two tiles thick
+        self.assertTrue(len(tileSet) <= 2 * len(expected))
+        self.assertEqual(set(TileSet.fromPolyline([(1.5, 2.5)], 3)), set([(1, 2, 3)]))
+        # clipped on the edge of the world
+        self.assertEqual(set(TileSet.fromPolyline([(-2.5, 0.5), (1.5, 0.5)], 1)), set([(0, 0, 1), (1, 0, 1)]))
+
+    def example_route_test(self):
+        """Coverage should match the previous algorithm on the example track"""
+        route = loadGpxPoints()
+        self.assertEqual(len(route), 364)
+        for radius in (1, 4):
+            corridor = tilesAroundRoute(route, radius, 15)
+            legacy = legacyRouteTiles(route, radius, 15)
+            # the tiles the track points are on and their surroundings are all covered
+            pointTiles = TileSet(tileXY(lat, lon, 15) + (15,) for lat, lon in route)
+            self.assertTrue(set(pointTiles.dilated(radius)) <= set(corridor))
+            # the previous algorithm rounded the point coordinates,
+            # so its tiles can be a tile off
+            self.assertTrue(legacy <= set(corridor.dilated(1)))
+            # it also left gaps between the densified points,
+            # that are covered now, but otherwise the coverage is the same
+            extraTiles = set(corridor) - set(TileSet(legacy).dilated(1))
+            self.assertTrue(len(extraTiles) < 0.01 * len(corridor))
+            self.assertTrue(abs(len(corridor) - len(legacy)) < 0.15 * len(legacy))
+
+    def gap_test(self):
+        """Points far apart should still get continuous coverage"""
+        route = [(48.85, 16.04), (49.20, 16.61)]
+        corridor = tilesAroundRoute(route, 2, 15)
+        for i in range(1001):
+            lat = route[0][0] + (route[1][0] - route[0][0]) * i / 1000.0
+            lon = route[0][1] + (route[1][1] - route[0][1]) * i / 1000.0
+            x, y = tileXY(lat, lon, 15)
+            self.assertIn((x, y, 15), corridor)
+            self.assertIn((x + 2, y - 2, 15), corridor)
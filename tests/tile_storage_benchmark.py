@@ -0,0 +1,68 @@
+"""Tile storage benchmarks
+
+Run from the modRana source folder:
+
+PYTHONPATH=core/bundle python -m tests.tile_storage_benchmark
+"""
+from __future__ import print_function
+import tempfile
+import shutil
+import time
+
+from core.tile_storage.sqlite_store import SqliteTileStore
+from core.tile_storage.files_store import FileBasedTileStore
+from tests.tile_storage_tests import LAYER, make_tile_data
+
+# a 1920x1080 screen with one tile of margin on each side
+VIEWPORT_WIDTH = 10
+VIEWPORT_HEIGHT = 7
+STORED_AREA_SIZE = 60
+ZOOM = 15
+REPEATS = 20
+
+def _fill_store(store):
+    for x in range(STORED_AREA_SIZE):
+        for y in range(STORED_AREA_SIZE):
+            store.store_tile_data((LAYER, ZOOM, x, y), make_tile_data(ZOOM, x, y))
+    store.flush()
+
+def _viewports():
+    """Viewports panning diagonally over the stored area & a bit past it"""
+    for offset in range(0, STORED_AREA_SIZE, 3):
+        yield [(LAYER, ZOOM, x, y) for x in range(offset, offset + VIEWPORT_WIDTH)
+                                    for y in range(offset, offset + VIEWPORT_HEIGHT)]
+
+def _run(label, function):
+    start = time.time()
+    for _i in range(REPEATS):
+        for viewport in _viewports():
+            function(viewport)
+    viewport_count = REPEATS * len(list(_viewports()))
+    print("%1.3f ms per viewport - %s" % (1000 * (time.time() - start) / viewport_count, label))
+
+def viewport_lookup_benchmark(store):
+    print("# %s #" % store)
+    print("%d tiles per viewport" % (VIEWPORT_WIDTH * VIEWPORT_HEIGHT))
+    # make sure both approaches give the same result
+    for viewport in _viewports():
+        per_tile = set(lzxy for lzxy in viewport if store.tile_is_stored(lzxy))
+        assert per_tile == set(store.tiles_stored(viewport).keys())
+        assert per_tile == set(store.get_tiles(viewport).keys())
+    _run("tile_is_stored() per tile", lambda viewport: [store.tile_is_stored(lzxy) for lzxy in viewport])
+    _run("tiles_stored() for the whole viewport", store.tiles_stored)
+    _run("get_tile() per tile", lambda viewport: [store.get_tile(lzxy) for lzxy in viewport])
+    _run("get_tiles() for the whole viewport", store.get_tiles)
+
+def main():
+    for store_class in (SqliteTileStore, FileBasedTileStore):
+        store_path = tempfile.mkdtemp(prefix="modrana_tile_store_benchmark")
+        try:
+            store = store_class(store_path)
+            _fill_store(store)
+            viewport_lookup_benchmark(store)
+            store.close()
+        finally:
+            shutil.rmtree(store_path)
+
+if __name__ == "__main__":
+    main()
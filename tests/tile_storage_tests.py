@@ -0,0 +1,463 @@
+import unittest
+import tempfile
+import shutil
+import os
+import sys
+import subprocess
+import threading
+import random
+import time
+
+import logging
+log = logging.getLogger("tests.tile_storage")
+
+from core.tile_storage.sqlite_store import SqliteTileStore
+from core.tile_storage.files_store import FileBasedTileStore
+from core.tile_storage.mbtiles_store import MBTilesStore, layer_to_metadata
+from core.tile_storage.exceptions import TileStoreReadOnly
+from core.tile_storage import convert
+import sqlite3
+
+# a minimal valid PNG header, so that the tile data is recognized as an image
+PNG_HEADER = b"\211PNG\r\n\032\n"
+
+class FakeLayer(object):
+    """Just the bits of MapLayer the tile stores actually use"""
+    type = "png"
+
+LAYER = FakeLayer()
+
+def make_tile_data(z, x, y):
+    return PNG_HEADER + ("%d/%d/%d" % (z, x, y)).encode("ascii")
+
+# stores tiles in a subprocess, flushes them and then "crashes"
+# without closing the store
+CRASHING_WRITER = """
+import os
+import sys
+sys.path = %(path)r
+from tests.tile_storage_tests import LAYER, make_tile_data
+from core.tile_storage.sqlite_store import SqliteTileStore
+store = SqliteTileStore(%(store_path)r, commit_interval=60)
+for x in range(%(flushed_count)d):
+    store.store_tile_data((LAYER, 15, x, 1), make_tile_data(15, x, 1))
+store.flush()
+for x in range(%(unflushed_count)d):
+    store.store_tile_data((LAYER, 16, x, 1), make_tile_data(16, x, 1))
+os._exit(1)
+"""
+
+def make_big_tile_data(z, x, y, size=4096):
+    """Tile data of the given size that does not compress well"""
+    return make_tile_data(z, x, y) + os.urandom(size)
+
+def check_bulk_lookup(test, store):
+    """Check bulk lookups on a store with tiles stored for
+    a 10x10 block at zoom 8 and a sparse diagonal at zoom 9
+    """
+    stored = [(LAYER, 8, x, y) for x in range(10) for y in range(10)]
+    stored.extend((LAYER, 9, i * 50, i * 50) for i in range(10))
+    missing = [(LAYER, 8, 100, 100), (LAYER, 9, 0, 50), (LAYER, 10, 1, 1)]
+    for lzxy in stored:
+        store.store_tile_data(lzxy, make_tile_data(*lzxy[1:]))
+    store.flush()
+    tiles = store.get_tiles(stored + missing)
+    test.assertEqual(set(tiles.keys()), set(stored))
+    for lzxy, (tile_data, _timestamp) in tiles.items():
+        test.assertEqual(tile_data, make_tile_data(*lzxy[1:]))
+    test.assertEqual(set(store.tiles_stored(stored + missing).keys()), set(stored))
+    sizes = store.get_tile_sizes(stored + missing)
+    test.assertEqual(sizes, dict((lzxy, len(make_tile_data(*lzxy[1:]))) for lzxy in stored))
+    test.assertEqual(store.get_tiles([]), {})
+    test.assertEqual(store.tiles_stored(missing), {})
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+class SqliteTileStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.store_path = tempfile.mkdtemp(prefix="modrana_tile_store_test")
+
+    def tearDown(self):
+        shutil.rmtree(self.store_path)
+
+    def store_and_read_test(self):
+        """Test if tiles are readable before and after they are written."""
+        store = SqliteTileStore(self.store_path, commit_interval=60)
+        lzxy = (LAYER, 10, 20, 30)
+        store.store_tile_data(lzxy, make_tile_data(10, 20, 30))
+        # the tile should be readable while still waiting in the queue
+        tile_data, _timestamp = store.get_tile(lzxy)
+        self.assertEqual(tile_data, make_tile_data(10, 20, 30))
+        self.assertTrue(store.tile_is_stored(lzxy))
+        # and also once it has been written
+        store.flush()
+        tile_data, _timestamp = store.get_tile(lzxy)
+        self.assertEqual(tile_data, make_tile_data(10, 20, 30))
+        self.assertTrue(store.tile_is_stored(lzxy))
+        self.assertIsNone(store.get_tile((LAYER, 10, 20, 31)))
+        self.assertFalse(store.tile_is_stored((LAYER, 10, 20, 31)))
+        # replacing a tile should work as well
+        store.store_tile_data(lzxy, make_tile_data(1, 1, 1))
+        store.flush()
+        tile_data, _timestamp = store.get_tile(lzxy)
+        self.assertEqual(tile_data, make_tile_data(1, 1, 1))
+        # and deleting it
+        store.delete_tile(lzxy)
+        self.assertIsNone(store.get_tile(lzxy))
+        store.close()
+
+    def batch_commit_test(self):
+        """Test if a full batch is committed without waiting for flush."""
+        store = SqliteTileStore(self.store_path, commit_interval=60, commit_batch_size=10)
+        for x in range(25):
+            store.store_tile_data((LAYER, 12, x, 0), make_tile_data(12, x, 0))
+        # close drains the queue
+        store.close()
+        store = SqliteTileStore(self.store_path)
+        for x in range(25):
+            tile_data, _timestamp = store.get_tile((LAYER, 12, x, 0))
+            self.assertEqual(tile_data, make_tile_data(12, x, 0))
+        store.close()
+
+    def crash_durability_test(self):
+        """Test that flushed tiles survive a crash and the store stays consistent."""
+        flushed_count = 200
+        unflushed_count = 30
+        script = CRASHING_WRITER % {"path": sys.path,
+                                    "store_path": self.store_path,
+                                    "flushed_count": flushed_count,
+                                    "unflushed_count": unflushed_count}
+        return_code = subprocess.call([sys.executable, "-c", script], cwd=os.getcwd())
+        self.assertEqual(return_code, 1)
+        store = SqliteTileStore(self.store_path)
+        # all flushed tiles need to be there
+        for x in range(flushed_count):
+            tile_data, _timestamp = store.get_tile((LAYER, 15, x, 1))
+            self.assertEqual(tile_data, make_tile_data(15, x, 1))
+        # tiles that were not flushed might have been lost, but the lookup
+        # database must never point to a tile that is missing from the store
+        for x in range(unflushed_count):
+            lzxy = (LAYER, 16, x, 1)
+            if store.tile_is_stored(lzxy):
+                tile_data, _timestamp = store.get_tile(lzxy)
+                self.assertEqual(tile_data, make_tile_data(16, x, 1))
+        store.close()
+
+    def bulk_lookup_test(self):
+        """Test bulk tile lookups."""
+        store = SqliteTileStore(self.store_path, commit_interval=60)
+        check_bulk_lookup(self, store)
+        # tiles waiting in the write queue should be found as well
+        lzxy = (LAYER, 3, 2, 1)
+        store.store_tile_data(lzxy, make_tile_data(3, 2, 1))
+        self.assertEqual(store.get_tiles([lzxy])[lzxy][0], make_tile_data(3, 2, 1))
+        self.assertIn(lzxy, store.tiles_stored([lzxy, (LAYER, 3, 2, 2)]))
+        self.assertEqual(store.get_tile_sizes([lzxy]), {lzxy: len(make_tile_data(3, 2, 1))})
+        store.close()
+
+    def eviction_test(self):
+        """Test that the store is shrunk to the size limit, evicting least recently used tiles."""
+        store = SqliteTileStore(self.store_path, commit_interval=60)
+        for x in range(300):
+            store.store_tile_data((LAYER, 15, x, 0), make_big_tile_data(15, x, 0))
+        store.flush()
+        # make the tiles look like they have been stored at different times,
+        # with the x coordinate giving the order
+        connection = sqlite3.connect(os.path.join(self.store_path, "lookup.sqlite"))
+        connection.execute("update access set unix_epoch_timestamp=1000+x")
+        connection.commit()
+        connection.close()
+        # the oldest tiles have been used recently
+        recently_used = [(LAYER, 15, x, 0) for x in range(10)]
+        for lzxy in recently_used:
+            self.assertIsNotNone(store.get_tile(lzxy))
+        size_before = store.get_size()
+        self.assertGreater(size_before, 300 * 4096)
+        max_size = 150 * 4096
+        removed = store.evict(max_size)
+        self.assertGreater(removed, 0)
+        self.assertLessEqual(store.get_size(), max_size)
+        # the database files should shrink as well
+        self.assertLess(sum(os.path.getsize(os.path.join(self.store_path, name))
+                            for name in os.listdir(self.store_path)), size_before)
+        stored = store.tiles_stored((LAYER, 15, x, 0) for x in range(300))
+        # recently used and recently stored tiles should be kept
+        for lzxy in recently_used:
+            self.assertIn(lzxy, stored)
+        self.assertIn((LAYER, 15, 299, 0), stored)
+        # and least recently used ones evicted
+        self.assertNotIn((LAYER, 15, 10, 0), stored)
+        self.assertEqual(len(stored), 300 - removed)
+        # nothing should be removed if the store is small enough
+        self.assertEqual(store.evict(max_size), 0)
+        store.close()
+
+    def legacy_eviction_test(self):
+        """Test eviction from databases created without incremental vacuum."""
+        store = SqliteTileStore(self.store_path, commit_interval=60)
+        for x in range(300):
+            store.store_tile_data((LAYER, 15, x, 0), make_big_tile_data(15, x, 0))
+        store.close()
+        # stores created by older modRana versions don't use incremental vacuum
+        # and have no access times
+        for name in os.listdir(self.store_path):
+            if name.endswith(".sqlite") or name[-1].isdigit():
+                connection = sqlite3.connect(os.path.join(self.store_path, name))
+                if name == "lookup.sqlite":
+                    connection.execute("drop table access")
+                    connection.commit()
+                connection.execute("PRAGMA auto_vacuum=NONE")
+                connection.execute("VACUUM")
+                connection.close()
+        store = SqliteTileStore(self.store_path, commit_interval=60)
+        max_size = 150 * 4096
+        removed = store.evict(max_size)
+        self.assertGreater(removed, 0)
+        # the files are not compacted, but the free pages are not counted
+        self.assertLessEqual(store.get_size(), max_size)
+        self.assertEqual(store.evict(max_size), 0)
+        self.assertEqual(len(store.tiles_stored((LAYER, 15, x, 0) for x in range(300))), 300 - removed)
+        store.close()
+
+    def access_times_test(self):
+        """Test that access times are written for a store that is only being read."""
+        store = SqliteTileStore(self.store_path, commit_interval=1)
+        store.store_tile_data((LAYER, 15, 1, 0), make_tile_data(15, 1, 0))
+        store.flush()
+        self.assertIsNotNone(store.get_tile((LAYER, 15, 1, 0)))
+        connection = sqlite3.connect(os.path.join(self.store_path, "lookup.sqlite"))
+        deadline = time.time() + 10
+        rows = []
+        while not rows and time.time() < deadline:
+            time.sleep(0.1)
+            rows = connection.execute("select z, x, y from access").fetchall()
+        connection.close()
+        self.assertEqual(rows, [(15, 1, 0)])
+        store.close()
+
+    def clear_test(self):
+        """Test that the store can be used after it has been cleared."""
+        store = SqliteTileStore(self.store_path, commit_interval=60)
+        store.store_tile_data((LAYER, 1, 1, 1), make_tile_data(1, 1, 1))
+        store.flush()
+        store.clear()
+        self.assertIsNone(store.get_tile((LAYER, 1, 1, 1)))
+        store.store_tile_data((LAYER, 2, 2, 2), make_tile_data(2, 2, 2))
+        store.flush()
+        self.assertTrue(SqliteTileStore.is_store(self.store_path))
+        self.assertEqual(store.get_tile((LAYER, 2, 2, 2))[0], make_tile_data(2, 2, 2))
+        store.close()
+        store = SqliteTileStore(self.store_path)
+        self.assertEqual(store.get_tile((LAYER, 2, 2, 2))[0], make_tile_data(2, 2, 2))
+        self.assertIsNone(store.get_tile((LAYER, 1, 1, 1)))
+        store.close()
+
+    def concurrent_access_stress_test(self):
+        """Test concurrent readers and writers don't run into locked database errors."""
+        store = SqliteTileStore(self.store_path, commit_interval=0.05, commit_batch_size=20)
+        tile_count = 2000
+        errors = []
+        latencies = []
+        latencies_lock = threading.Lock()
+        writers_done = threading.Event()
+
+        def write(offset, step):
+            try:
+                for x in range(offset, tile_count, step):
+                    store.store_tile_data((LAYER, 14, x, 7), make_tile_data(14, x, 7))
+                    if x % 100 == 0:
+                        store.flush()
+            except Exception as e:
+                errors.append(e)
+
+        def read():
+            thread_latencies = []
+            try:
+                while not writers_done.is_set():
+                    x = random.randrange(tile_count)
+                    start = time.time()
+                    tile_tuple = store.get_tile((LAYER, 14, x, 7))
+                    store.tile_is_stored((LAYER, 14, x, 7))
+                    thread_latencies.append(time.time() - start)
+                    if tile_tuple is not None:
+                        self.assertEqual(tile_tuple[0], make_tile_data(14, x, 7))
+            except Exception as e:
+                errors.append(e)
+            with latencies_lock:
+                latencies.extend(thread_latencies)
+
+        writers = [threading.Thread(target=write, args=(i, 3)) for i in range(3)]
+        readers = [threading.Thread(target=read) for _i in range(6)]
+        for thread in readers + writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        store.flush()
+        writers_done.set()
+        for thread in readers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        for x in range(tile_count):
+            self.assertTrue(store.tile_is_stored((LAYER, 14, x, 7)))
+        store.close()
+
+        latencies.sort()
+        self.assertTrue(latencies)
+        log.info("%d concurrent reads, latency p50: %.3f ms, p90: %.3f ms, p99: %.3f ms, max: %.3f ms",
+                 len(latencies),
+                 percentile(latencies, 0.5) * 1000,
+                 percentile(latencies, 0.9) * 1000,
+                 percentile(latencies, 0.99) * 1000,
+                 latencies[-1] * 1000)
+
+
+class FileBasedTileStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.store_path = tempfile.mkdtemp(prefix="modrana_tile_store_test")
+
+    def tearDown(self):
+        shutil.rmtree(self.store_path)
+
+    def bulk_lookup_test(self):
+        """Test bulk tile lookups."""
+        store = FileBasedTileStore(self.store_path)
+        check_bulk_lookup(self, store)
+        # a tile stored with different extension should be found by fuzzy matching
+        jpeg_tile_path = os.path.join(self.store_path, "8", "0", "20.jpg")
+        with open(jpeg_tile_path, "wb") as f:
+            f.write(make_tile_data(8, 0, 20))
+        lzxy = (LAYER, 8, 0, 20)
+        self.assertIn(lzxy, store.get_tiles([lzxy]))
+        self.assertIn(lzxy, store.tiles_stored([lzxy]))
+        self.assertEqual(store.get_tiles([lzxy], fuzzy_matching=False), {})
+        self.assertEqual(store.tiles_stored([lzxy], fuzzy_matching=False), {})
+
+    def eviction_test(self):
+        """Test that the store is shrunk to the size limit, evicting least recently used tiles."""
+        store = FileBasedTileStore(self.store_path)
+        for x in range(100):
+            lzxy = (LAYER, 15, x, 0)
+            store.store_tile_data(lzxy, make_big_tile_data(15, x, 0))
+            # make the tiles look like they have been accessed at different times
+            tile_path = os.path.join(self.store_path, "15", str(x), "0.png")
+            os.utime(tile_path, (1000 + x, os.path.getmtime(tile_path)))
+        recently_used = [(LAYER, 15, x, 0) for x in range(10)]
+        for lzxy in recently_used:
+            self.assertIsNotNone(store.get_tile(lzxy))
+        max_size = 50 * 4200
+        removed = store.evict(max_size)
+        self.assertGreater(removed, 0)
+        self.assertLessEqual(store.get_size(), max_size)
+        stored = store.tiles_stored((LAYER, 15, x, 0) for x in range(100))
+        for lzxy in recently_used:
+            self.assertIn(lzxy, stored)
+        self.assertIn((LAYER, 15, 99, 0), stored)
+        self.assertNotIn((LAYER, 15, 10, 0), stored)
+        # empty column folders should be removed
+        self.assertFalse(os.path.exists(os.path.join(self.store_path, "15", "10")))
+        self.assertEqual(store.evict(max_size), 0)
+
+
+class MapLayerStub(object):
+    config = {"attribution" : "Test attribution"}
+    label = "Test layer"
+    type = "png"
+    min_zoom = 2
+    max_zoom = 17
+
+
+class MBTilesStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.folder_path = tempfile.mkdtemp(prefix="modrana_tile_store_test")
+        self.store_path = os.path.join(self.folder_path, "test.mbtiles")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder_path)
+
+    def read_write_test(self):
+        """Test writing and reading a MBTiles file."""
+        store = MBTilesStore(self.store_path, read_only=False, metadata=layer_to_metadata(MapLayerStub()))
+        store.store_tile_data((LAYER, 3, 1, 2), make_tile_data(3, 1, 2))
+        store.close()
+        self.assertTrue(MBTilesStore.is_store(self.store_path))
+
+        # the y coordinate is flipped to the TMS tiling scheme
+        connection = sqlite3.connect(self.store_path)
+        rows = connection.execute("select zoom_level, tile_column, tile_row from tiles").fetchall()
+        self.assertEqual(rows, [(3, 1, 5)])
+        connection.close()
+
+        store = MBTilesStore(self.store_path)
+        tile_data, _timestamp = store.get_tile((LAYER, 3, 1, 2))
+        self.assertEqual(tile_data, make_tile_data(3, 1, 2))
+        self.assertTrue(store.tile_is_stored((LAYER, 3, 1, 2)))
+        self.assertIsNone(store.get_tile((LAYER, 3, 1, 5)))
+        self.assertFalse(store.tile_is_stored((LAYER, 3, 1, 5)))
+        self.assertEqual(list(store.iter_tiles())[0][0:4], (3, 1, 2, make_tile_data(3, 1, 2)))
+        # the store is read only by default
+        with self.assertRaises(TileStoreReadOnly):
+            store.store_tile_data((LAYER, 3, 1, 3), make_tile_data(3, 1, 3))
+        # metadata should be mapped to layer configuration
+        config = store.get_layer_config()
+        self.assertEqual(config["label"], "Test layer")
+        self.assertEqual(config["type"], "png")
+        self.assertEqual(config["min_zoom"], 2)
+        self.assertEqual(config["max_zoom"], 17)
+        self.assertEqual(config["folder_prefix"], os.path.basename(self.folder_path))
+        self.assertEqual(config["attribution"], "Test attribution")
+        # bounds are set from the stored tiles once the file is closed
+        west, south, east, north = map(float, store.metadata["bounds"].split(","))
+        self.assertAlmostEqual(west, -135.0)
+        self.assertAlmostEqual(south, 40.979898, places=5)
+        self.assertAlmostEqual(east, -90.0)
+        self.assertAlmostEqual(north, 66.513260, places=5)
+        store.close()
+
+    def zoom_metadata_test(self):
+        """Test that zoom range metadata is set once the tiles are written."""
+        store = MBTilesStore(self.store_path, read_only=False)
+        for z in range(4, 7):
+            store.store_tile_data((LAYER, z, 0, 0), make_tile_data(z, 0, 0))
+        store.close()
+        store = MBTilesStore(self.store_path)
+        metadata = store.metadata
+        self.assertEqual(metadata["format"], "png")
+        self.assertEqual(metadata["minzoom"], "4")
+        self.assertEqual(metadata["maxzoom"], "6")
+        store.close()
+
+    def conversion_test(self):
+        """Test converting tiles between sqlite, MBTiles and files stores."""
+        tiles = [(LAYER, z, x, y) for z in (5, 6) for x in range(4) for y in range(3)]
+        sqlite_path = os.path.join(self.folder_path, "sqlite")
+        sqlite_store = SqliteTileStore(sqlite_path)
+        for lzxy in tiles:
+            sqlite_store.store_tile_data(lzxy, make_tile_data(*lzxy[1:]))
+        sqlite_store.close()
+
+        self.assertEqual(convert.detect_store_type(sqlite_path), convert.STORE_TYPE_SQLITE)
+        source = convert.open_store(sqlite_path, convert.STORE_TYPE_SQLITE)
+        destination = convert.open_store(self.store_path, convert.STORE_TYPE_MBTILES, writable=True)
+        self.assertEqual(convert.convert(source, destination), len(tiles))
+        source.close()
+        destination.close()
+
+        files_path = os.path.join(self.folder_path, "files")
+        self.assertEqual(convert.detect_store_type(self.store_path), convert.STORE_TYPE_MBTILES)
+        source = convert.open_store(self.store_path, convert.STORE_TYPE_MBTILES)
+        destination = convert.open_store(files_path, convert.STORE_TYPE_FILES, writable=True)
+        self.assertEqual(convert.convert(source, destination), len(tiles))
+        source.close()
+        destination.close()
+
+        self.assertEqual(convert.detect_store_type(files_path), convert.STORE_TYPE_FILES)
+        files_store = FileBasedTileStore(files_path)
+        found_tiles = files_store.get_tiles(tiles)
+        self.assertEqual(len(found_tiles), len(tiles))
+        for lzxy, (tile_data, _timestamp) in found_tiles.items():
+            self.assertEqual(tile_data, make_tile_data(*lzxy[1:]))
@@ -0,0 +1,163 @@
+import unittest
+import threading
+import time
+from email.utils import formatdate
+
+try:  # Python 2
+    from httplib import HTTPConnection
+except ImportError:  # Python 3
+    from http.client import HTTPConnection
+
+from modules.mod_tileserver import TileServer, parseTilePath, TILE_MAX_AGE
+from tests.negative_cache_tests import PNG_HEADER
+
+TILE_TIMESTAMP = 1500000000
+JPEG_HEADER = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00"
+# how long a tile lookup takes in the load test
+LOOKUP_DELAY = 0.002  # in seconds
+CLIENT_COUNT = 8
+REQUESTS_PER_CLIENT = 50
+
+
+class CountingTileServer(TileServer):
+    """Counts accepted connections"""
+
+    def get_request(self):
+        request = TileServer.get_request(self)
+        with self.lock:
+            self.connectionCount += 1
+        return request
+
+
+class TileserverTests(unittest.TestCase):
+
+    def setUp(self):
+        self.lookups = []
+        self.lookupDelay = 0
+        self.server = CountingTileServer(("127.0.0.1", 0), self._getTile)
+        self.server.lock = threading.Lock()
+        self.server.connectionCount = 0
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _getTile(self, layerId, z, x, y):
+        self.lookups.append((layerId, z, x, y))
+        if self.lookupDelay:
+            time.sleep(self.lookupDelay)
+        if layerId == "missing":
+            return None
+        elif layerId == "photo":
+            return JPEG_HEADER, TILE_TIMESTAMP
+        else:
+            return PNG_HEADER + ("%d/%d/%d" % (z, x, y)).encode("ascii"), TILE_TIMESTAMP
+
+    def _connect(self):
+        return HTTPConnection("127.0.0.1", self.server.server_address[1], timeout=5)
+
+    def _request(self, connection, path, method="GET", headers=None):
+        connection.request(method, path, headers=headers or {})
+        response = connection.getresponse()
+        return response, response.read()
+
+    def parse_path_test(self):
+        self.assertEqual(parseTilePath("/mapnik/15/17800/11200.png"), ("mapnik", 15, 17800, 11200))
+        self.assertEqual(parseTilePath("/15/17800/11200"), (None, 15, 17800, 11200))
+        self.assertEqual(parseTilePath("/3/1/2.png?cache=1"), (None, 3, 1, 2))
+        # TMS numbers tile rows from the bottom
+        self.assertEqual(parseTilePath("/tms/3/1/2.png"), (None, 3, 1, 5))
+        self.assertEqual(parseTilePath("/tms/mapnik/0/0/0"), ("mapnik", 0, 0, 0))
+        self.assertIsNone(parseTilePath("/"))
+        self.assertIsNone(parseTilePath("/mapnik/a/b/c.png"))
+        self.assertIsNone(parseTilePath("/3/8/1.png"))
+        self.assertIsNone(parseTilePath("/1/2/3/4/5"))
+
+    def get_tile_test(self):
+        connection = self._connect()
+        response, data = self._request(connection, "/mapnik/3/1/2.png")
+        self.assertEqual(response.status, 200)
+        self.assertEqual(data, PNG_HEADER + b"3/1/2")
+        self.assertEqual(response.getheader("Content-Type"), "image/png")
+        self.assertEqual(response.getheader("Last-Modified"), formatdate(TILE_TIMESTAMP, usegmt=True))
+        self.assertEqual(response.getheader("Cache-Control"), "max-age=%d" % TILE_MAX_AGE)
+        self.assertTrue(response.getheader("ETag"))
+        # content type is based on the tile data
+        response, data = self._request(connection, "/photo/3/1/2.png")
+        self.assertEqual(response.getheader("Content-Type"), "image/jpeg")
+        response, data = self._request(connection, "/tms/3/1/2")
+        self.assertEqual(data, PNG_HEADER + b"3/1/5")
+        response, data = self._request(connection, "/mapnik/3/1/2.png", method="HEAD")
+        self.assertEqual(response.status, 200)
+        self.assertEqual(data, b"")
+        response, data = self._request(connection, "/missing/3/1/2.png")
+        self.assertEqual(response.status, 404)
+        response, data = self._request(connection, "/not/a/tile/path/at/all")
+        self.assertEqual(response.status, 400)
+        self.assertEqual(self.lookups, [("mapnik", 3, 1, 2), ("photo", 3, 1, 2), (None, 3, 1, 5),
+                                        ("mapnik", 3, 1, 2), ("missing", 3, 1, 2)])
+        # everything over a single keep-alive connection
+        self.assertEqual(self.server.connectionCount, 1)
+        connection.close()
+
+    def conditional_get_test(self):
+        connection = self._connect()
+        response, _data = self._request(connection, "/mapnik/3/1/2.png")
+        etag = response.getheader("ETag")
+        lastModified = response.getheader("Last-Modified")
+        response, data = self._request(connection, "/mapnik/3/1/2.png", headers={"If-None-Match": etag})
+        self.assertEqual(response.status, 304)
+        self.assertEqual(data, b"")
+        self.assertEqual(response.getheader("ETag"), etag)
+        response, _data = self._request(connection, "/mapnik/3/1/2.png",
+                                        headers={"If-None-Match": '"other", W/%s' % etag})
+        self.assertEqual(response.status, 304)
+        response, _data = self._request(connection, "/mapnik/3/1/2.png", headers={"If-None-Match": '"other"'})
+        self.assertEqual(response.status, 200)
+        response, _data = self._request(connection, "/mapnik/3/1/2.png", headers={"If-Modified-Since": lastModified})
+        self.assertEqual(response.status, 304)
+        olderDate = formatdate(TILE_TIMESTAMP - 60, usegmt=True)
+        response, _data = self._request(connection, "/mapnik/3/1/2.png", headers={"If-Modified-Since": olderDate})
+        self.assertEqual(response.status, 200)
+        # If-None-Match takes precedence
+        response, _data = self._request(connection, "/mapnik/3/1/2.png",
+                                        headers={"If-None-Match": '"other"', "If-Modified-Since": lastModified})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(self.server.connectionCount, 1)
+        connection.close()
+
+    def load_test(self):
+        """Concurrent keep-alive clients should be served in parallel"""
+        self.lookupDelay = LOOKUP_DELAY
+        errors = []
+
+        def client(index):
+            connection = self._connect()
+            try:
+                for i in range(REQUESTS_PER_CLIENT):
+                    x, y = index, i
+                    response, data = self._request(connection, "/mapnik/10/%d/%d.png" % (x, y))
+                    if response.status != 200 or data != PNG_HEADER + ("10/%d/%d" % (x, y)).encode("ascii"):
+                        errors.append((index, i, response.status))
+            except Exception as e:
+                errors.append((index, e))
+            finally:
+                connection.close()
+
+        clients = [threading.Thread(target=client, args=(index,)) for index in range(CLIENT_COUNT)]
+        start = time.time()
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        elapsed = time.time() - start
+        self.assertEqual(errors, [])
+        self.assertEqual(len(self.lookups), CLIENT_COUNT * REQUESTS_PER_CLIENT)
+        # one connection per client
+        self.assertEqual(self.server.connectionCount, CLIENT_COUNT)
+        # a single threaded server would need at least this long for all the lookups
+        serialTime = CLIENT_COUNT * REQUESTS_PER_CLIENT * LOOKUP_DELAY
+        self.assertTrue(elapsed < serialTime, (elapsed, serialTime))
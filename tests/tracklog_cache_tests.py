@@ -0,0 +1,200 @@
+import unittest
+import os
+import math
+import pickle
+import shutil
+import sqlite3
+import tempfile
+
+from core import tracklog_cache
+from core.point_array import PointArray
+from core.gpx_reader import TrackStats
+from core.tracklog_cache import TracklogCache, TracklogSummary, preview_points
+
+
+class CacheItem(object):
+    """Like the item class of the old pickled tracklog cache"""
+
+    def __init__(self, clusters, routeInfo=None, perElevList=None):
+        self.clusters = clusters
+        self.routeInfo = routeInfo
+        self.perElevList = perElevList
+
+
+class ClusterOfPoints(object):
+    """Like the cluster class of the old pickled tracklog cache"""
+
+    def __init__(self, pointsList, centreX, centreY, radius):
+        self.pointsList = pointsList
+        self.centreX = centreX
+        self.centreY = centreY
+        self.radius = radius
+
+
+def _summary(points):
+    stats = TrackStats()
+    for lat, lon, elevation in points:
+        stats.add(lat, lon, elevation)
+    return TracklogSummary.from_points(points, stats, clusters=[(49.2, 16.6, 1.5)],
+                                       elevation_profile=[(0.0, 200.0, 49.2, 16.6), (1.0, None, 49.3, 16.7)])
+
+
+class TracklogCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix="modrana_tracklog_cache_test")
+        self.cache_path = os.path.join(self.folder, "cache", "tracklog_cache.db")
+        self.cache = TracklogCache(self.cache_path)
+        self.tracklog_path = self._tracklog("track.gpx", "<gpx/>")
+        self.points = PointArray([(49.2, 16.6, 200.0), (49.25, 16.65, None), (49.3, 16.7, 250.0)])
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.folder)
+
+    def _tracklog(self, filename, content):
+        path = os.path.join(self.folder, filename)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def round_trip_test(self):
+        summary = _summary(self.points)
+        self.assertTrue(summary.complete)
+        self.assertIsNone(self.cache.get(self.tracklog_path))
+        self.assertTrue(self.cache.put(self.tracklog_path, summary))
+        cached = self.cache.get(self.tracklog_path)
+        self.assertEqual(cached, summary)
+        self.assertEqual(cached.point_count, 3)
+        self.assertEqual(cached.bounds, (49.2, 16.6, 49.3, 16.7))
+        self.assertEqual(cached.route_info['maxElevation'], 250.0)
+        self.assertEqual(cached.route_info['firstElevation'], 200.0)
+        self.assertEqual(cached.elevation_profile[1], (1.0, None, 49.3, 16.7))
+        # the summary persists
+        self.cache.close()
+        self.assertEqual(TracklogCache(self.cache_path).get(self.tracklog_path), summary)
+
+    def empty_summary_test(self):
+        summary = _summary(PointArray())
+        summary.clusters = []
+        summary.elevation_profile = None
+        self.cache.put(self.tracklog_path, summary)
+        cached = self.cache.get(self.tracklog_path)
+        self.assertEqual(cached, summary)
+        self.assertIsNone(cached.bounds)
+        self.assertIsNone(cached.route_info)
+        self.assertEqual(cached.clusters, [])
+        self.assertEqual(cached.preview, [])
+
+    def invalidation_test(self):
+        self.cache.put(self.tracklog_path, _summary(self.points))
+        # changed modification time
+        stat = os.stat(self.tracklog_path)
+        os.utime(self.tracklog_path, (stat.st_atime, stat.st_mtime + 10))
+        self.assertIsNone(self.cache.get(self.tracklog_path))
+        # the stale summary has been dropped
+        os.utime(self.tracklog_path, (stat.st_atime, stat.st_mtime))
+        self.assertIsNone(self.cache.get(self.tracklog_path))
+        # changed size, same modification time
+        self.cache.put(self.tracklog_path, _summary(self.points))
+        self._tracklog("track.gpx", "<gpx></gpx>")
+        os.utime(self.tracklog_path, (stat.st_atime, stat.st_mtime))
+        self.assertIsNone(self.cache.get(self.tracklog_path))
+        # removed file
+        self.cache.put(self.tracklog_path, _summary(self.points))
+        os.remove(self.tracklog_path)
+        self.assertIsNone(self.cache.get(self.tracklog_path))
+        self.assertFalse(self.cache.put(self.tracklog_path, _summary(self.points)))
+
+    def delete_and_prune_test(self):
+        other_path = self._tracklog("other.gpx", "<gpx/>")
+        self.cache.put(self.tracklog_path, _summary(self.points))
+        self.cache.put(other_path, _summary(self.points))
+        self.cache.delete(self.tracklog_path)
+        self.assertIsNone(self.cache.get(self.tracklog_path))
+        self.cache.put(self.tracklog_path, _summary(self.points))
+        self.assertEqual(self.cache.prune([self.tracklog_path]), 1)
+        self.assertIsNone(self.cache.get(other_path))
+        self.assertIsNotNone(self.cache.get(self.tracklog_path))
+
+    def version_mismatch_test(self):
+        self.cache.put(self.tracklog_path, _summary(self.points))
+        self.cache.close()
+        connection = sqlite3.connect(self.cache_path)
+        with connection:
+            connection.execute("UPDATE version SET v=?", (tracklog_cache.TRACKLOG_CACHE_VERSION + 1,))
+        connection.close()
+        # summaries stored in a different format are discarded
+        cache = TracklogCache(self.cache_path)
+        self.assertIsNone(cache.get(self.tracklog_path))
+        self.assertTrue(cache.put(self.tracklog_path, _summary(self.points)))
+        self.assertIsNotNone(cache.get(self.tracklog_path))
+        cache.close()
+
+    def corrupted_test(self):
+        self.cache.close()
+        os.makedirs(os.path.dirname(self.cache_path))
+        with open(self.cache_path, "wb") as f:
+            f.write(b"definitely not a sqlite database" * 100)
+        cache = TracklogCache(self.cache_path)
+        self.assertIsNone(cache.get(self.tracklog_path))
+        self.assertTrue(cache.put(self.tracklog_path, _summary(self.points)))
+        self.assertIsNotNone(cache.get(self.tracklog_path))
+        cache.close()
+
+    def migration_test(self):
+        pickle_path = os.path.join(self.folder, "tracklog_cache.txt")
+        route_info = {'maxElevation': 250.0, 'minElevation': 200.0, 'middle': 225.0,
+                      'firstElevation': 200.0, 'lastElevation': 250.0}
+        per_elev_list = [(0, 200.0, 49.2, 16.6), (1.5, 250.0, 49.3, 16.7)]
+        old_cache = {
+            self.tracklog_path: CacheItem([ClusterOfPoints([{'latitude': 49.2, 'longitude': 16.6}],
+                                                           49.2, 16.6, 0.0)],
+                                          route_info, per_elev_list),
+            os.path.join(self.folder, "removed.gpx"): CacheItem([]),
+        }
+        with open(pickle_path, "wb") as f:
+            pickle.dump(old_cache, f, 0)
+        self.assertEqual(self.cache.migrate_pickle(pickle_path), 1)
+        self.assertFalse(os.path.exists(pickle_path))
+        summary = self.cache.get(self.tracklog_path)
+        self.assertFalse(summary.complete)
+        self.assertEqual(summary.clusters, [(49.2, 16.6, 0.0)])
+        self.assertEqual(summary.route_info, route_info)
+        self.assertEqual(summary.elevation_profile, per_elev_list)
+        self.assertIsNone(summary.preview)
+        # nothing to migrate
+        self.assertEqual(self.cache.migrate_pickle(pickle_path), 0)
+
+    def python2_migration_test(self):
+        # the old cache could only be written by Python 2, the classes were old style ones
+        pickle_path = os.path.join(self.folder, "tracklog_cache.txt")
+        with open(pickle_path, "wb") as f:
+            f.write(("(dp0\nS'%s'\np1\n(imodules.mod_loadTracklogs\nCacheItem\np2\n(dp3\n"
+                     "S'clusters'\np4\n(lp5\nsS'routeInfo'\np6\nNsS'perElevList'\np7\nNsbs."
+                     % self.tracklog_path).encode("latin1"))
+        self.assertEqual(self.cache.migrate_pickle(pickle_path), 1)
+        summary = self.cache.get(self.tracklog_path)
+        self.assertEqual(summary.clusters, [])
+        self.assertIsNone(summary.route_info)
+
+    def unsafe_migration_test(self):
+        # the old cache is unpickled with just the cache classes allowed
+        pickle_path = os.path.join(self.folder, "tracklog_cache.txt")
+        with open(pickle_path, "wb") as f:
+            pickle.dump({self.tracklog_path: TracklogSummary()}, f, 0)
+        self.assertEqual(self.cache.migrate_pickle(pickle_path), 0)
+        self.assertFalse(os.path.exists(pickle_path))
+        self.assertIsNone(self.cache.get(self.tracklog_path))
+
+    def preview_test(self):
+        # a wiggly 10 km track with a point every meter or so
+        lats = [49.2 + 0.09 * index / 10000.0 for index in range(10000)]
+        lons = [16.6 + 0.0001 * math.sin(index / 100.0) for index in range(10000)]
+        preview = preview_points(lats, lons)
+        self.assertLess(len(preview), len(lats) // 10)
+        self.assertEqual(preview[0], (lats[0], lons[0]))
+        self.assertEqual(preview[-1], (lats[-1], lons[-1]))
+        # more detailed previews for higher zoom levels
+        self.assertGreater(len(preview_points(lats, lons, zoom=16)), len(preview))
+        self.assertEqual(preview_points([], []), [])
@@ -0,0 +1,112 @@
+"""Tracklog loading benchmarks
+
+Loads COPY_COUNT copies of the bundled example tracklogs (and of a bigger
+tracklog made by repeating the long example) once one after another
+on the calling thread, like before, and then with the background loader,
+both loading in its thread (the fallback if worker processes can't be used)
+and in worker processes. Reports the total loading time and the longest
+time the calling thread - the GUI thread in modRana - was not able to run.
+
+Run from the modRana source folder:
+
+PYTHONPATH=core/bundle python -m tests.tracklog_loader_benchmark
+"""
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from core import threads
+from core.tracklog_loader import TracklogLoader, load_tracklog
+
+EXAMPLE_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              "data", "tracklog_examples")
+EXAMPLE_FILES = ["example_short.gpx", "example_long_znojmo-brno.gpx"]
+# how many times the long example is repeated for the big tracklog
+REPEAT_COUNT = 20
+COPY_COUNT = 25
+# how often the calling thread checks if it got to run
+TICK = 0.005  # in seconds
+
+
+def prepareFiles(folder):
+    """Create COPY_COUNT copies of each of the example tracklogs"""
+    sources = [os.path.join(EXAMPLE_FOLDER, filename) for filename in EXAMPLE_FILES]
+    with open(sources[-1], "rt") as f:
+        text = f.read()
+    start = text.index("<ns0:trkpt")
+    end = text.rindex("</ns0:trkseg>")
+    bigPath = os.path.join(folder, "example_big.gpx")
+    with open(bigPath, "wt") as f:
+        f.write(text[:start])
+        for _i in range(REPEAT_COUNT):
+            f.write(text[start:end])
+        f.write(text[end:])
+    sources.append(bigPath)
+    paths = []
+    for index in range(COPY_COUNT):
+        for source in sources:
+            path = os.path.join(folder, "%d_%s" % (index, os.path.basename(source)))
+            shutil.copy(source, path)
+            paths.append(path)
+    return paths
+
+
+def serialLoad(paths):
+    """Load the tracklogs on the calling thread
+
+    The tracklogs were loaded in a single call, so the calling thread
+    can't run until all of them are loaded.
+
+    :returns: (total time, longest stall) tuple in seconds
+    """
+    start = time.time()
+    for path in paths:
+        load_tracklog(path)
+    elapsed = time.time() - start
+    return elapsed, elapsed
+
+
+def backgroundLoad(paths, useProcesses):
+    """Load the tracklogs with the background loader, the calling thread keeps ticking
+
+    :returns: (total time, longest stall) tuple in seconds
+    """
+    done = threading.Event()
+    loader = TracklogLoader(lambda path, track, summary: None, use_processes=useProcesses)
+    start = time.time()
+    loader.load(paths, callback=lambda loadedPaths: done.set())
+    longestStall = time.time() - start
+    lastTick = time.time()
+    while not done.is_set():
+        time.sleep(TICK)
+        now = time.time()
+        longestStall = max(longestStall, now - lastTick - TICK)
+        lastTick = now
+    elapsed = time.time() - start
+    loader.close()
+    return elapsed, longestStall
+
+
+def main():
+    threads.initThreading()
+    folder = tempfile.mkdtemp(prefix="modrana_tracklog_loader_benchmark")
+    try:
+        paths = prepareFiles(folder)
+        size = sum(os.path.getsize(path) for path in paths)
+        print("%d tracklogs, %.1f MB, %d worker processes"
+              % (len(paths), size / 1e6, TracklogLoader(None).processes))
+        for name, load in [("serial", serialLoad),
+                           ("thread", lambda paths: backgroundLoad(paths, False)),
+                           ("processes", lambda paths: backgroundLoad(paths, True))]:
+            elapsed, longestStall = load(paths)
+            print("    %-10s %8.1f ms total | %8.1f ms longest stall of the calling thread"
+                  % (name, 1000 * elapsed, 1000 * longestStall))
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main()
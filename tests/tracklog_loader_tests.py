@@ -0,0 +1,115 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+
+from core import threads
+from core.gpx_reader import read_gpx
+from core.tracklog_cache import summarize_track
+from core.tracklog_loader import TracklogLoader, load_tracklog
+
+EXAMPLE_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              "data", "tracklog_examples")
+EXAMPLE_FILES = ["example_short.gpx", "example_long_znojmo-brno.gpx"]
+TIMEOUT = 30
+
+
+class TracklogLoaderTests(unittest.TestCase):
+
+    def setUp(self):
+        if threads.threadMgr is None:
+            threads.initThreading()
+        self.folder = tempfile.mkdtemp(prefix="modrana_tracklog_loader_test")
+        self.paths = []
+        for index in range(5):
+            for filename in EXAMPLE_FILES:
+                path = os.path.join(self.folder, "%d_%s" % (index, filename))
+                shutil.copy(os.path.join(EXAMPLE_FOLDER, filename), path)
+                self.paths.append(path)
+        self.broken_path = os.path.join(self.folder, "broken.gpx")
+        with open(self.broken_path, "w") as f:
+            f.write("<gpx><trk>")
+        self.results = {}
+        self.done = threading.Event()
+        self.loaded_paths = None
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _loaded(self, path, track, summary):
+        self.assertNotIn(path, self.results)
+        self.results[path] = (track, summary)
+
+    def _batch_done(self, loaded_paths):
+        self.loaded_paths = loaded_paths
+        self.done.set()
+
+    def _wait(self):
+        self.assertTrue(self.done.wait(TIMEOUT))
+
+    def _assert_loaded(self, use_processes):
+        loader = TracklogLoader(self._loaded, processes=2, use_processes=use_processes)
+        # only the first & third tracklog are summarized
+        summarized = set(self.paths[0:3:2])
+        self.assertTrue(loader.load(self.paths + [self.broken_path], summarized.__contains__, self._batch_done))
+        self._wait()
+        loader.close()
+        self.assertEqual(sorted(self.loaded_paths), sorted(self.paths))
+        self.assertEqual(loader.in_flight, set())
+        self.assertEqual(self.results[self.broken_path], (None, None))
+        for path in self.paths:
+            track, summary = self.results[path]
+            expected = read_gpx(path)
+            self.assertEqual(track.points.llet_list(), expected.points.llet_list())
+            self.assertEqual(track.stats[0].length, expected.stats[0].length)
+            if path in summarized:
+                self.assertEqual(summary, summarize_track(read_gpx(path)))
+            else:
+                self.assertIsNone(summary)
+
+    def process_test(self):
+        self._assert_loaded(use_processes=True)
+
+    def thread_test(self):
+        self._assert_loaded(use_processes=False)
+
+    def deduplication_test(self):
+        loader = TracklogLoader(self._loaded, processes=1)
+        self.assertTrue(loader.load(self.paths + self.paths[0:2], callback=self._batch_done))
+        # all the paths are already being loaded
+        self.assertIsNone(loader.load(self.paths[0:3]))
+        self._wait()
+        loader.close()
+        self.assertEqual(len(self.loaded_paths), len(self.paths))
+        self.assertEqual(sorted(self.results), sorted(self.paths))
+
+    def cancel_test(self):
+        loader = TracklogLoader(self._loaded, processes=1)
+        loader.load(self.paths, callback=self._batch_done)
+        loader.cancel(self.paths[4:])
+        self._wait()
+        # the first tracklogs might have been loaded already
+        self.assertEqual(sorted(self.loaded_paths), sorted(self.results))
+        self.assertTrue(set(self.results).issubset(self.paths[0:4]))
+        self.assertEqual(loader.in_flight, set())
+        # cancelled tracklogs can be loaded again
+        self.done.clear()
+        self.results = {}
+        loader.load(self.paths[4:], callback=self._batch_done)
+        self._wait()
+        loader.close()
+        self.assertEqual(sorted(self.results), sorted(self.paths[4:]))
+        # nothing can be loaded once the loader is closed
+        self.assertIsNone(loader.load(self.paths))
+
+    def load_tracklog_test(self):
+        path, track, summary, error = load_tracklog(self.paths[1])
+        self.assertEqual(path, self.paths[1])
+        self.assertIsNone(error)
+        # clusters are summarized, not passed back
+        self.assertIsNone(track.clusters)
+        self.assertTrue(summary.complete)
+        path, track, summary, error = load_tracklog(self.broken_path, summarize=False)
+        self.assertIsNone(track)
+        self.assertIn("ParseError", error)
@@ -0,0 +1,142 @@
+"""Way point storage benchmarks
+
+Simulates a 24 hour tracklog - one point per second - stored
+the previous way (lists of (lat, lon, elevation, timestamp) tuples)
+and in the column based point array used by AppendOnlyWay.
+Reports the memory used by the points, append & flush throughput
+and how long it takes to get the points as a list while logging.
+
+Memory is measured with tracemalloc, which is only available on Python 3.
+Previously points not yet flushed were also referenced from a second list,
+that is not included.
+
+Run from the modRana source folder:
+
+PYTHONPATH=core/bundle python -m tests.way_benchmark
+"""
+from __future__ import print_function
+import csv
+import math
+import os
+import shutil
+import tempfile
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from core.point_array import PointArray, seconds_to_timestamp
+from core.way import AppendOnlyWay
+
+POINT_COUNT = 24 * 60 * 60
+# tracklogs are flushed to storage about once a minute
+FLUSH_INTERVAL = 60
+# how often the point list is requested while logging
+LIST_INTERVAL = 1000
+START_TIME = 1577872800  # 2020-01-01 10:00:00
+
+
+def dayTrackPoints(count):
+    """Generate LLET tuples of a track with a point every second"""
+    for index in range(count):
+        heading = index / 3000.0
+        yield (49.2 + 0.01 * math.sin(heading), 16.6 + 0.01 * math.cos(heading),
+               300.0 + index % 100, seconds_to_timestamp(START_TIME + index))
+
+
+class ListAppendOnlyWay(object):
+    """The previous AppendOnlyWay point storage"""
+
+    def __init__(self):
+        self._points = []
+        self.increment = []
+        self.file = None
+        self.writer = None
+
+    def add_point_llet(self, lat, lon, elevation, timestamp):
+        self._points.append((lat, lon, elevation, timestamp))
+        self.increment.append((lat, lon, elevation, timestamp))
+
+    @property
+    def points_lle(self):
+        return [(x[0], x[1], x[2]) for x in self._points]
+
+    def start_writing_csv(self, path):
+        self.file = open(path, "w")
+        self.writer = csv.writer(self.file)
+
+    def flush(self):
+        increment = self.increment
+        self.increment = []
+        self.writer.writerows(increment)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def _traced(create):
+    """Return (object, allocated bytes) for the object returned by create"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = create()
+        return result, tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+def memory_benchmark(llet):
+    if tracemalloc is None:
+        print("memory: tracemalloc not available")
+        return
+    # generate the points again, so that the track fixture itself is not counted
+    _tuples, tuplesSize = _traced(lambda: list(dayTrackPoints(len(llet))))
+    _points, arraySize = _traced(lambda: PointArray(dayTrackPoints(len(llet))))
+    print("memory:   %6.1f MB tuples (%5.0f B/point) | %6.1f MB point array (%5.0f B/point)"
+          % (tuplesSize / 1e6, tuplesSize / float(len(llet)), arraySize / 1e6, arraySize / float(len(llet))))
+
+
+def logging_benchmark(way, llet, folder, name):
+    """Append all the points, flushing once a minute & requesting the point list now and then"""
+    path = os.path.join(folder, "%s.csv" % name)
+    way.start_writing_csv(path)
+    appendTime = 0.0
+    flushTime = 0.0
+    listTime = 0.0
+    for index, (lat, lon, elevation, timestamp) in enumerate(llet, 1):
+        start = time.time()
+        way.add_point_llet(lat, lon, elevation, timestamp)
+        appendTime += time.time() - start
+        if index % FLUSH_INTERVAL == 0:
+            start = time.time()
+            way.flush()
+            flushTime += time.time() - start
+        if index % LIST_INTERVAL == 0:
+            start = time.time()
+            way.points_lle
+            listTime += time.time() - start
+    way.close()
+    print("%-12s append %6.1f ms | %4d flushes %7.1f ms | %3d point lists %8.1f ms"
+          % (name, 1000 * appendTime, len(llet) // FLUSH_INTERVAL, 1000 * flushTime,
+             len(llet) // LIST_INTERVAL, 1000 * listTime))
+
+
+def main():
+    llet = list(dayTrackPoints(POINT_COUNT))
+    print("%d points, one per second for 24 hours" % len(llet))
+    memory_benchmark(llet)
+    folder = tempfile.mkdtemp(prefix="modrana_way_benchmark")
+    try:
+        logging_benchmark(ListAppendOnlyWay(), llet, folder, "tuple lists")
+        logging_benchmark(AppendOnlyWay(), llet, folder, "point array")
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,10 @@
 import unittest
-from core.way import Way
+import tempfile
+import shutil
+import os
+import csv
+from core import geo
+from core.way import Way, AppendOnlyWay
 from core.point import Point
 
 class WayTests(unittest.TestCase):
@@ -240,3 +245,76 @@ class WayTests(unittest.TestCase):
 
 
 
+
+    def from_handmade_test(self):
+        """Test hand-made route distances."""
+        start = (49.0, 16.0)
+        middle_points = [(49.1, 16.0, None, "turn left"), (49.1, 16.1, None, ""), (49.2, 16.1, 300.0, "turn right")]
+        destination = (49.3, 16.1)
+        way = Way.from_handmade(start, middle_points, destination)
+        self.assertEqual(way.point_count, 5)
+        self.assertEqual(way.message_point_count, 2)
+        first_leg = geo.distance(49.0, 16.0, 49.1, 16.0) * 1000
+        self.assertAlmostEqual(way.get_message_point_by_index(0).distance_from_start, first_leg)
+        to_last_middle_point = first_leg + (geo.distance(49.1, 16.0, 49.1, 16.1) +
+                                            geo.distance(49.1, 16.1, 49.2, 16.1)) * 1000
+        self.assertAlmostEqual(way.get_message_point_by_index(1).distance_from_start, to_last_middle_point)
+        self.assertAlmostEqual(way.length, to_last_middle_point)
+
+    def points_view_test(self):
+        """Test the points view & the cached point lists follow appended points."""
+        lle_list = [(0.0, 0.0, 0.0), (1.0, 1.0, None), (2.0, 2.0, 200.0)]
+        way = Way(points=lle_list)
+        self.assertListEqual(list(way.points), lle_list)
+        self.assertListEqual(list(way.points[1:]), lle_list[1:])
+        self.assertListEqual(way.points_lle, lle_list)
+        self.assertEqual(len(way.points_radians_ll), 3)
+        way.add_point_lle(3.0, 3.0)
+        lle_list.append((3.0, 3.0, None))
+        self.assertListEqual(way.points_lle, lle_list)
+        self.assertListEqual(way.points_radians_ll, way.get_points_lle_radians(drop_elevation=True))
+        self.assertListEqual(way.points_radians_lle, way.get_points_lle_radians(drop_elevation=False))
+        way.clear()
+        self.assertListEqual(way.points_lle, [])
+        self.assertListEqual(way.points_radians_ll, [])
+
+
+class AppendOnlyWayTests(unittest.TestCase):
+
+    def setUp(self):
+        self.folder_path = tempfile.mkdtemp(prefix="modrana_way_test")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder_path)
+
+    def _read_csv(self, path):
+        with open(path, "r") as f:
+            return [tuple(row) for row in csv.reader(f)]
+
+    def incremental_flush_test(self):
+        """Test that only points added since the last flush are written."""
+        way = AppendOnlyWay(points=[(49.0, 16.0, 100.0)])
+        self.assertEqual(way.unsaved_point_count, 1)
+        path = os.path.join(self.folder_path, "log.csv")
+        way.start_writing_csv(path)
+        self.assertEqual(way.unsaved_point_count, 0)
+        way.add_point_llet(49.1, 16.1, None, "2020-01-01T10:00:00")
+        way.add_point_llet(49.2, 16.2, 300.0, "2020-01-01T10:00:01")
+        self.assertEqual(way.unsaved_point_count, 2)
+        self.assertListEqual(way.increment, [(49.1, 16.1, None, "2020-01-01T10:00:00"),
+                                             (49.2, 16.2, 300.0, "2020-01-01T10:00:01")])
+        way.flush()
+        self.assertListEqual(way.increment, [])
+        way.add_point_lle(49.3, 16.3, 400.0)
+        self.assertEqual(way.point_count, 4)
+        self.assertEqual(way.points_lle[-1], (49.3, 16.3, 400.0))
+        self.assertEqual(len(way.points_llet[-1]), 4)
+        way.close()
+        rows = self._read_csv(path)
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1], ("49.1", "16.1", "", "2020-01-01T10:00:00"))
+        self.assertEqual(rows[2], ("49.2", "16.2", "300.0", "2020-01-01T10:00:01"))
+        self.assertEqual(rows[3][0:3], ("49.3", "16.3", "400.0"))
+        # the points can be loaded back
+        loaded = Way.from_csv(path)
+        self.assertListEqual(loaded.points_lle, way.points_lle)